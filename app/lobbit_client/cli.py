@@ -0,0 +1,472 @@
+#!/usr/bin/bash python3
+
+import argparse
+import os
+import sys
+import time
+
+from typing import Iterator, List, TextIO
+
+# only the standard library is imported up front, the client and its
+# dependencies are imported when a command runs to keep startup fast
+_started = time.perf_counter()
+
+lobbit_app = os.path.join(os.path.abspath(os.path.dirname(__file__)), "../../")
+sys.path.append(lobbit_app)
+
+# exit codes returned by 'lobbit upload' and 'lobbit stream'
+EXIT_OK = 0
+EXIT_PARTIAL = 1
+EXIT_USAGE = 2
+EXIT_CONNECT = 3
+EXIT_NO_FILES = 4
+
+
+def read_stream(stream: TextIO, null: bool = False) -> Iterator[str]:
+    """
+    Lazily reads file paths from a stream, one per line or separated by
+    null characters, so uploads can start before the stream is closed
+
+    Args:
+        stream (TextIO) : the stream to read paths from
+        null (bool)     : paths are null separated instead of newline separated
+    Returns:
+        Iterator[str] : each non-empty path in the stream
+    """
+    if not null:
+        for line in stream:
+            path = line.rstrip("\r\n")
+            if path:
+                yield path
+        return
+    pending = ""
+    while data := stream.read(65536):
+        pending += data
+        *paths, pending = pending.split("\x00")
+        yield from (p for p in paths if p)
+    if pending:
+        yield pending
+
+
+def iter_sources(files: List, stream: TextIO, null: bool = False) -> Iterator[str]:
+    """
+    Yields the file arguments, replacing any '-' with the paths
+    read from <stream>
+
+    Args:
+        files (List)    : file, directory and glob arguments
+        stream (TextIO) : the stream to read paths from for '-'
+        null (bool)     : paths in the stream are null separated
+    Returns:
+        Iterator[str] : each source to upload
+    """
+    for file in files:
+        if file == "-":
+            yield from read_stream(stream, null)
+        else:
+            yield file
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Builds the argument parser for the lobbit command line
+
+    Returns:
+        argparse.ArgumentParser : the configured parser
+    """
+    parser = argparse.ArgumentParser(prog="lobbit", description="Lobbit file transfer tool")
+    commands = parser.add_subparsers(dest="command", required=True)
+    upload = commands.add_parser("upload", help="upload files to a lobbit server")
+    upload.add_argument("files", nargs="*", default=["-"],
+                        help="files, directories or glob patterns, '-' reads paths from stdin (default)")
+    upload.add_argument("--host", required=True, help="hostname or IP address of the server")
+    upload.add_argument("--port", required=True, type=int, help="port of the server")
+    upload.add_argument("-c", "--connections", type=int, default=4, help="TLS connections to upload over")
+    upload.add_argument("-s", "--streams", type=int, default=1,
+                        help="files sent at once over each connection as multiplexed streams")
+    upload.add_argument("--order", choices=("largest", "smallest", "fifo"), default="largest",
+                        help="send the largest or smallest files first, or in the order found")
+    upload.add_argument("--walk-workers", type=int, default=8, help="threads used to walk directories")
+    upload.add_argument("-0", "--null", action="store_true", help="paths read from stdin are null separated")
+    upload.add_argument("-q", "--quiet", action="store_true", help="only print the JSON summary")
+    upload.add_argument("--dedup", action="store_true",
+                        help="send large files as content defined chunks, skipping chunks the server holds")
+    upload.add_argument("--mirror", action="append", default=[], metavar="HOST:PORT",
+                        help="also send every file to this server, reading it once, can be repeated")
+    upload.add_argument("--sync", action="store_true",
+                        help="only send files the server does not hold with the same size and modified time")
+    queue = commands.add_parser("queue", help="manage the durable upload queue")
+    queue.add_argument("--db", help="path of the queue database, defaults to $LOBBIT_QUEUE or ~/.lobbit/queue.db")
+    actions = queue.add_subparsers(dest="action", required=True)
+    add = actions.add_parser("add", help="add files to the queue")
+    add.add_argument("files", nargs="*", default=["-"],
+                     help="files, directories or glob patterns, '-' reads paths from stdin (default)")
+    add.add_argument("--host", required=True, help="hostname or IP address of the server")
+    add.add_argument("--port", required=True, type=int, help="port of the server")
+    add.add_argument("-p", "--priority", type=int, default=0, help="higher priorities are sent first")
+    add.add_argument("-0", "--null", action="store_true", help="paths read from stdin are null separated")
+    actions.add_parser("list", help="list the uploads in the queue")
+    run = actions.add_parser("run", help="send everything queued for a server, retrying failures")
+    run.add_argument("--host", required=True, help="hostname or IP address of the server")
+    run.add_argument("--port", required=True, type=int, help="port of the server")
+    run.add_argument("-c", "--connections", type=int, default=4, help="TLS connections to upload over")
+    run.add_argument("-s", "--streams", type=int, default=1,
+                     help="files sent at once over each connection as multiplexed streams")
+    run.add_argument("-q", "--quiet", action="store_true", help="only print the JSON summary")
+    run.add_argument("--dedup", action="store_true",
+                     help="send large files as content defined chunks, skipping chunks the server holds")
+    remote = commands.add_parser("remote-list", help="list the files a server holds, one page at a time")
+    remote.add_argument("pattern", nargs="?", default="*", help="glob pattern matched against the upload names")
+    remote.add_argument("--host", required=True, help="hostname or IP address of the server")
+    remote.add_argument("--port", required=True, type=int, help="port of the server")
+    remote.add_argument("--after", default="", help="the 'next' value printed with the previous page")
+    remote.add_argument("--limit", type=int, default=100, help="most files on the page, up to 1000")
+    stream = commands.add_parser("stream", help="upload data of unknown length, e.g. from a pipe, as one file")
+    stream.add_argument("name", help="upload name of the data on the server")
+    stream.add_argument("--host", required=True, help="hostname or IP address of the server")
+    stream.add_argument("--port", required=True, type=int, help="port of the server")
+    stream.add_argument("--from", dest="source", default="-",
+                        help="file, FIFO or device to read, '-' reads stdin (default)")
+    stream.add_argument("-q", "--quiet", action="store_true", help="only print the JSON summary")
+    verify = commands.add_parser("verify", help="check local files against the checksums a server holds")
+    verify.add_argument("files", nargs="*", default=["-"],
+                        help="files, directories or glob patterns, '-' reads paths from stdin (default)")
+    verify.add_argument("--host", required=True, help="hostname or IP address of the server")
+    verify.add_argument("--port", required=True, type=int, help="port of the server")
+    verify.add_argument("--workers", type=int, default=4, help="threads hashing files")
+    verify.add_argument("--cache", help="path of the hash cache, defaults to $LOBBIT_HASH_CACHE or ~/.lobbit/hashes.db")
+    verify.add_argument("-0", "--null", action="store_true", help="paths read from stdin are null separated")
+    return parser
+
+
+def dedup_totals(results: List[dict]) -> dict:
+    """
+    Totals the bytes deduplicated across the confirmed files
+
+    Args:
+        results (List[dict]) : results from LobbitClient.lobbit_send
+    Returns:
+        dict : bytes_saved and dedup_ratio, the fraction of the bytes of
+               deduplicated files the server already held
+    """
+    deduped = [r for r in results if r["status"] == "confirmed" and "bytes_saved" in r]
+    saved = sum(r["bytes_saved"] for r in deduped)
+    size = sum(r["size"] for r in deduped)
+    return {"bytes_saved": saved, "dedup_ratio": round(saved / size, 4) if size else 0.0}
+
+
+def mirror_totals(results: List[dict]) -> dict:
+    """
+    Totals the files each server confirmed in a mirrored upload
+
+    Args:
+        results (List[dict]) : results from LobbitClient.lobbit_send
+    Returns:
+        dict : HOST:PORT to the files confirmed and not confirmed and the
+               bytes confirmed on that server
+    """
+    totals = {}
+    for result in results:
+        for name, copy in result.get("destinations", {}).items():
+            total = totals.setdefault(name, {"confirmed": 0, "failed": 0, "bytes": 0})
+            if copy["status"] == "confirmed":
+                total["confirmed"] += 1
+                total["bytes"] += result["size"]
+            else:
+                total["failed"] += 1
+    return totals
+
+
+def upload(args: argparse.Namespace) -> int:
+    """
+    Runs the upload command and prints a JSON summary to stdout. Progress
+    messages are written to stderr so stdout stays machine readable
+
+    Args:
+        args (argparse.Namespace) : parsed command line arguments
+    Returns:
+        int : the exit code for the process
+    """
+    import contextlib
+    import json
+    from app.lobbit_client.client import LobbitClient
+    from app.lobbit_client.mirror import parse_address
+
+    try:
+        mirrors = [parse_address(address) for address in args.mirror]
+    except ValueError as e:
+        print(f"[-] {e}", file=sys.stderr)
+        return EXIT_USAGE
+    if args.sync and set(mirrors) - {(args.host, args.port)}:
+        print("[-] --sync can't be combined with --mirror, sync each server on its own", file=sys.stderr)
+        return EXIT_USAGE
+    summary = {
+        "host": args.host,
+        "port": args.port,
+        "startup_seconds": round(time.perf_counter() - _started, 6),
+        "connected": False,
+        "files": [],
+    }
+    sources = iter_sources(args.files, sys.stdin, args.null)
+    log = open(os.devnull, "w") if args.quiet else sys.stderr
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(log):
+        client = LobbitClient(args.host, args.port, sources, walk_workers=args.walk_workers,
+                              connections=args.connections, order=args.order, dedup=args.dedup,
+                              streams=args.streams, mirrors=mirrors, sync=args.sync)
+        if client.lobbit_connect():
+            summary["connected"] = True
+            try:
+                summary["files"] = client.lobbit_send()
+            except OSError as e:
+                summary["error"] = str(e)
+            finally:
+                client.lobbit_close()
+    if args.quiet:
+        log.close()
+    results = summary["files"]
+    summary["seconds"] = round(time.perf_counter() - started, 6)
+    summary["confirmed"] = sum(1 for r in results if r["status"] == "confirmed")
+    summary["failed"] = sum(1 for r in results if r["status"] != "confirmed")
+    summary["bytes"] = sum(r["size"] for r in results if r["status"] == "confirmed")
+    if args.dedup:
+        summary.update(dedup_totals(results))
+    if mirrors:
+        summary["destinations"] = mirror_totals(results)
+    if client.manifest:
+        summary["sync"] = {"compared": client.manifest.compared, "unchanged": client.manifest.unchanged}
+    if not summary["connected"]:
+        code = EXIT_CONNECT
+    elif "error" in summary or summary["failed"]:
+        code = EXIT_PARTIAL
+    elif not results and not (client.manifest and client.manifest.compared):
+        # a sync with nothing to send found files, they were all unchanged
+        code = EXIT_NO_FILES
+    else:
+        code = EXIT_OK
+    summary["exit_code"] = code
+    json.dump(summary, sys.stdout)
+    sys.stdout.write("\n")
+    return code
+
+
+def queue(args: argparse.Namespace) -> int:
+    """
+    Runs the queue command. 'add' and 'list' manage the durable queue,
+    'run' sends everything queued for a server, resuming any uploads
+    left unfinished, and retries failures with backoff until the queue
+    is empty. A JSON summary of the run is printed to stdout
+
+    Args:
+        args (argparse.Namespace) : parsed command line arguments
+    Returns:
+        int : the exit code for the process
+    """
+    import contextlib
+    import json
+    from app.lobbit_client.client import LobbitClient
+    from app.lobbit_client.engine import UploadEngine
+    from app.lobbit_client.upload_queue import UploadQueue
+
+    upload_queue = UploadQueue(args.db)
+    try:
+        if args.action == "add":
+            # 'queue run' may be started from another directory
+            sources = [os.path.abspath(source) for source in iter_sources(args.files, sys.stdin, args.null)]
+            ids = upload_queue.add(sources, args.host, args.port, args.priority)
+            json.dump({"added": ids}, sys.stdout)
+            sys.stdout.write("\n")
+            return EXIT_OK if ids else EXIT_NO_FILES
+        if args.action == "list":
+            json.dump([dict(row) for row in upload_queue.entries()], sys.stdout)
+            sys.stdout.write("\n")
+            return EXIT_OK
+        log = open(os.devnull, "w") if args.quiet else sys.stderr
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(log):
+            client = LobbitClient(args.host, args.port, [], connections=args.connections, dedup=args.dedup,
+                                  streams=args.streams)
+            engine = UploadEngine(client, upload_queue, echo=True)
+            engine.start()
+            engine.join()
+        if args.quiet:
+            log.close()
+        results = engine.results
+        failed = len(engine.failed)
+        summary = {
+            "host": args.host,
+            "port": args.port,
+            "seconds": round(time.perf_counter() - started, 6),
+            "confirmed": sum(1 for r in results if r["status"] == "confirmed"),
+            "bytes": sum(r["size"] for r in results if r["status"] == "confirmed"),
+            "failed_uploads": failed,
+            "exit_code": EXIT_PARTIAL if failed else EXIT_OK,
+        }
+        if args.dedup:
+            summary.update(dedup_totals(results))
+        json.dump(summary, sys.stdout)
+        sys.stdout.write("\n")
+        return summary["exit_code"]
+    finally:
+        upload_queue.close()
+
+
+def remote_list(args: argparse.Namespace) -> int:
+    """
+    Runs the remote-list command, printing one page of the server's
+    catalog as JSON. Pass the page's 'next' value to --after to get
+    the page after it
+
+    Args:
+        args (argparse.Namespace) : parsed command line arguments
+    Returns:
+        int : the exit code for the process
+    """
+    import contextlib
+    import json
+    from app.lobbit_client.client import LobbitClient
+
+    with contextlib.redirect_stdout(sys.stderr):
+        client = LobbitClient(args.host, args.port, [], connections=1)
+        if not client.lobbit_connect():
+            return EXIT_CONNECT
+        try:
+            page = client.remote_list(args.pattern, args.after, args.limit)
+        except (OSError, ValueError) as e:
+            print(f"[-] Could not list the server's files: {e}")
+            return EXIT_CONNECT
+        finally:
+            client.lobbit_close()
+    json.dump(page, sys.stdout)
+    sys.stdout.write("\n")
+    return EXIT_OK
+
+
+def verify(args: argparse.Namespace) -> int:
+    """
+    Runs the verify command and prints a JSON summary holding the status
+    of every file: 'match', 'mismatch', 'missing', 'pending' or 'error'
+
+    Args:
+        args (argparse.Namespace) : parsed command line arguments
+    Returns:
+        int : the exit code for the process
+    """
+    import contextlib
+    import json
+    from app.lobbit_client.client import LobbitClient
+    from app.lobbit_client.hash_cache import HashCache
+
+    summary = {"host": args.host, "port": args.port, "connected": False, "files": []}
+    sources = iter_sources(args.files, sys.stdin, args.null)
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(sys.stderr):
+        client = LobbitClient(args.host, args.port, sources, connections=1)
+        client.hash_cache = HashCache(args.cache)
+        if client.lobbit_connect():
+            summary["connected"] = True
+            try:
+                summary["files"] = client.verify(args.workers)
+            except (OSError, ValueError) as e:
+                summary["error"] = str(e)
+            finally:
+                client.lobbit_close()
+        client.hash_cache.close()
+    results = summary["files"]
+    summary["seconds"] = round(time.perf_counter() - started, 6)
+    matched = sum(1 for r in results if r["status"] == "match")
+    if not summary["connected"]:
+        code = EXIT_CONNECT
+    elif "error" in summary or matched != len(results):
+        code = EXIT_PARTIAL
+    elif not results:
+        code = EXIT_NO_FILES
+    else:
+        code = EXIT_OK
+    summary["statuses"] = {status: sum(1 for r in results if r["status"] == status)
+                           for status in ("match", "mismatch", "missing", "pending", "error")}
+    summary["cache_hits"] = client.hash_cache.hits
+    summary["exit_code"] = code
+    json.dump(summary, sys.stdout)
+    sys.stdout.write("\n")
+    return code
+
+
+def stream(args: argparse.Namespace) -> int:
+    """
+    Runs the stream command. Data is read from stdin, or a file or FIFO,
+    as it is produced and uploaded under one name without being staged
+    on disk, e.g. 'pg_dump db | lobbit stream db.sql ...'. A JSON summary
+    of the upload is printed to stdout
+
+    Args:
+        args (argparse.Namespace) : parsed command line arguments
+    Returns:
+        int : the exit code for the process
+    """
+    import contextlib
+    import json
+    from app.lobbit_client.client import LobbitClient
+
+    summary = {"host": args.host, "port": args.port, "connected": False, "files": []}
+    log = open(os.devnull, "w") if args.quiet else sys.stderr
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(log):
+        client = LobbitClient(args.host, args.port, [], connections=1)
+        if client.lobbit_connect():
+            summary["connected"] = True
+            try:
+                if args.source == "-":
+                    summary["files"] = [client.send_stream(args.name, sys.stdin.buffer)]
+                else:
+                    with open(args.source, "rb") as source:
+                        summary["files"] = [client.send_stream(args.name, source)]
+            except OSError as e:
+                summary["error"] = str(e)
+            finally:
+                client.lobbit_close()
+    if args.quiet:
+        log.close()
+    results = summary["files"]
+    summary["seconds"] = round(time.perf_counter() - started, 6)
+    summary["bytes"] = sum(r["size"] for r in results if r["status"] == "confirmed")
+    if not summary["connected"]:
+        code = EXIT_CONNECT
+    elif "error" in summary or not results or results[0]["status"] != "confirmed":
+        code = EXIT_PARTIAL
+    else:
+        code = EXIT_OK
+    summary["exit_code"] = code
+    json.dump(summary, sys.stdout)
+    sys.stdout.write("\n")
+    return code
+
+
+def main(argv: List = None) -> int:
+    """
+    Main function of the non-interactive Lobbit client
+
+    Args:
+        argv (List) : command line arguments, defaults to sys.argv[1:]
+    Returns:
+        int : the exit code for the process
+    """
+    args = build_parser().parse_args(argv)
+    if args.command == "upload":
+        return upload(args)
+    if args.command == "queue":
+        return queue(args)
+    if args.command == "remote-list":
+        return remote_list(args)
+    if args.command == "verify":
+        return verify(args)
+    if args.command == "stream":
+        return stream(args)
+    return EXIT_USAGE
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    except KeyboardInterrupt:
+        sys.exit(130)
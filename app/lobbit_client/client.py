@@ -1,10 +1,82 @@
+import ipaddress
+import itertools
 import json
 import os
 import socket
 import ssl
+import stat
+import struct
+import time
 
+from app.lobbit_client.hash_cache import HashCache
+from app.lobbit_client.mirror import MirrorLane
+from app.lobbit_client.scheduler import FileScheduler
+from app.lobbit_client.sender import FileSender, SourceChanged, TransferCancelled
+from app.lobbit_client.sync import SyncManifest
 from app.lobbit_util.buffer import Buffer
-from typing import List, Tuple
+from app.lobbit_util.config import ConfigError, cert_exists, get_config
+from app.lobbit_util import protocol, sparse
+from app.lobbit_util.mux import MAX_STREAMS, MuxSession, Stream
+from app.lobbit_util.tuning import read_limits, set_nodelay
+from app.lobbit_util.walk import TreeWalker
+from threading import Event, Lock, Thread
+from typing import BinaryIO, Iterable, Iterator, List, Tuple, Union
+
+
+def peer_uid(sock: socket.socket) -> Union[int, None]:
+    """
+    Reads the user id of the process at the other end of a Unix socket
+
+    Args:
+        sock (socket.socket) : the connected socket
+    Returns:
+        Union[int, None] : the uid, or None where SO_PEERCRED is not supported
+    """
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    return struct.unpack("3i", creds)[1]
+
+
+def is_local_host(host: str) -> bool:
+    """
+    Checks whether <host> names this machine, either a loopback address
+    or an address one of its interfaces holds
+
+    Args:
+        host (str) : hostname or IP address
+    Returns:
+        bool : True if connections to <host> stay on this machine
+    """
+    try:
+        infos = socket.getaddrinfo(host, None, proto=socket.IPPROTO_TCP)
+    except OSError:
+        return False
+    for family, _, _, _, address in infos:
+        if ipaddress.ip_address(address[0].split("%")[0]).is_loopback:
+            return True
+        probe = socket.socket(family, socket.SOCK_DGRAM)
+        try:
+            # binding only succeeds for addresses held by a local interface
+            probe.bind((address[0], 0))
+            return True
+        except OSError:
+            pass
+        finally:
+            probe.close()
+    return False
+
+
+def glob_escape(name: str) -> str:
+    """
+    Escapes the GLOB wildcards in a name so it only matches itself
+
+    Args:
+        name (str) : the upload name
+    Returns:
+        str : the name with each '*', '?' and '[' wrapped in brackets
+    """
+    return "".join(f"[{c}]" if c in "*?[" else c for c in name)
 
 
 class LobbitClient:
@@ -14,20 +86,86 @@ class LobbitClient:
     and uploading files
     """
 
-    def __init__(self, host: str, port: int, files: List) -> None:
+    # seconds to wait for the server to close the connection
+    CLOSE_TIMEOUT = 5
+    # smaller files are not worth the round trip for the chunk manifest
+    DEDUP_MIN_SIZE = 1024 * 1024
+    # files hashed per call to the thread pool
+    HASH_BATCH = 1024
+    # catalog lookups written before their replies are read
+    LOOKUP_BATCH = 64
+
+    def __init__(self, host: str, port: int, files: Iterable, walk_workers: int = 8,
+                 connections: int = 1, order: str = "largest", window: int = protocol.DEFAULT_WINDOW,
+                 retries: int = 3, dedup: bool = False, streams: int = 1,
+                 mirrors: List[Tuple[str, int]] = None, sync: bool = False) -> None:
         """
         Constructor for the LobbitClient class
 
         Args:
-            host (str)   : remote IPv4 address
-            port (int)   : remote port to connect to
-            files (List) : list of files to upload to the server
+            host (str)         : remote IPv4 address
+            port (int)         : remote port to connect to
+            files (Iterable)   : files, directories or glob patterns to upload
+            walk_workers (int) : threads used to walk directories
+            connections (int)  : number of TLS connections to send files over
+            order (str)        : order files are sent in, see FileScheduler
+            window (int)       : bytes of unacknowledged data per connection
+            retries (int)      : times a failed file is retried
+            dedup (bool)       : send files of DEDUP_MIN_SIZE or more as content
+                                 defined chunks, skipping chunks the server holds
+            streams (int)      : files sent at once over each connection as
+                                 multiplexed streams, 1 sends them one by one
+            mirrors (List[Tuple[str, int]]) : the host and port of other servers every
+                                              file is sent to as well, see MirrorLane
+            sync (bool)        : only send the files the server does not hold with
+                                 the same size and modified time, see SyncManifest.
+                                 Can't be combined with mirrors
+        Raises:
+            ValueError : if <sync> is set with mirrors
         """
         self.host = host
         self.port = port
         self.files = files
+        self.walk_workers = walk_workers
+        self.connections = max(1, connections)
+        self.order = order
+        self.window = window
+        self.retries = retries
+        self.dedup = dedup
+        self.sync = sync
+        # the comparison made by the last sync, read for its counts
+        self.manifest = None
+        self.streams = min(max(1, streams), MAX_STREAMS)
+        self.mirrors = []
+        for mirror in mirrors or []:
+            if mirror != (host, port) and mirror not in self.mirrors:
+                self.mirrors.append(mirror)
+        if sync and self.mirrors:
+            # the manifest is only compared with this client's server, the mirrors may differ
+            raise ValueError("Sync can't be combined with mirrors")
+        # a client per mirror, connected alongside this one
+        self.replicas = []
         self.sock = None
-        self.context = ssl.create_default_context()
+        self.socks = []
+        # sessions carrying the streams in <self.socks> when streams > 1
+        self.sessions = []
+        # limits of the connection tuning read from config.json, see tuning.read_limits
+        self.tuning = None
+        self.config = get_config()
+        self.context = None
+        self.ktls = False
+        # 'tls' or 'unix', the transport of the connections in the pool
+        self.transport = None
+        # shared state of the current upload, read by the upload engine
+        self.state = None
+        self.scheduler = None
+        self.cancelled = Event()
+        # path to (size, mtime_ns, committed) of files partly sent by an earlier run
+        self.resume = {}
+        # messages from the send path go through <log> so they can be captured
+        self.log = print
+        # opened on first use by <checksums>
+        self.hash_cache = None
 
     @staticmethod
     def cert_exists(path: str) -> Tuple[bool, str]:
@@ -38,64 +176,721 @@ class LobbitClient:
         Returns:
             bool: True if <cert_name>.pem exists, False is not
         """
-        if not os.path.isfile(path):
-            return False, "[-] File not found, check value of PUBLIC_CERT_PATH"
-        suffix = path.split(".")[-1].lower()
-        if suffix != "pem":
-            return False, f"[-] Expected .pem certificate file, found .{suffix}"
-        return True, ""
+        return cert_exists(path)
 
     def lobbit_connect(self) -> bool:
         """
-        Create the connection to the remote location
+        Create the connections to the remote location. <self.sock> holds
+        the first connection and <self.socks> holds every connection in
+        the pool. Mirrors are connected too, in <self.replicas>; only a
+        failure to reach this client's own server fails the connection
 
         Returns:
             bool : True if connection was successful, False if not
         """
         try:
-            current_dir = os.path.abspath(os.path.dirname(__file__))
-            with open(f"{current_dir}/../../config.json") as file:
-                config = json.load(file)
-
-            path = config['PUBLIC_CERT_PATH']
-            exists, msg = LobbitClient.cert_exists(path)
-            if not exists:
-                print(msg)
-                return False
-
-            self.context.load_verify_locations(cafile=path)
-            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.sock = self.context.wrap_socket(self.sock, server_hostname=self.host)
-
-            print(f"[+] Connecting to {self.host}:{self.port}...")
-            self.sock.connect((self.host, self.port))
-            print("[+] Connected successfully\n")
+            self.log(f"[+] Connecting to {self.host}:{self.port}...")
+            self.tuning = read_limits(self.config.settings(), self.log)
+            for _ in range(self.connections):
+                sock = self.open_connection()
+                self.socks += self.open_streams(sock) if self.streams > 1 else [sock]
+            self.sock = self.socks[0]
+            via = " over the local Unix socket" if self.transport == "unix" else ""
+            streams = f", {self.streams} streams each" if self.streams > 1 else ""
+            self.log(f"[+] Connected successfully ({self.connections} connection(s){streams}{via})\n")
+            self.replicas = [self.replica(host, port) for host, port in self.mirrors]
+            for replica in self.replicas:
+                # a mirror that can't be reached fails its copies, the others still get theirs
+                replica.lobbit_connect()
             return True
         except ConnectionRefusedError as e:
-            print(e)
-            print(f"[-] Connection '{self.host}:{self.port}' failed. Connection refused...")
+            self.log(str(e))
+            self.log(f"[-] Connection '{self.host}:{self.port}' failed. Connection refused...")
+            self.lobbit_close()
             return False
         except TimeoutError:
-            print(f"[-] Connection '{self.host}:{self.port}' failed. Connection timeout...")
+            self.log(f"[-] Connection '{self.host}:{self.port}' failed. Connection timeout...")
+            self.lobbit_close()
             return False
         except ssl.SSLCertVerificationError as e:
-            print(f"[-] SSL Certificate verification failed: {e}")
+            self.log(f"[-] SSL Certificate verification failed: {e}")
+            self.lobbit_close()
+            return False
+        except ConfigError as e:
+            self.log(str(e))
+            self.lobbit_close()
             return False
         except Exception as e:
-            print(f"[-] Exception caught: {e}")
+            self.log(f"[-] Exception caught: {e}")
+            self.lobbit_close()
             return False
 
-    def lobbit_send(self) -> None:
+    def replica(self, host: str, port: int) -> "LobbitClient":
         """
-        Sends the file supplied by the user to the remote
-        location using the socket instance
+        Returns a client for a mirror with the same connection settings
+        and config as this one
+
+        Args:
+            host (str) : the mirror's host
+            port (int) : its port
+        Returns:
+            LobbitClient : the client, not yet connected
+        """
+        replica = LobbitClient(host, port, [], connections=self.connections, window=self.window,
+                               streams=self.streams)
+        replica.config, replica.log = self.config, self.log
+        return replica
+
+    def server_uids(self) -> set:
+        """
+        Returns the users the local server may run as, UNIX_SERVER_UID
+        in config.json, or root and this user when it is not set
+
+        Returns:
+            set : the user ids
+        """
+        uid = self.config.get("UNIX_SERVER_UID")
+        if isinstance(uid, int) and not isinstance(uid, bool):
+            return {uid}
+        return {0, os.getuid()}
+
+    def local_socket(self) -> Union[str, None]:
+        """
+        Returns the server's Unix domain socket when the server runs on
+        this machine, set as UNIX_SOCKET in config.json. TLS is what
+        authenticates the server otherwise, so the socket is only used
+        when it and its directory belong to a user the server may run
+        as and no other user can write to the directory to replace it
+
+        Returns:
+            Union[str, None] : path of the socket, or None to connect over TLS
+        """
+        path = self.config.get("UNIX_SOCKET")
+        if not path or not os.path.exists(path) or not is_local_host(self.host):
+            return None
+        uids = self.server_uids()
+        try:
+            st = os.stat(path)
+            parent = os.stat(os.path.dirname(os.path.abspath(path)))
+        except OSError:
+            return None
+        if st.st_uid not in uids or parent.st_uid not in uids or parent.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            self.log(f"[-] Not using the local socket '{path}', it or its directory could be replaced "
+                     f"by another user, connecting over TLS")
+            return None
+        return path
+
+    def open_connection(self) -> socket.socket:
+        """
+        Opens a single connection to the remote location. A server on this
+        machine is reached through its Unix domain socket, skipping TLS
+        and the TCP stack, once the user serving the socket has been
+        checked, otherwise a TLS connection is opened
+
+        Returns:
+            socket.socket : the connected socket
+        """
+        if self.transport != "tls":
+            path = self.local_socket()
+            if path:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                try:
+                    sock.connect(path)
+                    uid = peer_uid(sock)
+                    if uid is not None and uid not in self.server_uids():
+                        raise PermissionError(f"the socket is served by user {uid}")
+                    self.transport = "unix"
+                    return sock
+                except OSError as e:
+                    sock.close()
+                    if self.transport == "unix":
+                        raise
+                    self.log(f"[-] Could not use the local socket '{path}': {e}, connecting over TLS")
+        self.transport = "tls"
+        # the context is built once per process and shared by every connection
+        self.context = self.config.client_context()
+        self.ktls = self.config.ktls
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        set_nodelay(sock)
+        sock = self.context.wrap_socket(sock, server_hostname=self.host)
+        try:
+            sock.connect((self.host, self.port))
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def open_streams(self, sock: socket.socket) -> List[Union[socket.socket, Stream]]:
+        """
+        Asks the server to carry <self.streams> streams over a connection,
+        so that many files are sent at once without a handshake each.
+        Servers without streams close the connection, in which case a new
+        connection is opened and files are sent one by one
+
+        Args:
+            sock (socket.socket) : the new connection
+        Returns:
+            List[Union[socket.socket, Stream]] : the streams, or a single connection
+        """
+        buffer = Buffer(sock)
+        try:
+            buffer.put_utf8(protocol.MUX)
+            status, _ = protocol.recv_status(buffer)
+            if status != protocol.OK:
+                raise ConnectionError(f"Server replied '{status}'")
+        except (OSError, ValueError) as e:
+            sock.close()
+            self.log(f"[-] The server does not support streams ({e}), sending files one by one")
+            self.streams = 1
+            return [self.open_connection()]
+        session = MuxSession(buffer)
+        session.start()
+        self.sessions.append(session)
+        return [session.open_stream() for _ in range(self.streams)]
+
+    def replace_connection(self, sock: socket.socket) -> Union[socket.socket, None]:
+        """
+        Closes a connection that can no longer be used and opens a new
+        one in its place in the pool
+
+        Args:
+            sock (socket.socket) : the connection to replace
+        Returns:
+            Union[socket.socket, None] : the new connection or None if it failed
+        """
+        sock.close()
+        try:
+            # a stream is replaced by a new stream on the same connection
+            new_sock = sock.session.open_stream() if isinstance(sock, Stream) else self.open_connection()
+        except OSError as e:
+            self.log(f"[-] Could not reopen connection: {e}")
+            new_sock = None
+        with self.state["lock"]:
+            index = self.socks.index(sock)
+            if new_sock:
+                self.socks[index] = new_sock
+            else:
+                self.socks.pop(index)
+            self.sock = self.socks[0] if self.socks else None
+        return new_sock
+
+    def lobbit_close(self) -> None:
+        """
+        Closes every connection in the pool. An empty file name tells the
+        server the upload is complete and the connection is drained until
+        the server closes it, so closing never resets the connection
+        before the server has read everything that was sent. Streams are
+        closed the same way before their sessions are ended
+        """
+        for sock in self.socks:
+            try:
+                sock.settimeout(LobbitClient.CLOSE_TIMEOUT)
+                Buffer(sock).put_utf8("")
+                while sock.recv(4096):
+                    pass
+            except OSError:
+                pass
+            sock.close()
+        for session in self.sessions:
+            session.close(LobbitClient.CLOSE_TIMEOUT)
+            session.sock.close()
+        for replica in self.replicas:
+            replica.lobbit_close()
+        self.replicas = []
+        self.sessions = []
+        self.socks = []
+        self.sock = None
+        self.transport = None
+
+    def remote_list(self, pattern: str = "*", after: str = "", limit: int = 100) -> dict:
+        """
+        Asks the server for one page of its catalog of received files.
+        Must not be called while files are being sent
+
+        Args:
+            pattern (str) : GLOB pattern matched against the upload names
+            after (str)   : the 'next' value of the previous page, '' for the first page
+            limit (int)   : most entries on the page
+        Returns:
+            dict : 'files' holding the name, size, sha256, received time and
+                   client of each file, and 'next' holding the value to pass as
+                   <after> for the next page, or None on the last page
         """
         buffer = Buffer(self.sock)
-        for file in self.files:
-            print(f"[+] Sending '{file}'...")
-            buffer.put_utf8(file)
-            file_size = os.path.getsize(file)
-            buffer.put_utf8(str(file_size))
-            with open(file, 'rb') as f:
-                buffer.put_bytes(f.read())
-            print("[+] File sent\n")
+        buffer.put_utf8(protocol.LIST)
+        buffer.put_utf8(pattern)
+        buffer.put_utf8(after)
+        buffer.put_utf8(str(limit))
+        reply = buffer.get_utf8()
+        if not reply:
+            raise ConnectionError("Connection closed by the server")
+        return json.loads(reply)
+
+    def remote_lookup(self, names: List[str]) -> dict:
+        """
+        Looks up the catalog entries of several upload names at once. The
+        requests are all written before the replies are read so a batch
+        costs one round trip. Must not be called while files are being sent
+
+        Args:
+            names (List[str]) : the upload names, up to LOOKUP_BATCH
+        Returns:
+            dict : upload name to catalog entry for the names the server holds
+        """
+        buffer = Buffer(self.sock)
+        for name in names:
+            buffer.put_utf8(protocol.LIST)
+            buffer.put_utf8(glob_escape(name))
+            buffer.put_utf8("")
+            buffer.put_utf8("1")
+        entries = {}
+        for _ in names:
+            reply = buffer.get_utf8()
+            if not reply:
+                raise ConnectionError("Connection closed by the server")
+            for entry in json.loads(reply)["files"]:
+                entries[entry["name"]] = entry
+        return entries
+
+    def checksums(self, workers: int = 4) -> Iterator[dict]:
+        """
+        Walks the files supplied by the user and yields the SHA-256 of
+        each, read from the hash cache for files unchanged since they were
+        last hashed. Files are hashed in batches across a thread pool
+
+        Args:
+            workers (int) : threads hashing at once
+        Returns:
+            Iterator[dict] : the file path, upload name, sha256 and any error
+                             of each file found
+        """
+        if self.hash_cache is None:
+            self.hash_cache = HashCache()
+        walker = TreeWalker(self.files, workers=self.walk_workers)
+        found = iter(walker)
+        while batch := list(itertools.islice(found, LobbitClient.HASH_BATCH)):
+            names = dict(batch)
+            for path, digest, error in self.hash_cache.digest_many(names, workers):
+                yield {"file": path, "name": names[path], "sha256": digest, "error": error}
+        for path, error in walker.errors:
+            self.log(f"[-] Could not read '{path}': {error}")
+            yield {"file": path, "name": None, "sha256": None, "error": error}
+
+    def verify(self, workers: int = 4) -> List[dict]:
+        """
+        Checks the files supplied by the user against the server's catalog
+        by comparing the local SHA-256 of each file with the digest the
+        server recorded when it received it
+
+        Args:
+            workers (int) : threads hashing at once
+        Returns:
+            List[dict] : the file path, upload name, local and remote sha256, any
+                         error and status of each file: 'match', 'mismatch',
+                         'missing' when the server does not hold it, 'pending'
+                         while the server is still hashing it or 'error'
+        """
+        results = []
+        checksums = self.checksums(workers)
+        while batch := list(itertools.islice(checksums, LobbitClient.LOOKUP_BATCH)):
+            entries = self.remote_lookup([result["name"] for result in batch if result["name"]])
+            for result in batch:
+                entry = entries.get(result["name"])
+                result["remote_sha256"] = entry["sha256"] if entry else None
+                if result["error"]:
+                    result["status"] = "error"
+                elif not entry:
+                    result["status"] = "missing"
+                elif not entry["sha256"]:
+                    result["status"] = "pending"
+                else:
+                    result["status"] = "match" if entry["sha256"] == result["sha256"] else "mismatch"
+                results.append(result)
+        return results
+
+    def lobbit_send(self) -> List:
+        """
+        Sends the files supplied by the user to the remote location.
+        Directories and glob patterns are walked lazily so sending starts
+        straight away and each file is sent under its path relative to
+        the source. Files are handed to the connections in the pool
+        concurrently in the order set by <self.order>. A file is only
+        confirmed once the server acknowledges it is on disk; files or
+        ranges that fail are retried from the last committed offset.
+        With mirrors every file is sent to every server, see
+        <send_mirrored>, and only confirmed once all of them confirm it.
+        With <self.sync> only the files that are missing or changed on
+        this client's server are sent, compared over an extra connection
+        as they are found
+
+        Returns:
+            List : a result dict for every file found, holding the file
+                   path, upload name, size in bytes, status ('confirmed',
+                   'failed' or 'cancelled'), bytes committed, bytes sent over
+                   the connection, seconds taken and any error. With mirrors
+                   'destinations' holds the status, bytes committed and sent
+                   and any error of each server's copy, by HOST:PORT
+        """
+        walker = TreeWalker(self.files, workers=self.walk_workers)
+        source, self.manifest = walker, None
+        if self.sync:
+            source = self.manifest = SyncManifest(walker, self.open_connection())
+        scheduler = FileScheduler(source, order=self.order)
+        state = {"jobs": {}, "order": [], "results": [], "lock": Lock()}
+        self.state, self.scheduler = state, scheduler
+        live = [] if self.replicas else list(self.socks)
+        if self.replicas:
+            self.send_mirrored(scheduler, state)
+        while live:
+            dead = []
+            workers = [
+                Thread(target=self.send_worker, args=(sock, scheduler, state, dead), daemon=True)
+                for sock in live
+            ]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            with state["lock"]:
+                self.socks = [sock for sock in self.socks if sock not in dead]
+                self.sock = self.socks[0] if self.socks else None
+                # cancelled files replace their connection, so read the pool again
+                live = list(self.socks)
+            for sock in dead:
+                sock.close()
+            # files requeued by a failed connection are sent on the survivors
+            if self.cancelled.is_set() or not scheduler.pending():
+                break
+        results = state["results"]
+        if self.cancelled.is_set():
+            # files that were never started are dropped along with the walk
+            scheduler.close()
+        # every connection failed, so anything still queued cannot be sent
+        while job := scheduler.next_job():
+            job = self.new_job(state, *job)
+            error = f"No connection available, last error: {job['last_error']}" if job["last_error"] else \
+                "No connection available"
+            results.append(self.result(job, "failed", error))
+        for path, name, error in scheduler.errors:
+            self.log(f"[-] Could not read '{path}': {error}")
+            results.append(self.result(self.new_job(state, path, name, 0), "failed", error))
+        for path, error in source.errors:
+            self.log(f"[-] Could not read '{path}': {error}" if path != "sync" else f"[-] {error}")
+            results.append(self.result(self.new_job(state, path, None, 0), "failed", error))
+        if self.manifest:
+            self.log(f"[+] Compared {self.manifest.compared} file(s) with the server, "
+                     f"{self.manifest.unchanged} unchanged")
+        return results
+
+    def send_mirrored(self, scheduler: FileScheduler, state: dict) -> None:
+        """
+        Sends every file to this client's server and to each mirror at
+        once, reading it only once, see MirrorLane. Lane i carries the
+        i-th connection of every server. A mirror that could not be
+        reached fails its copy of each file while the others carry on
+
+        Args:
+            scheduler (FileScheduler) : source of files to send
+            state (dict)              : shared jobs, results and lock
+        """
+        for replica in self.replicas:
+            replica.state = state
+        pools = [self.socks] + [replica.socks for replica in self.replicas if replica.socks]
+        lanes = [
+            MirrorLane(self, [(self, self.socks[i])] +
+                       [(replica, replica.socks[i] if replica.socks else None) for replica in self.replicas],
+                       scheduler, state)
+            for i in range(min(len(pool) for pool in pools))
+        ]
+        workers = [Thread(target=lane.run, daemon=True) for lane in lanes]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+    def send_stream(self, name: str, source: Union[BinaryIO, Iterable[bytes]]) -> dict:
+        """
+        Uploads data of unknown length, e.g. the output of 'pg_dump' or
+        anything else read from a pipe, without staging it on disk. The
+        data is read from <source> as it is produced and sent in chunks
+        over the first connection, which must be open. The data can only
+        be read once so a failed stream is not retried
+
+        Args:
+            name (str)                                : upload name of the data on the server
+            source (Union[BinaryIO, Iterable[bytes]]) : a binary file-like object, e.g. sys.stdin.buffer,
+                                                        or an iterable of bytes such as a generator
+        Returns:
+            dict : the result, as returned for each file by <lobbit_send>
+        """
+        if not self.sock:
+            raise ConnectionError("Not connected, call lobbit_connect first")
+        state = {"jobs": {}, "order": [], "results": [], "lock": Lock()}
+        job = self.new_job(state, name, name, 0)
+        job["attempts"], job["status"] = 1, "sending"
+        job["attempt_started"] = time.perf_counter()
+
+        def on_final(job: dict, status: str, offset: int) -> None:
+            if status == protocol.OK and not job["error"]:
+                self.log(f"[+] Confirmed on disk '{job['name']}' ({offset} bytes, {job['method']})")
+                self.record(state, self.result(job, "confirmed", None))
+            else:
+                self.record(state, self.result(job, "failed", LobbitClient.refusal(job, status, offset)))
+
+        sender = FileSender(self.sock, on_final, window=self.window)
+        sender.tune(self.tuning, f"{self.host}:{self.port}", self.log)
+        self.log(f"[+] Streaming '{name}'...")
+        try:
+            sender.send_chunked(job, source)
+            sender.drain()
+        except OSError as e:
+            self.log(f"[-] Connection failed: {e}")
+            # the connection is left in the middle of the stream
+            self.socks.remove(self.sock)
+            self.sock.close()
+            self.sock = self.socks[0] if self.socks else None
+            self.record(state, self.result(job, "failed", str(e)))
+        return state["results"][0]
+
+    def send_worker(self, sock: socket.socket, scheduler: FileScheduler, state: dict, dead: List) -> None:
+        """
+        Sends files from the scheduler over a single connection until
+        there are none left or the connection fails, then waits for the
+        server to confirm every file still in flight. A file cancelled
+        part way through leaves the connection mid-file, so the files
+        sent before it are confirmed and the connection is replaced. A
+        file that shrinks while it is sent is abandoned the same way
+
+        Args:
+            sock (socket.socket)      : the connection to send over
+            scheduler (FileScheduler) : source of files to send
+            state (dict)              : shared jobs, results and lock
+            dead (List)               : connections that have failed
+        """
+        while sock:
+            sender = FileSender(sock, lambda job, status, offset: self.finish(job, status, offset, scheduler, state),
+                                window=self.window)
+            sender.tune(self.tuning, f"{self.host}:{self.port}", self.log)
+            try:
+                while not self.cancelled.is_set() and (job := scheduler.next_job()):
+                    self.send_file(sender, self.new_job(state, *job), state)
+                sender.drain()
+                return
+            except TransferCancelled as e:
+                if isinstance(e, SourceChanged):
+                    # dropping the connection stops the server confirming the part that was sent
+                    self.record(state, self.result(e.job, "failed", e.job["error"]))
+                else:
+                    self.record(state, self.result(e.job, "cancelled", "Cancelled by user"))
+                try:
+                    sender.drain_before(e.job)
+                except OSError as err:
+                    for job in sender.in_flight:
+                        if job is not e.job:
+                            self.retry(job, str(err), scheduler, state)
+                sock = self.replace_connection(sock)
+                if not sock:
+                    return
+            except OSError as e:
+                self.log(f"[-] Connection failed: {e}")
+                with state["lock"]:
+                    dead.append(sock)
+                for job in sender.in_flight:
+                    self.retry(job, str(e), scheduler, state)
+                return
+
+    def new_job(self, state: dict, path: str, name: Union[str, None], size: int) -> dict:
+        """
+        Returns the job tracking a file across attempts, creating it
+        the first time the file is seen
+
+        Args:
+            state (dict) : shared jobs, results and lock
+            path (str)   : path of the file
+            name (str)   : upload name of the file
+            size (int)   : size of the file in bytes
+        Returns:
+            dict : the job for the file
+        """
+        with state["lock"]:
+            if path not in state["jobs"]:
+                state["jobs"][path] = {"file": path, "name": name, "size": size, "committed": 0,
+                                       "attempts": 0, "started": time.perf_counter(),
+                                       "method": None, "error": None, "last_error": None,
+                                       "status": "queued", "sent": 0, "transferred": 0,
+                                       "attempt_started": None, "attempt_offset": 0, "cancelled": False}
+                state["order"].append(state["jobs"][path])
+            return state["jobs"][path]
+
+    def send_file(self, sender: FileSender, job: dict, state: dict) -> None:
+        """
+        Sends a single file, or the part of it the server has not yet
+        committed, over the connection held by <sender>
+
+        Args:
+            sender (FileSender) : sender for the connection
+            job (dict)          : the file to send
+            state (dict)        : shared jobs, results and lock
+        """
+        if job["cancelled"]:
+            self.record(state, self.result(job, "cancelled", "Cancelled by user"))
+            return
+        job["attempts"] += 1
+        try:
+            f = FileSender.open(job["file"])
+        except OSError as e:
+            self.log(f"[-] Could not open '{job['file']}': {e}")
+            self.record(state, self.result(job, "failed", str(e)))
+            return
+        with f:
+            if job["attempts"] == 1:
+                st = os.fstat(f.fileno())
+                # kept by the server so a later sync can tell whether the file changed
+                job["size"], job["mtime"] = st.st_size, st.st_mtime_ns
+                saved = self.resume.get(job["file"])
+                # an earlier run only resumes a file that has not changed since
+                if saved and saved[:2] == (st.st_size, st.st_mtime_ns):
+                    job["committed"] = saved[2]
+            extents = sparse.data_extents(f.fileno(), job["committed"], job["size"])
+            # files with holes are sent as their data extents, dedup would read every hole
+            if extents is not None and sum(n for _, n in extents) == job["size"] - job["committed"]:
+                extents = None
+            dedup = extents is None and self.dedup and job["size"] >= LobbitClient.DEDUP_MIN_SIZE
+            if dedup:
+                self.log(f"[+] Sending '{job['file']}' as chunks...")
+                job["committed"] = 0
+            elif extents is not None:
+                self.log(f"[+] Sending '{job['file']}' from byte {job['committed']}, "
+                         f"{sum(n for _, n in extents)} bytes of data in {len(extents)} extent(s)...")
+            else:
+                self.log(f"[+] Sending '{job['file']}' from byte {job['committed']}...")
+            if isinstance(sender.buffer.sock, Stream):
+                # streams sending smaller files cut in ahead of larger ones on the connection
+                sender.buffer.sock.priority = -(job["size"] - job["committed"]).bit_length()
+            job["status"], job["attempt_offset"] = "sending", job["committed"]
+            job["attempt_started"] = time.perf_counter()
+            if dedup:
+                sender.send_dedup(job, f)
+            else:
+                sender.send(job, f, extents)
+            if job["status"] == "sending":
+                job["status"] = "waiting"
+            if job.get("dedup"):
+                stats = job["dedup"]
+                self.log(f"[+] '{job['name']}' needed {stats['chunks_sent']} of {stats['chunks']} chunks, "
+                         f"sending {stats['bytes_sent']} of {job['size']} bytes")
+
+    def finish(self, job: dict, status: str, offset: int, scheduler: FileScheduler, state: dict) -> None:
+        """
+        Records the final status the server sent for a file
+
+        Args:
+            job (dict)                : the file the status is for
+            status (str)              : the status code from the server
+            offset (int)              : bytes committed by the server
+            scheduler (FileScheduler) : scheduler to requeue failed files on
+            state (dict)              : shared jobs, results and lock
+        """
+        if status == protocol.OK and not job["error"]:
+            self.log(f"[+] Confirmed on disk '{job['name']}' ({offset} bytes, {job['method']})")
+            self.record(state, self.result(job, "confirmed", None))
+        elif status in protocol.RETRYABLE:
+            self.retry(job, f"Server replied '{status}' at byte {offset}", scheduler, state)
+        else:
+            # a full disk is not retried at once, the upload queue retries it later
+            self.record(state, self.result(job, "failed", LobbitClient.refusal(job, status, offset)))
+
+    @staticmethod
+    def refusal(job: dict, status: str, offset: int) -> str:
+        """
+        Describes why a file was not confirmed by the server
+
+        Args:
+            job (dict)   : the file the status is for
+            status (str) : the final status code from the server
+            offset (int) : bytes committed by the server
+        Returns:
+            str : the error recorded in the file's result
+        """
+        if job["error"]:
+            return job["error"]
+        if status == protocol.ERR_SPACE:
+            return f"Not enough space on the server for the {job['size'] - offset} bytes left to send"
+        return f"Server replied '{status}'"
+
+    def retry(self, job: dict, error: str, scheduler: FileScheduler, state: dict) -> None:
+        """
+        Requeues a failed file to resume from its committed offset,
+        or records it as failed once it has used every attempt
+
+        Args:
+            job (dict)                : the file that failed
+            error (str)               : why it failed
+            scheduler (FileScheduler) : scheduler to requeue the file on
+            state (dict)              : shared jobs, results and lock
+        """
+        job["last_error"] = error
+        if job["cancelled"]:
+            self.record(state, self.result(job, "cancelled", "Cancelled by user"))
+        elif job["attempts"] <= self.retries:
+            self.log(f"[-] '{job['name']}' failed ({error}), retrying from byte {job['committed']}")
+            job["status"] = "retrying"
+            scheduler.requeue(job["file"], job["name"], job["size"] - job["committed"])
+        else:
+            self.record(state, self.result(job, "failed", error))
+
+    def cancel(self, job: Union[dict, None] = None) -> None:
+        """
+        Cancels a single file, or the whole upload if <job> is None. A
+        file being sent stops at the next chunk, a queued file is skipped
+        and a file already sent in full is left to be confirmed
+
+        Args:
+            job (dict) : the file to cancel, see <new_job>
+        """
+        if job is None:
+            self.cancelled.set()
+            jobs = list(self.state["jobs"].values()) if self.state else []
+        else:
+            jobs = [job]
+        for job in jobs:
+            if job["status"] in ("queued", "sending", "retrying"):
+                job["cancelled"] = True
+
+    @staticmethod
+    def record(state: dict, result: dict) -> None:
+        """
+        Adds a final result to the shared results
+
+        Args:
+            state (dict)  : shared jobs, results and lock
+            result (dict) : the result to add
+        """
+        with state["lock"]:
+            state["results"].append(result)
+            job = state["jobs"].get(result["file"])
+            if job:
+                job["status"] = result["status"]
+
+    @staticmethod
+    def result(job: dict, status: str, error: Union[str, None]) -> dict:
+        """
+        Builds the result dict recorded for each file
+
+        Args:
+            job (dict)   : the file the result is for
+            status (str) : 'confirmed', 'failed' or 'cancelled'
+            error (str)  : the error message if the file failed
+        Returns:
+            dict : the result of sending the file
+        """
+        result = {"file": job["file"], "name": job["name"], "size": job["size"], "mtime": job.get("mtime"),
+                  "status": status, "committed": job["committed"], "attempts": job["attempts"],
+                  "seconds": round(time.perf_counter() - job["started"], 6),
+                  "error": error, "method": job["method"], "bytes_sent": job["transferred"]}
+        if job.get("dedup"):
+            # bytes_saved were already on the server, dedup_ratio is the fraction of the file they make up
+            saved = job["size"] - job["dedup"]["bytes_sent"]
+            result["bytes_saved"] = saved
+            result["dedup_ratio"] = round(saved / job["size"], 4) if job["size"] else 0.0
+        return result
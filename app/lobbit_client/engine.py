@@ -0,0 +1,346 @@
+import time
+
+from app.lobbit_client.client import LobbitClient
+from app.lobbit_client.upload_queue import UploadQueue, source_exists, source_of
+from collections import deque
+from threading import Event, Lock, Thread
+from typing import List, Union
+
+
+def format_bytes(n: float) -> str:
+    """
+    Formats a number of bytes for display
+
+    Args:
+        n (float) : number of bytes
+    Returns:
+        str : the size using the largest sensible unit
+    """
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024:
+            return f"{n:.1f} {unit}" if unit != "B" else f"{int(n)} B"
+        n /= 1024
+    return f"{n:.1f} TB"
+
+
+def format_eta(seconds: Union[float, None]) -> str:
+    """
+    Formats a number of seconds as H:MM:SS
+
+    Args:
+        seconds (float) : seconds remaining or None if unknown
+    Returns:
+        str : the formatted time or '--:--' if unknown
+    """
+    if seconds is None:
+        return "--:--"
+    minutes, secs = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{secs:02d}"
+
+
+class UploadEngine:
+    """
+    Runs uploads from the durable UploadQueue on a background thread.
+    Files queued while an upload is running are sent once it finishes,
+    over the same connections, and failed entries are retried with
+    backoff until they succeed or run out of attempts. Progress is
+    never pushed to the terminal, the senders only update counters in
+    each job and <status> builds a report from them when asked, so the
+    data path does no rendering at all
+    """
+
+    # statuses of files that have not finished yet
+    ACTIVE = ("queued", "sending", "retrying", "waiting")
+    # seconds between saves of the bytes committed for files in flight
+    CHECKPOINT_INTERVAL = 5.0
+
+    def __init__(self, client: LobbitClient, queue: UploadQueue, priority: int = 0, echo: bool = False) -> None:
+        """
+        Constructor for the UploadEngine class
+
+        Args:
+            client (LobbitClient) : client to upload with, it is connected
+                                    when there are files to send
+            queue (UploadQueue)   : durable queue the uploads are taken from
+            priority (int)        : default priority of submitted files
+            echo (bool)           : print every message as well as keeping it
+        """
+        self.client = client
+        self.client.log = self.log
+        self.queue = queue
+        self.priority = priority
+        self.echo = echo
+        self.started = None
+        self.rounds = []
+        self.results = []
+        # ids of entries given up on after their last attempt
+        self.failed = []
+        self.messages = deque(maxlen=100)
+        self._lock = Lock()
+        self._wake = Event()
+        self._stop = Event()
+        self._thread = None
+        self._closed = False
+
+    @property
+    def busy(self) -> bool:
+        """
+        True while the engine has files to send or retry
+        """
+        return self._thread is not None and self._thread.is_alive()
+
+    def log(self, msg: str) -> None:
+        """
+        Keeps errors from the send path to show at the next prompt. The
+        per file progress messages are left to <status>
+
+        Args:
+            msg (str) : the message from the client
+        """
+        if self.echo:
+            print(msg)
+        if msg.startswith("[-]"):
+            self.messages.append(msg)
+
+    def submit(self, files: List, priority: int = None) -> bool:
+        """
+        Adds files, directories or glob patterns to the durable queue,
+        starting the background thread if it is not already running
+
+        Args:
+            files (List)   : sources to upload
+            priority (int) : higher priorities are sent first
+        Returns:
+            bool : True if queued, False if the engine has already closed
+        """
+        with self._lock:
+            if self._closed:
+                return False
+            self.queue.add(files, self.client.host, self.client.port,
+                           self.priority if priority is None else priority)
+            self.start()
+        self._wake.set()
+        return True
+
+    def start(self) -> None:
+        """
+        Starts sending the entries queued for the client's server,
+        including any left unfinished by an earlier run
+        """
+        if not self.busy:
+            self.started = self.started or time.perf_counter()
+            self._thread = Thread(target=self.run, daemon=True)
+            self._thread.start()
+
+    def join(self) -> None:
+        """
+        Waits until the queue for the client's server is empty
+        """
+        while self.busy:
+            self._thread.join(0.5)
+
+    def stop(self) -> None:
+        """
+        Stops sending. Files being sent are abandoned and their entries
+        stay in the queue to resume next time
+        """
+        self._stop.set()
+        self._wake.set()
+        self.client.cancel()
+
+    def run(self) -> None:
+        """
+        Sends the due entries, highest priority first, until the queue
+        is empty. While only retries remain the connections are closed
+        and reopened once the next retry is due; a connection that
+        cannot be opened is retried with the same backoff
+        """
+        host, port = self.client.host, self.client.port
+        failures = 0
+        while not self._stop.is_set():
+            entries = self.queue.claim(host, port)
+            if not entries:
+                with self._lock:
+                    due = self.queue.next_due(host, port)
+                    if due is None:
+                        self._closed = True
+                        break
+                self.client.lobbit_close()
+                self._wake.clear()
+                self._wake.wait(max(due - time.time(), 0))
+                continue
+            if not self.client.socks and not self.client.lobbit_connect():
+                self.queue.requeue(row["id"] for row in entries)
+                failures += 1
+                delay = self.queue.backoff(failures)
+                self.log(f"[-] Could not connect to {host}:{port}, retrying in {delay:.0f}s")
+                self._wake.clear()
+                self._stop.wait(delay)
+                continue
+            failures = 0
+            self.send(entries)
+        self.client.lobbit_close()
+
+    def send(self, entries: List) -> None:
+        """
+        Sends a group of claimed entries together, saving the progress
+        of the files in flight and renewing the entries' lease every
+        CHECKPOINT_INTERVAL seconds, then completes each entry or
+        schedules it to be retried
+
+        Args:
+            entries (List) : rows claimed from the queue
+        """
+        host, port = self.client.host, self.client.port
+        self.client.files = [row["source"] for row in entries]
+        self.client.resume = self.queue.load_progress(host, port)
+        self.client.cancelled.clear()
+        results = []
+
+        def send_all() -> None:
+            try:
+                results.extend(self.client.lobbit_send())
+            except Exception as e:
+                self.log(f"[-] Upload stopped: {e}")
+
+        sender = Thread(target=send_all, daemon=True)
+        sender.start()
+        while sender.is_alive():
+            sender.join(UploadEngine.CHECKPOINT_INTERVAL)
+            self.queue.renew(row["id"] for row in entries)
+            state = self.client.state
+            if state:
+                self.queue.save_progress(host, port, [job for job in list(state["order"])
+                                                      if job["status"] in UploadEngine.ACTIVE])
+        with self._lock:
+            self.rounds.append(self.client.state)
+            self.results.extend(results)
+        if self._stop.is_set():
+            state = self.client.state
+            if state:
+                self.queue.save_progress(host, port, [job for job in list(state["order"])
+                                                      if job["status"] != "confirmed"])
+            self.queue.requeue(row["id"] for row in entries)
+            return
+        by_source = {row["source"]: [] for row in entries}
+        for result in results:
+            source = source_of(by_source, result["file"])
+            if source is not None:
+                by_source[source].append(result)
+        for row in entries:
+            files = by_source[row["source"]]
+            failed = [r for r in files if r["status"] == "failed"]
+            if not failed and self.client.cancelled.is_set():
+                self.queue.complete(row["id"], UploadQueue.CANCELLED)
+            elif not failed:
+                self.queue.complete(row["id"])
+                self.queue.clear_progress(host, port, [r["file"] for r in files])
+            else:
+                # confirmed files are saved too so the retry skips their data
+                self.queue.save_progress(host, port, files)
+                error = f"{len(failed)} file(s) failed, last error: {failed[-1]['error']}"
+                if self.queue.fail(row["id"], error, retry=source_exists(row["source"])):
+                    self.log(f"[-] '{row['source']}' {error}, it will be retried")
+                else:
+                    self.failed.append(row["id"])
+                    self.log(f"[-] '{row['source']}' {error}, giving up")
+        confirmed = [r for r in results if r["status"] == "confirmed"]
+        message = f"[+] Upload finished: {len(confirmed)} confirmed, {len(results) - len(confirmed)} not confirmed"
+        deduped = [r for r in confirmed if "bytes_saved" in r]
+        if deduped:
+            saved = sum(r["bytes_saved"] for r in deduped)
+            size = sum(r["size"] for r in deduped)
+            message += f", {format_bytes(saved)} of {format_bytes(size)} already on the server " \
+                       f"({100.0 * saved / size if size else 0.0:.1f}% deduplicated)"
+        if self.client.manifest:
+            message += f", {self.client.manifest.unchanged} of {self.client.manifest.compared} file(s) unchanged"
+        self.messages.append(message)
+
+    def jobs(self) -> List[dict]:
+        """
+        Returns every file started so far in the order they were started
+
+        Returns:
+            List[dict] : the jobs, see LobbitClient.new_job
+        """
+        with self._lock:
+            rounds = list(self.rounds)
+            current = self.client.state
+        if current is not None and not any(state is current for state in rounds):
+            rounds.append(current)
+        return [job for state in rounds for job in list(state["order"])]
+
+    def cancel(self, index: Union[int, None] = None) -> Union[dict, None]:
+        """
+        Cancels the file at <index> in the status list, or the current
+        upload and everything queued behind it if <index> is None
+
+        Args:
+            index (int) : index shown by <status>
+        Returns:
+            Union[dict, None] : the cancelled job, or None if nothing was cancelled
+        """
+        if index is None:
+            self.queue.cancel(self.client.host, self.client.port)
+            self.client.cancel()
+            return None
+        job = self.jobs()[index]
+        if job["status"] not in ("queued", "sending", "retrying"):
+            return None
+        self.client.cancel(job)
+        return job
+
+    def status(self) -> List[str]:
+        """
+        Builds the progress report, one line per file followed by an
+        overall line, from the counters kept by the senders
+
+        Returns:
+            List[str] : the lines of the report
+        """
+        now = time.perf_counter()
+        jobs = self.jobs()
+        lines = []
+        done = total = transferred = 0
+        for index, job in enumerate(jobs):
+            size = job["size"] or 0
+            if job["status"] == "confirmed":
+                position = size
+            else:
+                position = max(job["sent"], job["committed"])
+            percent = 100.0 * position / size if size else 100.0
+            line = f"[{index}] {job['status']:<9} {percent:5.1f}%  {format_bytes(size):>9}"
+            if job["status"] == "sending" and job["attempt_started"]:
+                elapsed = now - job["attempt_started"]
+                rate = (job["sent"] - job["attempt_offset"]) / elapsed if elapsed > 0 else 0
+                eta = (size - job["sent"]) / rate if rate else None
+                line += f"  {format_bytes(rate):>9}/s  ETA {format_eta(eta)}"
+            lines.append(f"{line}  {job['name']}")
+            # a mirrored file also shows how far each server's copy has got
+            for name, copy in job.get("destinations", {}).items():
+                copied = size if copy["status"] == "confirmed" else max(copy["sent"], copy["committed"])
+                lines.append(f"      {copy['status']:<9} {100.0 * copied / size if size else 100.0:5.1f}%  {name}")
+            transferred += job["transferred"]
+            if job["status"] in UploadEngine.ACTIVE or job["status"] == "confirmed":
+                done += position
+                total += size
+        seen = {job["file"] for job in jobs}
+        scheduler = self.client.scheduler
+        queued = [size for path, size in scheduler.queued() if path not in seen] if scheduler else []
+        total += sum(queued)
+        waiting = self.queue.pending(self.client.host, self.client.port)
+        elapsed = now - self.started if self.started else 0
+        rate = transferred / elapsed if elapsed > 0 and self.busy else 0
+        eta = (total - done) / rate if rate else None
+        percent = 100.0 * done / total if total else 100.0
+        overall = f"Overall: {len(jobs)} file(s) started, {len(queued)} queued, {percent:.1f}% of " \
+                  f"{format_bytes(total)} known"
+        if self.busy:
+            overall += f", {format_bytes(rate)}/s, ETA {format_eta(eta)}"
+        else:
+            overall += ", finished"
+        if waiting:
+            overall += f", {waiting} queued upload(s) waiting"
+        lines.append(overall)
+        return lines
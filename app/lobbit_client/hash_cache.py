@@ -0,0 +1,164 @@
+import hashlib
+import os
+import sqlite3
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Iterable, List, Tuple, Union
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".lobbit", "hashes.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    dev      INTEGER NOT NULL,
+    ino      INTEGER NOT NULL,
+    size     INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256   TEXT    NOT NULL,
+    used     REAL    NOT NULL,
+    PRIMARY KEY (dev, ino)
+);
+CREATE INDEX IF NOT EXISTS hashes_used ON hashes (used);
+"""
+
+
+class HashCache:
+    """
+    On-disk cache of file digests keyed by device and inode. An entry
+    is only used while the file's size and mtime_ns are unchanged, so
+    hashing an unchanged file again costs a stat and an indexed lookup
+    instead of reading the whole file. The least recently used entries
+    are evicted beyond <max_entries>
+    """
+
+    # bytes read at a time while hashing
+    READ_SIZE = 1024 * 1024
+
+    def __init__(self, path: str = None, max_entries: int = 1000000) -> None:
+        """
+        Constructor for the HashCache class
+
+        Args:
+            path (str)        : path of the database, defaults to $LOBBIT_HASH_CACHE
+                                or ~/.lobbit/hashes.db
+            max_entries (int) : entries kept before the least recently used are evicted
+        """
+        self.path = path or os.getenv("LOBBIT_HASH_CACHE") or DEFAULT_CACHE_PATH
+        self.max_entries = max_entries
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        # keys looked up since the last flush, their use times are written in one go
+        self._used = {}
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        """
+        Saves the use times and closes the database
+        """
+        self.flush()
+        with self._lock:
+            self._db.close()
+
+    def lookup(self, st: os.stat_result) -> Union[str, None]:
+        """
+        Returns the cached digest of a file if it has not changed
+
+        Args:
+            st (os.stat_result) : the file's current stat
+        Returns:
+            Union[str, None] : the hex SHA-256 or None if not cached
+        """
+        with self._lock:
+            row = self._db.execute("SELECT size, mtime_ns, sha256 FROM hashes WHERE dev = ? AND ino = ?",
+                                   (st.st_dev, st.st_ino)).fetchone()
+            if row and row[:2] == (st.st_size, st.st_mtime_ns):
+                self._used[(st.st_dev, st.st_ino)] = time.time()
+                self.hits += 1
+                return row[2]
+            self.misses += 1
+            return None
+
+    def store(self, st: os.stat_result, digest: str) -> None:
+        """
+        Caches the digest of a file
+
+        Args:
+            st (os.stat_result) : the file's stat when it was hashed
+            digest (str)        : its hex SHA-256
+        """
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)",
+                             (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, digest, time.time()))
+
+    def digest(self, path: str) -> str:
+        """
+        Returns the SHA-256 of a file, from the cache if it has not
+        changed since it was last hashed. A file that changes while it
+        is being hashed is not cached
+
+        Args:
+            path (str) : path of the file
+        Returns:
+            str : the hex SHA-256
+        """
+        cached = self.lookup(os.stat(path))
+        if cached:
+            return cached
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as f:
+            before = os.fstat(f.fileno())
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            while data := f.read(HashCache.READ_SIZE):
+                sha256.update(data)
+            after = os.fstat(f.fileno())
+        digest = sha256.hexdigest()
+        if (before.st_size, before.st_mtime_ns) == (after.st_size, after.st_mtime_ns):
+            self.store(after, digest)
+        return digest
+
+    def digest_many(self, paths: Iterable[str], workers: int = 4) -> List[Tuple[str, Union[str, None], Union[str, None]]]:
+        """
+        Hashes files across a thread pool, hashlib releases the GIL
+        while hashing so the files are read and hashed in parallel
+
+        Args:
+            paths (Iterable[str]) : paths of the files
+            workers (int)         : threads hashing at once
+        Returns:
+            List[Tuple[str, Union[str, None], Union[str, None]]] : the path, hex SHA-256
+                                                                   and error of each file,
+                                                                   in the order given
+        """
+        def hash_one(path: str) -> Tuple[str, Union[str, None], Union[str, None]]:
+            try:
+                return path, self.digest(path), None
+            except OSError as e:
+                return path, None, str(e)
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            results = list(pool.map(hash_one, paths))
+        self.flush()
+        return results
+
+    def flush(self) -> None:
+        """
+        Writes the use times of the entries looked up since the last
+        flush and evicts the least recently used entries over the limit
+        """
+        with self._lock, self._db:
+            used, self._used = self._used, {}
+            self._db.executemany("UPDATE hashes SET used = ? WHERE dev = ? AND ino = ?",
+                                 [(when, dev, ino) for (dev, ino), when in used.items()])
+            excess = self._db.execute("SELECT COUNT(*) FROM hashes").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self._db.execute("DELETE FROM hashes WHERE rowid IN "
+                                 "(SELECT rowid FROM hashes ORDER BY used LIMIT ?)", (excess,))
@@ -0,0 +1,351 @@
+import os
+import queue
+import socket
+import time
+
+from app.lobbit_client.scheduler import FileScheduler
+from app.lobbit_client.sender import FileSender, SourceChanged, TransferCancelled
+from app.lobbit_util import protocol
+from threading import Thread
+from typing import Iterator, List, Tuple, Union
+
+# chunks waiting to be sent to each destination, once a queue is full the
+# reader waits, so reading keeps pace with the slowest destination
+QUEUE_DEPTH = 4
+# items a lane's reader puts on each destination's queue
+START, DATA, END, CANCEL = "start", "data", "end", "cancel"
+# statuses a destination's copy of a file can end with
+FINAL = ("confirmed", "failed", "cancelled")
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    """
+    Parses a server address given as HOST:PORT, IPv6 addresses in brackets
+
+    Args:
+        address (str) : the address, e.g. 'ingest2:8443' or '[::1]:8443'
+    Returns:
+        Tuple[str, int] : the host and port
+    """
+    host, _, port = address.rpartition(":")
+    host = host[1:-1] if host.startswith("[") and host.endswith("]") else host
+    if not host or not port.isdigit() or not 1 <= int(port) <= 65535:
+        raise ValueError(f"Invalid server address '{address}', expected HOST:PORT")
+    return host, int(port)
+
+
+class Destination:
+    """
+    One server a mirrored upload sends to, over one of its connections.
+    The lane's reader puts the chunks of each file on a bounded queue and
+    this destination sends them on its own thread, so every server is
+    written to at once and a server that fails only fails its own copy
+    """
+
+    def __init__(self, client, sock: Union[socket.socket, None], lane: "MirrorLane") -> None:
+        """
+        Constructor for the Destination class
+
+        Args:
+            client (LobbitClient) : client connected to the server
+            sock (socket.socket)  : the connection to send over, None if
+                                    the server could not be reached
+            lane (MirrorLane)     : the lane the destination belongs to
+        """
+        self.client = client
+        self.name = f"{client.host}:{client.port}"
+        self.lane = lane
+        self.queue = queue.Queue(QUEUE_DEPTH)
+        self.sock = sock
+        self.sender = self.new_sender(sock) if sock else None
+        self.error = None if sock else "Not connected"
+        self.thread = Thread(target=self.run, daemon=True)
+
+    @property
+    def alive(self) -> bool:
+        """
+        True until the connection fails
+        """
+        return self.error is None
+
+    def new_sender(self, sock: socket.socket) -> FileSender:
+        """
+        Returns a tuned FileSender for a connection to this destination
+
+        Args:
+            sock (socket.socket) : the connection
+        Returns:
+            FileSender : the sender
+        """
+        sender = FileSender(sock, self.on_final, window=self.client.window)
+        sender.tune(self.client.tuning, self.name, self.client.log)
+        return sender
+
+    def run(self) -> None:
+        """
+        Sends each file put on the queue until the lane puts None, then
+        waits for the server to confirm the files still in flight. Once
+        the connection has failed, files are failed without being sent
+        and the rest of the file being sent is discarded, so the reader
+        never waits on a dead destination
+        """
+        while (item := self.queue.get()) is not None:
+            kind, job, _ = item
+            if kind != START:
+                continue
+            if not self.alive:
+                self.lane.settle(job, "failed", self.error)
+                continue
+            try:
+                self.sender.send_chunks(job, self.chunks(job))
+            except TransferCancelled as e:
+                self.cancelled(job, e.job["error"] if isinstance(e, SourceChanged) else None)
+            except OSError as e:
+                self.failed(e)
+        if self.alive:
+            try:
+                self.sender.drain()
+            except OSError as e:
+                self.failed(e)
+
+    def chunks(self, job: dict) -> Iterator[bytes]:
+        """
+        Yields the chunks of the file being sent as the reader puts them
+        on the queue
+
+        Args:
+            job (dict) : this destination's copy of the file
+        Returns:
+            Iterator[bytes] : the chunks, ending when the file is read
+        """
+        while True:
+            kind, _, data = self.queue.get()
+            if kind == END:
+                return
+            if kind == CANCEL:
+                raise TransferCancelled(job)
+            yield data
+
+    def on_final(self, job: dict, status: str, offset: int) -> None:
+        """
+        Records the final status the server sent for this destination's
+        copy of a file. Retryable statuses fail the copy too, the other
+        destinations are not held back to resend it
+
+        Args:
+            job (dict)   : the copy the status is for
+            status (str) : the status code from the server
+            offset (int) : bytes committed by the server
+        """
+        if status == protocol.OK and not job["error"]:
+            self.client.log(f"[+] Confirmed on disk '{job['name']}' on {self.name} ({offset} bytes)")
+            self.lane.settle(job, "confirmed", None)
+        else:
+            self.lane.settle(job, "failed", self.client.refusal(job, status, offset))
+
+    def cancelled(self, job: dict, error: str = None) -> None:
+        """
+        Confirms the files sent before a file cancelled part way through
+        and replaces the connection, which was left in the middle of it
+
+        Args:
+            job (dict)  : the cancelled copy
+            error (str) : why the copy was abandoned, None if the user cancelled it
+        """
+        try:
+            self.sender.drain_before(job)
+        except OSError as e:
+            self.failed(e)
+            return
+        if error:
+            self.lane.settle(job, "failed", error)
+        else:
+            self.lane.settle(job, "cancelled", "Cancelled by user")
+        sock = self.client.replace_connection(self.sock)
+        if sock:
+            self.sock, self.sender = sock, self.new_sender(sock)
+        else:
+            self.error = "Could not reopen the connection"
+
+    def failed(self, e: OSError) -> None:
+        """
+        Fails every file in flight on a connection that failed and drops
+        it from the client's pool
+
+        Args:
+            e (OSError) : why the connection failed
+        """
+        self.error = str(e)
+        self.client.log(f"[-] Connection to {self.name} failed: {e}")
+        for job in self.sender.in_flight:
+            self.lane.settle(job, "failed", str(e))
+        self.sender.in_flight.clear()
+        with self.lane.state["lock"]:
+            if self.sock in self.client.socks:
+                self.client.socks.remove(self.sock)
+                self.client.sock = self.client.socks[0] if self.client.socks else None
+        self.sock.close()
+
+
+class MirrorLane:
+    """
+    Sends files to several servers at once over one connection to each,
+    reading every file from disk only once. Each chunk read is handed to
+    every destination, which send them concurrently, so an upload takes
+    as long as its slowest link rather than the sum of them all. Each
+    file's job holds a copy per destination in job['destinations'] and
+    its result is recorded once every destination has finished with it
+    """
+
+    def __init__(self, client, lane: List[Tuple[object, Union[socket.socket, None]]],
+                 scheduler: FileScheduler, state: dict) -> None:
+        """
+        Constructor for the MirrorLane class
+
+        Args:
+            client (LobbitClient)                : the client running the upload
+            lane (List[Tuple[LobbitClient, socket.socket]]) : each destination's
+                                                   client and connection
+            scheduler (FileScheduler)            : source of files to send
+            state (dict)                         : shared jobs, results and lock
+        """
+        self.client = client
+        self.scheduler = scheduler
+        self.state = state
+        self.destinations = [Destination(dest, sock, self) for dest, sock in lane]
+
+    def run(self) -> None:
+        """
+        Sends files from the scheduler until there are none left, the
+        upload is cancelled or every destination has failed, then waits
+        for the destinations to confirm the files in flight
+        """
+        for destination in self.destinations:
+            destination.thread.start()
+        try:
+            while not self.client.cancelled.is_set() and any(d.alive for d in self.destinations) and \
+                    (job := self.scheduler.next_job()):
+                self.send_file(self.client.new_job(self.state, *job))
+        finally:
+            for destination in self.destinations:
+                destination.queue.put(None)
+            for destination in self.destinations:
+                destination.thread.join()
+
+    def send_file(self, job: dict) -> None:
+        """
+        Reads a file once and hands each chunk to every destination still
+        connected, waiting while the slowest destination's queue is full
+
+        Args:
+            job (dict) : the file to send, see LobbitClient.new_job
+        """
+        if job["cancelled"]:
+            self.client.record(self.state, self.client.result(job, "cancelled", "Cancelled by user"))
+            return
+        job["attempts"] += 1
+        try:
+            f = FileSender.open(job["file"])
+        except OSError as e:
+            self.client.log(f"[-] Could not open '{job['file']}': {e}")
+            self.client.record(self.state, self.client.result(job, "failed", str(e)))
+            return
+        with f:
+            st = os.fstat(f.fileno())
+            job["size"], job["mtime"] = st.st_size, st.st_mtime_ns
+            job["method"], job["committed"], job["sent"] = "mirror", 0, 0
+            copies = {d.name: self.copy(job, d.name) for d in self.destinations}
+            with self.state["lock"]:
+                job["destinations"], job["pending"] = copies, len(copies)
+            job["status"], job["attempt_offset"] = "sending", 0
+            job["attempt_started"] = time.perf_counter()
+            sending = [d for d in self.destinations if d.alive]
+            self.client.log(f"[+] Sending '{job['file']}' to {len(sending)} server(s)...")
+            for destination in self.destinations:
+                if destination in sending:
+                    destination.queue.put((START, copies[destination.name], None))
+                else:
+                    self.settle(copies[destination.name], "failed", destination.error)
+            pos = 0
+            while pos < job["size"] and any(d.alive for d in sending):
+                if job["cancelled"]:
+                    for destination in sending:
+                        destination.queue.put((CANCEL, copies[destination.name], None))
+                    return
+                n = min(max(d.sender.chunk_size for d in sending), job["size"] - pos)
+                data = f.read(n)
+                if not data:
+                    # the file shrank, each destination abandons its copy
+                    break
+                for destination in sending:
+                    destination.queue.put((DATA, copies[destination.name], data))
+                pos += len(data)
+                job["sent"] = pos
+                self.progress(job)
+            for destination in sending:
+                destination.queue.put((END, copies[destination.name], None))
+            if job["status"] == "sending":
+                job["status"] = "waiting"
+
+    @staticmethod
+    def copy(job: dict, name: str) -> dict:
+        """
+        Returns the job tracking one destination's copy of a file, holding
+        the fields FileSender reads and updates
+
+        Args:
+            job (dict) : the file, see LobbitClient.new_job
+            name (str) : the destination's HOST:PORT
+        Returns:
+            dict : the copy
+        """
+        return {"file": job["file"], "name": job["name"], "size": job["size"], "mtime": job["mtime"],
+                "destination": name, "committed": 0, "sent": 0, "transferred": 0, "method": None, "error": None,
+                "status": "sending", "cancelled": False}
+
+    @staticmethod
+    def progress(job: dict) -> None:
+        """
+        Updates a file's committed and transferred bytes from its copies.
+        A file counts as committed up to the least any destination holds
+
+        Args:
+            job (dict) : the file
+        """
+        copies = list(job["destinations"].values())
+        job["committed"] = min(c["committed"] for c in copies)
+        job["transferred"] = sum(c["transferred"] for c in copies)
+
+    def settle(self, copy: dict, status: str, error: Union[str, None]) -> None:
+        """
+        Records how one destination's copy of a file ended, and the file's
+        result once every copy has. A file is only confirmed if every
+        destination confirmed it
+
+        Args:
+            copy (dict)  : the copy, see <copy>
+            status (str) : 'confirmed', 'failed' or 'cancelled'
+            error (str)  : why the copy failed
+        """
+        with self.state["lock"]:
+            if copy["status"] in FINAL:
+                return
+            copy["status"], copy["error"] = status, error
+            job = self.state["jobs"][copy["file"]]
+            job["pending"] -= 1
+            if job["pending"]:
+                return
+        self.progress(job)
+        copies = job["destinations"]
+        failed = {name: c["error"] for name, c in copies.items() if c["status"] != "confirmed"}
+        if not failed:
+            status, error = "confirmed", None
+        elif job["cancelled"]:
+            status, error = "cancelled", "Cancelled by user"
+        else:
+            status, error = "failed", "; ".join(f"{name}: {err}" for name, err in failed.items())
+        result = self.client.result(job, status, error)
+        result["destinations"] = {name: {"status": c["status"], "committed": c["committed"],
+                                         "bytes_sent": c["transferred"], "error": c["error"]}
+                                  for name, c in copies.items()}
+        self.client.record(self.state, result)
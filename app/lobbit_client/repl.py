@@ -1,9 +1,14 @@
 #!/usr/bin/bash python3
 
 import cmd
+import glob
 import ipaddress
+import json
 import os
+import subprocess
 import sys
+import tempfile
+import time
 
 from typing import List, Tuple, Union
 
@@ -12,6 +17,12 @@ sys.path.append(lobbit_app)
 
 if lobbit_app in sys.path:
     from app.lobbit_client.client import LobbitClient
+    from app.lobbit_client.engine import UploadEngine, format_bytes
+    from app.lobbit_client.mirror import parse_address
+    from app.lobbit_client.upload_queue import UploadQueue
+    from app.lobbit_util import bench
+    from app.lobbit_util.config import get_config
+    from app.lobbit_util.mux import MAX_STREAMS
 
 
 # noinspection PyArgumentList
@@ -21,6 +32,8 @@ class LobbitREPL(cmd.Cmd):
     intro_spacer = "=" * len(intro_msg)
     intro = f"\n{intro_spacer}\n{intro_msg}\n{intro_spacer}\n"
     prompt = "\033[91m" + "lobbit> " + "\033[39m"
+    # catalog entries shown per page by 'file remote-list'
+    page_size = 50
 
     def __init__(self) -> None:
         """
@@ -31,24 +44,43 @@ class LobbitREPL(cmd.Cmd):
             "set": {
                 "ip": self.handle_ip,
                 "hostname": self.handle_hostname,
-                "port": self.handle_port
+                "port": self.handle_port,
+                "connections": self.handle_connections,
+                "streams": self.handle_streams,
+                "mirrors": self.handle_mirrors,
+                "dedup": self.handle_dedup
             },
             "file": {
                 "add": self.handle_add,
                 "list": self.handle_list,
                 "remove": self.handle_remove,
-                "upload": self.handle_upload
+                "upload": self.handle_upload,
+                "sync": self.handle_sync,
+                "status": self.handle_status,
+                "cancel": self.handle_cancel,
+                "queue": self.handle_queue,
+                "remote-list": self.handle_remote_list,
+                "verify": self.handle_verify
             },
             "use": {
                 "hostname": self.set_hostname,
                 "ip": self.set_ip
+            },
+            "bench": {
+                "cipher": self.handle_bench_cipher
             }
         }
         self.client = None
+        self.engine = None
+        self.queue = None
         self.host = None
         self.port = None
         self.files = []
         self.hostname = False
+        self.connections = 1
+        self.streams = 1
+        self.mirrors = []
+        self.dedup = False
 
     # --- OVERLOADED CMD METHODS ---
 
@@ -81,6 +113,31 @@ class LobbitREPL(cmd.Cmd):
         """
         return
 
+    def preloop(self) -> None:
+        """
+        Tells the user about uploads left unfinished by an earlier session
+        """
+        pending = self.get_queue().entries((UploadQueue.PENDING,))
+        if pending:
+            servers = sorted({f"{row['host']}:{row['port']}" for row in pending})
+            print(f"[+] {len(pending)} unfinished upload(s) queued for {', '.join(servers)}. "
+                  f"They resume with the next 'file upload' to the same server\n")
+
+    def postcmd(self, stop: bool, line: str) -> bool:
+        """
+        Shows any messages from a background upload before the
+        next prompt is displayed
+
+        Args:
+            stop (bool) : True if the command loop should end
+            line (str)  : the command that was run
+        Returns:
+            bool : the value of <stop>
+        """
+        while self.engine and self.engine.messages:
+            print(self.engine.messages.popleft())
+        return stop
+
     def default(self, line: str) -> None:
         """
         Default output when a user inputs incorrect syntax
@@ -136,14 +193,28 @@ class LobbitREPL(cmd.Cmd):
         """
         print(f"[-] Error: {msg}")
 
+    def get_queue(self) -> UploadQueue:
+        """
+        Opens the durable upload queue on first use
+
+        Returns:
+            UploadQueue : the queue shared by every upload in the session
+        """
+        if not self.queue:
+            self.queue = UploadQueue()
+        return self.queue
+
     # --- DO METHODS ---
 
-    @staticmethod
-    def do_quit(_) -> None:
+    def do_quit(self, _) -> None:
         """
         Quits the program with a 0 exit status and prints a
-        message to the user
+        message to the user. A running upload is cancelled
         """
+        if self.engine and self.engine.busy:
+            print("[+] Stopping the current upload, unfinished files stay queued...")
+            self.engine.stop()
+            self.engine.join()
         print("Bye!")
         sys.exit(0)
 
@@ -194,7 +265,7 @@ class LobbitREPL(cmd.Cmd):
         if args[0] not in sub_cmds.keys():
             self.error(f"'{args[0]}' is not a valid sub-command of 'file'")
             return
-        if args[0] == "add" or args[0] == "remove":
+        if args[0] in ("add", "remove", "cancel", "upload", "sync", "remote-list"):
             sub_cmds.get(args[0])(args[1:])
         else:
             sub_cmds.get(args[0])()
@@ -220,6 +291,22 @@ class LobbitREPL(cmd.Cmd):
             return
         sub_cmds.get(args[0])()
 
+    def do_bench(self, arg: str) -> None:
+        """
+        Runs a benchmark on this machine
+
+        Args:
+            arg (str) : the base command arguments passed in by the user
+        """
+        args = self.split_args(arg)
+        if not args:
+            return
+        sub_cmds = self.cmd_map.get("bench")
+        if args[0] not in sub_cmds.keys():
+            self.error(f"'{args[0]}' is not a valid sub-command of 'bench'")
+            return
+        sub_cmds.get(args[0])(args[1:])
+
     def do_net(self, _) -> None:
         """
         Shows the current network socket configuration
@@ -230,6 +317,8 @@ class LobbitREPL(cmd.Cmd):
         else:
             print(f"IPv4 Address: {self.host}")
             print(f"Port number : {self.port}")
+        if self.mirrors:
+            print(f"Mirrors     : {', '.join(f'{host}:{port}' for host, port in self.mirrors)}")
 
     def do_help(self, arg: str) -> None:
         """
@@ -244,22 +333,43 @@ class LobbitREPL(cmd.Cmd):
               "  file - perform an action on a file or list of files\n"
               "  use  - use either 'hostname' or 'ip' for the remote connection\n"
               "  net  - display the current remote network parameters\n"
+              "  bench - measure the speed of this machine\n"
               "\nSet commands:\n"
               "  ip [IP_ADDRESS]    - set the IPv4 address of the remote server (REQUIRED)\n"
               "  port [PORT_NUMBER] - set the port of the remote server (REQUIRED)\n"
+              "  connections [N]    - set the number of connections to upload over (default 1)\n"
+              "  streams [N]        - set the number of files sent at once over each connection (default 1)\n"
+              "  mirrors [HOST:PORT,...|off] - also send every uploaded file to these servers, reading it once\n"
+              "  dedup [on|off]     - send large files as chunks, skipping chunks the server holds (default off)\n"
               "\nFile commands:\n"
-              "  add [FILE_PATHS] - add one or more file paths to the list of files to be uploaded\n"
-              "  list             - list the files you have added for upload\n"
-              "  remove [INDEXES] - remove a file from the upload list\n"
-              "  upload           - upload the files you have added\n"
+              "  add [FILE_PATHS]  - add one or more files, directories or glob patterns to the upload list\n"
+              "  list              - list the files you have added for upload\n"
+              "  remove [INDEXES]  - remove a file from the upload list\n"
+              "  upload [PRIORITY] - upload the files you have added in the background, higher priorities go first\n"
+              "  sync [PRIORITY]   - like upload, but only send new or changed files\n"
+              "  status            - show the progress, speed and ETA of each file being uploaded\n"
+              "  cancel [INDEXES]  - cancel uploading the files at the indexes shown by 'file status'\n"
+              "  cancel all        - cancel the current upload and any uploads queued behind it\n"
+              "  queue             - list the uploads waiting in the durable queue and their retries\n"
+              "  remote-list [PAT] - list the files the server holds, optionally matching a glob, a page at a time\n"
+              "  verify            - check the files you have added against the checksums the server holds\n"
+              "\nBench commands:\n"
+              "  cipher [MB] - measure TLS throughput over loopback for each cipher and suggest the fastest\n"
               "\nUse commands:\n"
               "  hostname - use a hostname for the remote connection\n"
               "  ip       - use an IP address for the remote connection\n"
               "\nExamples:\n"
               "  Set IPv4 address                       : set ip 100.200.0.1\n"
               "  Add 2 files for upload                 : file add /path/to/file1 /another/path/to/file2\n"
+              "  Add a directory and a glob for upload  : file add /path/to/dir /logs/**/*.log\n"
               "  Remove added files at indexes 1 and 3  : file remove 1 3\n"
-              "  Use hostname instead of IP to connect  : use hostname\n")
+              "  Stop uploading the file at index 2     : file cancel 2\n"
+              "  List the server's log files            : file remote-list logs/*.log\n"
+              "  Check added files reached the server   : file verify\n"
+              "  Send only new or changed files         : file sync\n"
+              "  Upload to 2 more servers at once       : set mirrors 10.0.0.2:8443,10.0.0.3:8443\n"
+              "  Use hostname instead of IP to connect  : use hostname\n"
+              "  Find the fastest cipher with 512MB     : bench cipher 512\n")
 
     # --- VALIDATION METHODS ---
 
@@ -293,19 +403,23 @@ class LobbitREPL(cmd.Cmd):
     def valid_path(file_path: str) -> Tuple:
         """
         Checks the system path passed in as <file_path> to ensure
-        that a valid file object can be found at the path
+        that a valid file or directory can be found at the path, or
+        that it is a glob pattern matching at least one path. Directory
+        contents are not checked here, they are walked at upload time
 
         Args:
             file_path (str) : the path to validate
         Returns:
-            bool : True is path is a file, False if not
+            bool : True is path is a file, directory or matching glob, False if not
         """
         try:
             if os.path.isabs(file_path):
                 path = file_path
             else:
                 path = f"{os.getcwd()}/{file_path}"
-            if os.path.isfile(path):
+            if os.path.isfile(path) or os.path.isdir(path):
+                return True, path
+            if glob.has_magic(path) and next(glob.iglob(path, recursive=True), None):
                 return True, path
             return False, None
         except TypeError:
@@ -354,12 +468,71 @@ class LobbitREPL(cmd.Cmd):
             self.port = None
             return
 
+    def handle_connections(self, connections: str) -> None:
+        """
+        Process the set connections command
+
+        Args:
+            connections (str) : number of connections passed into 'set connections'
+        """
+        try:
+            if int(connections) < 1:
+                raise ValueError
+        except ValueError:
+            self.error(f"Invalid number of connections: '{connections}'")
+            return
+        self.connections = int(connections)
+
+    def handle_streams(self, streams: str) -> None:
+        """
+        Process the set streams command
+
+        Args:
+            streams (str) : number of streams passed into 'set streams'
+        """
+        try:
+            if not 1 <= int(streams) <= MAX_STREAMS:
+                raise ValueError
+        except ValueError:
+            self.error(f"Invalid number of streams: '{streams}', expected 1 to {MAX_STREAMS}")
+            return
+        self.streams = int(streams)
+
+    def handle_mirrors(self, mirrors: str) -> None:
+        """
+        Process the set mirrors command
+
+        Args:
+            mirrors (str) : comma separated HOST:PORT addresses passed into
+                            'set mirrors', or 'off' to upload to one server
+        """
+        if mirrors == "off":
+            self.mirrors = []
+            return
+        try:
+            self.mirrors = [parse_address(address) for address in mirrors.split(",") if address]
+        except ValueError as e:
+            self.error(str(e))
+
+    def handle_dedup(self, value: str) -> None:
+        """
+        Process the set dedup command
+
+        Args:
+            value (str) : 'on' or 'off' passed into 'set dedup'
+        """
+        if value not in ("on", "off"):
+            self.error(f"Invalid dedup setting: '{value}', expected 'on' or 'off'")
+            return
+        self.dedup = value == "on"
+
     def handle_add(self, files: List) -> None:
         """
         Process the file add command
 
         Args:
-            files (List) : file paths to be added to the upload list
+            files (List) : file paths, directories or glob patterns to be
+                           added to the upload list
         """
         if not files:
             self.error(f"'{self.lastcmd}' missing required argument: <file_path(s)>")
@@ -381,7 +554,8 @@ class LobbitREPL(cmd.Cmd):
             self.error("No files have been added for upload")
             return
         for index, file in enumerate(self.files):
-            print(f"[{index}] {file}")
+            suffix = "/" if os.path.isdir(file) and not file.endswith("/") else ""
+            print(f"[{index}] {file}{suffix}")
 
     def handle_remove(self, indices: List) -> None:
         """
@@ -403,9 +577,17 @@ class LobbitREPL(cmd.Cmd):
             except ValueError:
                 self.error("Index must be of type 'int'")
 
-    def handle_upload(self) -> None:
+    def handle_upload(self, args: List = None, sync: bool = False) -> None:
         """
-        Process the file upload command
+        Process the file upload command. The files are added to the
+        durable queue and sent in the background so the prompt stays
+        available; files uploaded while another upload is running are
+        queued behind it, or ahead of it with a higher priority. Files are
+        queued even if the server can't be reached yet
+
+        Args:
+            args (List) : optional priority of the files, default 0
+            sync (bool) : only send the files that are new or changed on the server
         """
         if not self.files:
             self.error("No files have been added for upload")
@@ -413,10 +595,226 @@ class LobbitREPL(cmd.Cmd):
         if not self.host and not self.port:
             self.error("Invalid network parameters")
             return
-        client = LobbitClient(self.host, self.port, self.files)
-        connection = client.lobbit_connect()
-        if connection:
-            client.lobbit_send()
+        try:
+            priority = int(args[0]) if args else 0
+        except ValueError:
+            self.error("Priority must be of type 'int'")
+            return
+        same_server = self.engine and (self.engine.client.host, self.engine.client.port) == (self.host, self.port) \
+            and set(self.engine.client.mirrors) == set(self.mirrors) - {(self.host, self.port)} \
+            and self.engine.client.sync == sync
+        if same_server:
+            self.engine.client.dedup = self.dedup
+        if same_server and self.engine.submit(self.files, priority):
+            print(f"[+] Queued {len(self.files)} path(s) with the current upload")
+            self.files = []
+            return
+        if self.engine and self.engine.busy:
+            self.error("Another upload or sync is running, wait for it to finish")
+            return
+        client = LobbitClient(self.host, self.port, [], connections=self.connections, dedup=self.dedup,
+                              streams=self.streams, mirrors=self.mirrors, sync=sync)
+        # queued before connecting, the engine keeps retrying a server that can't be reached
+        self.engine = UploadEngine(client, self.get_queue(), priority)
+        self.engine.submit(self.files)
+        print(f"[+] Uploading {len(self.files)} path(s) in the background, "
+              f"use 'file status' to follow progress")
+        self.files = []
+
+    def handle_sync(self, args: List = None) -> None:
+        """
+        Process the file sync command. The files are uploaded as with
+        'file upload', but their manifest is compared with the server's
+        catalog first and only new or changed files are sent. Files are
+        only compared with one server, so mirrors must be turned off
+
+        Args:
+            args (List) : optional priority of the files, default 0
+        """
+        if set(self.mirrors) - {(self.host, self.port)}:
+            self.error("Sync can't be combined with mirrors, use 'set mirrors off' first")
+            return
+        self.handle_upload(args, sync=True)
+
+    def handle_queue(self) -> None:
+        """
+        Process the file queue command
+        """
+        entries = self.get_queue().entries()
+        if not entries:
+            print("[+] The upload queue is empty")
+            return
+        now = time.time()
+        for row in entries:
+            line = f"[{row['id']}] {row['state']:<7} priority {row['priority']}  attempts {row['attempts']}  " \
+                   f"{row['host']}:{row['port']}  {row['source']}"
+            if row["state"] == UploadQueue.PENDING and row["next_attempt"] > now:
+                line += f"  (retry in {row['next_attempt'] - now:.0f}s)"
+            if row["last_error"]:
+                line += f"\n      last error: {row['last_error']}"
+            print(line)
+
+    def handle_remote_list(self, args: List) -> None:
+        """
+        Process the file remote-list command. The server's catalog of
+        received files is read a page at a time, so listing millions of
+        files never loads them all at once
+
+        Args:
+            args (List) : optional glob pattern matched against the upload names
+        """
+        if len(args) > 1:
+            self.error("file remote-list expects at most 1 argument")
+            return
+        if not self.host and not self.port:
+            self.error("Invalid network parameters")
+            return
+        pattern = args[0] if args else "*"
+        client = LobbitClient(self.host, self.port, [], connections=1)
+        if not client.lobbit_connect():
+            return
+        shown = 0
+        after = ""
+        try:
+            while True:
+                page = client.remote_list(pattern, after, self.page_size)
+                for entry in page["files"]:
+                    received = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["received"]))
+                    print(f"{format_bytes(entry['size']):>9}  {received}  {(entry['sha256'] or 'hashing')[:12]:<12}  "
+                          f"{entry['client'] or '-':<15}  {entry['name']}")
+                shown += len(page["files"])
+                if not page["next"]:
+                    break
+                if input(f"-- {shown} shown, Enter for more or 'q' to stop -- ").strip().lower() == "q":
+                    break
+                after = page["next"]
+        except (OSError, ValueError) as e:
+            self.error(f"Could not list the server's files: {e}")
+        finally:
+            client.lobbit_close()
+        if not shown:
+            print(f"[+] The server holds no files matching '{pattern}'")
+
+    def handle_verify(self) -> None:
+        """
+        Process the file verify command. Each added file is hashed, from
+        the local hash cache when it has not changed, and compared with
+        the checksum the server recorded when it received the file
+        """
+        if not self.files:
+            self.error("No files have been added for upload")
+            return
+        if not self.host and not self.port:
+            self.error("Invalid network parameters")
+            return
+        client = LobbitClient(self.host, self.port, self.files, connections=1)
+        if not client.lobbit_connect():
+            return
+        try:
+            results = client.verify()
+        except (OSError, ValueError) as e:
+            self.error(f"Could not verify the files: {e}")
+            return
+        finally:
+            client.lobbit_close()
+            if client.hash_cache:
+                client.hash_cache.close()
+        counts = {}
+        for result in results:
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+            if result["status"] != "match":
+                print(f"[-] {result['status']:<8}  {result['name'] or result['file']}"
+                      f"{': ' + result['error'] if result['error'] else ''}")
+        print(f"[+] Verified {len(results)} file(s): " +
+              ", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+        cache = client.hash_cache
+        if cache:
+            print(f"[+] Hash cache: {cache.hits} unchanged, {cache.misses} hashed")
+
+    def handle_bench_cipher(self, args: List) -> None:
+        """
+        Process the bench cipher command. Each candidate cipher is timed
+        sending data over a TLS connection on the loopback interface and
+        the TLS_CIPHERS setting preferring the fastest is suggested
+
+        Args:
+            args (List) : optional megabytes to send with each cipher
+        """
+        try:
+            size = int(args[0]) if args else 128
+            if len(args) > 1 or size < 1:
+                raise ValueError
+        except ValueError:
+            self.error("bench cipher expects a positive number of megabytes")
+            return
+        config = get_config()
+        cert, key = config.get("PUBLIC_CERT_PATH"), config.get("PRIVATE_CERT_PATH")
+        with tempfile.TemporaryDirectory() as tmp:
+            if not (cert and key and os.path.isfile(cert) and os.path.isfile(key)):
+                try:
+                    cert, key = bench.throwaway_cert(tmp)
+                except (OSError, subprocess.CalledProcessError) as e:
+                    self.error(f"No server certificate to benchmark with and openssl failed: {e}")
+                    return
+            print(f"[+] Sending {size}MB over loopback with each cipher...")
+            results = bench.bench_ciphers(cert, key, size * 1024 * 1024)
+        for result in results:
+            if result["error"]:
+                print(f"[-] {result['aead']:<18} failed: {result['error']}")
+            else:
+                print(f"[+] {result['aead']:<18} {format_bytes(result['rate'])}/s  ({result['cipher']})")
+        fastest = bench.suggestion(results)
+        if not fastest:
+            return
+        print(f"[+] Fastest: add this to config.json on the client and server:\n"
+              f'    "TLS_CIPHERS": {json.dumps(fastest)}')
+        if not fastest[0].startswith("TLS_"):
+            print("[+] This Python cannot choose TLS 1.3 suites, so the TLS 1.2 ciphers using the "
+                  "same AEAD were measured and suggested")
+
+    def handle_status(self) -> None:
+        """
+        Process the file status command
+        """
+        if not self.engine:
+            self.error("No files have been uploaded")
+            return
+        for line in self.engine.status():
+            print(line)
+        if not self.engine.busy:
+            failed = [r for r in self.engine.results if r["status"] == "failed"]
+            for result in failed:
+                self.error(f"{result['file']}: {result['error']}")
+
+    def handle_cancel(self, indices: List) -> None:
+        """
+        Process the file cancel command
+
+        Args:
+             indices (List) : indexes shown by 'file status', or 'all'
+        """
+        if not self.engine or not self.engine.busy:
+            self.error("No upload is running")
+            return
+        if not indices:
+            self.error(f"'{self.lastcmd}' missing required argument: <index(es)>")
+            return
+        if indices == ["all"]:
+            self.engine.cancel()
+            print("[+] Cancelling the current upload and everything queued behind it")
+            return
+        for index in indices:
+            try:
+                job = self.engine.cancel(int(index))
+            except IndexError:
+                self.error(f"Chosen index '{index}' is out of bounds")
+            except ValueError:
+                self.error("Index must be of type 'int'")
+            else:
+                if job:
+                    print(f"[+] Cancelling '{job['name']}'")
+                else:
+                    self.error(f"File at index '{index}' has already been sent")
 
     def set_hostname(self) -> None:
         """
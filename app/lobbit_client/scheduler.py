@@ -0,0 +1,162 @@
+import heapq
+import itertools
+import os
+
+from threading import Lock
+from typing import Iterable, List, Tuple, Union
+
+
+class FileScheduler:
+    """
+    Hands files out to upload workers in a size based order. Files
+    are pulled lazily from the source into a bounded look-ahead heap
+    so ordering never requires the whole file list up front. One worker
+    at a time reads the source without holding the heap, so the others
+    keep taking files while it waits on a slow source such as a
+    SyncManifest asking the server about its next batch
+    """
+
+    ORDERS = ("largest", "smallest", "fifo")
+
+    def __init__(self, files: Iterable, order: str = "largest", lookahead: int = 1024) -> None:
+        """
+        Constructor for the FileScheduler class
+
+        Args:
+            files (Iterable) : (path, upload name) pairs to schedule
+            order (str)      : 'largest' first to minimise the total transfer
+                               time across connections, 'smallest' first to
+                               minimise the average time to complete a file,
+                               or 'fifo' to keep the discovery order
+            lookahead (int)  : number of files held for ordering at once
+        """
+        if order not in FileScheduler.ORDERS:
+            raise ValueError(f"order must be one of {', '.join(FileScheduler.ORDERS)}")
+        self.files = iter(files)
+        self.order = order
+        self.lookahead = max(1, lookahead)
+        self.errors = []
+        self._heap = []
+        self._counter = itertools.count()
+        self._lock = Lock()
+        # held while reading the source, which is not thread safe
+        self._source = Lock()
+        self._exhausted = False
+
+    def _key(self, size: int) -> int:
+        """
+        Returns the heap key for a file of <size> bytes
+
+        Args:
+            size (int) : size of the file in bytes
+        Returns:
+            int : the heap priority, lowest is handed out first
+        """
+        if self.order == "largest":
+            return -size
+        if self.order == "smallest":
+            return size
+        return 0
+
+    def _fill(self, wait: bool = True) -> None:
+        """
+        Tops up the heap from the source until it holds <lookahead>
+        files or the source is exhausted. The heap lock is only held to
+        add each file. Must be called without the lock held
+
+        Args:
+            wait (bool) : wait for another thread reading the source,
+                          False returns at once instead
+        """
+        if not self._source.acquire(wait):
+            return
+        try:
+            while True:
+                with self._lock:
+                    if self._exhausted or len(self._heap) >= self.lookahead:
+                        return
+                try:
+                    path, name = next(self.files)
+                except StopIteration:
+                    with self._lock:
+                        self._exhausted = True
+                    return
+                try:
+                    size = os.stat(path).st_size
+                except OSError as e:
+                    with self._lock:
+                        self.errors.append((path, name, str(e)))
+                    continue
+                with self._lock:
+                    heapq.heappush(self._heap, (self._key(size), next(self._counter), path, name, size))
+        finally:
+            self._source.release()
+
+    def next_job(self) -> Union[Tuple[str, str, int], None]:
+        """
+        Returns the next file to upload
+
+        Returns:
+            Union[Tuple[str, str, int], None] : the path, upload name and size
+                                                of the file or None when done
+        """
+        wait = False
+        while True:
+            self._fill(wait)
+            with self._lock:
+                if self._heap:
+                    _, _, path, name, size = heapq.heappop(self._heap)
+                    return path, name, size
+                if self._exhausted:
+                    return None
+            # the heap is empty while another worker reads the source
+            wait = True
+
+    def requeue(self, path: str, name: str, size: int) -> None:
+        """
+        Puts a file back in the queue to be sent again
+
+        Args:
+            path (str) : path of the file
+            name (str) : upload name of the file
+            size (int) : bytes still to send, used for ordering
+        """
+        with self._lock:
+            heapq.heappush(self._heap, (self._key(size), next(self._counter), path, name, size))
+
+    def pending(self) -> bool:
+        """
+        Checks whether there are files left to hand out
+
+        Returns:
+            bool : True if next_job would return a file
+        """
+        wait = False
+        while True:
+            self._fill(wait)
+            with self._lock:
+                if self._heap or self._exhausted:
+                    return bool(self._heap)
+            wait = True
+
+    def queued(self) -> List[Tuple[str, int]]:
+        """
+        Returns the files read from the source but not yet handed out.
+        Files still to be found by the source are not included
+
+        Returns:
+            List[Tuple[str, int]] : the path and size of each queued file
+        """
+        with self._lock:
+            return [(path, size) for _, _, path, _, size in self._heap]
+
+    def close(self) -> None:
+        """
+        Drops every queued file and stops reading from the source
+        """
+        with self._source, self._lock:
+            self._heap = []
+            self._exhausted = True
+            close = getattr(self.files, "close", None)
+            if close:
+                close()
@@ -0,0 +1,436 @@
+import os
+import socket
+
+from app.lobbit_util.buffer import Buffer
+from app.lobbit_util.ktls import can_sendfile
+from app.lobbit_util.tuning import Tuner
+from app.lobbit_util import cdc, protocol, sparse
+from collections import deque
+from typing import BinaryIO, Callable, Iterable, Iterator, List, Tuple, Union
+
+
+class TransferCancelled(Exception):
+    """
+    Raised when a file is cancelled part way through sending. The
+    connection is left in the middle of the file and cannot be reused
+    """
+
+    def __init__(self, job: dict) -> None:
+        """
+        Constructor for the TransferCancelled class
+
+        Args:
+            job (dict) : the file that was cancelled
+        """
+        super().__init__(f"Cancelled '{job['name']}'")
+        self.job = job
+
+
+class SourceChanged(TransferCancelled):
+    """
+    Raised when a file shrinks part way through sending. The rest of
+    the file can't be sent, so it is abandoned like a cancelled file
+    and the server drops or truncates it instead of confirming it.
+    The reason is kept in job['error']
+    """
+
+    def __init__(self, job: dict) -> None:
+        """
+        Constructor for the SourceChanged class
+
+        Args:
+            job (dict) : the file that changed
+        """
+        job["error"] = "File changed size while sending"
+        super().__init__(job)
+        self.args = (f"'{job['name']}' changed size while sending",)
+
+
+class FileSender:
+    """
+    Sends files over a single connection while reading the server's
+    acknowledgements. Up to <window> bytes of unacknowledged data are
+    kept in flight, across file boundaries, so the connection never
+    waits for a round trip between files
+    """
+
+    # number of bytes read from disk per socket write until the connection is tuned
+    CHUNK_SIZE = 1024 * 1024
+    # files with this many bytes left to send wait for the server to admit
+    # them, so a refusal costs a round trip instead of the whole file
+    EXPECT_SIZE = 64 * 1024 * 1024
+
+    def __init__(self, sock: socket.socket, on_final: Callable, window: int = protocol.DEFAULT_WINDOW) -> None:
+        """
+        Constructor for the FileSender class
+
+        Args:
+            sock (socket.socket) : the connection to send over
+            on_final (Callable)  : called with (job, status, offset) when the
+                                   server sends the final status for a file
+            window (int)         : maximum bytes of unacknowledged data
+        """
+        self.buffer = Buffer(sock)
+        self.on_final = on_final
+        self.window = self.base_window = max(window, FileSender.CHUNK_SIZE)
+        self.in_flight = deque()
+        self.sent = 0
+        self.acked = 0
+        # bytes written to the connection, unlike <sent> holes are not counted
+        self.written = 0
+        self.sendfile = can_sendfile(sock)
+        self.tuner = None
+
+    def tune(self, limits: dict = None, name: str = "", log: Callable = None) -> None:
+        """
+        Sizes the chunks, socket send buffer and window of the connection
+        to its measured throughput and round trip time as files are sent
+
+        Args:
+            limits (dict)  : limits from tuning.read_limits
+            name (str)     : name of the connection used in the log
+            log (Callable) : called with the values chosen whenever they change
+        """
+        self.tuner = Tuner(self.buffer.sock, socket.SO_SNDBUF, lambda: self.written, limits, name,
+                           FileSender.CHUNK_SIZE, log)
+
+    @property
+    def chunk_size(self) -> int:
+        """
+        Bytes read from disk per socket write
+        """
+        return self.tuner.chunk_size if self.tuner else FileSender.CHUNK_SIZE
+
+    def send(self, job: dict, f: BinaryIO, extents: List[Tuple[int, int]] = None) -> None:
+        """
+        Sends the header and data for <job> from the open file <f>,
+        starting at the offset already committed by the server. With
+        <extents> only the data extents and the extent map are sent and
+        the server recreates the holes. Progress is kept in the job as
+        plain counters, once per chunk, so reading it never touches the
+        data path. Large files are only sent once the server has admitted
+        them, see <admitted>
+
+        Args:
+            job (dict)                      : the file being sent, see LobbitClient.new_job
+            f (BinaryIO)                    : the open file
+            extents (List[Tuple[int, int]]) : data extents from the committed offset,
+                                              see sparse.data_extents
+        """
+        while len(self.in_flight) >= protocol.MAX_IN_FLIGHT:
+            self.read_status()
+        self.in_flight.append(job)
+        start = job["committed"]
+        expect = job["size"] - start >= FileSender.EXPECT_SIZE
+        self.header(job, expect)
+        if extents is None:
+            self.buffer.put_utf8(str(job["committed"]))
+            extents = [(job["committed"], job["size"] - job["committed"])]
+        else:
+            self.buffer.put_utf8(protocol.SPARSE)
+            self.buffer.put_utf8(str(job["committed"]))
+            self.buffer.put_utf8(str(len(extents)))
+            self.buffer.put_bytes(sparse.encode_extents(extents))
+        if expect and not self.admitted(job):
+            # refused, the final status accounts for the file as if it had been sent
+            self.sent += job["size"] - start
+            return
+        job["method"] = "sendfile" if self.sendfile else "send"
+        pos = job["committed"]
+        job["sent"] = pos
+        for start, length in extents:
+            # a hole is committed by the server without any data being sent
+            self.sent += start - pos
+            pos = self.send_range(job, f, start, start + length)
+            if pos < start + length:
+                # the file shrank while sending, the server must not confirm what was sent
+                raise SourceChanged(job)
+        self.sent += job["size"] - pos
+
+    def header(self, job: dict, expect: bool = False) -> None:
+        """
+        Sends the name and size of <job> and the optional fields that go
+        before its offset field: the modified time of the file when the
+        job has one and, with <expect>, a request to be admitted first
+
+        Args:
+            job (dict)    : the file being sent, see LobbitClient.new_job
+            expect (bool) : wait for the server to admit the file, see <admitted>
+        """
+        self.buffer.put_utf8(job["name"])
+        self.buffer.put_utf8(str(job["size"]))
+        if job.get("mtime") is not None:
+            self.buffer.put_utf8(protocol.MTIME)
+            self.buffer.put_utf8(str(job["mtime"]))
+        if expect:
+            self.buffer.put_utf8(protocol.EXPECT)
+
+    def send_range(self, job: dict, f: BinaryIO, pos: int, end: int) -> int:
+        """
+        Sends the bytes from <pos> to <end> of the open file <f>
+
+        Args:
+            job (dict)   : the file being sent
+            f (BinaryIO) : the open file
+            pos (int)    : first byte to send
+            end (int)    : byte to stop at
+        Returns:
+            int : the offset reached, short of <end> if the file shrank
+        """
+        f.seek(pos)
+        while pos < end:
+            if job["cancelled"]:
+                raise TransferCancelled(job)
+            n = min(self.chunk_size, end - pos)
+            while self.in_flight and self.sent - self.acked + n > self.window:
+                self.read_status()
+            if self.sendfile:
+                n = self.buffer.sock.sendfile(f, pos, n)
+            else:
+                chunk = f.read(n)
+                self.buffer.put_bytes(chunk)
+                n = len(chunk)
+            if not n:
+                break
+            pos += n
+            self.sent += n
+            self.written += n
+            job["sent"] = pos
+            job["transferred"] += n
+            if self.tuner and self.tuner.update():
+                # enough unacknowledged data to keep a long link busy
+                self.window = max(self.base_window, 4 * self.tuner.bdp)
+        return pos
+
+    def send_chunks(self, job: dict, chunks: Iterable[bytes]) -> None:
+        """
+        Sends the header for <job> and the whole file from <chunks>, data
+        already read from the file, e.g. by a reader shared with other
+        connections. If the chunks end short of job['size'] the file shrank
+        while it was read and SourceChanged is raised as <send> does. A
+        large file the server refuses to admit has its chunks consumed
+        without sending them
+
+        Args:
+            job (dict)               : the file being sent, see LobbitClient.new_job
+            chunks (Iterable[bytes]) : the file's data in order
+        """
+        while len(self.in_flight) >= protocol.MAX_IN_FLIGHT:
+            self.read_status()
+        self.in_flight.append(job)
+        expect = job["size"] >= FileSender.EXPECT_SIZE
+        self.header(job, expect)
+        self.buffer.put_utf8("0")
+        job["method"], job["committed"], job["sent"] = "send", 0, 0
+        if expect and not self.admitted(job):
+            self.sent += job["size"]
+            for _ in chunks:
+                pass
+            return
+        for chunk in chunks:
+            while self.in_flight and self.sent - self.acked + len(chunk) > self.window:
+                self.read_status()
+            self.buffer.put_bytes(chunk)
+            self.sent += len(chunk)
+            self.written += len(chunk)
+            job["sent"] += len(chunk)
+            job["transferred"] += len(chunk)
+            if self.tuner and self.tuner.update():
+                self.window = max(self.base_window, 4 * self.tuner.bdp)
+        if job["sent"] < job["size"]:
+            raise SourceChanged(job)
+
+    def send_chunked(self, job: dict, source: Union[BinaryIO, Iterable[bytes]]) -> None:
+        """
+        Sends data of unknown length from <source> as chunks, ending with
+        a chunk of length 0. The size is only known, and set in the job,
+        once the source is exhausted. If reading the source fails the
+        stream is aborted, so the server drops what it received, and the
+        error is kept in job['error']
+
+        Args:
+            job (dict)                                : the stream being sent, see LobbitClient.new_job
+            source (Union[BinaryIO, Iterable[bytes]]) : a binary file-like object or an iterable of bytes
+        """
+        while len(self.in_flight) >= protocol.MAX_IN_FLIGHT:
+            self.read_status()
+        self.in_flight.append(job)
+        self.buffer.put_utf8(job["name"])
+        self.buffer.put_utf8("0")
+        self.buffer.put_utf8(protocol.CHUNKED)
+        job["method"], job["size"], job["sent"] = "chunked", 0, 0
+        chunks = self.read_source(source)
+        while True:
+            try:
+                chunk = next(chunks, None)
+            except Exception as e:
+                job["error"] = f"Could not read the source: {e}"
+                job["size"] = job["sent"]
+                self.buffer.put_utf8(protocol.ABORT)
+                return
+            if chunk is None:
+                break
+            while self.in_flight and self.sent - self.acked + len(chunk) > self.window:
+                self.read_status()
+            self.buffer.put_utf8(str(len(chunk)))
+            self.buffer.put_bytes(chunk)
+            self.sent += len(chunk)
+            self.written += len(chunk)
+            job["sent"] += len(chunk)
+            job["transferred"] += len(chunk)
+            if self.tuner and self.tuner.update():
+                self.window = max(self.base_window, 4 * self.tuner.bdp)
+        # the final status accounts for the size, set before the server can send it
+        job["size"] = job["sent"]
+        self.buffer.put_utf8("0")
+
+    def read_source(self, source: Union[BinaryIO, Iterable[bytes]]) -> Iterator[bytes]:
+        """
+        Reads a stream's source in chunks of up to <chunk_size> bytes.
+        File-like objects are read as their data arrives, small items
+        from an iterable are joined so each chunk is worth its header
+
+        Args:
+            source (Union[BinaryIO, Iterable[bytes]]) : a binary file-like object or an iterable of bytes
+        Returns:
+            Iterator[bytes] : the chunks, none of them empty
+        """
+        if hasattr(source, "read"):
+            while data := source.read(min(self.chunk_size, protocol.MAX_CHUNK)):
+                if not isinstance(data, (bytes, bytearray)):
+                    raise TypeError(f"source returned {type(data).__name__}, not bytes")
+                yield data
+            return
+        pending = bytearray()
+        for data in source:
+            if not isinstance(data, (bytes, bytearray, memoryview)):
+                raise TypeError(f"source yielded {type(data).__name__}, not bytes")
+            pending += data
+            while len(pending) >= self.chunk_size:
+                n = min(self.chunk_size, protocol.MAX_CHUNK)
+                yield bytes(pending[:n])
+                del pending[:n]
+        if pending:
+            yield bytes(pending)
+
+    def send_dedup(self, job: dict, f: BinaryIO) -> None:
+        """
+        Sends <job> as content defined chunks, only the chunks the server
+        does not already hold cross the connection. The server must
+        answer the manifest before any data is sent, so the files in
+        flight are confirmed first and the file is always sent whole;
+        chunks the server stored before a failure are not sent again.
+        The chunk counts and bytes sent are kept in job['dedup']
+
+        Args:
+            job (dict)   : the file being sent, see LobbitClient.new_job
+            f (BinaryIO) : the open file
+        """
+        self.drain()
+        job["method"], job["committed"], job["sent"], job["dedup"] = "dedup", 0, 0, None
+        f.seek(0)
+        entries = list(cdc.chunks(f))
+        size = sum(length for _, _, length in entries)
+        if size != job["size"]:
+            job["error"] = "File changed size while sending"
+        job["size"] = size
+        self.in_flight.append(job)
+        self.header(job)
+        self.buffer.put_utf8(protocol.DEDUP)
+        self.buffer.put_utf8(str(len(entries)))
+        self.buffer.put_bytes(cdc.encode_manifest(entries))
+        status, count = protocol.recv_status(self.buffer)
+        if status != protocol.NEED:
+            # refused, no chunk data follows
+            self.in_flight.popleft()
+            self.on_final(job, status, count)
+            return
+        wanted = cdc.decode_bitmap(self.buffer.read_exact((len(entries) + 7) // 8), len(entries))
+        stats = job["dedup"] = {"chunks": len(entries), "chunks_sent": 0, "bytes_sent": 0}
+        for (_, offset, length), flag in zip(entries, wanted):
+            if job["cancelled"]:
+                raise TransferCancelled(job)
+            if flag:
+                f.seek(offset)
+                chunk = f.read(length)
+                # a file changed since chunking fails the server's digest check
+                self.buffer.put_bytes(chunk + bytes(length - len(chunk)))
+                stats["chunks_sent"] += 1
+                stats["bytes_sent"] += length
+                self.written += length
+                job["transferred"] += length
+            job["sent"] = offset + length
+        # the final status accounts for the whole file, not the bytes sent
+        self.sent += size
+
+    def admitted(self, job: dict) -> bool:
+        """
+        Waits for the server to admit <job>, sent with EXPECT, reading the
+        replies for the files ahead of it. The server only answers once
+        it has received those files, so the wait is at most one round
+        trip once the connection has caught up
+
+        Args:
+            job (dict) : the file whose header has just been sent
+        Returns:
+            bool : True if the data may be sent, False if the file was refused
+        """
+        job["admitted"] = False
+        while self.in_flight and self.in_flight[-1] is job:
+            if job["admitted"]:
+                return True
+            self.read_status()
+        return False
+
+    def read_status(self) -> None:
+        """
+        Reads one status reply and applies it to the oldest file in flight
+        """
+        status, offset = protocol.recv_status(self.buffer)
+        job = self.in_flight[0]
+        if status == protocol.CONTINUE:
+            job["admitted"] = True
+            return
+        if status == protocol.ACK:
+            self.acked += offset - job["committed"]
+            job["committed"] = offset
+            return
+        # the server has consumed every byte of the file, whatever the outcome
+        self.acked += job["size"] - job["committed"]
+        job["committed"] = offset
+        self.in_flight.popleft()
+        self.on_final(job, status, offset)
+
+    def drain(self) -> None:
+        """
+        Waits for the final status of every file in flight
+        """
+        while self.in_flight:
+            self.read_status()
+
+    def drain_before(self, job: dict) -> None:
+        """
+        Waits for the final status of every file sent before <job>
+        and removes <job> from the files in flight
+
+        Args:
+            job (dict) : the file that was abandoned part way through
+        """
+        while self.in_flight[0] is not job:
+            self.read_status()
+        self.in_flight.popleft()
+
+    @staticmethod
+    def open(path: str) -> BinaryIO:
+        """
+        Opens a file for sending
+
+        Args:
+            path (str) : path of the file
+        Returns:
+            BinaryIO : the open file
+        """
+        f = open(path, 'rb')
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        return f
@@ -0,0 +1,122 @@
+import itertools
+import os
+import socket
+
+from app.lobbit_util import cdc, manifest, protocol
+from app.lobbit_util.buffer import Buffer
+from app.lobbit_util.walk import TreeWalker
+from collections import deque
+from typing import Iterator, List, Tuple
+
+
+class SyncManifest:
+    """
+    Narrows the files found by a TreeWalker down to the ones the server
+    does not hold with the same size and modified time. The manifest of
+    every file found is streamed to the server in compressed frames over
+    a connection of its own and the files flagged in each reply are
+    yielded straight away, so uploading starts while the rest of the
+    tree is still being walked and compared, and neither side ever holds
+    the whole manifest
+    """
+
+    # frames sent ahead of the reply to the oldest being read
+    WINDOW = 8
+
+    def __init__(self, walker: TreeWalker, sock: socket.socket) -> None:
+        """
+        Constructor for the SyncManifest class
+
+        Args:
+            walker (TreeWalker)  : the files to compare
+            sock (socket.socket) : connection to the server used only for the
+                                   comparison, closed once it is done
+        """
+        self.walker = walker
+        self.sock = sock
+        self.compared = 0
+        self.unchanged = 0
+        self._errors = []
+
+    @property
+    def errors(self) -> List[Tuple[str, str]]:
+        """
+        The path and error of every source or file that could not be read,
+        and of the comparison itself if it failed
+        """
+        return self.walker.errors + self._errors
+
+    def entries(self) -> Iterator[Tuple[str, str, int, int]]:
+        """
+        Stats every file found by the walker
+
+        Returns:
+            Iterator[Tuple[str, str, int, int]] : the path, upload name, size
+                                                  and modified time of each file
+        """
+        for path, name in self.walker:
+            try:
+                st = os.stat(path)
+            except OSError as e:
+                self._errors.append((path, str(e)))
+                continue
+            yield path, name, st.st_size, st.st_mtime_ns
+
+    def __iter__(self) -> Iterator[Tuple[str, str]]:
+        """
+        Compares the files with the server's catalog, yielding those that
+        are missing or changed as (path, upload name) pairs like the walker.
+        If the comparison fails the files not yet compared are not yielded
+        and the error is kept in <errors>
+
+        Returns:
+            Iterator[Tuple[str, str]] : the files to upload
+        """
+        buffer = Buffer(self.sock)
+        pending = deque()
+        try:
+            buffer.put_utf8(protocol.SYNC)
+            found = self.entries()
+            while batch := list(itertools.islice(found, manifest.BATCH_SIZE)):
+                frame = manifest.encode_frame([(name, size, mtime) for _, name, size, mtime in batch])
+                buffer.put_utf8(str(len(frame)))
+                buffer.put_bytes(frame)
+                pending.append(batch)
+                if len(pending) >= SyncManifest.WINDOW:
+                    yield from self.wanted(buffer, pending.popleft())
+            buffer.put_utf8("0")
+            while pending:
+                yield from self.wanted(buffer, pending.popleft())
+            status, _ = protocol.recv_status(buffer)
+            if status != protocol.OK:
+                raise ConnectionError(f"Server replied '{status}'")
+            buffer.put_utf8("")
+        except (OSError, ValueError) as e:
+            self._errors.append(("sync", f"Could not compare the files with the server: {e}"))
+        finally:
+            self.sock.close()
+
+    def wanted(self, buffer: Buffer, batch: List[Tuple[str, str, int, int]]) -> Iterator[Tuple[str, str]]:
+        """
+        Reads the server's reply to one frame
+
+        Args:
+            buffer (Buffer) : buffer wrapping the connection
+            batch (List)    : the files in the frame, see <entries>
+        Returns:
+            Iterator[Tuple[str, str]] : the path and upload name of the files flagged
+        """
+        status, count = protocol.recv_status(buffer)
+        if status != protocol.NEED:
+            raise ConnectionError(f"Server replied '{status}'")
+        self.compared += len(batch)
+        self.unchanged += len(batch) - count
+        if not count:
+            return
+        bitmap = buffer.read_exact((len(batch) + 7) // 8)
+        if len(bitmap) < (len(batch) + 7) // 8:
+            raise ConnectionError("Connection closed by the server")
+        flags = cdc.decode_bitmap(bitmap, len(batch))
+        for (path, name, _, _), flag in zip(batch, flags):
+            if flag:
+                yield path, name
@@ -0,0 +1,433 @@
+import fnmatch
+import glob
+import os
+import random
+import sqlite3
+import time
+
+from threading import Lock
+from typing import Iterable, List, Union
+
+DEFAULT_QUEUE_PATH = os.path.join(os.path.expanduser("~"), ".lobbit", "queue.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    source       TEXT    NOT NULL,
+    host         TEXT    NOT NULL,
+    port         INTEGER NOT NULL,
+    priority     INTEGER NOT NULL DEFAULT 0,
+    state        TEXT    NOT NULL DEFAULT 'pending',
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL    NOT NULL DEFAULT 0,
+    last_error   TEXT,
+    added        REAL    NOT NULL,
+    owner        INTEGER,
+    lease        REAL
+);
+CREATE INDEX IF NOT EXISTS uploads_due ON uploads (state, host, port, priority, next_attempt);
+CREATE TABLE IF NOT EXISTS progress (
+    host      TEXT    NOT NULL,
+    port      INTEGER NOT NULL,
+    path      TEXT    NOT NULL,
+    size      INTEGER NOT NULL,
+    mtime_ns  INTEGER NOT NULL,
+    committed INTEGER NOT NULL,
+    PRIMARY KEY (host, port, path)
+);
+"""
+
+
+def source_of(sources: Iterable[str], path: str) -> Union[str, None]:
+    """
+    Finds the source a file was found under, the source itself, a
+    directory above the file or a glob pattern matching the file or
+    one of its parent directories
+
+    Args:
+        sources (Iterable[str]) : sources as they were queued
+        path (str)              : absolute path of the file
+    Returns:
+        Union[str, None] : the matching source or None
+    """
+    for source in sources:
+        if path == source:
+            return source
+        root = os.path.abspath(source)
+        if glob.has_magic(source) and not os.path.exists(source):
+            parent = path
+            while parent != os.path.dirname(parent):
+                if fnmatch.fnmatchcase(parent, root):
+                    return source
+                parent = os.path.dirname(parent)
+        elif path == root or path.startswith(root.rstrip(os.sep) + os.sep):
+            return source
+    return None
+
+
+def pid_alive(pid: int) -> bool:
+    """
+    Checks whether a process is still running on this machine. Where
+    that can't be told without signalling the process, it is assumed
+    to be running and only its lease is trusted
+
+    Args:
+        pid (int) : id of the process
+    Returns:
+        bool : False if the process has exited
+    """
+    if os.name != "posix":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # running, but owned by another user
+        return True
+    return True
+
+
+def source_exists(source: str) -> bool:
+    """
+    Checks that a source still names at least one path, a failed
+    entry whose source has gone cannot succeed by retrying
+
+    Args:
+        source (str) : file, directory or glob pattern
+    Returns:
+        bool : True if the source matches a path
+    """
+    if os.path.exists(source):
+        return True
+    return glob.has_magic(source) and next(glob.iglob(source, recursive=True), None) is not None
+
+
+class UploadQueue:
+    """
+    Durable queue of uploads kept in a sqlite database. Each entry is
+    a file, directory or glob pattern waiting to be sent to a server.
+    Failed entries are retried with exponential backoff and the bytes
+    the server has committed for each file are saved, so uploads left
+    unfinished by a crash or restart resume where they stopped. A
+    claimed entry is owned by the claiming process for as long as it
+    keeps renewing its lease, so several processes can share the queue
+    without sending the same entry twice
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    # seconds before the first retry, doubled on every attempt
+    BACKOFF_BASE = 2.0
+    BACKOFF_MAX = 15 * 60.0
+    # seconds a claimed entry stays owned without its lease being renewed
+    LEASE = 60.0
+
+    def __init__(self, path: str = None, max_attempts: int = 20) -> None:
+        """
+        Constructor for the UploadQueue class
+
+        Args:
+            path (str)         : path of the database, defaults to $LOBBIT_QUEUE
+                                 or ~/.lobbit/queue.db
+            max_attempts (int) : attempts before an entry is marked failed
+        """
+        self.path = path or os.getenv("LOBBIT_QUEUE") or DEFAULT_QUEUE_PATH
+        self.max_attempts = max_attempts
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._lock = Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(SCHEMA)
+            if "owner" not in {row[1] for row in self._db.execute("PRAGMA table_info(uploads)")}:
+                # queues from before leases, their running entries have no owner and are recovered
+                self._db.execute("ALTER TABLE uploads ADD COLUMN owner INTEGER")
+                self._db.execute("ALTER TABLE uploads ADD COLUMN lease REAL")
+        self.recovered = self.recover()
+
+    def close(self) -> None:
+        """
+        Closes the database
+        """
+        with self._lock:
+            self._db.close()
+
+    def execute(self, sql: str, params: Iterable = ()) -> List[sqlite3.Row]:
+        """
+        Runs a statement in its own transaction
+
+        Args:
+            sql (str)         : the statement
+            params (Iterable) : values bound to the statement
+        Returns:
+            List[sqlite3.Row] : any rows returned
+        """
+        with self._lock, self._db:
+            return self._db.execute(sql, tuple(params)).fetchall()
+
+    def recover(self) -> int:
+        """
+        Returns entries left running by a process that stopped to the
+        pending state so they are picked up again. Entries whose owner
+        is still running and renewing its lease are left alone
+
+        Returns:
+            int : the number of entries recovered
+        """
+        with self._lock, self._db:
+            return self._recover()
+
+    def _recover(self) -> int:
+        """
+        Recovers stale entries inside the caller's transaction, see <recover>
+
+        Returns:
+            int : the number of entries recovered
+        """
+        now = time.time()
+        rows = self._db.execute("SELECT id, owner, lease FROM uploads WHERE state = ?",
+                                (UploadQueue.RUNNING,)).fetchall()
+        stale = [row["id"] for row in rows
+                 if row["owner"] is None or (row["lease"] or 0) < now or not pid_alive(row["owner"])]
+        self._db.executemany("UPDATE uploads SET state = ?, owner = NULL, lease = NULL WHERE id = ?",
+                             [(UploadQueue.PENDING, entry_id) for entry_id in stale])
+        return len(stale)
+
+    # --- ENTRIES ---
+
+    def add(self, sources: Iterable[str], host: str, port: int, priority: int = 0) -> List[int]:
+        """
+        Adds sources to the queue
+
+        Args:
+            sources (Iterable[str]) : files, directories or glob patterns
+            host (str)              : server to upload to
+            port (int)              : port of the server
+            priority (int)          : higher priorities are sent first
+        Returns:
+            List[int] : the id of each new entry
+        """
+        now = time.time()
+        with self._lock, self._db:
+            return [self._db.execute("INSERT INTO uploads (source, host, port, priority, added) "
+                                     "VALUES (?, ?, ?, ?, ?)", (source, host, port, priority, now)).lastrowid
+                    for source in sources]
+
+    def entries(self, states: Iterable[str] = (PENDING, RUNNING, FAILED)) -> List[sqlite3.Row]:
+        """
+        Returns the entries in <states>, highest priority first
+
+        Args:
+            states (Iterable[str]) : states to include
+        Returns:
+            List[sqlite3.Row] : the matching entries
+        """
+        states = list(states)
+        marks = ", ".join("?" * len(states))
+        return self.execute(f"SELECT * FROM uploads WHERE state IN ({marks}) "
+                            f"ORDER BY priority DESC, id", states)
+
+    def claim(self, host: str, port: int) -> List[sqlite3.Row]:
+        """
+        Marks the due entries for a server that share the highest
+        priority as running and returns them. They are sent together
+        so the files of small entries keep every connection busy. Entries
+        abandoned by another process are recovered first. The claim holds
+        for LEASE seconds and is kept by calling <renew>
+
+        Args:
+            host (str) : server to upload to
+            port (int) : port of the server
+        Returns:
+            List[sqlite3.Row] : the claimed entries, empty if none are due
+        """
+        with self._lock, self._db:
+            self._recover()
+            rows = self._db.execute("SELECT * FROM uploads WHERE state = ? AND host = ? AND port = ? "
+                                    "AND next_attempt <= ? AND priority = (SELECT MAX(priority) FROM uploads "
+                                    "WHERE state = ? AND host = ? AND port = ? AND next_attempt <= ?) "
+                                    "ORDER BY id", (UploadQueue.PENDING, host, port, time.time()) * 2).fetchall()
+            lease = time.time() + UploadQueue.LEASE
+            self._db.executemany("UPDATE uploads SET state = ?, attempts = attempts + 1, owner = ?, lease = ? "
+                                 "WHERE id = ?", [(UploadQueue.RUNNING, os.getpid(), lease, row["id"]) for row in rows])
+        return rows
+
+    def renew(self, entry_ids: Iterable[int]) -> None:
+        """
+        Extends the lease on entries this process has claimed, so other
+        processes opening the queue don't take them over while they run
+
+        Args:
+            entry_ids (Iterable[int]) : ids of the entries
+        """
+        lease = time.time() + UploadQueue.LEASE
+        with self._lock, self._db:
+            self._db.executemany("UPDATE uploads SET lease = ? WHERE id = ? AND state = ? AND owner = ?",
+                                 [(lease, entry_id, UploadQueue.RUNNING, os.getpid()) for entry_id in entry_ids])
+
+    def pending(self, host: str, port: int) -> int:
+        """
+        Returns the number of entries waiting to be sent to a server
+
+        Args:
+            host (str) : server to upload to
+            port (int) : port of the server
+        Returns:
+            int : the number of pending entries
+        """
+        return self.execute("SELECT COUNT(*) FROM uploads WHERE state = ? AND host = ? AND port = ?",
+                            (UploadQueue.PENDING, host, port))[0][0]
+
+    def next_due(self, host: str, port: int) -> Union[float, None]:
+        """
+        Returns when the next pending entry for a server is due
+
+        Args:
+            host (str) : server to upload to
+            port (int) : port of the server
+        Returns:
+            Union[float, None] : the time.time() it is due, or None if nothing is pending
+        """
+        rows = self.execute("SELECT MIN(next_attempt) FROM uploads WHERE state = ? AND host = ? AND port = ?",
+                            (UploadQueue.PENDING, host, port))
+        return rows[0][0]
+
+    def backoff(self, attempts: int) -> float:
+        """
+        Returns the delay before the next attempt of an entry, doubling
+        on every attempt with jitter so many nodes do not retry in step
+
+        Args:
+            attempts (int) : attempts made so far
+        Returns:
+            float : seconds to wait
+        """
+        delay = min(UploadQueue.BACKOFF_BASE * 2 ** max(attempts - 1, 0), UploadQueue.BACKOFF_MAX)
+        return delay * random.uniform(0.5, 1.0)
+
+    def complete(self, entry_id: int, state: str = DONE) -> None:
+        """
+        Marks an entry as finished
+
+        Args:
+            entry_id (int) : id of the entry
+            state (str)    : 'done' or 'cancelled'
+        """
+        self.execute("UPDATE uploads SET state = ?, last_error = NULL WHERE id = ?", (state, entry_id))
+
+    def fail(self, entry_id: int, error: str, retry: bool = True) -> bool:
+        """
+        Schedules a failed entry to be retried after a backoff, or marks
+        it failed once it has used every attempt or cannot succeed
+
+        Args:
+            entry_id (int) : id of the entry
+            error (str)    : why it failed
+            retry (bool)   : False if retrying cannot help
+        Returns:
+            bool : True if the entry will be retried
+        """
+        with self._lock, self._db:
+            attempts = self._db.execute("SELECT attempts FROM uploads WHERE id = ?", (entry_id,)).fetchone()[0]
+            retry = retry and attempts < self.max_attempts
+            self._db.execute("UPDATE uploads SET state = ?, next_attempt = ?, last_error = ? WHERE id = ?",
+                             (UploadQueue.PENDING if retry else UploadQueue.FAILED,
+                              time.time() + self.backoff(attempts), error, entry_id))
+        return retry
+
+    def requeue(self, entry_ids: Iterable[int]) -> None:
+        """
+        Returns claimed entries to the queue without counting the
+        attempt, used when the connection could not be opened
+
+        Args:
+            entry_ids (Iterable[int]) : ids of the entries
+        """
+        with self._lock, self._db:
+            self._db.executemany("UPDATE uploads SET state = ?, attempts = attempts - 1 WHERE id = ?",
+                                 [(UploadQueue.PENDING, entry_id) for entry_id in entry_ids])
+
+    def cancel(self, host: str, port: int) -> int:
+        """
+        Cancels every pending entry for a server
+
+        Args:
+            host (str) : server to upload to
+            port (int) : port of the server
+        Returns:
+            int : the number of entries cancelled
+        """
+        with self._lock, self._db:
+            return self._db.execute("UPDATE uploads SET state = ? WHERE state = ? AND host = ? AND port = ?",
+                                    (UploadQueue.CANCELLED, UploadQueue.PENDING, host, port)).rowcount
+
+    def remove(self, entry_id: int) -> bool:
+        """
+        Removes an entry that is not running
+
+        Args:
+            entry_id (int) : id of the entry
+        Returns:
+            bool : True if the entry was removed
+        """
+        with self._lock, self._db:
+            return bool(self._db.execute("DELETE FROM uploads WHERE id = ? AND state != ?",
+                                         (entry_id, UploadQueue.RUNNING)).rowcount)
+
+    # --- FILE PROGRESS ---
+
+    def save_progress(self, host: str, port: int, jobs: Iterable[dict]) -> None:
+        """
+        Saves the bytes committed by the server for each file so a
+        later run can resume them. Each is saved with the size and
+        modified time the file had when it was opened, so a file changed
+        while it was sent is not resumed
+
+        Args:
+            host (str)       : server the files are sent to
+            port (int)       : port of the server
+            jobs (Iterable)  : jobs from LobbitClient.new_job or their results
+        """
+        rows = []
+        for job in jobs:
+            # files never opened have no modified time to check against
+            if not job["committed"] or job.get("mtime") is None:
+                continue
+            rows.append((host, port, job["file"], job["size"], job["mtime"], job["committed"]))
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO progress VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def load_progress(self, host: str, port: int) -> dict:
+        """
+        Returns the saved progress of every file sent to a server
+
+        Args:
+            host (str) : server the files are sent to
+            port (int) : port of the server
+        Returns:
+            dict : path to a (size, mtime_ns, committed) tuple
+        """
+        rows = self.execute("SELECT path, size, mtime_ns, committed FROM progress WHERE host = ? AND port = ?",
+                            (host, port))
+        return {row["path"]: (row["size"], row["mtime_ns"], row["committed"]) for row in rows}
+
+    def clear_progress(self, host: str, port: int, paths: Iterable[str]) -> None:
+        """
+        Forgets the progress of files that no longer need resuming
+
+        Args:
+            host (str)            : server the files are sent to
+            port (int)            : port of the server
+            paths (Iterable[str]) : paths of the files
+        """
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM progress WHERE host = ? AND port = ? AND path = ?",
+                                 [(host, port, path) for path in paths])
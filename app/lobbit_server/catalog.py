@@ -0,0 +1,273 @@
+import hashlib
+import itertools
+import os
+import queue
+import sqlite3
+import time
+
+from threading import Lock, Thread
+from typing import Iterable, List, Tuple, Union
+
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    name     TEXT    PRIMARY KEY,
+    path     TEXT    NOT NULL,
+    size     INTEGER NOT NULL,
+    sha256   TEXT,
+    received REAL    NOT NULL,
+    client   TEXT,
+    mtime    INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_received ON files (received);
+"""
+
+GLOB_SPECIAL = "*?["
+
+
+def glob_prefix(pattern: str) -> str:
+    """
+    Returns the literal text a GLOB pattern starts with
+
+    Args:
+        pattern (str) : the pattern
+    Returns:
+        str : characters before the first wildcard
+    """
+    end = min((pattern.index(c) for c in GLOB_SPECIAL if c in pattern), default=len(pattern))
+    return pattern[:end]
+
+
+class Catalog:
+    """
+    Catalog of the files the server holds, kept in a sqlite database and
+    updated as each file is confirmed, so listing or searching millions
+    of uploads is an indexed query instead of a directory scan. The
+    SHA-256 of each file is filled in by a background thread after the
+    file is confirmed, keeping hashing off the receive path
+    """
+
+    # most entries returned by one query
+    MAX_PAGE = 1000
+    # bytes read at a time while hashing
+    READ_SIZE = 1024 * 1024
+    # entries added per transaction by <add_many>
+    BATCH_SIZE = 1000
+    # names looked up per query by <changed>, below sqlite's limit on parameters
+    LOOKUP_SIZE = 500
+
+    def __init__(self, path: str) -> None:
+        """
+        Constructor for the Catalog class
+
+        Args:
+            path (str) : path of the catalog database
+        """
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.created = path == ":memory:" or not os.path.exists(path)
+        self._lock = Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(CATALOG_SCHEMA)
+            if "mtime" not in {row[1] for row in self._db.execute("PRAGMA table_info(files)")}:
+                # catalogs from before sync, the clients' modified times are unknown
+                self._db.execute("ALTER TABLE files ADD COLUMN mtime INTEGER")
+        self._hashes = queue.Queue()
+        self._thread = None
+        self._running = False
+        self._resumed = False
+        self._closed = False
+
+    def add(self, name: str, path: str, size: int, client: Union[str, None] = None,
+            received: float = None, mtime: Union[int, None] = None) -> None:
+        """
+        Adds or replaces the entry for a file and queues it to be hashed
+
+        Args:
+            name (str)       : the upload name
+            path (str)       : absolute path of the file
+            size (int)       : size of the file in bytes
+            client (str)     : address of the client that sent it, if known
+            received (float) : time the file was confirmed, defaults to now
+            mtime (int)      : modified time of the client's copy in nanoseconds, if sent
+        """
+        received = time.time() if received is None else received
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO files (name, path, size, received, client, mtime) "
+                             "VALUES (?, ?, ?, ?, ?, ?)", (name, path, size, received, client, mtime))
+        self._hashes.put((name, path, received))
+        self.start()
+
+    def add_many(self, entries: Iterable[Tuple[str, str, int, float]]) -> int:
+        """
+        Adds entries for files found on disk without replacing any that
+        are already cataloged, queueing each new one to be hashed
+
+        Args:
+            entries (Iterable[Tuple[str, str, int, float]]) : the name, path,
+                                                              size and modified time
+                                                              of each file
+        Returns:
+            int : number of entries added
+        """
+        added = 0
+        entries = iter(entries)
+        while batch := list(itertools.islice(entries, Catalog.BATCH_SIZE)):
+            with self._lock:
+                if self._closed:
+                    break
+                with self._db:
+                    for name, path, size, received in batch:
+                        cursor = self._db.execute("INSERT OR IGNORE INTO files (name, path, size, received) "
+                                                  "VALUES (?, ?, ?, ?)", (name, path, size, received))
+                        if cursor.rowcount:
+                            added += 1
+                            self._hashes.put((name, path, received))
+            self.start()
+        return added
+
+    def remove(self, name: str) -> None:
+        """
+        Removes the entry for a file
+
+        Args:
+            name (str) : the upload name
+        """
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM files WHERE name = ?", (name,))
+
+    def query(self, pattern: str = "*", after: str = "", limit: int = 100) -> List[dict]:
+        """
+        Returns the entries matching a GLOB <pattern> in name order,
+        starting after the name <after> so pages are read with an index
+        seek however deep into the catalog they are
+
+        Args:
+            pattern (str) : GLOB pattern matched against the upload names
+            after (str)   : last name of the previous page, '' for the first page
+            limit (int)   : most entries to return, up to MAX_PAGE
+        Returns:
+            List[dict] : the name, size, sha256, received time and client of each file
+        """
+        limit = max(1, min(limit, Catalog.MAX_PAGE))
+        sql = "SELECT name, size, sha256, received, client FROM files WHERE name > ? AND name GLOB ?"
+        args = [after, pattern or "*"]
+        prefix = glob_prefix(pattern or "*")
+        if prefix:
+            # bound the scan to the names sharing the literal prefix
+            sql += " AND name >= ? AND name < ?"
+            args += [prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)]
+        sql += " ORDER BY name LIMIT ?"
+        with self._lock:
+            rows = self._db.execute(sql, args + [limit]).fetchall()
+        return [{"name": name, "size": size, "sha256": sha256, "received": received, "client": client}
+                for name, size, sha256, received, client in rows]
+
+    def page(self, pattern: str = "*", after: str = "", limit: int = 100) -> dict:
+        """
+        Returns one page of a listing, see <query>
+
+        Args:
+            pattern (str) : GLOB pattern matched against the upload names
+            after (str)   : the 'next' value of the previous page, '' for the first page
+            limit (int)   : most entries on the page
+        Returns:
+            dict : 'files' holding the entries and 'next' holding the value to
+                   pass as <after> for the next page, or None on the last page
+        """
+        files = self.query(pattern, after, limit)
+        full = len(files) == max(1, min(limit, Catalog.MAX_PAGE))
+        return {"files": files, "next": files[-1]["name"] if full else None}
+
+    def changed(self, entries: List[Tuple[str, int, int]]) -> List[bool]:
+        """
+        Compares a batch of a client's files with the catalog. A file is
+        changed unless it is cataloged with the same size and modified
+        time, so files received without a modified time always are
+
+        Args:
+            entries (List[Tuple[str, int, int]]) : the upload name, size and
+                                                   modified time of each file
+        Returns:
+            List[bool] : True for each file that is missing or different
+        """
+        held = {}
+        names = [name for name, _, _ in entries]
+        with self._lock:
+            for i in range(0, len(names), Catalog.LOOKUP_SIZE):
+                batch = names[i:i + Catalog.LOOKUP_SIZE]
+                rows = self._db.execute("SELECT name, size, mtime FROM files WHERE name IN "
+                                        f"({', '.join('?' * len(batch))})", batch)
+                held.update((name, (size, mtime)) for name, size, mtime in rows)
+        return [held.get(name) != (size, mtime) for name, size, mtime in entries]
+
+    def count(self) -> int:
+        """
+        Returns the number of files cataloged
+
+        Returns:
+            int : the number of entries
+        """
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def start(self) -> None:
+        """
+        Starts the hashing thread if it is not running, queueing any
+        entries left unhashed by an earlier run the first time
+        """
+        with self._lock:
+            if self._running or self._closed:
+                return
+            if not self._resumed:
+                self._resumed = True
+                for row in self._db.execute("SELECT name, path, received FROM files WHERE sha256 IS NULL"):
+                    self._hashes.put(row)
+            self._running = True
+            self._thread = Thread(target=self.run, daemon=True)
+            self._thread.start()
+
+    def run(self) -> None:
+        """
+        Hashes queued files until the queue is empty or the catalog is
+        closed. An entry replaced while its file was being hashed keeps
+        the newer, unhashed state
+        """
+        while True:
+            with self._lock:
+                if self._closed or self._hashes.empty():
+                    self._running = False
+                    return
+            name, path, received = self._hashes.get()
+            digest = hashlib.sha256()
+            try:
+                with open(path, "rb") as f:
+                    while data := f.read(Catalog.READ_SIZE):
+                        digest.update(data)
+            except OSError:
+                continue
+            with self._lock:
+                if self._closed:
+                    break
+                with self._db:
+                    self._db.execute("UPDATE files SET sha256 = ? WHERE name = ? AND received = ?",
+                                     (digest.hexdigest(), name, received))
+
+    def join(self) -> None:
+        """
+        Waits until every queued file has been hashed
+        """
+        while self._thread and self._thread.is_alive():
+            self._thread.join(0.1)
+
+    def close(self) -> None:
+        """
+        Closes the database. Hashing stops, files left unhashed are
+        hashed when the catalog is next opened
+        """
+        with self._lock:
+            self._closed = True
+            self._db.close()
@@ -0,0 +1,113 @@
+import hashlib
+import os
+
+from app.lobbit_util.buffer import Buffer
+from app.lobbit_util.paths import make_dirs, sync_dir
+from threading import get_ident
+from typing import BinaryIO
+
+
+class ChunkStore:
+    """
+    Content addressed store of the chunks of deduplicated uploads. Each
+    chunk is kept once at <root>/ab/cd/<digest> however many files it
+    appears in, so a client only sends the chunks the server has never
+    seen and files are rebuilt by copying chunks from the store
+    """
+
+    def __init__(self, root: str) -> None:
+        """
+        Constructor for the ChunkStore class
+
+        Args:
+            root (str) : directory holding the chunks, created on first write
+        """
+        self.root = root
+
+    def path(self, digest: bytes) -> str:
+        """
+        Returns where the chunk with <digest> is stored
+
+        Args:
+            digest (bytes) : SHA-256 digest of the chunk
+        Returns:
+            str : path of the chunk
+        """
+        name = digest.hex()
+        return os.path.join(self.root, name[:2], name[2:4], name)
+
+    def has(self, digest: bytes) -> bool:
+        """
+        Checks whether a chunk is held
+
+        Args:
+            digest (bytes) : SHA-256 digest of the chunk
+        Returns:
+            bool : True if the chunk is in the store
+        """
+        return os.path.isfile(self.path(digest))
+
+    def put(self, digest: bytes, data: bytes) -> None:
+        """
+        Adds a chunk after checking it matches its digest. The chunk is
+        written to a temporary file and renamed into place, so readers
+        never see part of a chunk and two connections storing the same
+        chunk at once do not conflict. The chunk and its name are flushed
+        to disk before returning, as the files rebuilt from it are
+        confirmed as soon as they are written
+
+        Args:
+            digest (bytes) : SHA-256 digest the client gave for the chunk
+            data (bytes)   : the chunk
+        """
+        if hashlib.sha256(data).digest() != digest:
+            raise ValueError(f"Chunk {digest.hex()} does not match its digest")
+        path = self.path(digest)
+        directory = os.path.dirname(path)
+        make_dirs(directory)
+        tmp = f"{path}.{os.getpid()}.{get_ident()}.tmp"
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+            sync_dir(directory)
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+    def copy_to(self, digest: bytes, f: BinaryIO) -> int:
+        """
+        Appends a chunk to the open file <f>. copy_file_range is used
+        where the kernel supports it, which shares the data blocks on
+        filesystems with reflinks instead of copying them
+
+        Args:
+            digest (bytes) : SHA-256 digest of the chunk
+            f (BinaryIO)   : unbuffered file being rebuilt, positioned at the chunk
+        Returns:
+            int : number of bytes copied
+        """
+        with open(self.path(digest), 'rb') as chunk:
+            size = os.fstat(chunk.fileno()).st_size
+            copied = 0
+            if hasattr(os, "copy_file_range"):
+                try:
+                    while copied < size:
+                        n = os.copy_file_range(chunk.fileno(), f.fileno(), size - copied)
+                        if not n:
+                            break
+                        copied += n
+                except OSError:
+                    # not supported between these files, fall back to reading
+                    pass
+            if copied < size:
+                chunk.seek(copied)
+                while data := chunk.read(size - copied):
+                    Buffer.write_all(f.fileno(), data)
+                    copied += len(data)
+        return copied
@@ -0,0 +1,314 @@
+import fnmatch
+import gzip
+import hashlib
+import importlib
+import json
+import multiprocessing
+import os
+import time
+import zipfile
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import BoundedSemaphore, Lock
+from typing import Callable, List, Tuple, Union
+
+# bytes read at a time by the built-in hooks
+READ_SIZE = 1024 * 1024
+
+# hooks that can be named in POST_RECEIVE_HOOKS without a module path
+BUILTIN_HOOKS = {
+    "sha256": "app.lobbit_server.hooks:sha256",
+    "gzip": "app.lobbit_server.hooks:check_gzip",
+    "zip": "app.lobbit_server.hooks:check_zip",
+    "json": "app.lobbit_server.hooks:check_json",
+}
+
+
+def sha256(path: str, name: str, size: int) -> dict:
+    """
+    Hashes a received file
+
+    Args:
+        path (str) : path of the file
+        name (str) : its upload name
+        size (int) : its size in bytes
+    Returns:
+        dict : the hex SHA-256
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while data := f.read(READ_SIZE):
+            digest.update(data)
+    return {"sha256": digest.hexdigest()}
+
+
+def check_gzip(path: str, name: str, size: int) -> dict:
+    """
+    Decompresses a gzip file to check it is complete and uncorrupted
+
+    Args:
+        path (str) : path of the file
+        name (str) : its upload name
+        size (int) : its size in bytes
+    Returns:
+        dict : the uncompressed size
+    """
+    uncompressed = 0
+    with gzip.open(path, "rb") as f:
+        while data := f.read(READ_SIZE):
+            uncompressed += len(data)
+    return {"uncompressed": uncompressed}
+
+
+def check_zip(path: str, name: str, size: int) -> dict:
+    """
+    Checks the CRC of every member of a zip archive
+
+    Args:
+        path (str) : path of the file
+        name (str) : its upload name
+        size (int) : its size in bytes
+    Returns:
+        dict : the number of members
+    """
+    with zipfile.ZipFile(path) as archive:
+        bad = archive.testzip()
+        if bad:
+            raise ValueError(f"Member '{bad}' is corrupt")
+        return {"members": len(archive.infolist())}
+
+
+def check_json(path: str, name: str, size: int) -> dict:
+    """
+    Checks that a file parses as JSON
+
+    Args:
+        path (str) : path of the file
+        name (str) : its upload name
+        size (int) : its size in bytes
+    Returns:
+        dict : the type of the top level value
+    """
+    with open(path, "rb") as f:
+        return {"type": type(json.load(f)).__name__}
+
+
+def resolve(target: str) -> Callable:
+    """
+    Imports the function a hook names, either a built-in hook or
+    'package.module:function'
+
+    Args:
+        target (str) : the hook
+    Returns:
+        Callable : the function, called with the path, upload name and size
+    """
+    module, _, function = BUILTIN_HOOKS.get(target, target).partition(":")
+    hook = getattr(importlib.import_module(module), function or "", None)
+    if not callable(hook):
+        raise ValueError(f"Hook '{target}' is not a function, expected 'package.module:function'")
+    return hook
+
+
+def run_hook(target: str, path: str, name: str, size: int) -> Tuple[float, float, object, Union[str, None]]:
+    """
+    Runs one hook on one file, in a worker process
+
+    Args:
+        target (str) : the hook
+        path (str)   : path of the file
+        name (str)   : its upload name
+        size (int)   : its size in bytes
+    Returns:
+        Tuple[float, float, object, Union[str, None]] : the time it started, seconds
+                                                        taken, its result and any error
+    """
+    started = time.time()
+    clock = time.perf_counter()
+    try:
+        result, error = resolve(target)(path, name, size), None
+    except Exception as e:
+        result, error = None, f"{type(e).__name__}: {e}"
+    return started, time.perf_counter() - clock, result, error
+
+
+class HookRunner:
+    """
+    Runs post-receive hooks on files once they are committed, in a pool
+    of worker processes so CPU heavy work never runs on a receive thread
+    or contends with it for the GIL. At most <backlog> hook runs wait or
+    run at once; past that <submit> blocks, so a server receiving faster
+    than its hooks keep up slows its clients down instead of queueing
+    without bound. Every run is appended to a JSON lines results log and
+    counted in per-hook metrics
+    """
+
+    def __init__(self, hooks: List[dict], log_path: str, workers: int = 2, backlog: int = 64,
+                 echo: Callable = print) -> None:
+        """
+        Constructor for the HookRunner class
+
+        Args:
+            hooks (List[dict]) : each hook's 'hook', a built-in name or
+                                 'package.module:function', and 'match', a
+                                 glob of the upload names it runs on (default '*')
+            log_path (str)     : path of the results log
+            workers (int)      : processes running hooks
+            backlog (int)      : hook runs waiting or running before <submit> blocks
+            echo (Callable)    : called with a message for each run
+        """
+        if not isinstance(hooks, list):
+            raise ValueError("POST_RECEIVE_HOOKS must be a list")
+        self.hooks = []
+        for spec in hooks:
+            spec = {"hook": spec} if isinstance(spec, str) else spec
+            if not isinstance(spec, dict) or not isinstance(spec.get("hook"), str):
+                raise ValueError(f"Invalid hook {spec!r}, expected {{\"hook\": ..., \"match\": ...}}")
+            # fail on start rather than on every file
+            resolve(spec["hook"])
+            self.hooks.append((spec["hook"], spec.get("match", "*")))
+        self.log_path = log_path
+        self.workers = max(1, workers)
+        self.echo = echo
+        self.metrics = {hook: {"runs": 0, "failures": 0, "seconds": 0.0, "max_seconds": 0.0, "queued_seconds": 0.0}
+                        for hook, _ in self.hooks}
+        self._slots = BoundedSemaphore(max(1, backlog))
+        self._lock = Lock()
+        self._pool = None
+        self._log = None
+
+    def pool(self) -> ProcessPoolExecutor:
+        """
+        Returns the worker pool, starting it on first use. Workers are
+        started by a fork server, forking the threaded server directly
+        could copy a lock held by another thread into the child
+
+        Returns:
+            ProcessPoolExecutor : the pool
+        """
+        with self._lock:
+            if self._pool is None:
+                method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context(method))
+            return self._pool
+
+    def matching(self, name: str) -> List[str]:
+        """
+        Returns the hooks that run on an upload name
+
+        Args:
+            name (str) : the upload name
+        Returns:
+            List[str] : the hooks
+        """
+        return [hook for hook, match in self.hooks if fnmatch.fnmatchcase(name, match)]
+
+    def submit(self, name: str, path: str, size: int) -> int:
+        """
+        Queues the hooks matching a committed file, waiting while the
+        backlog is full. A hook that can't be queued is skipped
+
+        Args:
+            name (str) : the upload name
+            path (str) : path of the file
+            size (int) : its size in bytes
+        Returns:
+            int : the number of hooks matching the file
+        """
+        hooks = self.matching(name)
+        for hook in hooks:
+            if not self._slots.acquire(blocking=False):
+                self.echo(f"[-] Post-receive backlog full, waiting to queue '{hook}' for '{name}'")
+                self._slots.acquire()
+            submitted = time.time()
+            try:
+                try:
+                    future = self.pool().submit(run_hook, hook, path, name, size)
+                except BrokenProcessPool:
+                    # a worker died, e.g. killed for memory, so the pool is replaced
+                    with self._lock:
+                        self._pool = None
+                    future = self.pool().submit(run_hook, hook, path, name, size)
+            except Exception as e:
+                # the run was never queued, so <done> won't free its slot
+                self._slots.release()
+                self.echo(f"[-] Could not queue '{hook}' for '{name}': {e}")
+                continue
+            future.add_done_callback(lambda f, hook=hook: self.done(f, hook, name, path, size, submitted))
+        return len(hooks)
+
+    def done(self, future: Future, hook: str, name: str, path: str, size: int, submitted: float) -> None:
+        """
+        Records a finished hook run in the metrics and the results log
+
+        Args:
+            future (Future)   : the finished run
+            hook (str)        : the hook
+            name (str)        : the upload name
+            path (str)        : path of the file
+            size (int)        : its size in bytes
+            submitted (float) : time.time() the run was queued
+        """
+        self._slots.release()
+        try:
+            started, seconds, result, error = future.result()
+        except Exception as e:
+            # the worker died or the result could not be sent back
+            started, seconds, result, error = time.time(), 0.0, None, f"{type(e).__name__}: {e}"
+        entry = {"time": round(started, 6), "hook": hook, "name": name, "path": path, "size": size,
+                 "queued_seconds": round(max(0.0, started - submitted), 6), "seconds": round(seconds, 6),
+                 "status": "failed" if error else "ok", "result": result, "error": error}
+        try:
+            line = json.dumps(entry)
+        except (TypeError, ValueError):
+            entry["result"] = repr(result)
+            line = json.dumps(entry)
+        with self._lock:
+            stats = self.metrics[hook]
+            stats["runs"] += 1
+            stats["failures"] += bool(error)
+            stats["seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+            stats["queued_seconds"] += entry["queued_seconds"]
+            try:
+                if self._log is None:
+                    os.makedirs(os.path.dirname(os.path.abspath(self.log_path)), exist_ok=True)
+                    self._log = open(self.log_path, "a", buffering=1)
+                self._log.write(line + "\n")
+            except OSError as e:
+                self.echo(f"[-] Could not write the hook results log: {e}")
+        if error:
+            self.echo(f"[-] Hook '{hook}' failed on '{name}' after {seconds:.3f}s: {error}")
+        else:
+            self.echo(f"[+] Hook '{hook}' finished '{name}' in {seconds:.3f}s")
+
+    def summary(self) -> dict:
+        """
+        Returns the metrics of each hook
+
+        Returns:
+            dict : hook to its runs, failures, total and longest seconds,
+                   mean seconds per run and mean seconds spent queued
+        """
+        with self._lock:
+            return {hook: dict(stats, mean_seconds=round(stats["seconds"] / stats["runs"], 6) if stats["runs"] else 0.0,
+                               mean_queued_seconds=round(stats["queued_seconds"] / stats["runs"], 6)
+                               if stats["runs"] else 0.0)
+                    for hook, stats in self.metrics.items()}
+
+    def close(self, wait: bool = True) -> None:
+        """
+        Stops the pool, finishing the runs already queued if <wait>
+
+        Args:
+            wait (bool) : wait for queued runs to finish
+        """
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool:
+            pool.shutdown(wait=wait)
+        with self._lock:
+            if self._log:
+                self._log.close()
+                self._log = None
@@ -0,0 +1,184 @@
+import socket
+import time
+
+from app.lobbit_util.buffer import Buffer
+from threading import Event, Lock, Thread
+from typing import Tuple, Union
+
+
+class WatchedConnection:
+    """
+    Progress of a single client connection as seen by the reaper
+    """
+
+    def __init__(self, sock: socket.socket, buffer: Buffer, address: Tuple) -> None:
+        """
+        Constructor for the WatchedConnection class
+
+        Args:
+            sock (socket.socket) : the client connection
+            buffer (Buffer)      : buffer counting the bytes read from it
+            address (Tuple)      : IP and port of the client
+        """
+        self.sock = sock
+        self.buffer = buffer
+        self.address = address
+        self.receiving = False
+        # set while the server works on a file without reading, neither limit applies
+        self.busy = False
+        self.reaped = None
+        now = time.monotonic()
+        self.last_bytes = 0
+        self.last_active = now
+        self.window_bytes = 0
+        self.window_start = now
+
+    def set_receiving(self, receiving: bool) -> None:
+        """
+        Marks whether the connection is inside a file, where the
+        throughput floor applies, or waiting for the next file, where
+        the idle timeout applies
+
+        Args:
+            receiving (bool) : True while file data is being received
+        """
+        self.receiving = receiving
+        self.busy = False
+        self.window_bytes = self.buffer.received
+        self.window_start = time.monotonic()
+
+
+class ConnectionReaper:
+    """
+    Closes client connections that stall. A single thread checks the
+    byte counters of every connection once per <interval>; connections
+    idle between files for longer than <idle_timeout>, or receiving a
+    file slower than <min_rate> bytes per second over <window> seconds,
+    are shut down. The blocked read on the connection thread then
+    returns, so a slow peer never holds a thread and its capacity for
+    longer than the limits allow. The data path only counts bytes
+    """
+
+    def __init__(self, idle_timeout: float = 300.0, min_rate: float = 1024.0, window: float = 30.0,
+                 interval: float = 1.0) -> None:
+        """
+        Constructor for the ConnectionReaper class
+
+        Args:
+            idle_timeout (float) : seconds a connection may wait between files,
+                                   0 to disable
+            min_rate (float)     : minimum bytes per second while receiving a file,
+                                   0 to disable
+            window (float)       : seconds the rate is measured over
+            interval (float)     : seconds between checks
+        """
+        self.idle_timeout = idle_timeout
+        self.min_rate = min_rate
+        self.window = window
+        self.interval = interval
+        self.connections = set()
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread = None
+
+    def watch(self, sock: socket.socket, buffer: Buffer, address: Tuple) -> WatchedConnection:
+        """
+        Starts watching a connection
+
+        Args:
+            sock (socket.socket) : the client connection
+            buffer (Buffer)      : buffer the connection is read through
+            address (Tuple)      : IP and port of the client
+        Returns:
+            WatchedConnection : the entry to update and pass to <forget>
+        """
+        conn = WatchedConnection(sock, buffer, address)
+        with self._lock:
+            self.connections.add(conn)
+        return conn
+
+    def forget(self, conn: WatchedConnection) -> None:
+        """
+        Stops watching a connection
+
+        Args:
+            conn (WatchedConnection) : the entry returned by <watch>
+        """
+        with self._lock:
+            self.connections.discard(conn)
+
+    def check(self, conn: WatchedConnection, now: float) -> Union[str, None]:
+        """
+        Checks a single connection against the limits
+
+        Args:
+            conn (WatchedConnection) : the connection to check
+            now (float)              : the current time.monotonic()
+        Returns:
+            Union[str, None] : why the connection should be reaped, or None
+        """
+        received = conn.buffer.received
+        if received != conn.last_bytes or conn.busy:
+            conn.last_bytes, conn.last_active = received, now
+        if conn.busy:
+            conn.window_bytes, conn.window_start = received, now
+            return None
+        if not conn.receiving:
+            if self.idle_timeout and now - conn.last_active > self.idle_timeout:
+                return f"idle for {now - conn.last_active:.0f}s"
+            return None
+        elapsed = now - conn.window_start
+        if elapsed < self.window:
+            return None
+        rate = (received - conn.window_bytes) / elapsed
+        if self.min_rate and rate < self.min_rate:
+            return f"receiving at {rate:.0f} B/s, below {self.min_rate:.0f} B/s"
+        conn.window_bytes, conn.window_start = received, now
+        return None
+
+    def reap(self, conn: WatchedConnection, reason: str) -> None:
+        """
+        Shuts a connection down so the thread reading from it wakes up
+
+        Args:
+            conn (WatchedConnection) : the connection to reap
+            reason (str)             : why it is being reaped
+        """
+        conn.reaped = reason
+        self.forget(conn)
+        try:
+            if isinstance(conn.sock, socket.socket):
+                # bypass the SSL layer, the connection is abandoned rather than closed cleanly
+                socket.socket.shutdown(conn.sock, socket.SHUT_RDWR)
+            else:
+                # a stream of a multiplexed connection, the other streams carry on
+                conn.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def run(self) -> None:
+        """
+        Checks every connection once per <interval> until stopped
+        """
+        while not self._stop.wait(self.interval):
+            now = time.monotonic()
+            with self._lock:
+                connections = list(self.connections)
+            for conn in connections:
+                reason = self.check(conn, now)
+                if reason:
+                    self.reap(conn, reason)
+
+    def start(self) -> None:
+        """
+        Starts the reaper thread
+        """
+        if not self._thread:
+            self._thread = Thread(target=self.run, daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stops the reaper thread
+        """
+        self._stop.set()
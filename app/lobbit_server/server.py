@@ -1,20 +1,35 @@
 #!/bin/bash python
 
+import errno
 import json
+import mmap
 import os
 import socket
 import ssl
+import stat
+import struct
 import sys
 
 from _thread import start_new_thread
-from threading import Lock
-from typing import Tuple
+from threading import Lock, Thread
+from typing import BinaryIO, Callable, List, Tuple, Union
 
 lobbit_app = os.path.join(os.path.abspath(os.path.dirname(__file__)), "../../")
 sys.path.append(lobbit_app)
 
 if lobbit_app in sys.path:
+    from app.lobbit_util import cdc, manifest, protocol, sparse
     from app.lobbit_util.buffer import Buffer
+    from app.lobbit_util.config import ConfigError, LobbitConfig, SERVER_KEYS, cert_exists, get_config
+    from app.lobbit_util.ktls import can_splice
+    from app.lobbit_util.mux import MuxSession, Stream
+    from app.lobbit_util.paths import make_dirs, sync_dir
+    from app.lobbit_util.tuning import Tuner, read_limits, set_nodelay
+    from app.lobbit_server.catalog import Catalog
+    from app.lobbit_server.hooks import HookRunner
+    from app.lobbit_server.reaper import ConnectionReaper, WatchedConnection
+    from app.lobbit_server.space import Reservation, SpaceAdmission
+    from app.lobbit_server.storage import Storage
 
 
 class LobbitServer:
@@ -23,46 +38,164 @@ class LobbitServer:
     connections from the client application
     """
 
-    def __init__(self, ip: str, port: int, upload_path: str) -> None:
+    RECEIVE_MODES = ("stream", "mmap")
+    # errors writing a file that are reported to the client instead of
+    # being treated as a failed connection
+    DISK_ERRORS = (errno.ENOSPC, errno.EDQUOT, errno.EIO, errno.EROFS, errno.EFBIG)
+    PARTIAL_POLICIES = ("keep", "delete")
+    # connection limits and their defaults, all can be set in config.json
+    LIMITS = {
+        "HANDSHAKE_TIMEOUT": 10.0,
+        "IDLE_TIMEOUT": 300.0,
+        "MIN_THROUGHPUT": 1024.0,
+        "THROUGHPUT_WINDOW": 30.0,
+        "MAX_CONNECTIONS": 128,
+        "PARTIAL_FILES": "keep",
+        "MIN_FREE_SPACE": 0,
+        "SPACE_WAIT": 0.0,
+    }
+
+    def __init__(self, ip: str, port: int, upload_path: Union[str, List[str]], receive_mode: str = "stream",
+                 config: LobbitConfig = None, storage_settings: dict = None, limits: dict = None,
+                 unix_path: str = None) -> None:
         """
         Constructor for the LobbitServer class
 
         Args:
-            ip (str)          : local IPv4 address
-            port (int)        : local port for clients to connect to
-            upload_path (str) : upload destination
+            ip (str)              : local IPv4 address
+            port (int)            : local port for clients to connect to
+            upload_path (Union[str, List[str]]) : upload destination, or a list of
+                                                  destinations to shard files across
+            receive_mode (str)    : 'stream' to write received chunks to the file
+                                    or 'mmap' to receive straight into a memory
+                                    mapping of the preallocated file
+            config (LobbitConfig) : config holding the SSL context, defaults
+                                    to the shared config
+            storage_settings (dict) : STORAGE_* settings, see Storage.from_settings
+            limits (dict)           : timeouts and limits, see <apply_limits>
+            unix_path (str)         : path of a Unix domain socket to also listen
+                                      on for clients on the same host
         """
+        if receive_mode not in LobbitServer.RECEIVE_MODES:
+            raise ValueError(f"receive_mode must be one of {', '.join(LobbitServer.RECEIVE_MODES)}")
         self.host = ip
         self.port = port
+        self.storage_settings = storage_settings or {}
+        self.thread_lock = Lock()
+        self._storage = None
+        self._catalog = None
         self.upload_path = upload_path
+        self.receive_mode = receive_mode
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.thread_lock = Lock()
+        self.unix_path = unix_path
+        self.unix_sock = None
+        self.active = 0
+        self.reaper = ConnectionReaper()
+        self.space = SpaceAdmission()
+        self._hooks = None
+        self.hook_settings = {}
+        self.apply_limits(limits or {})
+        self.apply_hooks(limits or {})
+        self.config = config or get_config()
         self.context = self.get_ssl_context()
+        self.ktls = self.config.ktls
 
-    @staticmethod
-    def get_ssl_context() -> ssl.SSLContext:
+    @property
+    def upload_path(self) -> Union[str, List[str]]:
+        """
+        The upload destination or list of destinations
+        """
+        return self._upload_path
+
+    @upload_path.setter
+    def upload_path(self, upload_path: Union[str, List[str]]) -> None:
+        """
+        Sets the upload destination, the storage and catalog of the old
+        one are closed and rebuilt for new files
+
+        Args:
+            upload_path (Union[str, List[str]]) : the new destination
+        """
+        with self.thread_lock:
+            self._upload_path = upload_path
+            for old in (self._storage, self._catalog):
+                if old is not None:
+                    old.close()
+            self._storage = None
+            self._catalog = None
+
+    @property
+    def storage(self) -> Storage:
+        """
+        The Storage mapping upload names to paths, built on first use
         """
-        Creates a default SSLContext object for socket encryption/decryption
-        and loads the SSL certificate used for client authentication to the
-        server
+        with self.thread_lock:
+            return self.get_storage()
+
+    def get_storage(self) -> Storage:
+        """
+        Returns the Storage, building it if needed. Must be called with
+        thread_lock held
 
         Returns:
-            SSLContext: the default context to wrap the socket
+            Storage : the storage of the upload destination
+        """
+        if self._storage is None:
+            self._storage = Storage.from_settings(self._upload_path, self.storage_settings)
+        return self._storage
+
+    @property
+    def catalog(self) -> Catalog:
+        """
+        The Catalog of received files, built on first use in .lobbit in
+        the first upload root or at STORAGE_CATALOG. A new catalog is
+        filled in the background with the files already stored
+        """
+        with self.thread_lock:
+            if self._catalog is None:
+                storage = self.get_storage()
+                path = self.storage_settings.get("STORAGE_CATALOG") or \
+                    os.path.join(storage.meta_dir, "catalog.db")
+                self._catalog = Catalog(path)
+                if self._catalog.created:
+                    Thread(target=self._catalog.add_many, args=(storage.files(),), daemon=True).start()
+            return self._catalog
+
+    @property
+    def hooks(self) -> Union[HookRunner, None]:
+        """
+        The HookRunner of the POST_RECEIVE_HOOKS, started on first use
+        with its results log in .lobbit in the first upload root or at
+        HOOK_LOG. None if no hooks are configured or they are invalid
         """
-        context = ssl.SSLContext(protocol=ssl.PROTOCOL_TLS_SERVER)
+        with self.thread_lock:
+            if self._hooks is None and self.hook_settings.get("POST_RECEIVE_HOOKS"):
+                settings = self.hook_settings
+                log_path = settings.get("HOOK_LOG") or os.path.join(self.get_storage().meta_dir, "hooks.log")
+                try:
+                    self._hooks = HookRunner(settings["POST_RECEIVE_HOOKS"], log_path,
+                                             workers=settings.get("HOOK_WORKERS", 2),
+                                             backlog=settings.get("HOOK_BACKLOG", 64))
+                except (ImportError, ValueError) as e:
+                    print(f"[-] Post-receive hooks disabled: {e}")
+                    self.hook_settings = {}
+            return self._hooks
 
-        current_dir = os.path.abspath(os.path.dirname(__file__))
-        with open(f"{current_dir}/../../config.json", encoding="utf-8") as file:
-            config = json.load(file)
+    def get_ssl_context(self) -> ssl.SSLContext:
+        """
+        Returns the SSLContext used for socket encryption/decryption, loaded
+        with the SSL certificate used for client authentication to the
+        server. The context is built once by the shared config and replaced
+        there when the certificates are reloaded
 
-        public_path = config['PUBLIC_CERT_PATH']
-        private_path = config['PRIVATE_CERT_PATH']
-        exists, msg = LobbitServer.cert_exists(public_path)
-        if exists:
-            context.load_cert_chain(certfile=public_path, keyfile=private_path)
-            return context
-        print(msg)
-        sys.exit(1)
+        Returns:
+            SSLContext: the current context to wrap client sockets
+        """
+        try:
+            return self.config.server_context()
+        except ConfigError as e:
+            print(e)
+            sys.exit(1)
 
     @staticmethod
     def cert_exists(path: str) -> Tuple[bool, str]:
@@ -73,12 +206,122 @@ class LobbitServer:
         Returns:
             bool: True if <cert_name>.pem exists, False is not
         """
-        if not os.path.isfile(path):
-            return False, "[-] File not found, check value of PUBLIC_CERT_PATH"
-        suffix = path.split(".")[-1].lower()
-        if suffix != "pem":
-            return False, f"[-] Expected .pem certificate file type, found .{suffix} file"
-        return True, ""
+        return cert_exists(path)
+
+    def apply_limits(self, settings: dict) -> None:
+        """
+        Applies the connection limits in <settings>, falling back to
+        LIMITS for any that are missing or invalid
+
+        HANDSHAKE_TIMEOUT : seconds allowed for the TLS handshake
+        IDLE_TIMEOUT      : seconds a connection may wait between files
+        MIN_THROUGHPUT    : bytes per second a file must be received at, measured
+                            over THROUGHPUT_WINDOW seconds, slower peers are reaped
+        MAX_CONNECTIONS   : connections served at once, others are refused
+        UNIX_ALLOWED_UIDS : users other than the server's own allowed to connect
+                            over the Unix socket
+        PARTIAL_FILES     : 'keep' files left incomplete by a failed connection,
+                            journaled in the storage index so the client can
+                            resume them, or 'delete' them
+        MIN_FREE_SPACE    : bytes always left free on each upload filesystem
+        SPACE_WAIT        : seconds a file that does not fit waits for space
+                            before it is refused with ERR_SPACE
+
+        The limits of the socket buffer and chunk size tuning are read too,
+        see tuning.read_limits
+
+        Args:
+            settings (dict) : the server settings
+        """
+        limits = {}
+        for key, default in LobbitServer.LIMITS.items():
+            value = settings.get(key, default)
+            if isinstance(default, str):
+                valid = value in LobbitServer.PARTIAL_POLICIES
+            else:
+                valid = isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0
+            if not valid:
+                print(f"[-] Invalid {key} '{value}', using {default}")
+                value = default
+            limits[key] = value
+        self.limits = limits
+        self.reaper.idle_timeout = limits["IDLE_TIMEOUT"]
+        self.reaper.min_rate = limits["MIN_THROUGHPUT"]
+        self.reaper.window = limits["THROUGHPUT_WINDOW"]
+        self.space.min_free = limits["MIN_FREE_SPACE"]
+        self.space.wait = limits["SPACE_WAIT"]
+        uids = settings.get("UNIX_ALLOWED_UIDS", [])
+        if not isinstance(uids, list) or not all(isinstance(uid, int) for uid in uids):
+            print(f"[-] Invalid UNIX_ALLOWED_UIDS '{uids}', only the server's user may connect locally")
+            uids = []
+        # root and the server's own user may always use the Unix socket
+        self.allowed_uids = {0, os.getuid(), *uids}
+        self.tuning = read_limits(settings)
+
+    def apply_hooks(self, settings: dict) -> None:
+        """
+        Applies the post-receive hook settings in <settings>. A changed
+        hook setup starts a new HookRunner for the next file, runs queued
+        on the old one still finish
+
+        POST_RECEIVE_HOOKS : hooks run on each file received, see HookRunner
+        HOOK_WORKERS       : processes running hooks
+        HOOK_BACKLOG       : hook runs queued before receiving waits for them
+        HOOK_LOG           : path of the JSON lines results log
+
+        Args:
+            settings (dict) : the server settings
+        """
+        keys = ("POST_RECEIVE_HOOKS", "HOOK_WORKERS", "HOOK_BACKLOG", "HOOK_LOG")
+        hook_settings = {key: settings[key] for key in keys if key in settings}
+        for key in ("HOOK_WORKERS", "HOOK_BACKLOG"):
+            value = hook_settings.get(key, 1)
+            if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+                print(f"[-] Invalid {key} '{value}', using the default")
+                del hook_settings[key]
+        with self.thread_lock:
+            if hook_settings == self.hook_settings:
+                return
+            self.hook_settings = hook_settings
+            hooks, self._hooks = self._hooks, None
+        if hooks:
+            hooks.close(wait=False)
+
+    def close_hooks(self) -> None:
+        """
+        Waits for queued post-receive hooks to finish and prints their metrics
+        """
+        with self.thread_lock:
+            hooks, self._hooks = self._hooks, None
+        if hooks:
+            print("[+] Waiting for post-receive hooks to finish...")
+            hooks.close()
+            for hook, stats in hooks.summary().items():
+                print(f"[+] Hook '{hook}': {stats['runs']} run(s), {stats['failures']} failed, "
+                      f"{stats['mean_seconds']:.3f}s mean, {stats['max_seconds']:.3f}s max, "
+                      f"{stats['mean_queued_seconds']:.3f}s mean queued")
+
+    def apply_config(self, settings: dict) -> None:
+        """
+        Applies reloaded settings. Only new files use the new upload
+        path and receive mode; the listening address cannot change
+        without a restart
+
+        Args:
+            settings (dict) : the reloaded settings
+        """
+        storage_settings = {key: value for key, value in settings.items() if key.startswith("STORAGE_")}
+        if settings.get("UPLOAD_PATH", self.upload_path) != self.upload_path or \
+                storage_settings != self.storage_settings:
+            self.storage_settings = storage_settings
+            self.upload_path = settings.get("UPLOAD_PATH", self.upload_path)
+        self.apply_limits(settings)
+        self.apply_hooks(settings)
+        if settings.get("RECEIVE_MODE", self.receive_mode) in LobbitServer.RECEIVE_MODES:
+            self.receive_mode = settings.get("RECEIVE_MODE", self.receive_mode)
+        if (settings.get("HOST"), settings.get("PORT"), settings.get("UNIX_SOCKET")) != \
+                (self.host, self.port, self.unix_path):
+            print("[-] HOST, PORT and UNIX_SOCKET changes take effect after a restart")
 
     def lobbit_listen(self) -> None:
         """
@@ -86,58 +329,905 @@ class LobbitServer:
         held in <self.sock> then starts listening on
         that port
         """
+        # reaped connections are closed by the server and leave the port in
+        # TIME_WAIT, which would otherwise stop a restart from binding it
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.sock.bind((self.host, self.port))
         self.sock.listen(10)
         print(f"[+] Server listening on {self.host}:{self.port}...")
+        if self.unix_path:
+            self.listen_unix()
+        self.reaper.start()
+        if self.ktls:
+            print("[+] Kernel TLS offload requested, files are spliced to disk when the kernel supports it")
+
+    def listen_unix(self) -> None:
+        """
+        Listens on the Unix domain socket at <self.unix_path> as well. Local
+        clients connecting there skip TLS and the TCP stack, files are
+        moved with sendfile and splice at memory copy speed. Peers are
+        authenticated by their credentials, the socket is only writable by
+        the server's user unless UNIX_ALLOWED_UIDS lets others in
+        """
+        if os.path.exists(self.unix_path):
+            if not stat.S_ISSOCK(os.stat(self.unix_path).st_mode):
+                raise OSError(errno.EEXIST, f"UNIX_SOCKET '{self.unix_path}' exists and is not a socket")
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.unix_path)
+                raise OSError(errno.EADDRINUSE, f"UNIX_SOCKET '{self.unix_path}' is in use by another server")
+            except (ConnectionRefusedError, FileNotFoundError):
+                # left behind by a server that did not shut down cleanly
+                os.unlink(self.unix_path)
+            finally:
+                probe.close()
+        os.makedirs(os.path.dirname(os.path.abspath(self.unix_path)), exist_ok=True)
+        self.unix_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.unix_sock.bind(self.unix_path)
+        shared = len(self.allowed_uids - {0, os.getuid()}) and hasattr(socket, "SO_PEERCRED")
+        os.chmod(self.unix_path, 0o666 if shared else 0o600)
+        self.unix_sock.listen(10)
+        print(f"[+] Server listening on {self.unix_path}...")
+        Thread(target=self.lobbit_accept_unix, daemon=True).start()
+
+    def close_unix(self) -> None:
+        """
+        Stops listening on the Unix domain socket and removes it
+        """
+        if self.unix_sock:
+            self.unix_sock.close()
+            self.unix_sock = None
+            try:
+                os.unlink(self.unix_path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def peer_credentials(sock: socket.socket) -> Union[Tuple[int, int], None]:
+        """
+        Reads the process and user ids of the peer of a Unix socket
+
+        Args:
+            sock (socket.socket) : the accepted connection
+        Returns:
+            Union[Tuple[int, int], None] : the pid and uid, or None where
+                                           SO_PEERCRED is not supported
+        """
+        if not hasattr(socket, "SO_PEERCRED"):
+            return None
+        creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+        pid, uid, _ = struct.unpack("3i", creds)
+        return pid, uid
+
+    def admit(self, client_sock: socket.socket, connection: Tuple) -> bool:
+        """
+        Counts an accepted connection as active unless MAX_CONNECTIONS are
+        already being served, in which case it is closed
+
+        Args:
+            client_sock (socket.socket) : the accepted connection
+            connection (Tuple)          : the address of the client
+        Returns:
+            bool : True if the connection can be served
+        """
+        with self.thread_lock:
+            full = self.active >= self.limits["MAX_CONNECTIONS"]
+            if not full:
+                self.active += 1
+        if full:
+            print(f"[-] Refused '{connection[0]}:{connection[1]}', {self.active} connections active")
+            client_sock.close()
+            return False
+        print(f"[+] Client '{connection[0]}:{connection[1]}' accepted ({self.active} active)")
+        return True
 
     def lobbit_accept(self) -> None:
         """
-        Accepts incoming connections from the client
+        Accepts incoming connections from the client. The TLS handshake
+        runs on the connection thread with the context current at that
+        moment, so reloaded certificates apply to new connections only
         """
-        self.sock = self.context.wrap_socket(self.sock, server_side=True)
         try:
             while True:
                 client_sock, address = self.sock.accept()
-                self.thread_lock.acquire()
-                print(f"[+] Client '{address[0]}:{address[1]}' accepted")
-                start_new_thread(self.lobbit_receive, (client_sock, address,))
+                if self.admit(client_sock, address):
+                    start_new_thread(self.lobbit_handshake, (client_sock, address,))
         except KeyboardInterrupt:
+            self.close_unix()
+            self.close_hooks()
             print("\r[+] Shutting down server... bye!\n")
             sys.exit(0)
 
+    def lobbit_accept_unix(self) -> None:
+        """
+        Accepts connections on the Unix domain socket until it is closed.
+        They are not wrapped with TLS, peers whose user is not allowed are
+        refused and the rest are named 'unix:<uid>' with their pid
+        """
+        while self.unix_sock:
+            try:
+                client_sock, _ = self.unix_sock.accept()
+            except OSError:
+                return
+            creds = LobbitServer.peer_credentials(client_sock)
+            if creds is None:
+                # the socket is only accessible to the server's user
+                connection = ("unix", 0)
+            else:
+                connection = (f"unix:{creds[1]}", creds[0])
+                if creds[1] not in self.allowed_uids:
+                    print(f"[-] Refused '{connection[0]}:{connection[1]}', user {creds[1]} is not allowed")
+                    client_sock.close()
+                    continue
+            if self.admit(client_sock, connection):
+                start_new_thread(self.lobbit_receive, (client_sock, connection,))
+
+    def lobbit_handshake(self, client_sock: socket.socket, connection: Tuple) -> None:
+        """
+        Wraps an accepted connection with the current SSLContext and
+        hands it to <lobbit_receive>
+
+        Args:
+            client_sock (socket.socket): accepted client socket
+            connection (Tuple) : contains the IP and port of the client
+        """
+        try:
+            context = self.config.server_context()
+            # a peer that never finishes the handshake is dropped after the timeout
+            client_sock.settimeout(self.limits["HANDSHAKE_TIMEOUT"] or None)
+            client_sock = context.wrap_socket(client_sock, server_side=True)
+            # reads block again, the reaper handles stalls without making the
+            # socket non-blocking, which would stop splice and sendfile
+            client_sock.settimeout(None)
+        except (OSError, ConfigError) as e:
+            print(f"[-] Handshake with '{connection[0]}:{connection[1]}' failed: {e}")
+            client_sock.close()
+            with self.thread_lock:
+                self.active -= 1
+            return
+        self.lobbit_receive(client_sock, connection)
+
     def lobbit_receive(self, client_sock: socket.socket, connection: Tuple) -> None:
         """
-        Receives the files that were sent from the server
+        Receives the files that were sent from the server. Each
+        connection is handled on its own thread so several clients,
+        or several connections from one client, are served at once.
+        Every file is answered with a final status and the number of
+        bytes committed to disk
 
         Args:
             client_sock (socket.socket): client socket object
             connection (Tuple) : contains the IP and port of the client
         """
+        set_nodelay(client_sock)
         buffer = Buffer(client_sock)
+        buffer.tuner = Tuner(client_sock, socket.SO_RCVBUF, lambda: buffer.received, self.tuning,
+                             f"{connection[0]}:{connection[1]}", log=print)
+        watched = self.reaper.watch(client_sock, buffer, connection)
+        try:
+            self.serve_files(buffer, watched, connection)
+        except (OSError, ValueError) as e:
+            print(f"[-] Connection '{connection[0]}:{connection[1]}' failed: {e}")
+        finally:
+            self.reaper.forget(watched)
+            if watched.reaped:
+                print(f"[-] Reaped connection '{connection[0]}:{connection[1]}', {watched.reaped}")
+            print(f"[+] Closing connection '{connection[0]}:{connection[1]}'...")
+            client_sock.close()
+            with self.thread_lock:
+                self.active -= 1
+
+    def serve_files(self, buffer: Buffer, watched: WatchedConnection, connection: Tuple) -> None:
+        """
+        Receives files and answers requests on a connection, or on one
+        stream of a multiplexed connection, until the client sends an
+        empty name
+
+        Args:
+            buffer (Buffer)              : buffer wrapping the connection or stream
+            watched (WatchedConnection)  : the reaper's entry for it
+            connection (Tuple)           : contains the IP and port of the client
+        """
         while True:
-            file_name = buffer.get_utf8().split('/')[-1]
+            file_name = buffer.get_utf8()
             if not file_name:
-                self.thread_lock.release()
                 break
+            if file_name == protocol.MUX and isinstance(buffer.sock, socket.socket):
+                self.serve_mux(buffer, watched, connection)
+                break
+            if file_name.startswith(protocol.REQUEST):
+                self.handle_request(buffer, file_name, connection, watched)
+                continue
             print(f"[+] File name: {file_name}")
             file_size = int(buffer.get_utf8())
-            print(f"[+] File size: {file_size}MB")
-            with open(f"{self.upload_path}{file_name}", 'wb') as f:
-                remaining = file_size
-                while remaining:
-                    chunk_size = 4096 if remaining >= 4096 else remaining
-                    chunk = buffer.get_bytes(chunk_size)
-                    if not chunk:
-                        break
-                    f.write(chunk)
-                    remaining -= len(chunk)
-                if remaining:
-                    print(f"[-] File incomplete, missing {remaining} bytes")
+            offset = buffer.get_utf8()
+            mtime, expect = None, False
+            while offset in (protocol.MTIME, protocol.EXPECT):
+                if offset == protocol.MTIME:
+                    mtime = int(buffer.get_utf8())
                 else:
-                    print(f"[+] File '{file_name}' received successfully")
-        print(f"[+] Closing connection '{connection[0]}:{connection[1]}'...")
-        print(f"[+] Server listening on {self.host}:{self.port}...")
-        client_sock.close()
+                    # the client waits for CONTINUE before sending the data
+                    expect = True
+                offset = buffer.get_utf8()
+            watched.set_receiving(True)
+            if offset == protocol.DEDUP:
+                print(f"[+] File size: {file_size} bytes, sent as chunks")
+                status, committed = self.receive_dedup(buffer, file_name, file_size, watched)
+            elif offset == protocol.CHUNKED:
+                print("[+] File size: unknown, sent as a stream")
+                status, committed = self.receive_chunked(buffer, file_name, watched)
+            elif offset == protocol.SPARSE:
+                offset = int(buffer.get_utf8())
+                extents = self.receive_extent_map(buffer, file_size, offset)
+                print(f"[+] File size: {file_size} bytes, starting at byte {offset}, "
+                      f"{sum(n for _, n in extents)} bytes of data in {len(extents)} extent(s)")
+                status, committed = self.receive_file(buffer, file_name, file_size, offset, extents,
+                                                      expect, watched)
+            else:
+                offset = int(offset)
+                print(f"[+] File size: {file_size} bytes, starting at byte {offset}")
+                status, committed = self.receive_file(buffer, file_name, file_size, offset, None, expect, watched)
+            watched.set_receiving(False)
+            path = self.storage.locate(file_name) if status == protocol.OK else None
+            if path:
+                self.catalog.add(file_name, path, committed, connection[0], mtime=mtime)
+            protocol.send_status(buffer, status, committed)
+            if path and self.hooks:
+                # only queued here, a full backlog holds back the client's next file
+                # and waiting for it is not the client idling
+                watched.busy = True
+                try:
+                    self.hooks.submit(file_name, path, committed)
+                finally:
+                    watched.busy = False
+            if status == protocol.ERR_IO:
+                # bytes may have been read but not written, the stream can't be resumed
+                break
+
+    def serve_mux(self, buffer: Buffer, watched: WatchedConnection, connection: Tuple) -> None:
+        """
+        Carries several streams over the connection until the client ends
+        the session. Each stream is served by <serve_files> on its own
+        thread and watched by the reaper on its own, so a slow file on
+        one stream never holds up the others
+
+        Args:
+            buffer (Buffer)              : buffer wrapping the connection
+            watched (WatchedConnection)  : the reaper's entry for the connection
+            connection (Tuple)           : contains the IP and port of the client
+        """
+        protocol.send_status(buffer, protocol.OK, 0)
+        print(f"[+] Connection '{connection[0]}:{connection[1]}' carries multiplexed streams")
+        session = MuxSession(buffer, lambda stream: self.serve_stream(stream, session, watched, connection))
+        session.run()
+        for thread in list(session.threads):
+            thread.join()
+
+    def serve_stream(self, stream: Stream, session: MuxSession, watched: WatchedConnection,
+                     connection: Tuple) -> None:
+        """
+        Serves one stream of a multiplexed connection. The connection is
+        kept out of the idle timeout while any of its streams are open
+
+        Args:
+            stream (Stream)              : the stream opened by the client
+            session (MuxSession)         : the session carrying it
+            watched (WatchedConnection)  : the reaper's entry for the connection
+            connection (Tuple)           : contains the IP and port of the client
+        """
+        watched.busy = True
+        address = (connection[0], f"{connection[1]}#{stream.id}")
+        buffer = Buffer(stream)
+        # the connection is tuned as a whole from the bytes of every stream
+        buffer.tuner = watched.buffer.tuner
+        stream_watched = self.reaper.watch(stream, buffer, address)
+        try:
+            self.serve_files(buffer, stream_watched, address)
+        except (OSError, ValueError) as e:
+            print(f"[-] Stream '{address[0]}:{address[1]}' failed: {e}")
+        finally:
+            self.reaper.forget(stream_watched)
+            if stream_watched.reaped:
+                print(f"[-] Reaped stream '{address[0]}:{address[1]}', {stream_watched.reaped}")
+            stream.close()
+            if not session.streams:
+                # the idle timeout applies to the connection again
+                watched.set_receiving(False)
+
+    @staticmethod
+    def receive_extent_map(buffer: Buffer, file_size: int, offset: int) -> List[Tuple[int, int]]:
+        """
+        Reads the extent map of a file sent as data extents
+
+        Args:
+            buffer (Buffer) : buffer wrapping the client connection
+            file_size (int) : total size of the file in bytes
+            offset (int)    : byte the data sent by the client starts at
+        Returns:
+            List[Tuple[int, int]] : the start and length of each extent
+        """
+        count = int(buffer.get_utf8())
+        if not 0 <= count <= sparse.MAX_EXTENTS:
+            raise ValueError(f"Invalid extent count {count}")
+        data = buffer.read_exact(count * sparse.EXTENT.size)
+        if len(data) < count * sparse.EXTENT.size:
+            raise ConnectionError("Connection closed during the extent map")
+        return sparse.decode_extents(data, max(offset, 0), file_size)
+
+    def handle_request(self, buffer: Buffer, request: str, connection: Tuple,
+                       watched: WatchedConnection = None) -> None:
+        """
+        Answers a request sent in place of a file name
+
+        Args:
+            buffer (Buffer)             : buffer wrapping the client connection
+            request (str)               : the request, see protocol.REQUEST
+            connection (Tuple)          : contains the IP and port of the client
+            watched (WatchedConnection) : the connection's reaper entry
+        """
+        if request == protocol.SYNC:
+            self.compare_manifest(buffer, watched, connection)
+            return
+        if request != protocol.LIST:
+            # the fields that follow are unknown, so the stream can't be resynced
+            raise ValueError(f"Unknown request '{request}'")
+        pattern, after, limit = buffer.get_utf8(), buffer.get_utf8(), int(buffer.get_utf8())
+        print(f"[+] Listing '{pattern}' for '{connection[0]}:{connection[1]}'")
+        buffer.put_utf8(json.dumps(self.catalog.page(pattern, after, limit)))
+
+    def compare_manifest(self, buffer: Buffer, watched: Union[WatchedConnection, None], connection: Tuple) -> None:
+        """
+        Answers a SYNC request. Each frame of the client's manifest is
+        compared with the catalog as it arrives and answered with the
+        files that are missing or changed, so the manifest is never held
+        whole and the client uploads those files while it sends the rest
+
+        Args:
+            buffer (Buffer)             : buffer wrapping the client connection
+            watched (WatchedConnection) : the connection's reaper entry
+            connection (Tuple)          : contains the IP and port of the client
+        """
+        print(f"[+] Comparing a file manifest from '{connection[0]}:{connection[1]}'")
+        if watched:
+            # the client only sends the next frame once it has files to spare, waiting for it is not idling
+            watched.busy = True
+        compared = wanted = 0
+        while (length := int(buffer.get_utf8() or 0)) > 0:
+            if length > manifest.MAX_FRAME:
+                raise ValueError(f"Manifest frame of {length} bytes is larger than {manifest.MAX_FRAME}")
+            frame = buffer.read_exact(length)
+            if len(frame) < length:
+                raise ConnectionError("Connection closed in the middle of a manifest")
+            flags = self.catalog.changed(manifest.decode_frame(frame))
+            count = sum(flags)
+            protocol.send_status(buffer, protocol.NEED, count)
+            if count:
+                buffer.put_bytes(cdc.encode_bitmap(flags))
+            compared += len(flags)
+            wanted += count
+        if watched:
+            watched.set_receiving(False)
+        protocol.send_status(buffer, protocol.OK, compared)
+        print(f"[+] {wanted} of {compared} file(s) in the manifest are new or changed")
+
+    def receive_file(self, buffer: Buffer, file_name: str, file_size: int, offset: int,
+                     extents: List[Tuple[int, int]] = None, expect: bool = False,
+                     watched: WatchedConnection = None) -> Tuple[str, int]:
+        """
+        Writes the bytes from <offset> to <file_size> of <file_name> under
+        the upload directory, sending an ACK after every ACK_INTERVAL bytes
+        committed. A file is only resumed at <offset> if the server already
+        holds that many bytes of it. With <extents> only those ranges are
+        sent and the rest of the file is left as holes. Space for the data
+        is reserved before any of it is written, see <reserve_space>, and
+        a complete file is flushed to disk before OK is returned
+
+        Args:
+            buffer (Buffer)                 : buffer wrapping the client connection
+            file_name (str)                 : relative name sent by the client
+            file_size (int)                 : total size of the file in bytes
+            offset (int)                    : byte the data sent by the client starts at
+            extents (List[Tuple[int, int]]) : data extents after <offset>, see <receive_extent_map>
+            expect (bool)                   : the client waits for CONTINUE before sending the data
+            watched (WatchedConnection)     : the connection's reaper entry
+        Returns:
+            Tuple[str, int] : the final status and bytes committed to disk
+        """
+        # bytes of data the client sends for the file
+        data_size = file_size - offset if extents is None else sum(n for _, n in extents)
+
+        def refuse(status: str, committed: int) -> Tuple[str, int]:
+            if not expect:
+                # the data is already on its way, it is read so the stream stays in step
+                buffer.discard(data_size)
+            return status, committed
+
+        storage = self.storage
+        path = storage.place(file_name, file_size)
+        if not path:
+            print(f"[-] Rejected unsafe file name '{file_name}'")
+            return refuse(protocol.ERR_NAME, 0)
+        held = os.path.getsize(path) if offset and os.path.isfile(path) else 0
+        if not 0 <= offset <= file_size or held < offset:
+            print(f"[-] Cannot resume '{file_name}' at byte {offset}, {held} bytes held")
+            return refuse(protocol.ERR_OFFSET, held)
+        needed = max(data_size - LobbitServer.reclaimed(path, offset), 0)
+        reservation = self.reserve_space(file_name, path, needed, watched)
+        if not reservation:
+            return refuse(protocol.ERR_SPACE, offset)
+        try:
+            acked = [offset]
+            done = [offset]
+
+            def progress(committed: int) -> None:
+                done[0] = committed
+                if extents is None:
+                    # holes take no space, so only a plain file is counted off as it arrives
+                    reservation.written = committed - offset
+                if buffer.tuner:
+                    buffer.tuner.update()
+                if committed - acked[0] >= protocol.ACK_INTERVAL:
+                    protocol.send_status(buffer, protocol.ACK, committed)
+                    acked[0] = committed
+
+            try:
+                make_dirs(os.path.dirname(path))
+                created = not os.path.exists(path)
+                f = open(path, 'r+b' if offset else 'w+b', buffering=0)
+            except OSError as e:
+                # nothing has been read yet so the connection stays usable
+                print(f"[-] Could not open '{file_name}': {e}")
+                return refuse(protocol.ERR_OPEN, 0)
+            if expect:
+                protocol.send_status(buffer, protocol.CONTINUE, offset)
+            # recorded before any data arrives so a resume finds the file on the same root
+            storage.record(file_name, path, offset, complete=False)
+            try:
+                with f:
+                    f.truncate(offset)
+                    if extents is None:
+                        f.seek(offset)
+                        committed, method = self.receive_into(buffer, f, file_size, offset, progress)
+                    else:
+                        committed, method = self.receive_extents(buffer, f, file_size, extents, progress)
+                    if committed == file_size:
+                        LobbitServer.make_durable(f, path, created)
+            except OSError as e:
+                self.abandon_file(storage, file_name, path, done[0])
+                if e.errno not in LobbitServer.DISK_ERRORS:
+                    raise
+                print(f"[-] Could not write '{file_name}': {e}")
+                return protocol.ERR_IO, acked[0]
+            if committed < file_size:
+                self.abandon_file(storage, file_name, path, committed)
+                raise ConnectionError(f"File '{file_name}' incomplete, missing {file_size - committed} bytes")
+        finally:
+            self.space.release(reservation)
+        storage.record(file_name, path, committed)
+        print(f"[+] File '{file_name}' received successfully ({method})")
+        return protocol.OK, committed
+
+    def reserve_space(self, file_name: str, path: str, size: int,
+                      watched: WatchedConnection = None) -> Union[Reservation, None]:
+        """
+        Reserves the disk space a file needs before any of its data is
+        written, waiting up to SPACE_WAIT seconds for room. A connection
+        waiting for space is not reaped as a slow peer
+
+        Args:
+            file_name (str)             : relative name sent by the client
+            path (str)                  : path the file is written to
+            size (int)                  : bytes the file will add to the disk
+            watched (WatchedConnection) : the connection's reaper entry
+        Returns:
+            Union[Reservation, None] : the reservation, None if the file does not fit
+        """
+        if watched:
+            watched.busy = True
+        try:
+            reservation = self.space.reserve(path, size)
+        finally:
+            if watched:
+                watched.busy = False
+        if not reservation:
+            print(f"[-] Not enough space for '{file_name}' ({size} bytes), {self.space.describe(path)}")
+        return reservation
+
+    @staticmethod
+    def reclaimed(path: str, offset: int) -> int:
+        """
+        Returns the bytes of disk freed when a file already held at
+        <path> is overwritten from the start
+
+        Args:
+            path (str)   : path of the file
+            offset (int) : byte the upload starts at, 0 overwrites the file
+        Returns:
+            int : bytes the old copy takes on disk, 0 if it is kept or missing
+        """
+        if offset:
+            return 0
+        try:
+            return os.stat(path).st_blocks * 512
+        except (OSError, AttributeError):
+            return 0
+
+    def receive_chunked(self, buffer: Buffer, file_name: str, watched: WatchedConnection) -> Tuple[str, int]:
+        """
+        Writes data of unknown length, sent as chunks until a chunk of
+        length 0, to <file_name> under the upload directory, sending an
+        ACK after every ACK_INTERVAL bytes committed. Data arrives as
+        fast as the client's source produces it, so only the idle
+        timeout applies. A stream the client aborts is deleted, as is
+        one that outgrows the free space, which is reserved chunk by
+        chunk since the size is not known up front
+
+        Args:
+            buffer (Buffer)             : buffer wrapping the client connection
+            file_name (str)             : relative name sent by the client
+            watched (WatchedConnection) : the reaper's entry for the connection
+        Returns:
+            Tuple[str, int] : the final status and bytes committed to disk
+        """
+        watched.set_receiving(False)
+        storage = self.storage
+        path = storage.place(file_name)
+        f = None
+        if not path:
+            print(f"[-] Rejected unsafe file name '{file_name}'")
+            status = protocol.ERR_NAME
+        else:
+            try:
+                make_dirs(os.path.dirname(path))
+                created = not os.path.exists(path)
+                f = open(path, 'wb', buffering=0)
+                status = protocol.OK
+            except OSError as e:
+                print(f"[-] Could not open '{file_name}': {e}")
+                status = protocol.ERR_OPEN
+        if not f:
+            # the stream is read to its end so the connection stays usable
+            while (length := LobbitServer.read_chunk_length(buffer)) > 0:
+                buffer.discard(length)
+            return status, 0
+        storage.record(file_name, path, 0, complete=False)
+        committed = acked = 0
+        reservation = self.space.reserve(path, 0, wait=0)
+        try:
+            with f:
+                while (length := LobbitServer.read_chunk_length(buffer)) > 0:
+                    if not self.space.extend(reservation, length):
+                        status = protocol.ERR_SPACE
+                        break
+                    end = committed + length
+                    while committed < end:
+                        chunk_size = buffer.tuner.chunk_size if buffer.tuner else Buffer.READ_SIZE
+                        chunk = buffer.get_bytes(min(chunk_size, end - committed))
+                        if not chunk:
+                            raise ConnectionError(f"Stream '{file_name}' ended after {committed} bytes")
+                        f.write(chunk)
+                        committed += len(chunk)
+                        reservation.written = committed
+                        if buffer.tuner:
+                            buffer.tuner.update()
+                    if committed - acked >= protocol.ACK_INTERVAL:
+                        protocol.send_status(buffer, protocol.ACK, committed)
+                        acked = committed
+                if length == 0:
+                    LobbitServer.make_durable(f, path, created)
+        except OSError as e:
+            self.abandon_file(storage, file_name, path, committed)
+            if e.errno not in LobbitServer.DISK_ERRORS:
+                raise
+            print(f"[-] Could not write '{file_name}': {e}")
+            return protocol.ERR_IO, acked
+        finally:
+            self.space.release(reservation)
+        if status == protocol.ERR_SPACE:
+            print(f"[-] Not enough space for '{file_name}' after {committed} bytes, "
+                  f"{self.space.describe(path)}, deleting it")
+            # the rest of the stream is read so the connection stays usable
+            buffer.discard(length)
+            while (length := LobbitServer.read_chunk_length(buffer)) > 0:
+                buffer.discard(length)
+        elif length < 0:
+            print(f"[-] The client's source for '{file_name}' failed, deleting {committed} bytes received")
+            status = protocol.ERR_SOURCE
+        if status != protocol.OK:
+            self.catalog.remove(file_name)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            storage.forget(file_name)
+            return status, 0
+        storage.record(file_name, path, committed)
+        print(f"[+] File '{file_name}' received successfully ({committed} bytes, chunked)")
+        return protocol.OK, committed
+
+    @staticmethod
+    def read_chunk_length(buffer: Buffer) -> int:
+        """
+        Reads the length field of the next chunk of a stream
+
+        Args:
+            buffer (Buffer) : buffer wrapping the client connection
+        Returns:
+            int : the chunk length, 0 at the end of the stream or -1 if it was aborted
+        """
+        field = buffer.get_utf8()
+        if not field:
+            raise ConnectionError("Connection closed in the middle of a stream")
+        if field == protocol.ABORT:
+            return -1
+        length = int(field)
+        if not 0 <= length <= protocol.MAX_CHUNK:
+            raise ValueError(f"Chunk of {length} bytes is larger than {protocol.MAX_CHUNK}")
+        return length
+
+    def receive_dedup(self, buffer: Buffer, file_name: str, file_size: int,
+                      watched: WatchedConnection) -> Tuple[str, int]:
+        """
+        Receives a file sent as content defined chunks. The client's
+        manifest is checked against the chunk store, only the chunks the
+        store does not hold are requested, and once they have arrived the
+        file is rebuilt from the store. A file whose missing chunks and
+        rebuilt copy don't fit on disk is refused before any is sent
+
+        Args:
+            buffer (Buffer)             : buffer wrapping the client connection
+            file_name (str)             : relative name sent by the client
+            file_size (int)             : total size of the file in bytes
+            watched (WatchedConnection) : the connection's reaper entry
+        Returns:
+            Tuple[str, int] : the final status and bytes committed to disk
+        """
+        count = int(buffer.get_utf8())
+        if not 0 <= count <= file_size // cdc.MIN_SIZE + 1:
+            raise ValueError(f"Invalid chunk count {count} for {file_size} bytes")
+        entries = cdc.decode_manifest(buffer.read_exact(count * cdc.ENTRY.size))
+        if len(entries) != count or sum(length for _, length in entries) != file_size or \
+                not all(0 < length <= cdc.MAX_SIZE for _, length in entries):
+            raise ValueError(f"Invalid chunk manifest for '{file_name}'")
+        storage = self.storage
+        path = storage.place(file_name, file_size)
+        if not path:
+            # refused before any chunk is sent, the stream is still in step
+            print(f"[-] Rejected unsafe file name '{file_name}'")
+            return protocol.ERR_NAME, 0
+        chunks = storage.chunks
+        wanted = set()
+        flags = []
+        for digest, _ in entries:
+            # a chunk repeated within the file is only sent once
+            flag = digest not in wanted and not chunks.has(digest)
+            if flag:
+                wanted.add(digest)
+            flags.append(flag)
+        sizes = dict(entries)
+        # the chunks go to the store and the file is rebuilt from them, both need room
+        needed = sum(sizes[digest] for digest in wanted) + max(file_size - LobbitServer.reclaimed(path, 0), 0)
+        reservation = self.reserve_space(file_name, path, needed, watched)
+        if not reservation:
+            # refused before any chunk is sent, the stream is still in step
+            return protocol.ERR_SPACE, 0
+        try:
+            protocol.send_status(buffer, protocol.NEED, len(wanted))
+            buffer.put_bytes(cdc.encode_bitmap(flags))
+            received = 0
+            corrupt = None
+            for (digest, length), flag in zip(entries, flags):
+                if not flag:
+                    continue
+                data = buffer.read_exact(length)
+                if len(data) < length:
+                    raise ConnectionError(f"File '{file_name}' incomplete, chunk {digest.hex()} cut short")
+                received += length
+                try:
+                    chunks.put(digest, data)
+                except ValueError as e:
+                    # keep reading so the stream stays in step, the client resends
+                    corrupt = corrupt or str(e)
+                except OSError as e:
+                    if e.errno not in LobbitServer.DISK_ERRORS:
+                        raise
+                    print(f"[-] Could not store chunks of '{file_name}': {e}")
+                    return protocol.ERR_IO, 0
+            if corrupt:
+                print(f"[-] '{file_name}' not stored: {corrupt}")
+                return protocol.ERR_OFFSET, 0
+            # every byte has been read, the file is rebuilt without touching the connection
+            watched.busy = True
+            try:
+                make_dirs(os.path.dirname(path))
+                created = not os.path.exists(path)
+                f = open(path, 'wb', buffering=0)
+            except OSError as e:
+                print(f"[-] Could not open '{file_name}': {e}")
+                return protocol.ERR_OPEN, 0
+            storage.record(file_name, path, 0, complete=False)
+            committed = 0
+            try:
+                with f:
+                    for digest, length in entries:
+                        if chunks.copy_to(digest, f) != length:
+                            raise FileNotFoundError(errno.ENOENT, f"Chunk {digest.hex()} is damaged")
+                        committed += length
+                    LobbitServer.make_durable(f, path, created)
+            except FileNotFoundError as e:
+                # the chunk was removed from the store, the retry sends it again
+                self.abandon_file(storage, file_name, path, committed)
+                print(f"[-] Could not rebuild '{file_name}': {e}")
+                return protocol.ERR_OFFSET, 0
+            except OSError as e:
+                self.abandon_file(storage, file_name, path, committed)
+                if e.errno not in LobbitServer.DISK_ERRORS:
+                    raise
+                print(f"[-] Could not write '{file_name}': {e}")
+                return protocol.ERR_IO, 0
+        finally:
+            self.space.release(reservation)
+        storage.record(file_name, path, committed)
+        print(f"[+] File '{file_name}' rebuilt from {count} chunks, {len(wanted)} received "
+              f"({file_size - received} bytes deduplicated)")
+        return protocol.OK, committed
+
+    @staticmethod
+    def make_durable(f: BinaryIO, path: str, created: bool) -> None:
+        """
+        Flushes a received file to disk before the client is told it is
+        there, with its directory entry when the file is new, so a file
+        the client has dropped from its resume state survives a crash
+
+        Args:
+            f (BinaryIO)   : the open file
+            path (str)     : path of the file
+            created (bool) : the file did not exist before it was received
+        """
+        os.fsync(f.fileno())
+        if created:
+            sync_dir(os.path.dirname(path))
+
+    def abandon_file(self, storage: Storage, file_name: str, path: str, committed: int) -> None:
+        """
+        Cleans up a file the connection failed part way through. With
+        PARTIAL_FILES 'keep' the file is cut back to the bytes committed
+        and journaled as incomplete in the storage index, so the client
+        can resume it; with 'delete' it is removed
+
+        Args:
+            storage (Storage) : storage the file was placed in
+            file_name (str)   : relative name sent by the client
+            path (str)        : path of the file
+            committed (int)   : bytes of the file received
+        """
+        # any earlier copy of the file has been overwritten
+        self.catalog.remove(file_name)
+        try:
+            if self.limits["PARTIAL_FILES"] == "delete":
+                os.remove(path)
+                storage.forget(file_name)
+                print(f"[-] Deleted incomplete file '{file_name}'")
+                return
+            # preallocated space beyond the received bytes is released
+            os.truncate(path, committed)
+        except OSError as e:
+            print(f"[-] Could not clean up incomplete file '{file_name}': {e}")
+            return
+        storage.record(file_name, path, committed, complete=False)
+        print(f"[-] Kept incomplete file '{file_name}' ({committed} bytes) to be resumed")
+
+    def receive_extents(self, buffer: Buffer, f: BinaryIO, file_size: int, extents: List[Tuple[int, int]],
+                        progress: Callable) -> Tuple[int, str]:
+        """
+        Receives the data extents of a sparse file into <f>, which has been
+        truncated to the offset the data starts at. The file is only
+        written inside the extents, so the gaps between them and after
+        the last one stay unallocated holes that read back as zeros
+
+        Args:
+            buffer (Buffer)                 : buffer wrapping the client connection
+            f (BinaryIO)                    : unbuffered destination file
+            file_size (int)                 : total size of the file in bytes
+            extents (List[Tuple[int, int]]) : the start and length of each extent
+            progress (Callable)             : called with the bytes of the file committed
+        Returns:
+            Tuple[int, str] : bytes of the file committed and the receive path used
+        """
+        method = "stream"
+        for start, length in extents:
+            # the hole before the extent is already zeros, so it is committed
+            progress(start)
+            f.seek(start)
+            committed, method = self.receive_into(buffer, f, start + length, start, progress)
+            if committed < start + length:
+                return committed, method
+        f.truncate(file_size)
+        return file_size, f"{method}+sparse"
+
+    def receive_into(self, buffer: Buffer, f: BinaryIO, file_size: int, offset: int = 0,
+                     progress: Callable = None) -> Tuple[int, str]:
+        """
+        Copies the bytes from <offset> to <file_size> from the connection
+        into the open file <f>, which is positioned at <offset>. When the
+        kernel decrypts TLS the data is spliced from the socket into the
+        file without passing through userspace. Otherwise it is received
+        into a memory mapping of the file in 'mmap' mode, or read and
+        written in chunks (also used if a splice fails part way). Plain
+        local connections are spliced too in 'stream' mode
+
+        Args:
+            buffer (Buffer)     : buffer wrapping the client connection
+            f (BinaryIO)        : unbuffered destination file
+            file_size (int)     : total size of the file in bytes
+            offset (int)        : byte the data starts at
+            progress (Callable) : called with the bytes of the file committed
+        Returns:
+            Tuple[int, str] : bytes of the file committed and the receive path used
+        """
+        progress = progress or (lambda committed: None)
+        committed = offset
+        method = "stream"
+        plain = not isinstance(buffer.sock, ssl.SSLSocket)
+        if can_splice(buffer.sock) and (self.ktls or plain and self.receive_mode == "stream"):
+            moved, spliced = buffer.splice_into(f.fileno(), file_size - offset,
+                                                lambda n: progress(offset + n))
+            committed += moved
+            method = "splice" if spliced else "splice+stream"
+        elif self.receive_mode == "mmap" and file_size > offset:
+            return LobbitServer.receive_mmap(buffer, f, file_size, offset, progress), "mmap"
+        while committed < file_size:
+            # written to disk in chunks sized by the connection's tuner
+            chunk_size = buffer.tuner.chunk_size if buffer.tuner else Buffer.READ_SIZE
+            chunk = buffer.get_bytes(min(chunk_size, file_size - committed))
+            if not chunk:
+                break
+            f.write(chunk)
+            committed += len(chunk)
+            progress(committed)
+        return committed, method
+
+    @staticmethod
+    def receive_mmap(buffer: Buffer, f: BinaryIO, file_size: int, offset: int = 0,
+                     progress: Callable = None) -> int:
+        """
+        Preallocates <f> to <file_size> bytes, maps it into memory and
+        decrypts received data directly into the mapping from <offset>,
+        removing the userspace copies between the socket and the page
+        cache. Space is allocated up front so a full disk fails here
+        instead of faulting while writing to the mapping
+
+        Args:
+            buffer (Buffer)     : buffer wrapping the client connection
+            f (BinaryIO)        : destination file opened for reading and writing
+            file_size (int)     : total size of the file in bytes
+            offset (int)        : byte the data starts at
+            progress (Callable) : called with the bytes of the file committed
+        Returns:
+            int : bytes of the file committed
+        """
+        fd = f.fileno()
+        try:
+            os.posix_fallocate(fd, offset, file_size - offset)
+        except (AttributeError, OSError) as e:
+            if isinstance(e, OSError) and e.errno == errno.ENOSPC:
+                raise
+            os.ftruncate(fd, file_size)
+        committed = offset
+        with mmap.mmap(fd, file_size) as mapping:
+            if hasattr(mapping, "madvise"):
+                mapping.madvise(mmap.MADV_SEQUENTIAL)
+            with memoryview(mapping) as view:
+                while committed < file_size:
+                    n = buffer.recv_into(view[committed:])
+                    if not n:
+                        break
+                    committed += n
+                    if progress:
+                        progress(committed)
+        if committed < file_size:
+            os.ftruncate(fd, committed)
+        return committed
 
 
 def main() -> None:
@@ -145,11 +1235,20 @@ def main() -> None:
     Main function of the Lobbit server application
     """
     try:
-        current_dir = os.path.abspath(os.path.dirname(__file__))
-        with open(f"{current_dir}/../../config.json", encoding="utf-8") as file:
-            config = json.load(file)
+        config = get_config()
+        try:
+            settings = config.require(SERVER_KEYS)
+        except ConfigError as e:
+            print(e)
+            sys.exit(1)
         server = LobbitServer(
-            config["HOST"], config["PORT"], config["UPLOAD_PATH"])
+            settings["HOST"], settings["PORT"], settings["UPLOAD_PATH"],
+            receive_mode=settings.get("RECEIVE_MODE", "stream"), config=config,
+            storage_settings={key: value for key, value in settings.items() if key.startswith("STORAGE_")},
+            limits=settings, unix_path=settings.get("UNIX_SOCKET"))
+        config.on_reload(server.apply_config)
+        config.install_sighup()
+        config.watch()
         server.lobbit_listen()
         server.lobbit_accept()
     except KeyboardInterrupt:
@@ -0,0 +1,163 @@
+import os
+import time
+
+from threading import Condition
+from typing import Union
+
+# seconds between checks of the free space while an upload waits for room
+RECHECK_INTERVAL = 1.0
+
+
+def existing_dir(path: str) -> str:
+    """
+    Returns the nearest directory of <path> that exists, the directory a
+    new file goes in may not have been created yet
+
+    Args:
+        path (str) : path of the file
+    Returns:
+        str : the directory
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    while not os.path.isdir(directory) and os.path.dirname(directory) != directory:
+        directory = os.path.dirname(directory)
+    return directory
+
+
+class Reservation:
+    """
+    Space held on one filesystem for an upload in progress. Bytes are
+    counted off the reservation as they are written, since the written
+    bytes already show in the filesystem's free space
+    """
+
+    def __init__(self, directory: str, dev: int, size: int) -> None:
+        """
+        Constructor for the Reservation class
+
+        Args:
+            directory (str) : existing directory on the filesystem
+            dev (int)       : st_dev of the filesystem
+            size (int)      : bytes reserved
+        """
+        self.directory = directory
+        self.dev = dev
+        self.size = size
+        self.written = 0
+
+    @property
+    def remaining(self) -> int:
+        """
+        Bytes reserved that have not been written yet
+        """
+        return max(0, self.size - self.written)
+
+
+class SpaceAdmission:
+    """
+    Admits uploads by the free space of the filesystem they are written
+    to. The free space reported by statvfs is reduced by the bytes every
+    admitted upload still has to write, so uploads running at once can't
+    together overfill a disk, and by <min_free> so the server's own
+    files have room. An upload that does not fit waits up to <wait>
+    seconds for space, e.g. from uploads that fail or files deleted by
+    an operator, before it is refused
+    """
+
+    def __init__(self, min_free: int = 0, wait: float = 0.0) -> None:
+        """
+        Constructor for the SpaceAdmission class
+
+        Args:
+            min_free (int) : bytes always left free on each filesystem
+            wait (float)   : seconds an upload may wait for space
+        """
+        self.min_free = min_free
+        self.wait = wait
+        self.reservations = []
+        self._changed = Condition()
+
+    def free(self, directory: str) -> int:
+        """
+        Returns the bytes uploads may still use on the filesystem holding
+        <directory>, must be called holding the lock
+
+        Args:
+            directory (str) : an existing directory
+        Returns:
+            int : free bytes less the reserved bytes and <min_free>, may be negative
+        """
+        st = os.statvfs(directory)
+        dev = os.stat(directory).st_dev
+        reserved = sum(r.remaining for r in self.reservations if r.dev == dev)
+        return st.f_bavail * st.f_frsize - reserved - self.min_free
+
+    def reserve(self, path: str, size: int, wait: float = None) -> Union[Reservation, None]:
+        """
+        Reserves <size> bytes for a file about to be written at <path>
+
+        Args:
+            path (str)   : path of the file
+            size (int)   : bytes the file will add to the disk
+            wait (float) : seconds to wait for space, defaults to <self.wait>
+        Returns:
+            Union[Reservation, None] : the reservation, None if there is no room
+        """
+        directory = existing_dir(path)
+        deadline = time.monotonic() + (self.wait if wait is None else wait)
+        with self._changed:
+            while True:
+                if size <= max(self.free(directory), 0):
+                    reservation = Reservation(directory, os.stat(directory).st_dev, size)
+                    self.reservations.append(reservation)
+                    return reservation
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return None
+                # released reservations wake the waiters, space freed by anything else is polled for
+                self._changed.wait(min(left, RECHECK_INTERVAL))
+
+    def extend(self, reservation: Reservation, size: int) -> bool:
+        """
+        Grows a reservation by <size> bytes if they fit, for data whose
+        length is only known as it arrives
+
+        Args:
+            reservation (Reservation) : the reservation
+            size (int)                : bytes to add
+        Returns:
+            bool : True if the reservation grew
+        """
+        with self._changed:
+            # the reservation's own unwritten bytes are already taken off the free space
+            if size > self.free(reservation.directory):
+                return False
+            reservation.size += size
+            return True
+
+    def release(self, reservation: Union[Reservation, None]) -> None:
+        """
+        Gives back what is left of a reservation once its upload has
+        finished, succeeded or not
+
+        Args:
+            reservation (Reservation) : the reservation, None is ignored
+        """
+        if reservation is None:
+            return
+        with self._changed:
+            if reservation in self.reservations:
+                self.reservations.remove(reservation)
+                self._changed.notify_all()
+
+    def describe(self, path: str) -> str:
+        """
+        Describes the space available for uploads at <path>, for the log
+
+        Args:
+            path (str) : path of a file
+        Returns:
+            str : the free bytes left for uploads
+        """
+        with self._changed:
+            return f"{max(self.free(existing_dir(path)), 0)} bytes free for uploads"
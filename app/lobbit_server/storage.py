@@ -0,0 +1,325 @@
+import bisect
+import hashlib
+import os
+import random
+import sqlite3
+import time
+
+from app.lobbit_server.chunks import ChunkStore
+from app.lobbit_util.paths import safe_join
+from threading import Lock
+from typing import Iterator, List, Tuple, Union
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    name     TEXT    PRIMARY KEY,
+    root     TEXT    NOT NULL,
+    path     TEXT    NOT NULL,
+    size     INTEGER NOT NULL,
+    complete INTEGER NOT NULL,
+    updated  REAL    NOT NULL
+);
+"""
+
+
+def name_hash(value: str) -> int:
+    """
+    Returns a stable 64 bit hash of <value>, unlike <hash> it is the
+    same in every process
+
+    Args:
+        value (str) : the value to hash
+    Returns:
+        int : the hash
+    """
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class StorageIndex:
+    """
+    Records where each uploaded file is stored in a sqlite database,
+    so a file can be found by its upload name without scanning the
+    upload roots
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Constructor for the StorageIndex class
+
+        Args:
+            path (str) : path of the index database
+        """
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(INDEX_SCHEMA)
+
+    def get(self, name: str) -> Union[tuple, None]:
+        """
+        Looks up a file by its upload name
+
+        Args:
+            name (str) : the upload name
+        Returns:
+            Union[tuple, None] : the (root, path, size, complete) of the file or None
+        """
+        with self._lock:
+            return self._db.execute("SELECT root, path, size, complete FROM files WHERE name = ?",
+                                    (name,)).fetchone()
+
+    def put(self, name: str, root: str, path: str, size: int, complete: bool) -> None:
+        """
+        Records the location of a file
+
+        Args:
+            name (str)      : the upload name
+            root (str)      : the upload root holding the file
+            path (str)      : absolute path of the file
+            size (int)      : bytes of the file on disk
+            complete (bool) : True once every byte has been received
+        """
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                             (name, root, path, size, int(complete), time.time()))
+
+    def complete_files(self) -> Iterator[Tuple[str, str, int, float]]:
+        """
+        Lists every file recorded as complete
+
+        Returns:
+            Iterator[Tuple[str, str, int, float]] : the name, path, size and
+                                                    last update of each file
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT name, path, size, updated FROM files WHERE complete = 1").fetchall()
+        return iter(rows)
+
+    def delete(self, name: str) -> None:
+        """
+        Removes the entry for a file
+
+        Args:
+            name (str) : the upload name
+        """
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM files WHERE name = ?", (name,))
+
+    def close(self) -> None:
+        """
+        Closes the database
+        """
+        with self._lock:
+            self._db.close()
+
+
+class Storage:
+    """
+    Maps upload names to paths across one or more upload roots. With a
+    single root and no fan-out files are stored at <root>/<name>. With
+    several roots, typically on separate disks, each new file is placed
+    on a root by consistent hashing of its name or at random weighted by
+    free space, so concurrent uploads write to every disk at once. Inside
+    a root files go under <fanout> levels of hashed sub-directories to
+    keep directories small, and the index records where each file went.
+    Server data, the index and the chunk store, lives in .lobbit in the
+    first root and no upload may be written inside it
+    """
+
+    PLACEMENTS = ("hash", "space")
+    # points per root on the hash ring, more points spread names more evenly
+    VNODES = 64
+    META_DIR = ".lobbit"
+    INDEX_NAME = os.path.join(META_DIR, "index.db")
+
+    def __init__(self, roots: Union[str, List[str]], placement: str = "hash", fanout: int = None,
+                 index_path: str = None) -> None:
+        """
+        Constructor for the Storage class
+
+        Args:
+            roots (Union[str, List[str]]) : upload root or list of upload roots
+            placement (str)               : 'hash' to place files by consistent hashing
+                                            of their names or 'space' to favour the
+                                            roots with the most free space
+            fanout (int)                  : levels of hashed sub-directories, defaults
+                                            to 2 for a list of roots and 0 for one root
+            index_path (str)              : path of the index database, defaults to
+                                            .lobbit/index.db in the first root when
+                                            files are sharded, otherwise no index is kept
+        """
+        if placement not in Storage.PLACEMENTS:
+            raise ValueError(f"placement must be one of {', '.join(Storage.PLACEMENTS)}")
+        sharded = not isinstance(roots, str)
+        self.roots = [os.path.abspath(root) for root in ([roots] if isinstance(roots, str) else roots)]
+        if not self.roots:
+            raise ValueError("at least one upload root is required")
+        for root in self.roots:
+            os.makedirs(root, exist_ok=True)
+        self.placement = placement
+        self.fanout = (2 if sharded else 0) if fanout is None else fanout
+        if index_path is None and (len(self.roots) > 1 or self.fanout):
+            index_path = os.path.join(self.roots[0], Storage.INDEX_NAME)
+        self.index = StorageIndex(index_path) if index_path else None
+        self.meta_dir = os.path.join(self.roots[0], Storage.META_DIR)
+        self.chunks = ChunkStore(os.path.join(self.meta_dir, "chunks"))
+        self._ring = sorted((name_hash(f"{root}#{i}"), root) for root in self.roots
+                            for i in range(Storage.VNODES))
+        self._keys = [key for key, _ in self._ring]
+
+    @classmethod
+    def from_settings(cls, upload_path: Union[str, List[str]], settings: dict) -> "Storage":
+        """
+        Builds the storage described by the STORAGE_* settings in config.json
+
+        Args:
+            upload_path (Union[str, List[str]]) : UPLOAD_PATH, one root or a list
+            settings (dict)                     : the server settings
+        Returns:
+            Storage : the configured storage
+        """
+        return cls(upload_path, placement=settings.get("STORAGE_PLACEMENT", "hash"),
+                   fanout=settings.get("STORAGE_FANOUT"), index_path=settings.get("STORAGE_INDEX"))
+
+    def close(self) -> None:
+        """
+        Closes the index
+        """
+        if self.index:
+            self.index.close()
+
+    def choose_root(self, name: str, size: int = 0) -> str:
+        """
+        Picks the root a new file is stored on
+
+        Args:
+            name (str) : the upload name
+            size (int) : size of the file, roots without room for it are
+                         skipped when placing by free space
+        Returns:
+            str : the chosen root
+        """
+        if len(self.roots) == 1:
+            return self.roots[0]
+        if self.placement == "hash":
+            index = bisect.bisect(self._keys, name_hash(name)) % len(self._ring)
+            return self._ring[index][1]
+        free = []
+        for root in self.roots:
+            try:
+                st = os.statvfs(root)
+                free.append(st.f_bavail * st.f_frsize)
+            except OSError:
+                free.append(0)
+        weights = [n if n > size else 0 for n in free]
+        if not any(weights):
+            # nothing has room, let the write fail on the emptiest disk
+            return self.roots[free.index(max(free))]
+        return random.choices(self.roots, weights=weights)[0]
+
+    def shard_dir(self, root: str, name: str) -> str:
+        """
+        Returns the hashed fan-out directory for <name> under <root>
+
+        Args:
+            root (str) : the upload root
+            name (str) : the upload name
+        Returns:
+            str : the directory the file is stored under
+        """
+        if not self.fanout:
+            return root
+        digest = hashlib.blake2b(name.encode("utf-8"), digest_size=8).hexdigest()
+        return os.path.join(root, *(digest[i * 2:i * 2 + 2] for i in range(self.fanout)))
+
+    def locate(self, name: str) -> Union[str, None]:
+        """
+        Finds where a file is stored without scanning the roots
+
+        Args:
+            name (str) : the upload name
+        Returns:
+            Union[str, None] : absolute path of the file or None if unknown
+        """
+        if self.index:
+            row = self.index.get(name)
+            return row[1] if row else None
+        path = safe_join(self.roots[0], name)
+        return path if path and os.path.isfile(path) else None
+
+    def place(self, name: str, size: int = 0) -> Union[str, None]:
+        """
+        Returns the path a file is written to. A file that is already
+        stored keeps its location so resumes and re-uploads find it
+
+        Args:
+            name (str) : the upload name
+            size (int) : size of the file in bytes
+        Returns:
+            Union[str, None] : absolute path for the file or None if the name is not safe
+        """
+        row = self.index.get(name) if self.index else None
+        if row and row[0] in self.roots:
+            return row[1]
+        root = self.choose_root(name, size)
+        path = safe_join(self.shard_dir(root, name), name)
+        if path:
+            # never let an upload overwrite the index, the chunk store or their directories
+            protected = [self.meta_dir]
+            if self.index:
+                protected.append(os.path.dirname(os.path.abspath(self.index.path)))
+            if any(os.path.commonpath([path, d]) in (path, d) for d in protected):
+                return None
+        return path
+
+    def files(self) -> Iterator[Tuple[str, str, int, float]]:
+        """
+        Lists the files already stored, from the index when there is one
+        or by walking the upload root, skipping the server's own data
+
+        Returns:
+            Iterator[Tuple[str, str, int, float]] : the name, path, size and
+                                                    modified time of each file
+        """
+        if self.index:
+            yield from self.index.complete_files()
+            return
+        root = self.roots[0]
+        for dirpath, dirnames, filenames in os.walk(root):
+            if dirpath == root and Storage.META_DIR in dirnames:
+                dirnames.remove(Storage.META_DIR)
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield os.path.relpath(path, root).replace(os.sep, "/"), path, st.st_size, st.st_mtime
+
+    def record(self, name: str, path: str, size: int, complete: bool = True) -> None:
+        """
+        Adds or updates the index entry for a file
+
+        Args:
+            name (str)      : the upload name
+            path (str)      : absolute path of the file
+            size (int)      : bytes of the file on disk
+            complete (bool) : True once every byte has been received
+        """
+        if not self.index:
+            return
+        root = next((r for r in self.roots if os.path.commonpath([r, path]) == r), self.roots[0])
+        self.index.put(name, root, path, size, complete)
+
+    def forget(self, name: str) -> None:
+        """
+        Removes the index entry for a file that has been deleted
+
+        Args:
+            name (str) : the upload name
+        """
+        if self.index:
+            self.index.delete(name)
@@ -0,0 +1,156 @@
+import os
+import socket
+import ssl
+import subprocess
+import time
+
+from threading import Thread
+from typing import List, Tuple, Union
+
+# AEADs measured by <bench_ciphers>, each with the TLS 1.3 suite that uses
+# it and the TLS 1.2 ciphers used on Pythons that can't pick TLS 1.3 suites
+CANDIDATES = (
+    ("AES-128-GCM", "TLS_AES_128_GCM_SHA256",
+     "ECDHE-ECDSA-AES128-GCM-SHA256:ECDHE-RSA-AES128-GCM-SHA256"),
+    ("AES-256-GCM", "TLS_AES_256_GCM_SHA384",
+     "ECDHE-ECDSA-AES256-GCM-SHA384:ECDHE-RSA-AES256-GCM-SHA384"),
+    ("CHACHA20-POLY1305", "TLS_CHACHA20_POLY1305_SHA256",
+     "ECDHE-ECDSA-CHACHA20-POLY1305:ECDHE-RSA-CHACHA20-POLY1305"),
+)
+# bytes written per send while measuring
+SEND_SIZE = 256 * 1024
+
+
+def throwaway_cert(directory: str) -> Tuple[str, str]:
+    """
+    Creates a short lived self-signed certificate with the openssl command
+    for benchmarking where the server's private key is not available
+
+    Args:
+        directory (str) : directory to write cert.pem and key.pem to
+    Returns:
+        Tuple[str, str] : paths of the certificate and private key
+    """
+    cert, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1",
+                    "-keyout", key, "-out", cert, "-days", "1", "-nodes", "-subj", "/CN=localhost"],
+                   check=True, capture_output=True)
+    return cert, key
+
+
+def restrict(context: ssl.SSLContext, suite: str, tls12: str) -> None:
+    """
+    Limits <context> to one TLS 1.3 suite, or to the TLS 1.2 ciphers using
+    the same AEAD when the suite can't be chosen
+
+    Args:
+        context (ssl.SSLContext) : the context to restrict
+        suite (str)              : TLS 1.3 suite name
+        tls12 (str)              : OpenSSL TLS 1.2 cipher string
+    """
+    if hasattr(context, "set_ciphersuites"):
+        context.minimum_version = ssl.TLSVersion.TLSv1_3
+        context.set_ciphersuites(suite)
+    else:
+        context.maximum_version = ssl.TLSVersion.TLSv1_2
+        context.set_ciphers(tls12)
+
+
+def measure(server_context: ssl.SSLContext, client_context: ssl.SSLContext, size: int) -> Tuple[float, str]:
+    """
+    Sends <size> bytes over a TLS connection on the loopback interface,
+    encrypting on one thread and decrypting on another as an upload does
+
+    Args:
+        server_context (ssl.SSLContext) : context of the receiving side
+        client_context (ssl.SSLContext) : context of the sending side
+        size (int)                      : bytes to send
+    Returns:
+        Tuple[float, str] : bytes per second and the negotiated cipher
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    done = []
+
+    def receive() -> None:
+        conn, _ = listener.accept()
+        try:
+            with server_context.wrap_socket(conn, server_side=True) as tls:
+                view = memoryview(bytearray(SEND_SIZE))
+                received = 0
+                while received < size:
+                    n = tls.recv_into(view)
+                    if not n:
+                        break
+                    received += n
+                done.append(time.perf_counter())
+        except OSError:
+            conn.close()
+
+    receiver = Thread(target=receive, daemon=True)
+    receiver.start()
+    try:
+        sock = socket.create_connection(listener.getsockname())
+        with client_context.wrap_socket(sock, server_hostname="localhost") as tls:
+            cipher = tls.cipher()[0]
+            data = os.urandom(SEND_SIZE)
+            started = time.perf_counter()
+            for _ in range(size // SEND_SIZE):
+                tls.sendall(data)
+            receiver.join()
+    finally:
+        listener.close()
+    if not done:
+        raise ConnectionError("The receiving side closed the connection")
+    return size / (done[0] - started), cipher
+
+
+def bench_ciphers(cert: str, key: str, size: int = 128 * 1024 * 1024) -> List[dict]:
+    """
+    Measures the TLS throughput of each AEAD in CANDIDATES over loopback
+
+    Args:
+        cert (str) : certificate the benchmark server presents
+        key (str)  : its private key
+        size (int) : bytes sent with each cipher
+    Returns:
+        List[dict] : the aead, TLS 1.3 suite, negotiated cipher, rate in bytes
+                     per second and any error of each candidate
+    """
+    results = []
+    size = max(SEND_SIZE, size - size % SEND_SIZE)
+    for aead, suite, tls12 in CANDIDATES:
+        result = {"aead": aead, "suite": suite, "cipher": None, "rate": None, "error": None}
+        try:
+            server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            server_context.load_cert_chain(cert, key)
+            client_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            # only the cipher is being measured, the peer is this process
+            client_context.check_hostname = False
+            client_context.verify_mode = ssl.CERT_NONE
+            restrict(server_context, suite, tls12)
+            restrict(client_context, suite, tls12)
+            result["rate"], result["cipher"] = measure(server_context, client_context, size)
+        except (OSError, ssl.SSLError) as e:
+            result["error"] = str(e)
+        results.append(result)
+    return results
+
+
+def suggestion(results: List[dict]) -> Union[List[str], None]:
+    """
+    Returns the TLS_CIPHERS value that prefers the fastest AEAD measured
+
+    Args:
+        results (List[dict]) : results from <bench_ciphers>
+    Returns:
+        Union[List[str], None] : cipher names fastest first, or None if nothing was measured
+    """
+    measured = sorted((r for r in results if r["rate"]), key=lambda r: r["rate"], reverse=True)
+    if not measured:
+        return None
+    if hasattr(ssl.SSLContext, "set_ciphersuites"):
+        return [r["suite"] for r in measured]
+    return [name for r in measured for aead, _, tls12 in CANDIDATES if aead == r["aead"]
+            for name in tls12.split(":")]
@@ -1,5 +1,8 @@
+import fcntl
+import os
+
 from socket import socket
-from typing import Union
+from typing import Callable, Tuple, Union
 
 
 class Buffer:
@@ -8,6 +11,11 @@ class Buffer:
     information over an instance of <socket.socket>
     """
 
+    # bytes moved through the pipe per <os.splice> call
+    SPLICE_SIZE = 1024 * 1024
+    # bytes asked of the socket per <recv> call
+    READ_SIZE = 64 * 1024
+
     def __init__(self, sock: socket) -> None:
         """
         Buffer class constructor
@@ -17,6 +25,10 @@ class Buffer:
         """
         self.sock = sock
         self.buffer = b''
+        # bytes read from the socket, watched by the server to reap stalled peers
+        self.received = 0
+        # Tuner sizing the chunks read from the connection, see tuning
+        self.tuner = None
 
     def get_bytes(self, len_bytes: int) -> bytes:
         """
@@ -27,17 +39,147 @@ class Buffer:
         Returns:
             bytes : byte test_data sent over the socket
         """
-        while len(self.buffer) < len_bytes:
-            data = self.sock.recv(1024)
-            if not data:
-                data = self.buffer
-                self.buffer = b''
-                return data
-            self.buffer += data
+        if len(self.buffer) < len_bytes:
+            # gathered in place so large reads aren't copied on every recv
+            held = bytearray(self.buffer)
+            while len(held) < len_bytes:
+                data = self.sock.recv(Buffer.READ_SIZE)
+                if not data:
+                    self.buffer = b''
+                    return bytes(held)
+                self.received += len(data)
+                held += data
+            self.buffer = bytes(held)
         # split message bytes from the buffer
         data, self.buffer = self.buffer[:len_bytes], self.buffer[len_bytes:]
         return data
 
+    def recv_into(self, view: memoryview) -> int:
+        """
+        Reads from the connection straight into <view>. Bytes already held
+        in the buffer are copied out first, otherwise a single <recv_into>
+        is made on the socket so no intermediate bytes object is created
+
+        Args:
+            view (memoryview) : writable destination for the data
+        Returns:
+            int : number of bytes written to <view>, 0 when the peer has closed
+        """
+        if self.buffer:
+            n = min(len(view), len(self.buffer))
+            view[:n] = self.buffer[:n]
+            self.buffer = self.buffer[n:]
+            return n
+        n = self.sock.recv_into(view)
+        self.received += n
+        return n
+
+    def read_exact(self, len_bytes: int) -> bytes:
+        """
+        Reads exactly len_bytes from the connection into a single
+        preallocated buffer, for blocks too large to build up from
+        small reads
+
+        Args:
+            len_bytes (int) : number of bytes to read
+        Returns:
+            bytes : the data, shorter if the peer closed
+        """
+        data = bytearray(len_bytes)
+        view = memoryview(data)
+        pos = 0
+        while pos < len_bytes:
+            n = self.recv_into(view[pos:])
+            if not n:
+                break
+            pos += n
+        return bytes(data[:pos]) if pos < len_bytes else bytes(data)
+
+    @staticmethod
+    def write_all(fd: int, data: bytes) -> None:
+        """
+        Writes all of <data> to the file descriptor <fd>
+
+        Args:
+            fd (int)     : file descriptor to write to
+            data (bytes) : data to write
+        """
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+
+    def splice_into(self, fd: int, len_bytes: int, progress: Callable = None) -> Tuple[int, bool]:
+        """
+        Moves up to len_bytes from the connection into the file descriptor
+        <fd> without copying through userspace. Bytes already held in the
+        buffer, or decrypted and pending in the SSL object, are written
+        first and the rest is spliced from the socket through a pipe. Only
+        valid for plain sockets or when the kernel decrypts TLS (kTLS)
+
+        Args:
+            fd (int)            : file descriptor to write to
+            len_bytes (int)     : maximum number of bytes to move
+            progress (Callable) : called with the bytes moved so far
+        Returns:
+            Tuple[int, bool] : bytes moved and False if the splice failed
+                               and the caller must fall back to <get_bytes>
+        """
+        moved = 0
+        if self.buffer:
+            data, self.buffer = self.buffer[:len_bytes], self.buffer[len_bytes:]
+            Buffer.write_all(fd, data)
+            moved += len(data)
+        pending = getattr(self.sock, "pending", None)
+        while moved < len_bytes and pending and pending():
+            data = self.sock.recv(min(pending(), len_bytes - moved))
+            self.received += len(data)
+            Buffer.write_all(fd, data)
+            moved += len(data)
+        read_end, write_end = os.pipe()
+        if hasattr(fcntl, "F_SETPIPE_SZ"):
+            try:
+                # the default 64K pipe would split each splice into many small moves
+                fcntl.fcntl(write_end, fcntl.F_SETPIPE_SZ, Buffer.SPLICE_SIZE)
+            except OSError:
+                pass
+        try:
+            while moved < len_bytes:
+                try:
+                    n = os.splice(self.sock.fileno(), write_end, min(len_bytes - moved, Buffer.SPLICE_SIZE))
+                except OSError:
+                    # e.g. a TLS control record the kernel cannot pass through
+                    return moved, False
+                if not n:
+                    break
+                self.received += n
+                done = 0
+                while done < n:
+                    done += os.splice(read_end, fd, n - done)
+                moved += n
+                if progress:
+                    progress(moved)
+        finally:
+            os.close(read_end)
+            os.close(write_end)
+        return moved, True
+
+    def discard(self, len_bytes: int) -> int:
+        """
+        Reads and throws away the next len_bytes from the connection
+
+        Args:
+            len_bytes (int) : number of bytes to discard
+        Returns:
+            int : number of bytes discarded, less if the peer closed
+        """
+        discarded = 0
+        while discarded < len_bytes:
+            data = self.get_bytes(min(len_bytes - discarded, 65536))
+            if not data:
+                break
+            discarded += len(data)
+        return discarded
+
     def put_bytes(self, data: bytes) -> None:
         """
         Send buffered test_data over the socket
@@ -55,9 +197,10 @@ class Buffer:
             Union[str, bytes] : empty string or decoded bytes
         """
         while b'\x00' not in self.buffer:
-            data = self.sock.recv(1024)
+            data = self.sock.recv(Buffer.READ_SIZE)
             if not data:
                 return ''
+            self.received += len(data)
             self.buffer += data
         # split the string off from the buffer
         data, _, self.buffer = self.buffer.partition(b'\x00')
@@ -0,0 +1,148 @@
+import hashlib
+import random
+import struct
+
+from typing import BinaryIO, Iterator, List, Tuple
+
+# Files are split into chunks with a gear based rolling hash in the style
+# of FastCDC. Boundaries depend only on the bytes around them, so an
+# insertion or deletion only changes the chunks it touches and the rest
+# of the file still deduplicates against earlier uploads. The hash runs
+# a Python loop per byte, so chunking is CPU bound at roughly 5-20 MB/s
+# and pays off on links slower than that.
+
+MIN_SIZE = 16 * 1024
+AVG_SIZE = 64 * 1024
+MAX_SIZE = 256 * 1024
+
+# fixed so every client cuts the same content at the same places
+_rng = random.Random(0x6C6F62626974)
+GEAR = tuple(_rng.getrandbits(64) for _ in range(256))
+# normalised chunking, a harder mask before the average size and an easier
+# one after it pulls chunk sizes towards AVG_SIZE. The hash is shifted
+# right so it never grows past 65 bits and each of its low bits depends
+# on the last 64 bytes
+MASK_S = (1 << 18) - 1
+MASK_L = (1 << 14) - 1
+
+DIGEST_SIZE = 32
+# one manifest entry, the SHA-256 digest and length of a chunk
+ENTRY = struct.Struct(f"!{DIGEST_SIZE}sI")
+
+# bytes read from the file at a time while chunking
+READ_SIZE = 4 * 1024 * 1024
+
+
+def cut_point(data: bytes, start: int, end: int) -> int:
+    """
+    Finds the length of the chunk starting at <start>
+
+    Args:
+        data (bytes) : buffered file data
+        start (int)  : offset of the chunk in <data>
+        end (int)    : end of the data available, the end of the file
+                       or at least MAX_SIZE bytes after <start>
+    Returns:
+        int : the chunk length
+    """
+    available = end - start
+    if available <= MIN_SIZE:
+        return available
+    limit = min(available, MAX_SIZE)
+    normal = min(limit, AVG_SIZE)
+    gear = GEAR
+    h = 0
+    # bytes before MIN_SIZE can never be a boundary so they are not hashed
+    i = start + MIN_SIZE
+    for byte in data[i:start + normal]:
+        h = (h >> 1) + gear[byte]
+        i += 1
+        if not h & MASK_S:
+            return i - start
+    for byte in data[i:start + limit]:
+        h = (h >> 1) + gear[byte]
+        i += 1
+        if not h & MASK_L:
+            return i - start
+    return limit
+
+
+def chunks(f: BinaryIO) -> Iterator[Tuple[bytes, int, int]]:
+    """
+    Splits a file into content defined chunks
+
+    Args:
+        f (BinaryIO) : the file, read from its current position
+    Returns:
+        Iterator[Tuple[bytes, int, int]] : the SHA-256 digest, offset and
+                                           length of each chunk
+    """
+    data = b""
+    start = 0
+    offset = 0
+    eof = False
+    while True:
+        if not eof and len(data) - start < MAX_SIZE:
+            more = f.read(READ_SIZE)
+            eof = not more
+            data = data[start:] + more
+            start = 0
+        if start == len(data):
+            return
+        n = cut_point(data, start, len(data))
+        yield hashlib.sha256(data[start:start + n]).digest(), offset, n
+        start += n
+        offset += n
+
+
+def encode_manifest(entries: List[Tuple[bytes, int, int]]) -> bytes:
+    """
+    Packs chunks into the manifest sent to the server
+
+    Args:
+        entries (List[Tuple[bytes, int, int]]) : chunks from <chunks>
+    Returns:
+        bytes : the manifest
+    """
+    return b"".join(ENTRY.pack(digest, length) for digest, _, length in entries)
+
+
+def decode_manifest(data: bytes) -> List[Tuple[bytes, int]]:
+    """
+    Unpacks a manifest sent by a client
+
+    Args:
+        data (bytes) : the manifest
+    Returns:
+        List[Tuple[bytes, int]] : the digest and length of each chunk
+    """
+    return list(ENTRY.iter_unpack(data))
+
+
+def encode_bitmap(flags: List[bool]) -> bytes:
+    """
+    Packs one flag per chunk into a bitmap, chunk 0 is the lowest bit
+
+    Args:
+        flags (List[bool]) : the flags
+    Returns:
+        bytes : the bitmap
+    """
+    bitmap = bytearray((len(flags) + 7) // 8)
+    for i, flag in enumerate(flags):
+        if flag:
+            bitmap[i >> 3] |= 1 << (i & 7)
+    return bytes(bitmap)
+
+
+def decode_bitmap(bitmap: bytes, count: int) -> List[bool]:
+    """
+    Unpacks a bitmap made by <encode_bitmap>
+
+    Args:
+        bitmap (bytes) : the bitmap
+        count (int)    : number of flags
+    Returns:
+        List[bool] : the flags
+    """
+    return [bool(bitmap[i >> 3] & (1 << (i & 7))) for i in range(count)]
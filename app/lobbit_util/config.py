@@ -0,0 +1,382 @@
+import json
+import os
+import signal
+import ssl
+
+from app.lobbit_util.ktls import enable_ktls
+from threading import Event, Lock, Thread
+from typing import Callable, List, Tuple
+
+CONFIG_PATH = os.path.join(os.path.abspath(os.path.dirname(__file__)), "../../config.json")
+
+SERVER_KEYS = ("HOST", "PORT", "UPLOAD_PATH", "PUBLIC_CERT_PATH", "PRIVATE_CERT_PATH")
+CLIENT_KEYS = ("PUBLIC_CERT_PATH",)
+
+
+def cert_exists(path: str) -> Tuple[bool, str]:
+    """
+    Checks for the existence of a .pem certificate file at <path>
+
+    Args:
+        path (str) : path to the certificate file
+    Returns:
+        Tuple[bool, str] : True if the .pem file exists, else False and a message
+    """
+    if not isinstance(path, str) or not os.path.isfile(path):
+        return False, "[-] File not found, check value of PUBLIC_CERT_PATH"
+    suffix = path.split(".")[-1].lower()
+    if suffix != "pem":
+        return False, f"[-] Expected .pem certificate file type, found .{suffix} file"
+    return True, ""
+
+
+class ConfigError(Exception):
+    """
+    Raised when config.json cannot be read or fails validation
+    """
+
+
+def restrict_ciphers(context: ssl.SSLContext, ciphers: List[str]) -> None:
+    """
+    Limits <context> to the cipher suites in <ciphers>, in order of
+    preference. TLS 1.3 suites (named 'TLS_*') need a Python with
+    <SSLContext.set_ciphersuites> and are rejected without it, as
+    <set_ciphers> would ignore them. A list of only TLS 1.2 ciphers caps
+    the context at TLS 1.2 so the ciphers are actually used
+
+    Args:
+        context (ssl.SSLContext) : the context to restrict
+        ciphers (List[str])      : TLS 1.3 suite or OpenSSL TLS 1.2 cipher names
+    """
+    tls13 = [name for name in ciphers if name.startswith("TLS_")]
+    tls12 = [name for name in ciphers if not name.startswith("TLS_")]
+    if tls13 and not hasattr(context, "set_ciphersuites"):
+        raise ConfigError(f"[-] Invalid TLS_CIPHERS '{':'.join(ciphers)}': this Python can't restrict "
+                          f"TLS 1.3 suites, use TLS 1.2 cipher names such as 'ECDHE-RSA-AES128-GCM-SHA256'")
+    try:
+        if tls13:
+            context.set_ciphersuites(":".join(tls13))
+        if tls12:
+            context.set_ciphers(":".join(tls12))
+            if not tls13:
+                context.maximum_version = ssl.TLSVersion.TLSv1_2
+    except ssl.SSLError as e:
+        raise ConfigError(f"[-] Invalid TLS_CIPHERS '{':'.join(ciphers)}': {e}")
+
+
+def restrict_groups(context: ssl.SSLContext, groups: List[str]) -> None:
+    """
+    Limits the key exchange groups of <context> to <groups>, in order of
+    preference. Pythons without <SSLContext.set_groups> can only set one
+    group, so the first is used
+
+    Args:
+        context (ssl.SSLContext) : the context to restrict
+        groups (List[str])       : group names such as 'X25519' or 'prime256v1'
+    """
+    try:
+        if hasattr(context, "set_groups"):
+            context.set_groups(":".join(groups))
+        else:
+            context.set_ecdh_curve(groups[0])
+    except (ssl.SSLError, ValueError) as e:
+        raise ConfigError(f"[-] Invalid TLS_GROUPS '{':'.join(groups)}': {e}")
+
+
+class LobbitConfig:
+    """
+    Loads and validates config.json once and caches the SSLContext
+    objects built from it. The settings and contexts can be reloaded
+    atomically on SIGHUP or when the config or certificate files change,
+    so new connections use the new values while existing connections
+    keep the context they were created with
+    """
+
+    def __init__(self, path: str = None) -> None:
+        """
+        Constructor for the LobbitConfig class
+
+        Args:
+            path (str) : path to config.json, defaults to $LOBBIT_CONFIG
+                         or config.json in the root directory
+        """
+        self.path = path or os.getenv("LOBBIT_CONFIG") or CONFIG_PATH
+        self.ktls = False
+        self._lock = Lock()
+        self._settings = None
+        self._contexts = {}
+        self._callbacks = []
+        self._watcher = None
+        self._stop = Event()
+
+    # --- LOADING ---
+
+    def read(self) -> dict:
+        """
+        Reads config.json from disk
+
+        Returns:
+            dict : the parsed settings
+        """
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                settings = json.load(file)
+        except (OSError, ValueError) as e:
+            raise ConfigError(f"[-] Could not read config '{self.path}': {e}")
+        if not isinstance(settings, dict):
+            raise ConfigError(f"[-] Expected a JSON object in '{self.path}'")
+        return settings
+
+    @staticmethod
+    def validate(settings: dict, keys: Tuple) -> None:
+        """
+        Checks that every key in <keys> is present and that the
+        certificate files they point to exist
+
+        Args:
+            settings (dict) : the settings to validate
+            keys (Tuple)    : keys required by the caller
+        """
+        missing = [key for key in keys if key not in settings]
+        if missing:
+            raise ConfigError(f"[-] Missing config value(s): {', '.join(missing)}")
+        if "PUBLIC_CERT_PATH" in keys:
+            exists, msg = cert_exists(settings["PUBLIC_CERT_PATH"])
+            if not exists:
+                raise ConfigError(msg)
+        if "PRIVATE_CERT_PATH" in keys and not os.path.isfile(settings["PRIVATE_CERT_PATH"]):
+            raise ConfigError("[-] File not found, check value of PRIVATE_CERT_PATH")
+
+    def settings(self) -> dict:
+        """
+        Returns the cached settings, loading them on first use
+
+        Returns:
+            dict : the current settings
+        """
+        if self._settings is None:
+            with self._lock:
+                if self._settings is None:
+                    self._settings = self.read()
+        return self._settings
+
+    def get(self, key: str, default: object = None) -> object:
+        """
+        Returns a single setting
+
+        Args:
+            key (str)        : the setting name
+            default (object) : value returned if the setting is missing
+        Returns:
+            object : the setting value
+        """
+        return self.settings().get(key, default)
+
+    def require(self, keys: Tuple) -> dict:
+        """
+        Returns the settings after checking the keys a caller needs
+
+        Args:
+            keys (Tuple) : keys required by the caller
+        Returns:
+            dict : the current settings
+        """
+        settings = self.settings()
+        LobbitConfig.validate(settings, keys)
+        return settings
+
+    # --- SSL CONTEXTS ---
+
+    def build_context(self, role: str, settings: dict) -> ssl.SSLContext:
+        """
+        Builds a new SSLContext for <role> from <settings>
+
+        Args:
+            role (str)      : 'server' or 'client'
+            settings (dict) : settings to build the context from
+        Returns:
+            ssl.SSLContext : the new context
+        """
+        if role == "server":
+            LobbitConfig.validate(settings, SERVER_KEYS)
+            context = ssl.SSLContext(protocol=ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile=settings["PUBLIC_CERT_PATH"],
+                                    keyfile=settings["PRIVATE_CERT_PATH"])
+        else:
+            LobbitConfig.validate(settings, CLIENT_KEYS)
+            context = ssl.create_default_context()
+            context.load_verify_locations(cafile=settings["PUBLIC_CERT_PATH"])
+        LobbitConfig.apply_tls_preferences(context, settings)
+        self.ktls = enable_ktls(context)
+        return context
+
+    @staticmethod
+    def apply_tls_preferences(context: ssl.SSLContext, settings: dict) -> None:
+        """
+        Applies the optional TLS_CIPHERS and TLS_GROUPS lists to a new
+        context. The server's order is preferred over the client's so the
+        suite picked by 'bench cipher' is the one negotiated
+
+        Args:
+            context (ssl.SSLContext) : the new context
+            settings (dict)          : settings to read the preferences from
+        """
+        for key in ("TLS_CIPHERS", "TLS_GROUPS"):
+            value = settings.get(key)
+            if value is not None and (not isinstance(value, list) or not value or
+                                      not all(isinstance(name, str) for name in value)):
+                raise ConfigError(f"[-] {key} must be a list of names, found '{value}'")
+        if settings.get("TLS_CIPHERS"):
+            restrict_ciphers(context, settings["TLS_CIPHERS"])
+            context.options |= ssl.OP_CIPHER_SERVER_PREFERENCE
+        if settings.get("TLS_GROUPS"):
+            restrict_groups(context, settings["TLS_GROUPS"])
+
+    def context(self, role: str) -> ssl.SSLContext:
+        """
+        Returns the cached SSLContext for <role>, building it on first use
+
+        Args:
+            role (str) : 'server' or 'client'
+        Returns:
+            ssl.SSLContext : the shared context
+        """
+        context = self._contexts.get(role)
+        if context is None:
+            settings = self.settings()
+            with self._lock:
+                context = self._contexts.get(role)
+                if context is None:
+                    try:
+                        context = self.build_context(role, settings)
+                    except ssl.SSLError as e:
+                        raise ConfigError(f"[-] Could not load certificate: {e}")
+                    self._contexts = {**self._contexts, role: context}
+        return context
+
+    def server_context(self) -> ssl.SSLContext:
+        """
+        Returns the shared server SSLContext
+
+        Returns:
+            ssl.SSLContext : context loaded with the certificate chain
+        """
+        return self.context("server")
+
+    def client_context(self) -> ssl.SSLContext:
+        """
+        Returns the shared client SSLContext
+
+        Returns:
+            ssl.SSLContext : context trusting the server certificate
+        """
+        return self.context("client")
+
+    # --- RELOADING ---
+
+    def on_reload(self, callback: Callable) -> None:
+        """
+        Registers a function called with the new settings after a reload
+
+        Args:
+            callback (Callable) : function taking the settings dict
+        """
+        self._callbacks.append(callback)
+
+    def reload(self) -> bool:
+        """
+        Re-reads config.json and rebuilds every context that has been
+        used. The new settings and contexts replace the old ones in a
+        single step and only if all of them load, so a bad certificate
+        or config never replaces a working one
+
+        Returns:
+            bool : True if the reload succeeded, False if the old values were kept
+        """
+        try:
+            settings = self.read()
+            contexts = {role: self.build_context(role, settings) for role in self._contexts}
+        except (ConfigError, ssl.SSLError) as e:
+            print(f"[-] Config reload failed, keeping current settings: {e}")
+            return False
+        with self._lock:
+            self._settings, self._contexts = settings, contexts
+        for callback in self._callbacks:
+            callback(settings)
+        print("[+] Config and certificates reloaded")
+        return True
+
+    def watched_files(self) -> dict:
+        """
+        Returns the modification time of the config and certificate files
+
+        Returns:
+            dict : path to st_mtime_ns, or None if the file is missing
+        """
+        settings = self._settings or {}
+        paths = [self.path, settings.get("PUBLIC_CERT_PATH"), settings.get("PRIVATE_CERT_PATH")]
+        mtimes = {}
+        for path in filter(None, paths):
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                mtimes[path] = None
+        return mtimes
+
+    def watch(self, interval: float = 2.0) -> None:
+        """
+        Starts a daemon thread that reloads the config whenever the
+        config or certificate files change
+
+        Args:
+            interval (float) : seconds between checks
+        """
+        if self._watcher:
+            return
+
+        def poll() -> None:
+            last = self.watched_files()
+            while not self._stop.wait(interval):
+                current = self.watched_files()
+                if current != last:
+                    self.reload()
+                    last = self.watched_files()
+
+        self._watcher = Thread(target=poll, daemon=True)
+        self._watcher.start()
+
+    def install_sighup(self) -> bool:
+        """
+        Reloads the config when the process receives SIGHUP. The reload
+        runs on its own thread so the handler never waits on a lock held
+        by the interrupted code. Must be called from the main thread
+
+        Returns:
+            bool : True if the handler was installed
+        """
+        if not hasattr(signal, "SIGHUP"):
+            return False
+        signal.signal(signal.SIGHUP, lambda signum, frame: Thread(target=self.reload, daemon=True).start())
+        return True
+
+    def close(self) -> None:
+        """
+        Stops the file watcher thread
+        """
+        self._stop.set()
+
+
+_config = None
+
+
+def get_config() -> LobbitConfig:
+    """
+    Returns the process wide LobbitConfig instance
+
+    Returns:
+        LobbitConfig : the shared config
+    """
+    global _config
+    if _config is None:
+        _config = LobbitConfig()
+    return _config
@@ -0,0 +1,98 @@
+import os
+import socket
+import ssl
+
+
+def enable_ktls(context: ssl.SSLContext) -> bool:
+    """
+    Asks OpenSSL to hand record encryption and decryption to the Linux
+    kernel (kTLS) for sockets wrapped by <context>. Requires Python 3.12+
+    built against OpenSSL 3 and the kernel 'tls' module, and is only
+    used if the negotiated cipher is supported by the kernel
+
+    Args:
+        context (ssl.SSLContext) : the context to enable kTLS on
+    Returns:
+        bool : True if the option could be set, False if not supported
+    """
+    option = getattr(ssl, "OP_ENABLE_KTLS", None)
+    if option is None:
+        return False
+    context.options |= option
+    return True
+
+
+def _uses_ktls(sock: socket.socket, check: str) -> bool:
+    """
+    Calls one of the private SSLObject kTLS checks if it is available
+
+    Args:
+        sock (socket.socket) : the socket to check
+        check (str)          : name of the SSLObject method to call
+    Returns:
+        bool : result of the check or False for plain sockets
+    """
+    method = getattr(getattr(sock, "_sslobj", None), check, None)
+    try:
+        return bool(method and method())
+    except (ValueError, OSError):
+        return False
+
+
+def ktls_send(sock: socket.socket) -> bool:
+    """
+    Checks whether the kernel encrypts data written to <sock>, in which
+    case <SSLSocket.sendfile> uses a zero-copy <os.sendfile>
+
+    Args:
+        sock (socket.socket) : the socket to check
+    Returns:
+        bool : True if kTLS is used for sending
+    """
+    return _uses_ktls(sock, "uses_ktls_for_send")
+
+
+def ktls_recv(sock: socket.socket) -> bool:
+    """
+    Checks whether the kernel decrypts data read from <sock>, in which
+    case plaintext can be spliced straight out of the socket
+
+    Args:
+        sock (socket.socket) : the socket to check
+    Returns:
+        bool : True if kTLS is used for receiving
+    """
+    return _uses_ktls(sock, "uses_ktls_for_recv")
+
+
+def can_splice(sock: socket.socket) -> bool:
+    """
+    Checks whether data read from the file descriptor of <sock> is
+    plaintext that can be moved into a file with <os.splice>
+
+    Args:
+        sock (socket.socket) : the socket to check
+    Returns:
+        bool : True if splice can be used
+    """
+    if not hasattr(os, "splice") or not isinstance(sock, socket.socket):
+        return False
+    if isinstance(sock, ssl.SSLSocket):
+        return ktls_recv(sock)
+    return True
+
+
+def can_sendfile(sock: socket.socket) -> bool:
+    """
+    Checks whether files can be written to <sock> with a zero-copy
+    <os.sendfile>, which is the case for plain sockets and when the
+    kernel encrypts TLS (kTLS)
+
+    Args:
+        sock (socket.socket) : the socket to check
+    Returns:
+        bool : True if sendfile can be used
+    """
+    if isinstance(sock, ssl.SSLSocket):
+        return ktls_send(sock)
+    return hasattr(os, "sendfile") and isinstance(sock, socket.socket)
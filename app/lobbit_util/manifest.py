@@ -0,0 +1,62 @@
+import struct
+import zlib
+
+from typing import List, Tuple
+
+# fixed part of a manifest entry, the size, modified time in nanoseconds
+# and length of the UTF-8 upload name that follows it
+ENTRY = struct.Struct("!QqH")
+# files per manifest frame, the server answers each frame with a bitmap
+BATCH_SIZE = 4096
+# largest frame before or after decompression, bounds the memory one frame can take
+MAX_FRAME = 16 * 1024 * 1024
+# names repeat their directories from entry to entry, the fastest level
+# already takes most of that out
+LEVEL = 1
+
+
+def encode_frame(entries: List[Tuple[str, int, int]]) -> bytes:
+    """
+    Packs manifest entries into a compressed frame
+
+    Args:
+        entries (List[Tuple[str, int, int]]) : the upload name, size and
+                                               modified time of each file
+    Returns:
+        bytes : the frame
+    """
+    parts = []
+    for name, size, mtime in entries:
+        raw = name.encode("utf-8")
+        parts.append(ENTRY.pack(size, mtime, len(raw)))
+        parts.append(raw)
+    return zlib.compress(b"".join(parts), LEVEL)
+
+
+def decode_frame(frame: bytes) -> List[Tuple[str, int, int]]:
+    """
+    Unpacks a frame made by <encode_frame>
+
+    Args:
+        frame (bytes) : the frame
+    Returns:
+        List[Tuple[str, int, int]] : the upload name, size and modified time of each file
+    """
+    inflater = zlib.decompressobj()
+    try:
+        data = inflater.decompress(frame, MAX_FRAME)
+    except zlib.error as e:
+        raise ValueError(f"Invalid manifest frame: {e}")
+    if inflater.unconsumed_tail or not inflater.eof:
+        raise ValueError(f"Manifest frame is truncated or larger than {MAX_FRAME} bytes")
+    entries = []
+    pos = 0
+    while pos < len(data):
+        if pos + ENTRY.size > len(data):
+            raise ValueError("Manifest entry cut short")
+        size, mtime, length = ENTRY.unpack_from(data, pos)
+        pos += ENTRY.size + length
+        if pos > len(data):
+            raise ValueError("Manifest entry cut short")
+        entries.append((data[pos - length:pos].decode("utf-8"), size, mtime))
+    return entries
@@ -0,0 +1,560 @@
+import heapq
+import itertools
+import select
+import socket
+import ssl
+import struct
+
+from app.lobbit_util.buffer import Buffer
+from collections import deque
+from threading import Condition, Lock, Thread
+from typing import Callable, Union
+
+# header of every frame: stream id, frame type and payload length
+FRAME = struct.Struct("!IBI")
+# payload is the next bytes of the stream
+DATA = 0
+# the sender will send nothing more on the stream, on stream 0 it ends the session
+CLOSE = 1
+# payload is CREDIT, more bytes the receiver will accept on the stream
+WINDOW = 2
+CREDIT = struct.Struct("!I")
+# largest payload per frame, small enough for urgent streams to cut in quickly
+MAX_FRAME = 256 * 1024
+# bytes a peer may send on a stream before the receiver grants it more
+STREAM_WINDOW = 4 * 1024 * 1024
+# streams a peer may have open on one session
+MAX_STREAMS = 64
+# bytes read from the connection at a time
+READ_SIZE = 256 * 1024
+# seconds between checks for a closed session while the connection is quiet
+POLL_INTERVAL = 0.5
+
+
+class PriorityGate:
+    """
+    Lock granted to the waiter with the highest priority, waiters with
+    the same priority are served in arrival order so streams of equal
+    priority share the connection frame by frame
+    """
+
+    def __init__(self) -> None:
+        """
+        Constructor for the PriorityGate class
+        """
+        self._cond = Condition()
+        self._held = False
+        self._waiters = []
+        self._counter = itertools.count()
+
+    def acquire(self, priority: int) -> None:
+        """
+        Waits until the gate is free and no waiter outranks this one
+
+        Args:
+            priority (int) : higher priorities are granted first
+        """
+        with self._cond:
+            entry = (-priority, next(self._counter))
+            heapq.heappush(self._waiters, entry)
+            while self._held or self._waiters[0] != entry:
+                self._cond.wait()
+            heapq.heappop(self._waiters)
+            self._held = True
+
+    def release(self) -> None:
+        """
+        Frees the gate for the next waiter
+        """
+        with self._cond:
+            self._held = False
+            self._cond.notify_all()
+
+
+class Stream:
+    """
+    A logical connection carried by a MuxSession. It behaves like a
+    blocking socket for Buffer and FileSender: data written with
+    <sendall> is framed and interleaved with the other streams of the
+    session, data for the stream is queued by the session's reader
+    until <recv> is called. A sender waits for credit once it has sent
+    STREAM_WINDOW bytes the receiver has not read yet, so the reader
+    never waits for a stream that is not being read
+    """
+
+    def __init__(self, session: "MuxSession", stream_id: int) -> None:
+        """
+        Constructor for the Stream class
+
+        Args:
+            session (MuxSession) : the session carrying the stream
+            stream_id (int)      : id of the stream within the session
+        """
+        self.session = session
+        self.id = stream_id
+        # frames of streams with a higher priority are sent first
+        self.priority = 0
+        self._cond = Condition()
+        self._chunks = deque()
+        # bytes of the first chunk already read
+        self._offset = 0
+        self._buffered = 0
+        # bytes read here and not yet granted back to the peer
+        self._ungranted = 0
+        # bytes the peer will still accept
+        self._credit = STREAM_WINDOW
+        self._eof = False
+        self._closed = False
+        self._timeout = None
+
+    def settimeout(self, timeout: Union[float, None]) -> None:
+        """
+        Sets the seconds <recv> waits for data before raising TimeoutError
+
+        Args:
+            timeout (Union[float, None]) : seconds to wait, None waits forever
+        """
+        self._timeout = timeout
+
+    def gettimeout(self) -> Union[float, None]:
+        """
+        Returns the seconds <recv> waits for data
+
+        Returns:
+            Union[float, None] : the timeout, None if reads wait forever
+        """
+        return self._timeout
+
+    def feed(self, data: bytes) -> None:
+        """
+        Queues data received for the stream. Called by the session's
+        reader
+
+        Args:
+            data (bytes) : the payload of a DATA frame
+        Raises:
+            ValueError : if the peer sent more than its credit
+        """
+        with self._cond:
+            if self._eof:
+                return
+            if self._buffered + self._ungranted + len(data) > STREAM_WINDOW:
+                raise ValueError(f"Stream {self.id} was sent more than its window")
+            self._chunks.append(data)
+            self._buffered += len(data)
+            self._cond.notify_all()
+
+    def grant(self, credit: int) -> None:
+        """
+        Adds to the bytes the peer will accept, waking any sender.
+        Called by the session's reader
+
+        Args:
+            credit (int) : the payload of a WINDOW frame
+        """
+        with self._cond:
+            self._credit += credit
+            self._cond.notify_all()
+
+    def end(self) -> None:
+        """
+        Marks the end of the data for the stream, waking any reader or
+        sender
+        """
+        with self._cond:
+            self._eof = True
+            self._cond.notify_all()
+
+    def _wait(self) -> bool:
+        """
+        Waits for queued data, must be called with the condition held
+
+        Returns:
+            bool : True if there is data, False at the end of the stream
+        """
+        while not self._chunks and not self._eof:
+            if not self._cond.wait(self._timeout):
+                raise TimeoutError(f"Stream {self.id} timed out")
+        return bool(self._chunks)
+
+    def recv(self, len_bytes: int) -> bytes:
+        """
+        Reads up to len_bytes of the stream
+
+        Args:
+            len_bytes (int) : most bytes to return
+        Returns:
+            bytes : the data, empty at the end of the stream
+        """
+        with self._cond:
+            if not self._wait():
+                return b""
+            chunk = self._chunks[0]
+            data = chunk[self._offset:self._offset + len_bytes]
+            credit = self._consume(len(data), len(chunk))
+        self._send_credit(credit)
+        return data
+
+    def recv_into(self, view: memoryview) -> int:
+        """
+        Reads up to len(view) bytes of the stream into <view>
+
+        Args:
+            view (memoryview) : writable destination for the data
+        Returns:
+            int : number of bytes written, 0 at the end of the stream
+        """
+        with self._cond:
+            if not self._wait():
+                return 0
+            chunk = self._chunks[0]
+            n = min(len(view), len(chunk) - self._offset)
+            view[:n] = chunk[self._offset:self._offset + n]
+            credit = self._consume(n, len(chunk))
+        self._send_credit(credit)
+        return n
+
+    def _consume(self, n: int, chunk_size: int) -> int:
+        """
+        Advances past <n> bytes of the first chunk, must be called with
+        the condition held
+
+        Args:
+            n (int)          : bytes read
+            chunk_size (int) : size of the first chunk
+        Returns:
+            int : credit to grant the peer, 0 until half the window has been read
+        """
+        self._offset += n
+        if self._offset == chunk_size:
+            self._chunks.popleft()
+            self._offset = 0
+        self._buffered -= n
+        self._ungranted += n
+        if self._ungranted < STREAM_WINDOW // 2 or self._closed:
+            return 0
+        credit, self._ungranted = self._ungranted, 0
+        return credit
+
+    def _send_credit(self, credit: int) -> None:
+        """
+        Lets the peer send <credit> more bytes on the stream. The frame
+        goes ahead of data frames, whose priority is at most 0
+
+        Args:
+            credit (int) : bytes read since the last grant, nothing is sent if 0
+        """
+        if not credit:
+            return
+        try:
+            self.session.send_frame(self.id, WINDOW, CREDIT.pack(credit), 1)
+        except OSError:
+            pass
+
+    def _reserve(self, wanted: int) -> int:
+        """
+        Waits until the peer will accept more of the stream and takes
+        credit for the next frame
+
+        Args:
+            wanted (int) : bytes left to send
+        Returns:
+            int : size of the next frame
+        """
+        with self._cond:
+            while self._credit <= 0 and not self._eof and not self.session.closed:
+                self._cond.wait()
+            if self._closed or self._credit <= 0:
+                raise BrokenPipeError(f"Stream {self.id} is closed")
+            size = min(wanted, MAX_FRAME, self._credit)
+            self._credit -= size
+            return size
+
+    def sendall(self, data: bytes) -> None:
+        """
+        Sends <data> on the stream as one or more DATA frames, waiting
+        for credit from the peer when its window is full
+
+        Args:
+            data (bytes) : the data to send
+        """
+        if self._closed:
+            raise BrokenPipeError(f"Stream {self.id} is closed")
+        view = memoryview(data)
+        while view:
+            size = self._reserve(len(view))
+            self.session.send_frame(self.id, DATA, view[:size], self.priority)
+            view = view[size:]
+
+    def shutdown(self, how: int = socket.SHUT_RDWR) -> None:
+        """
+        Ends the stream in both directions, waking any reader
+
+        Args:
+            how (int) : ignored, streams are always shut in both directions
+        """
+        self.end()
+        self.close()
+
+    def close(self) -> None:
+        """
+        Tells the peer nothing more will be sent on the stream
+        """
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.session.send_frame(self.id, CLOSE, b"", self.priority)
+        except OSError:
+            pass
+        self.session.release(self)
+
+
+class MuxSession:
+    """
+    Carries several streams over one connection so a small file never
+    waits behind a large one and no extra handshakes are needed. Frames
+    from the streams are interleaved by priority and a reader splits
+    incoming frames between them. Each stream is flow controlled by
+    WINDOW frames, so at most STREAM_WINDOW bytes are queued for a stream
+    that is not being read and the others keep flowing. Reads and writes
+    on the connection are serialised as an SSLSocket must not be used
+    from two threads at once, but only for one non-blocking call at a
+    time so the reader keeps draining the connection while a writer
+    waits for the peer
+    """
+
+    def __init__(self, buffer: Buffer, on_stream: Callable = None) -> None:
+        """
+        Constructor for the MuxSession class
+
+        Args:
+            buffer (Buffer)      : buffer wrapping the connection, bytes it
+                                   already holds are the start of the first frame
+            on_stream (Callable) : called on its own thread with each Stream the
+                                   peer opens, None if the peer may not open streams
+        """
+        self.buffer = buffer
+        self.sock = buffer.sock
+        self.on_stream = on_stream
+        self.streams = {}
+        self.threads = []
+        self.closed = False
+        self._io = Lock()
+        self._gate = PriorityGate()
+        self._lock = Lock()
+        self._last_id = 0
+        self._seen = set()
+        self._reader = None
+
+    @property
+    def alive(self) -> bool:
+        """
+        True until the session is closed or the connection fails
+        """
+        return not self.closed
+
+    def start(self) -> None:
+        """
+        Starts reading frames on a background thread
+        """
+        self._reader = Thread(target=self.run, daemon=True)
+        self._reader.start()
+
+    def open_stream(self) -> Stream:
+        """
+        Opens a new stream, the peer sees it with its first frame
+
+        Returns:
+            Stream : the new stream
+        """
+        with self._lock:
+            if self.closed:
+                raise ConnectionError("The session is closed")
+            self._last_id += 1
+            stream = self.streams[self._last_id] = Stream(self, self._last_id)
+        return stream
+
+    def release(self, stream: Stream) -> None:
+        """
+        Forgets a stream once it has been closed locally
+
+        Args:
+            stream (Stream) : the closed stream
+        """
+        with self._lock:
+            if self.streams.get(stream.id) is stream:
+                del self.streams[stream.id]
+
+    def send_frame(self, stream_id: int, frame_type: int, payload: Union[bytes, memoryview],
+                   priority: int = 0) -> None:
+        """
+        Sends one frame once no waiting stream outranks <priority>
+
+        Args:
+            stream_id (int)                     : the stream the frame belongs to
+            frame_type (int)                    : DATA, CLOSE or WINDOW
+            payload (Union[bytes, memoryview])  : the frame payload
+            priority (int)                      : priority of the stream
+        """
+        if self.closed:
+            raise BrokenPipeError("The session is closed")
+        header = FRAME.pack(stream_id, frame_type, len(payload))
+        self._gate.acquire(priority)
+        try:
+            if len(payload) < 4096:
+                self.write(header + payload)
+            else:
+                self.write(header)
+                self.write(payload)
+        finally:
+            self._gate.release()
+
+    def write(self, data: Union[bytes, memoryview]) -> None:
+        """
+        Writes all of <data> to the connection, holding it only while
+        each non-blocking send is made
+
+        Args:
+            data (Union[bytes, memoryview]) : the bytes to write
+        """
+        view = memoryview(data)
+        while view:
+            if self.closed:
+                raise BrokenPipeError("The session is closed")
+            with self._io:
+                timeout = self.sock.gettimeout()
+                self.sock.settimeout(0)
+                try:
+                    sent = self.sock.send(view)
+                except (ssl.SSLWantReadError, ssl.SSLWantWriteError, BlockingIOError):
+                    # a TLS record that could not be sent whole is retried
+                    # with the same data
+                    sent = 0
+                finally:
+                    self.sock.settimeout(timeout)
+            view = view[sent:]
+            if view:
+                select.select([], [self.sock], [], POLL_INTERVAL)
+
+    def read(self) -> Union[bytes, None]:
+        """
+        Reads whatever the connection holds without blocking other
+        threads from writing while it waits
+
+        Returns:
+            Union[bytes, None] : the data, None if there is nothing yet, empty if closed
+        """
+        pending = getattr(self.sock, "pending", None)
+        if not (pending and pending()):
+            readable, _, _ = select.select([self.sock], [], [], POLL_INTERVAL)
+            if not readable:
+                return None
+        with self._io:
+            timeout = self.sock.gettimeout()
+            self.sock.settimeout(0)
+            try:
+                data = self.sock.recv(READ_SIZE)
+            except (ssl.SSLWantReadError, ssl.SSLWantWriteError, BlockingIOError):
+                # only a TLS record that carried no data, e.g. a session ticket
+                return None
+            finally:
+                self.sock.settimeout(timeout)
+        self.buffer.received += len(data)
+        return data
+
+    def run(self) -> None:
+        """
+        Reads frames and hands their payloads to the streams until the
+        peer ends the session or the connection fails. Streams still open
+        at the end see the end of their data
+        """
+        pending = bytearray(self.buffer.buffer)
+        self.buffer.buffer = b""
+        try:
+            while not self.closed:
+                while len(pending) >= FRAME.size:
+                    stream_id, frame_type, length = FRAME.unpack_from(pending)
+                    if length > MAX_FRAME:
+                        raise ValueError(f"Frame of {length} bytes is larger than {MAX_FRAME}")
+                    if len(pending) < FRAME.size + length:
+                        break
+                    payload = bytes(pending[FRAME.size:FRAME.size + length])
+                    del pending[:FRAME.size + length]
+                    if not self.dispatch(stream_id, frame_type, payload):
+                        return
+                data = self.read()
+                if data == b"":
+                    return
+                if data:
+                    pending += data
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.closed = True
+            with self._lock:
+                streams = list(self.streams.values())
+            for stream in streams:
+                stream.end()
+
+    def dispatch(self, stream_id: int, frame_type: int, payload: bytes) -> bool:
+        """
+        Handles one frame
+
+        Args:
+            stream_id (int)  : the stream the frame belongs to
+            frame_type (int) : DATA, CLOSE or WINDOW
+            payload (bytes)  : the frame payload
+        Returns:
+            bool : False once the peer has ended the session
+        """
+        if stream_id == 0:
+            return frame_type != CLOSE
+        with self._lock:
+            stream = self.streams.get(stream_id)
+            # streams may send their first frames in any order, so a peer's
+            # stream is new until its id has been seen once
+            opened = stream is None and self.on_stream and stream_id not in self._seen and frame_type == DATA
+            if opened:
+                self._seen.add(stream_id)
+                stream = Stream(self, stream_id)
+                refused = len(self.streams) >= MAX_STREAMS
+                if not refused:
+                    self.streams[stream_id] = stream
+        if opened:
+            if refused:
+                # the reader must not wait for the connection to take a frame
+                Thread(target=stream.close, daemon=True).start()
+                return True
+            thread = Thread(target=self.on_stream, args=(stream,), daemon=True)
+            self.threads.append(thread)
+            thread.start()
+        if stream is None:
+            # a frame for a stream that has been closed here
+            return True
+        if frame_type == CLOSE:
+            stream.end()
+        elif frame_type == WINDOW:
+            if len(payload) != CREDIT.size:
+                raise ValueError(f"WINDOW frame of {len(payload)} bytes")
+            stream.grant(CREDIT.unpack(payload)[0])
+        else:
+            stream.feed(payload)
+        return True
+
+    def close(self, timeout: float = None) -> None:
+        """
+        Ends the session, waiting up to <timeout> seconds for the peer
+        to close the connection if the reader runs in the background
+
+        Args:
+            timeout (float) : seconds to wait for the reader
+        """
+        if not self.closed:
+            try:
+                self.send_frame(0, CLOSE, b"")
+            except OSError:
+                pass
+        if self._reader:
+            self._reader.join(timeout)
+        self.closed = True
@@ -0,0 +1,69 @@
+import os
+
+from typing import Union
+
+
+def safe_join(root: str, name: str) -> Union[str, None]:
+    """
+    Resolves the relative upload name sent by a client to a path under
+    <root>. Names that are absolute or that contain empty, '.' or '..'
+    components are rejected so a client can never write outside of
+    the upload directory
+
+    Args:
+        root (str) : the upload directory
+        name (str) : '/' separated relative path sent by the client
+    Returns:
+        Union[str, None] : the absolute destination path or None if the
+                           name is not safe
+    """
+    if not name or name.startswith("/") or "\\" in name or "\x00" in name:
+        return None
+    parts = name.split("/")
+    if any(part in ("", ".", "..") for part in parts):
+        return None
+    root = os.path.abspath(root)
+    path = os.path.join(root, *parts)
+    if os.path.commonpath([root, path]) != root:
+        return None
+    return path
+
+
+def sync_dir(path: str) -> None:
+    """
+    Flushes the directory <path> to disk, so the names of the files
+    created or renamed in it survive a crash along with their data.
+    Skipped on platforms that can't open a directory
+
+    Args:
+        path (str) : the directory
+    """
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def make_dirs(path: str) -> None:
+    """
+    Creates the directory <path> and any missing parents like
+    os.makedirs, flushing the entry of each new directory to disk
+
+    Args:
+        path (str) : the directory
+    """
+    missing = []
+    while path and not os.path.isdir(path):
+        missing.append(path)
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    if not missing:
+        return
+    os.makedirs(missing[0], exist_ok=True)
+    for directory in reversed(missing):
+        sync_dir(os.path.dirname(directory) or ".")
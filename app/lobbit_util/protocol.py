@@ -0,0 +1,132 @@
+from app.lobbit_util.buffer import Buffer
+from typing import Tuple
+
+# Each file is sent as three null terminated UTF-8 fields, the relative
+# name, the total size and the offset the data starts at, followed by
+# <size - offset> bytes of data. An empty name ends the connection.
+#
+# The server replies with a status and the number of bytes of the file
+# committed to disk. ACK is sent after every ACK_INTERVAL bytes and one
+# final status is sent once the data for the file has been consumed.
+#
+# A file sent with the offset field set to DEDUP is sent as content
+# defined chunks, see cdc. The header is followed by the number of chunks
+# as a UTF-8 field and the manifest of their digests and lengths. The
+# server replies NEED with the number of chunks it does not already hold
+# followed by a bitmap flagging them, or with a final status if the file
+# is refused. The client sends the flagged chunks in order and the server
+# sends the final status once the file has been rebuilt from its chunks.
+#
+# A file with holes is sent with the offset field set to SPARSE, followed
+# by the offset, the number of data extents after it and the extent map,
+# see sparse. Only the bytes of the extents follow and the server leaves
+# the gaps between them as holes. Committed offsets count the holes.
+#
+# Data of unknown length, e.g. read from a pipe, is sent with the offset
+# field set to CHUNKED and the size field set to 0. The header is followed
+# by chunks, each a UTF-8 field holding its length and that many bytes, of
+# up to MAX_CHUNK bytes. A chunk length of 0 ends the data and the final
+# status holds its size. A chunk length of ABORT means the source failed,
+# the server drops the data received and replies ERR_SOURCE. Streams are
+# always sent whole, they can't be resumed.
+#
+# The offset field of a file may be preceded by MTIME and the modified
+# time of the client's copy in nanoseconds, which the server keeps in its
+# catalog for SYNC requests.
+#
+# The offset field of a plain or SPARSE file may be preceded by EXPECT,
+# asking the server to admit the file before its data is sent. The server
+# replies CONTINUE once the file has room on disk and can be written, or
+# with a final status, ERR_SPACE if the disk is too full, in which case
+# no data follows. Files sent without EXPECT are refused the same way but
+# their data, already on its way, is read and dropped by the server.
+#
+# A name starting with REQUEST is a request instead of a file, no upload
+# name can start with it. LIST is followed by a GLOB pattern, the last
+# name of the previous page and the page size as UTF-8 fields, and is
+# answered with one UTF-8 field holding a JSON page of the server's
+# catalog of received files.
+#
+# SYNC is followed by frames of the client's file manifest, see manifest,
+# each a UTF-8 field holding its length and that many bytes. The server
+# answers every frame with NEED and the number of its files that the
+# catalog does not hold with the same size and modified time, followed by
+# a bitmap flagging them if there are any. A frame length of 0 ends the
+# manifest and the server replies OK with the number of files compared.
+#
+# MUX asks the server to carry several logical streams over the
+# connection, see mux. The server replies OK and from then on the
+# connection only carries frames. Each stream carries files and requests
+# exactly as a connection does and ends with an empty name.
+
+ACK = "ack"
+NEED = "need"
+CONTINUE = "continue"
+OK = "ok"
+ERR_NAME = "err-name"
+ERR_OFFSET = "err-offset"
+ERR_OPEN = "err-open"
+# a write failed part way through the data, the server closes the connection
+ERR_IO = "err-io"
+# the client could not read the data it was streaming
+ERR_SOURCE = "err-source"
+# the file does not fit in the space left on the server's disk
+ERR_SPACE = "err-space"
+
+FINAL = (OK, ERR_NAME, ERR_OFFSET, ERR_OPEN, ERR_IO, ERR_SOURCE, ERR_SPACE)
+RETRYABLE = (ERR_OFFSET, ERR_IO)
+
+# offset field marking a file sent as content defined chunks
+DEDUP = "cdc"
+# offset field marking a file sent as data extents
+SPARSE = "sparse"
+# offset field marking data of unknown length sent as chunks
+CHUNKED = "chunked"
+# field before the offset asking the server to admit a file before its data
+EXPECT = "expect"
+# field before the offset followed by the modified time of the client's copy
+MTIME = "mtime"
+# chunk length field marking a stream whose source failed
+ABORT = "abort"
+
+REQUEST = "/"
+LIST = "/list"
+MUX = "/mux"
+SYNC = "/sync"
+
+# bytes committed by the server between ACK messages
+ACK_INTERVAL = 1024 * 1024
+# bytes of unacknowledged data a client keeps in flight per connection
+DEFAULT_WINDOW = 16 * ACK_INTERVAL
+# files awaiting a final status per connection, bounds the unread replies
+MAX_IN_FLIGHT = 256
+# largest chunk of a CHUNKED stream
+MAX_CHUNK = 16 * 1024 * 1024
+
+
+def send_status(buffer: Buffer, status: str, offset: int) -> None:
+    """
+    Sends a status reply for the current file
+
+    Args:
+        buffer (Buffer) : buffer wrapping the connection
+        status (str)    : one of the status codes above
+        offset (int)    : bytes of the file committed to disk
+    """
+    buffer.put_utf8(f"{status} {offset}")
+
+
+def recv_status(buffer: Buffer) -> Tuple[str, int]:
+    """
+    Reads a status reply sent by <send_status>
+
+    Args:
+        buffer (Buffer) : buffer wrapping the connection
+    Returns:
+        Tuple[str, int] : the status code and committed offset
+    """
+    reply = buffer.get_utf8()
+    if not reply:
+        raise ConnectionError("Connection closed by the server")
+    status, _, offset = reply.partition(" ")
+    return status, int(offset or 0)
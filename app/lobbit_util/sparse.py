@@ -0,0 +1,83 @@
+import errno
+import os
+import struct
+
+from typing import List, Tuple, Union
+
+# one entry of an extent map, the start and length of a run of data
+EXTENT = struct.Struct("!QQ")
+# extents sent for one file, files more fragmented than this are sent whole
+MAX_EXTENTS = 1 << 20
+
+
+def data_extents(fd: int, start: int, end: int) -> Union[List[Tuple[int, int]], None]:
+    """
+    Finds the runs of data between <start> and <end> of a file with
+    SEEK_DATA and SEEK_HOLE, skipping the holes. Filesystems without
+    hole support report the whole file as one extent
+
+    Args:
+        fd (int)    : file descriptor of the open file
+        start (int) : offset to search from
+        end (int)   : offset to search to, normally the file size
+    Returns:
+        Union[List[Tuple[int, int]], None] : the start and length of each
+                                             extent, or None if holes can't be
+                                             found or there are too many extents
+    """
+    if not hasattr(os, "SEEK_DATA"):
+        return None
+    extents = []
+    pos = start
+    try:
+        while pos < end:
+            try:
+                data = os.lseek(fd, pos, os.SEEK_DATA)
+            except OSError as e:
+                if e.errno == errno.ENXIO:
+                    # only a hole is left
+                    break
+                raise
+            if data >= end:
+                break
+            hole = min(os.lseek(fd, data, os.SEEK_HOLE), end)
+            extents.append((data, hole - data))
+            if len(extents) > MAX_EXTENTS:
+                return None
+            pos = hole
+    except OSError:
+        return None
+    return extents
+
+
+def encode_extents(extents: List[Tuple[int, int]]) -> bytes:
+    """
+    Packs an extent map to send to the server
+
+    Args:
+        extents (List[Tuple[int, int]]) : extents from <data_extents>
+    Returns:
+        bytes : the extent map
+    """
+    return b"".join(EXTENT.pack(start, length) for start, length in extents)
+
+
+def decode_extents(data: bytes, start: int, end: int) -> List[Tuple[int, int]]:
+    """
+    Unpacks an extent map sent by a client, checking the extents are in
+    order, do not overlap and lie between <start> and <end>
+
+    Args:
+        data (bytes) : the extent map
+        start (int)  : offset the data starts at
+        end (int)    : size of the file
+    Returns:
+        List[Tuple[int, int]] : the start and length of each extent
+    """
+    extents = list(EXTENT.iter_unpack(data))
+    pos = start
+    for extent_start, length in extents:
+        if extent_start < pos or not length or extent_start + length > end:
+            raise ValueError(f"Invalid extent ({extent_start}, {length}) in extent map")
+        pos = extent_start + length
+    return extents
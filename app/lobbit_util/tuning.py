@@ -0,0 +1,301 @@
+import functools
+import socket
+import struct
+import time
+
+from threading import Lock
+from typing import Callable, Tuple, Union
+
+# settings limiting the tuner and their defaults, 0 turns socket buffer tuning off
+DEFAULT_LIMITS = {
+    "SOCKET_BUFFER_MAX": 32 * 1024 * 1024,
+    "CHUNK_SIZE_MIN": 64 * 1024,
+    "CHUNK_SIZE_MAX": 8 * 1024 * 1024,
+}
+# seconds between measurements of a connection
+SAMPLE_INTERVAL = 0.5
+# a longer gap between measurements means the connection sat idle, e.g.
+# between files, so it starts a new measurement instead of lowering the rate
+IDLE_GAP = 4 * SAMPLE_INTERVAL
+# a chunk holds about this many seconds of data at the measured rate, so
+# fast links make few large writes and slow ones keep flow control fine grained
+CHUNK_TIME = 0.01
+# offset of tcpi_rtt, the smoothed round trip time in microseconds, in
+# the Linux struct tcp_info: 8 one byte fields then 15 unsigned ints
+TCP_INFO_RTT = struct.Struct("I")
+TCP_INFO_RTT_OFFSET = 8 + 15 * 4
+# Linux settings bounding the socket buffer of each direction, the size TCP
+# autotuning grows a buffer to and the cap on a size set with setsockopt
+BUFFER_SYSCTLS = {
+    socket.SO_SNDBUF: ("/proc/sys/net/ipv4/tcp_wmem", "/proc/sys/net/core/wmem_max"),
+    socket.SO_RCVBUF: ("/proc/sys/net/ipv4/tcp_rmem", "/proc/sys/net/core/rmem_max"),
+}
+
+
+def read_limits(settings: dict, log: Callable = print) -> dict:
+    """
+    Returns the tuning limits in <settings>, falling back to
+    DEFAULT_LIMITS for any that are missing or invalid
+
+    SOCKET_BUFFER_MAX : largest SO_SNDBUF / SO_RCVBUF set on a connection
+    CHUNK_SIZE_MIN    : smallest number of bytes read or written at a time
+    CHUNK_SIZE_MAX    : largest number of bytes read or written at a time
+
+    Args:
+        settings (dict) : the settings from config.json
+        log (Callable)  : called with a message for each invalid setting
+    Returns:
+        dict : the limits
+    """
+    limits = {}
+    for key, default in DEFAULT_LIMITS.items():
+        value = settings.get(key, default)
+        if not isinstance(value, int) or isinstance(value, bool) or value < 0 or \
+                (key.startswith("CHUNK") and value < 4096):
+            log(f"[-] Invalid {key} '{value}', using {default}")
+            value = default
+        limits[key] = value
+    if limits["CHUNK_SIZE_MIN"] > limits["CHUNK_SIZE_MAX"]:
+        log(f"[-] CHUNK_SIZE_MIN is larger than CHUNK_SIZE_MAX, using {limits['CHUNK_SIZE_MAX']} for both")
+        limits["CHUNK_SIZE_MIN"] = limits["CHUNK_SIZE_MAX"]
+    return limits
+
+
+def set_nodelay(sock: socket.socket) -> None:
+    """
+    Turns off Nagle's algorithm on a TCP connection so the short status
+    replies and request headers are sent at once instead of waiting for
+    the peer's delayed ACK. Other sockets are left alone
+
+    Args:
+        sock (socket.socket) : the connection
+    """
+    if isinstance(sock, socket.socket) and sock.family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            pass
+
+
+def tcp_rtt(sock: socket.socket) -> Union[float, None]:
+    """
+    Returns the kernel's smoothed round trip time of a TCP connection
+
+    Args:
+        sock (socket.socket) : the connection
+    Returns:
+        Union[float, None] : seconds, or None if not known on this platform
+    """
+    if not hasattr(socket, "TCP_INFO") or not isinstance(sock, socket.socket) or \
+            sock.family not in (socket.AF_INET, socket.AF_INET6):
+        return None
+    try:
+        info = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, TCP_INFO_RTT_OFFSET + TCP_INFO_RTT.size)
+    except OSError:
+        return None
+    if len(info) < TCP_INFO_RTT_OFFSET + TCP_INFO_RTT.size:
+        return None
+    rtt = TCP_INFO_RTT.unpack_from(info, TCP_INFO_RTT_OFFSET)[0]
+    return rtt / 1000000 if rtt else None
+
+
+@functools.lru_cache(maxsize=None)
+def kernel_buffer_limits(option: int) -> Tuple[Union[int, None], Union[int, None]]:
+    """
+    Reads how large the kernel lets a socket buffer grow by itself and
+    how large one can be set
+
+    Args:
+        option (int) : socket.SO_SNDBUF or SO_RCVBUF
+    Returns:
+        Tuple[Union[int, None], Union[int, None]] : the autotuning maximum and the
+                                                    setsockopt cap, None where unknown
+    """
+    limits = []
+    for path in BUFFER_SYSCTLS.get(option, (None, None)):
+        try:
+            with open(path) as f:
+                # tcp_wmem and tcp_rmem hold the minimum, default and maximum
+                limits.append(int(f.read().split()[-1]))
+        except (OSError, TypeError, ValueError, IndexError):
+            limits.append(None)
+    return limits[0], limits[1]
+
+
+def power_of_two(n: float, low: int, high: int) -> int:
+    """
+    Rounds <n> down to a power of two between <low> and <high>
+
+    Args:
+        n (float)  : the size wanted
+        low (int)  : smallest size returned
+        high (int) : largest size returned
+    Returns:
+        int : the size
+    """
+    size = 1 << (int(n).bit_length() - 1) if n >= 1 else 1
+    return max(low, min(high, size))
+
+
+def megabytes(n: float) -> str:
+    """
+    Formats a byte count for the tuning messages
+
+    Args:
+        n (float) : bytes
+    Returns:
+        str : the count in MB, or KB below 1 MB
+    """
+    return f"{n / 1048576:.1f} MB" if n >= 1048576 else f"{n / 1024:.0f} KB"
+
+
+class Tuner:
+    """
+    Measures the round trip time and throughput of one connection while
+    data moves and sizes its chunks and socket buffers to match. The
+    socket buffer in the direction data flows is raised to hold a few
+    bandwidth-delay products so a long link is not limited by its window,
+    and chunks hold about CHUNK_TIME seconds of data. Setting a buffer
+    turns the kernel's autotuning off for the socket, so it is only set
+    when the size that can be set is beyond what autotuning would reach
+    by itself, and every value stays within the configured limits
+    """
+
+    def __init__(self, sock: socket.socket, option: int, counter: Callable, limits: dict = None,
+                 name: str = "", chunk_size: int = None, log: Callable = None) -> None:
+        """
+        Constructor for the Tuner class
+
+        Args:
+            sock (socket.socket) : the connection, or a stream over one
+            option (int)         : socket.SO_SNDBUF when sending, SO_RCVBUF when receiving
+            counter (Callable)   : returns the bytes moved on the connection so far
+            limits (dict)        : limits from <read_limits>, defaults to DEFAULT_LIMITS
+            name (str)           : name of the connection used in the log
+            chunk_size (int)     : chunk size used until the first measurement
+            log (Callable)       : called with a message whenever the values change
+        """
+        self.sock = sock
+        self.option = option
+        self.counter = counter
+        self.limits = limits or DEFAULT_LIMITS
+        self.name = name
+        self.log = log or (lambda msg: None)
+        self.chunk_size = power_of_two(chunk_size or self.limits["CHUNK_SIZE_MIN"],
+                                       self.limits["CHUNK_SIZE_MIN"], self.limits["CHUNK_SIZE_MAX"])
+        self.buffer_size = self.current_buffer()
+        self.rtt = None
+        self.rate = None
+        self._last = None
+        self._lock = Lock()
+
+    def current_buffer(self) -> Union[int, None]:
+        """
+        Returns the size of the socket buffer being tuned
+
+        Returns:
+            Union[int, None] : bytes, or None if it can't be tuned
+        """
+        if not isinstance(self.sock, socket.socket):
+            return None
+        try:
+            return self.sock.getsockopt(socket.SOL_SOCKET, self.option)
+        except OSError:
+            return None
+
+    def update(self) -> bool:
+        """
+        Measures the connection and retunes it, at most once per
+        SAMPLE_INTERVAL. Called as data moves, from any thread using
+        the connection
+
+        Returns:
+            bool : True if the chunk size or socket buffer changed
+        """
+        now = time.perf_counter()
+        if self._last and now - self._last[0] < SAMPLE_INTERVAL:
+            return False
+        with self._lock:
+            return self.measure(now)
+
+    def measure(self, now: float) -> bool:
+        """
+        Takes one measurement and retunes the connection
+
+        Args:
+            now (float) : the time of the measurement
+        Returns:
+            bool : True if the chunk size or socket buffer changed
+        """
+        transferred = self.counter()
+        last, self._last = self._last, (now, transferred)
+        if last is None or now - last[0] > IDLE_GAP:
+            return False
+        rate = (transferred - last[1]) / (now - last[0])
+        if rate <= 0:
+            return False
+        # smoothed so one slow moment, e.g. the disk flushing, doesn't undo the tuning
+        self.rate = rate if self.rate is None else (self.rate + rate) / 2
+        self.rtt = tcp_rtt(self.sock) or self.rtt
+        changed = self.tune_chunk()
+        changed = self.tune_buffer() or changed
+        if changed:
+            rtt = f"RTT {self.rtt * 1000:.2f} ms, " if self.rtt else ""
+            buffer = f"socket buffer {megabytes(self.buffer_size)}, " if self.buffer_size else ""
+            self.log(f"[+] Tuned '{self.name}': {rtt}{megabytes(self.rate)}/s, "
+                     f"{buffer}chunks {megabytes(self.chunk_size)}")
+        return changed
+
+    def tune_chunk(self) -> bool:
+        """
+        Sizes chunks to hold CHUNK_TIME seconds of data at the measured
+        rate. Chunks shrink only once the rate has fallen to a quarter of
+        what they were sized for, so a rate near a power of two doesn't
+        flip the size back and forth
+
+        Returns:
+            bool : True if the chunk size changed
+        """
+        size = power_of_two(self.rate * CHUNK_TIME, self.limits["CHUNK_SIZE_MIN"], self.limits["CHUNK_SIZE_MAX"])
+        if size > self.chunk_size or size <= self.chunk_size // 4:
+            self.chunk_size = size
+            return True
+        return False
+
+    def tune_buffer(self) -> bool:
+        """
+        Raises the socket buffer to four bandwidth-delay products. A
+        connection held back by its window measures a bandwidth-delay
+        product of about half the buffer, so the buffer doubles until the
+        rate stops growing or SOCKET_BUFFER_MAX is reached. The buffer is
+        left to the kernel while its autotuning maximum (tcp_wmem or
+        tcp_rmem) covers the size wanted, or is above the size the
+        wmem_max or rmem_max cap allows to be set
+
+        Returns:
+            bool : True if the buffer was raised
+        """
+        if not self.rtt or not self.buffer_size or not self.limits["SOCKET_BUFFER_MAX"]:
+            return False
+        wanted = min(4 * self.rate * self.rtt, self.limits["SOCKET_BUFFER_MAX"])
+        autotune, cap = kernel_buffer_limits(self.option)
+        if cap:
+            # the kernel doubles the size set, up to twice the cap
+            wanted = min(wanted, 2 * cap)
+        if wanted <= self.buffer_size or autotune and wanted <= autotune:
+            return False
+        try:
+            # doubled by the kernel to account for its bookkeeping
+            self.sock.setsockopt(socket.SOL_SOCKET, self.option, int(wanted) // 2)
+        except OSError:
+            return False
+        size = self.current_buffer() or self.buffer_size
+        changed, self.buffer_size = size > self.buffer_size, size
+        return changed
+
+    @property
+    def bdp(self) -> int:
+        """
+        The bandwidth-delay product last measured, 0 until measured
+        """
+        return int(self.rate * self.rtt) if self.rate and self.rtt else 0
@@ -0,0 +1,202 @@
+import glob
+import os
+import queue
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock
+from typing import Iterator, List, Tuple
+
+
+class TreeWalker:
+    """
+    Expands a list of file paths, directories and glob patterns into
+    the individual files they contain. Directories are scanned with
+    <os.scandir> across a thread pool and discovered files are yielded
+    lazily, so callers can start work before the walk has finished
+    """
+
+    # sentinel placed on the queue once every scan has completed
+    DONE = None
+
+    def __init__(self, sources: List, workers: int = 8, max_pending: int = 1024) -> None:
+        """
+        Constructor for the TreeWalker class
+
+        Args:
+            sources (List)    : file paths, directory paths or glob patterns
+            workers (int)     : number of threads used to scan directories
+            max_pending (int) : maximum number of directory batches held in
+                                memory before the scanning threads wait
+        """
+        self.sources = sources
+        self.workers = workers
+        self.errors = []
+        self._results = queue.Queue(maxsize=max_pending)
+        self._stop = Event()
+        self._lock = Lock()
+        self._outstanding = 0
+        self._executor = None
+
+    @staticmethod
+    def upload_name(*parts: str) -> str:
+        """
+        Joins path components into the '/' separated relative name
+        that is sent to the server
+
+        Args:
+            parts (str) : path components to join
+        Returns:
+            str : the relative upload name
+        """
+        return "/".join(p.replace(os.sep, "/").strip("/") for p in parts if p)
+
+    @staticmethod
+    def glob_root(pattern: str) -> str:
+        """
+        Returns the directory a glob pattern searches from, made of the
+        components before the first one with a wildcard
+
+        Args:
+            pattern (str) : the glob pattern
+        Returns:
+            str : absolute path of the directory
+        """
+        root = pattern
+        while glob.has_magic(root):
+            root = os.path.dirname(root)
+        return os.path.abspath(root or os.curdir)
+
+    def expand(self, source: str) -> Iterator[Tuple[str, str, bool]]:
+        """
+        Expands a single source into (path, upload name, is directory)
+        tuples, directories still need scanning. A file or directory is
+        named by its base name, glob matches by their path below the
+        pattern's <glob_root>, so matches in different directories keep
+        apart on the server
+
+        Args:
+            source (str) : file path, directory path or glob pattern
+        Returns:
+            Iterator[Tuple[str, str, bool]] : matched paths, their upload names and
+                                              whether they are directories
+        """
+        root = None
+        if glob.has_magic(source) and not os.path.exists(source):
+            matches = glob.iglob(source, recursive=True)
+            root = TreeWalker.glob_root(source)
+        else:
+            matches = [source]
+        found = False
+        for match in matches:
+            path = os.path.abspath(match)
+            name = os.path.basename(path)
+            if root and path != root:
+                name = TreeWalker.upload_name(os.path.relpath(path, root))
+            if os.path.isdir(path):
+                found = True
+                yield path, name, True
+            elif os.path.isfile(path):
+                found = True
+                yield path, name, False
+        if not found:
+            self.errors.append((source, "No such file or directory"))
+
+    def __iter__(self) -> Iterator[Tuple[str, str]]:
+        """
+        Walks every source and yields each file found as a tuple of
+        (absolute path, relative upload name)
+
+        Returns:
+            Iterator[Tuple[str, str]] : discovered files
+        """
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            with self._lock:
+                self._outstanding += 1
+            for source in self.sources:
+                for path, name, directory in self.expand(source):
+                    if directory:
+                        self._submit(path, name)
+                    else:
+                        yield path, name
+            self._task_done()
+            while True:
+                batch = self._results.get()
+                if batch is TreeWalker.DONE:
+                    break
+                yield from batch
+        finally:
+            self._stop.set()
+            self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def _submit(self, path: str, prefix: str) -> None:
+        """
+        Schedules a directory to be scanned by the thread pool
+
+        Args:
+            path (str)   : absolute path of the directory
+            prefix (str) : upload name of the directory
+        """
+        with self._lock:
+            self._outstanding += 1
+        try:
+            self._executor.submit(self._scan, path, prefix)
+        except RuntimeError:
+            # the pool has been shut down because the consumer stopped
+            self._task_done()
+
+    def _task_done(self) -> None:
+        """
+        Marks one scan as finished and signals the consumer once
+        there is nothing left to scan
+        """
+        with self._lock:
+            self._outstanding -= 1
+            finished = self._outstanding == 0
+        if finished:
+            self._put(TreeWalker.DONE)
+
+    def _put(self, item: object) -> None:
+        """
+        Places an item on the results queue without blocking forever
+        if the consumer has stopped iterating
+
+        Args:
+            item (object) : batch of files or the DONE sentinel
+        """
+        while not self._stop.is_set():
+            try:
+                self._results.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _scan(self, path: str, prefix: str) -> None:
+        """
+        Scans a single directory, scheduling sub-directories for scanning
+        and pushing the files it contains to the consumer as one batch
+
+        Args:
+            path (str)   : absolute path of the directory
+            prefix (str) : upload name of the directory
+        """
+        try:
+            if self._stop.is_set():
+                return
+            batch = []
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    name = TreeWalker.upload_name(prefix, entry.name)
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            self._submit(entry.path, name)
+                        elif entry.is_file():
+                            batch.append((entry.path, name))
+                    except OSError as e:
+                        self.errors.append((entry.path, str(e)))
+            if batch:
+                self._put(batch)
+        except OSError as e:
+            self.errors.append((path, str(e)))
+        finally:
+            self._task_done()
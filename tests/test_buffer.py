@@ -1,6 +1,7 @@
 import os
 import socket
 import sys
+import tempfile
 import unittest
 
 lobbit_app = os.path.join(os.path.abspath(os.path.dirname(__file__)), "../")
@@ -35,3 +36,39 @@ class TestBuffer(unittest.TestCase):
         """
         self.assertEqual(self.client_sock, self.client_buffer.sock)
         self.assertEqual(b'', self.client_buffer.buffer)
+
+    @unittest.skipUnless(hasattr(os, "splice"), "os.splice is only available on Linux")
+    def test_splice_into_moves_buffered_and_socket_bytes(self) -> None:
+        """
+        Tests that splice_into writes bytes already held in the buffer
+        followed by bytes spliced from the socket
+        """
+        left, right = socket.socketpair()
+        buffer = Buffer(left)
+        buffer.buffer = b"head-"
+        right.sendall(b"tail-and-more")
+        with tempfile.TemporaryFile() as f:
+            moved, spliced = buffer.splice_into(f.fileno(), 9)
+            f.seek(0)
+            self.assertEqual(f.read(), b"head-tail")
+        self.assertEqual((moved, spliced), (9, True))
+        self.assertEqual(buffer.get_bytes(8), b"-and-mor")
+        left.close()
+        right.close()
+
+    def test_recv_into_drains_buffer_before_socket(self) -> None:
+        """
+        Tests that recv_into copies held bytes first and then reads
+        from the socket directly into the view
+        """
+        left, right = socket.socketpair()
+        buffer = Buffer(left)
+        buffer.buffer = b"abc"
+        right.sendall(b"defg")
+        target = bytearray(6)
+        view = memoryview(target)
+        self.assertEqual(buffer.recv_into(view), 3)
+        self.assertEqual(buffer.recv_into(view[3:]), 3)
+        self.assertEqual(target, b"abcdef")
+        left.close()
+        right.close()
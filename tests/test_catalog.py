@@ -0,0 +1,114 @@
+import hashlib
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+lobbit_app = os.path.join(os.path.abspath(os.path.dirname(__file__)), "../")
+sys.path.append(lobbit_app)
+
+if lobbit_app in sys.path:
+    from app.lobbit_server.catalog import Catalog, glob_prefix
+
+
+class TestCatalog(unittest.TestCase):
+    """
+    Test class for the server's catalog of received files
+    """
+
+    def setUp(self) -> None:
+        """
+        Initialises test case variables
+        """
+        self.dir = tempfile.TemporaryDirectory()
+        self.catalog = Catalog(os.path.join(self.dir.name, ".lobbit", "catalog.db"))
+
+    def tearDown(self) -> None:
+        """
+        Cleans up after testing
+        """
+        self.catalog.join()
+        self.catalog.close()
+        self.dir.cleanup()
+
+    def write(self, name: str, data: bytes) -> str:
+        """
+        Writes a file to catalog
+
+        Args:
+            name (str)   : name of the file
+            data (bytes) : its contents
+        Returns:
+            str : path of the file
+        """
+        path = os.path.join(self.dir.name, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_files_are_hashed_in_the_background(self) -> None:
+        """
+        Tests that an added file is listed with its size and client and
+        that its SHA-256 is filled in
+        """
+        self.assertTrue(self.catalog.created)
+        self.catalog.add("a.log", self.write("a.log", b"hello"), 5, "10.0.0.1")
+        self.catalog.join()
+        entry = self.catalog.query()[0]
+        self.assertEqual((entry["name"], entry["size"], entry["client"]), ("a.log", 5, "10.0.0.1"))
+        self.assertEqual(entry["sha256"], hashlib.sha256(b"hello").hexdigest())
+
+    def test_pages_follow_name_order_and_pattern(self) -> None:
+        """
+        Tests that pages continue from the previous page's last name and
+        only hold names matching the pattern
+        """
+        names = [f"logs/{i:03d}.log" for i in range(25)] + ["logs/skip.txt", "other/000.log"]
+        self.catalog.add_many((name, "/missing", 1, 0.0) for name in names)
+        seen = []
+        after = ""
+        while True:
+            page = self.catalog.page("logs/*.log", after, 10)
+            seen += [entry["name"] for entry in page["files"]]
+            if not page["next"]:
+                break
+            after = page["next"]
+        self.assertEqual(seen, names[:25])
+        self.assertEqual(self.catalog.add_many([("logs/000.log", "/missing", 2, 0.0)]), 0)
+        self.assertEqual(self.catalog.count(), 27)
+
+    def test_changed_files_are_found_by_size_and_modified_time(self) -> None:
+        """
+        Tests that only files cataloged with the same size and modified
+        time are unchanged, including after an older catalog is upgraded
+        """
+        self.catalog.add("same", "/missing", 5, mtime=100)
+        self.catalog.add("touched", "/missing", 5, mtime=100)
+        self.catalog.add("grown", "/missing", 5, mtime=100)
+        self.catalog.add_many([("unknown", "/missing", 5, 0.0)])
+        entries = [("same", 5, 100), ("touched", 5, 101), ("grown", 6, 100), ("unknown", 5, 100), ("new", 1, 1)]
+        self.assertEqual(self.catalog.changed(entries), [False, True, True, True, True])
+        path = os.path.join(self.dir.name, "old.db")
+        db = sqlite3.connect(path)
+        db.execute("CREATE TABLE files (name TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL, "
+                   "sha256 TEXT, received REAL NOT NULL, client TEXT)")
+        db.execute("INSERT INTO files VALUES ('old', '/missing', 5, NULL, 0, NULL)")
+        db.commit()
+        db.close()
+        old = Catalog(path)
+        old.add("new", "/missing", 1, mtime=1)
+        self.assertEqual(old.changed([("old", 5, 100), ("new", 1, 1)]), [True, False])
+        old.close()
+
+    def test_glob_prefix(self) -> None:
+        """
+        Tests that the literal prefix of a pattern stops at the first wildcard
+        """
+        self.assertEqual(glob_prefix("logs/2024-*.log"), "logs/2024-")
+        self.assertEqual(glob_prefix("*.log"), "")
+        self.assertEqual(glob_prefix("exact"), "exact")
+
+
+if __name__ == '__main__':
+    unittest.main()
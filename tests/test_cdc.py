@@ -0,0 +1,62 @@
+import io
+import os
+import random
+import sys
+import unittest
+
+lobbit_app = os.path.join(os.path.abspath(os.path.dirname(__file__)), "../")
+sys.path.append(lobbit_app)
+
+if lobbit_app in sys.path:
+    from app.lobbit_util import cdc
+
+
+class TestCDC(unittest.TestCase):
+    """
+    Test class for content defined chunking
+    """
+
+    def setUp(self) -> None:
+        """
+        Initialises test case variables
+        """
+        self.data = random.Random(1).randbytes(1024 * 1024)
+
+    def test_chunks_cover_file_within_size_limits(self) -> None:
+        """
+        Tests that the chunks are contiguous, cover the whole file and
+        respect the minimum and maximum sizes
+        """
+        entries = list(cdc.chunks(io.BytesIO(self.data)))
+        offset = 0
+        for _, chunk_offset, length in entries:
+            self.assertEqual(chunk_offset, offset)
+            self.assertLessEqual(length, cdc.MAX_SIZE)
+            offset += length
+        self.assertEqual(offset, len(self.data))
+        self.assertTrue(all(length >= cdc.MIN_SIZE for _, _, length in entries[:-1]))
+
+    def test_insertion_only_changes_nearby_chunks(self) -> None:
+        """
+        Tests that inserting bytes near the start of a file leaves the
+        digests of the later chunks unchanged
+        """
+        before = [digest for digest, _, _ in cdc.chunks(io.BytesIO(self.data))]
+        changed = self.data[:1000] + b"inserted" + self.data[1000:]
+        after = [digest for digest, _, _ in cdc.chunks(io.BytesIO(changed))]
+        self.assertGreaterEqual(len(set(before) & set(after)), len(before) - 2)
+
+    def test_manifest_and_bitmap_round_trip(self) -> None:
+        """
+        Tests that manifests and bitmaps decode to what was encoded
+        """
+        entries = list(cdc.chunks(io.BytesIO(self.data)))
+        manifest = cdc.encode_manifest(entries)
+        self.assertEqual(len(manifest), len(entries) * cdc.ENTRY.size)
+        self.assertEqual(cdc.decode_manifest(manifest), [(digest, length) for digest, _, length in entries])
+        flags = [True, False, False, True, True, False, False, False, True]
+        self.assertEqual(cdc.decode_bitmap(cdc.encode_bitmap(flags), len(flags)), flags)
+
+
+if __name__ == '__main__':
+    unittest.main()
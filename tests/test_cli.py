@@ -0,0 +1,80 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+from io import StringIO
+from unittest.mock import patch
+
+lobbit_app = os.path.join(os.path.abspath(os.path.dirname(__file__)), "../")
+sys.path.append(lobbit_app)
+
+if lobbit_app in sys.path:
+    from app.lobbit_client import cli
+
+
+class TestCLI(unittest.TestCase):
+    """
+    Test cases for the non-interactive lobbit command line
+    """
+
+    def test_read_stream_splits_lines(self) -> None:
+        """
+        Tests that newline separated paths are read from a stream
+        and blank lines are skipped
+        """
+        stream = StringIO("/a/b\n\n/c d/e\r\n")
+        self.assertEqual(list(cli.read_stream(stream)), ["/a/b", "/c d/e"])
+
+    def test_read_stream_splits_null_separated_paths(self) -> None:
+        """
+        Tests that null separated paths are read from a stream
+        """
+        stream = StringIO("/a/b\x00/c\nd\x00/e")
+        self.assertEqual(list(cli.read_stream(stream, null=True)), ["/a/b", "/c\nd", "/e"])
+
+    def test_iter_sources_replaces_dash_with_stream(self) -> None:
+        """
+        Tests that '-' in the file arguments is replaced by the paths
+        read from the stream
+        """
+        sources = cli.iter_sources(["/x", "-", "/y"], StringIO("/a\n/b\n"))
+        self.assertEqual(list(sources), ["/x", "/a", "/b", "/y"])
+
+    def test_upload_returns_connect_exit_code_and_summary(self) -> None:
+        """
+        Tests that a failed connection returns EXIT_CONNECT and a JSON
+        summary is printed to stdout
+        """
+        with patch("sys.stdout", new=StringIO()) as stdout:
+            code = cli.main(["upload", "--host", "127.0.0.1", "--port", "1", "-q", "/x"])
+            self.assertEqual(code, cli.EXIT_CONNECT)
+            self.assertIn('"exit_code": 3', stdout.getvalue())
+
+    def test_sync_with_mirrors_is_a_usage_error(self) -> None:
+        """
+        Tests that --sync is refused with --mirror as the files would only
+        be compared with the first server
+        """
+        with patch("sys.stdout", new=StringIO()), patch("sys.stderr", new=StringIO()) as stderr:
+            code = cli.main(["upload", "--host", "127.0.0.1", "--port", "1", "--sync",
+                             "--mirror", "127.0.0.1:2", "/x"])
+        self.assertEqual(code, cli.EXIT_USAGE)
+        self.assertIn("--sync can't be combined with --mirror", stderr.getvalue())
+
+    def test_queue_add_and_list(self) -> None:
+        """
+        Tests that queued files are listed with their priority and that
+        relative sources are queued as absolute paths
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            db = os.path.join(tmp, "queue.db")
+            with patch("sys.stdout", new=StringIO()):
+                code = cli.main(["queue", "--db", db, "add", "--host", "h", "--port", "1", "-p", "3", "/x", "rel"])
+            self.assertEqual(code, cli.EXIT_OK)
+            with patch("sys.stdout", new=StringIO()) as stdout:
+                cli.main(["queue", "--db", db, "list"])
+            entries = json.loads(stdout.getvalue())
+            self.assertEqual([(e["source"], e["priority"], e["state"]) for e in entries],
+                             [("/x", 3, "pending"), (os.path.abspath("rel"), 3, "pending")])
@@ -1,12 +1,18 @@
+import json
 import os
+import socket
 import sys
+import tempfile
 import unittest
 
+from unittest import mock
+
 lobbit_app = os.path.join(os.path.abspath(os.path.dirname(__file__)), "../")
 sys.path.append(lobbit_app)
 
 if lobbit_app in sys.path:
     from app.lobbit_client.client import LobbitClient
+    from app.lobbit_util.config import ConfigError, LobbitConfig
 
 
 class TestClient(unittest.TestCase):
@@ -37,3 +43,43 @@ class TestClient(unittest.TestCase):
         self.assertEqual(self.lc.port, 1234)
         self.assertEqual(self.lc.files, [self.path])
         self.assertEqual(self.lc.sock, None)
+
+    def test_connections_are_closed_when_the_config_fails(self) -> None:
+        """
+        Tests that connections already open are closed when the config
+        fails to load part way through connecting
+        """
+        left, right = socket.socketpair()
+        right.close()
+        self.lc.connections = 2
+        with mock.patch.object(self.lc, "open_connection", side_effect=[left, ConfigError("[-] bad config")]), \
+                mock.patch("app.lobbit_client.client.read_limits"):
+            self.assertFalse(self.lc.lobbit_connect())
+        self.assertEqual(left.fileno(), -1)
+        self.assertEqual(self.lc.socks, [])
+
+    @unittest.skipUnless(hasattr(socket, "AF_UNIX"), "Unix domain sockets are not supported")
+    def test_local_socket_is_only_used_when_another_user_cannot_replace_it(self) -> None:
+        """
+        Tests that the Unix socket is skipped when its directory is writable
+        by others or it belongs to a user the server is not expected to run as
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "lobbit.sock")
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            server.bind(path)
+            server.listen(1)
+            config = os.path.join(tmp, "config.json")
+            client = LobbitClient("localhost", 1234, [])
+            client.log = lambda *args: None
+            try:
+                for settings, mode, expected in (({}, 0o700, path), ({}, 0o777, None),
+                                                 ({"UNIX_SERVER_UID": os.getuid() + 1}, 0o700, None)):
+                    with open(config, "w") as f:
+                        json.dump(dict(settings, UNIX_SOCKET=path), f)
+                    os.chmod(tmp, mode)
+                    client.config = LobbitConfig(config)
+                    self.assertEqual(client.local_socket(), expected)
+            finally:
+                os.chmod(tmp, 0o700)
+                server.close()
@@ -0,0 +1,138 @@
+import json
+import os
+import shutil
+import ssl
+import subprocess
+import sys
+import tempfile
+import unittest
+
+lobbit_app = os.path.join(os.path.abspath(os.path.dirname(__file__)), "../")
+sys.path.append(lobbit_app)
+
+if lobbit_app in sys.path:
+    from app.lobbit_util import bench
+    from app.lobbit_util.config import ConfigError, LobbitConfig, SERVER_KEYS
+
+
+@unittest.skipIf(shutil.which("openssl") is None, "Skipping due to missing openssl binary")
+class TestLobbitConfig(unittest.TestCase):
+    """
+    Test class for the LobbitConfig class
+    """
+
+    def setUp(self) -> None:
+        """
+        Initialises test case variables
+        """
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cert = os.path.join(self.tmp.name, "cert.pem")
+        self.key = os.path.join(self.tmp.name, "key.pem")
+        subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-keyout", self.key,
+                        "-out", self.cert, "-days", "1", "-nodes", "-subj", "/CN=localhost"],
+                       check=True, capture_output=True)
+        self.path = os.path.join(self.tmp.name, "config.json")
+        self.settings = {
+            "HOST": "127.0.0.1",
+            "PORT": 8443,
+            "UPLOAD_PATH": self.tmp.name,
+            "PUBLIC_CERT_PATH": self.cert,
+            "PRIVATE_CERT_PATH": self.key
+        }
+        self.write(self.settings)
+        self.config = LobbitConfig(self.path)
+
+    def tearDown(self) -> None:
+        """
+        Cleans up after testing
+        """
+        self.tmp.cleanup()
+
+    def write(self, settings: dict) -> None:
+        """
+        Writes <settings> to the temporary config.json
+        """
+        with open(self.path, "w") as f:
+            json.dump(settings, f)
+
+    def test_settings_are_loaded_once(self) -> None:
+        """
+        Tests that settings are cached after the first read
+        """
+        self.assertEqual(self.config.get("PORT"), 8443)
+        self.write({**self.settings, "PORT": 9000})
+        self.assertEqual(self.config.get("PORT"), 8443)
+
+    def test_contexts_are_cached(self) -> None:
+        """
+        Tests that the same SSLContext is returned on every call
+        """
+        self.assertIs(self.config.server_context(), self.config.server_context())
+        self.assertIs(self.config.client_context(), self.config.client_context())
+
+    def test_require_raises_ConfigError_for_missing_keys(self) -> None:
+        """
+        Tests that missing settings are reported
+        """
+        self.write({"HOST": "127.0.0.1"})
+        with self.assertRaises(ConfigError):
+            LobbitConfig(self.path).require(SERVER_KEYS)
+
+    def test_reload_replaces_settings_and_contexts(self) -> None:
+        """
+        Tests that a reload swaps in new settings and a new context
+        and notifies registered callbacks
+        """
+        context = self.config.server_context()
+        reloaded = []
+        self.config.on_reload(reloaded.append)
+        self.write({**self.settings, "UPLOAD_PATH": "/new/path"})
+        self.assertTrue(self.config.reload())
+        self.assertEqual(self.config.get("UPLOAD_PATH"), "/new/path")
+        self.assertIsNot(self.config.server_context(), context)
+        self.assertEqual(reloaded[0]["UPLOAD_PATH"], "/new/path")
+
+    def test_failed_reload_keeps_current_values(self) -> None:
+        """
+        Tests that a broken config does not replace a working one
+        """
+        context = self.config.server_context()
+        self.write({**self.settings, "PUBLIC_CERT_PATH": "/missing/cert.pem"})
+        self.assertFalse(self.config.reload())
+        self.assertIs(self.config.server_context(), context)
+        self.assertEqual(self.config.get("PUBLIC_CERT_PATH"), self.cert)
+
+    def test_tls_preferences_are_applied(self) -> None:
+        """
+        Tests that a list of TLS 1.2 ciphers restricts the context to them
+        and that invalid names are reported
+        """
+        self.write({**self.settings, "TLS_CIPHERS": ["ECDHE-RSA-CHACHA20-POLY1305"], "TLS_GROUPS": ["X25519"]})
+        context = LobbitConfig(self.path).server_context()
+        self.assertEqual(context.maximum_version, ssl.TLSVersion.TLSv1_2)
+        self.assertEqual([c["name"] for c in context.get_ciphers() if c["protocol"] == "TLSv1.2"],
+                         ["ECDHE-RSA-CHACHA20-POLY1305"])
+        self.write({**self.settings, "TLS_CIPHERS": ["NOT-A-CIPHER"]})
+        with self.assertRaises(ConfigError):
+            LobbitConfig(self.path).server_context()
+        if not hasattr(ssl.SSLContext, "set_ciphersuites"):
+            # TLS 1.3 suites would be ignored, so they are refused
+            self.write({**self.settings, "TLS_CIPHERS": ["TLS_AES_128_GCM_SHA256"]})
+            with self.assertRaises(ConfigError):
+                LobbitConfig(self.path).server_context()
+        self.write({**self.settings, "TLS_GROUPS": "X25519"})
+        with self.assertRaises(ConfigError):
+            LobbitConfig(self.path).client_context()
+
+    def test_bench_measures_each_cipher(self) -> None:
+        """
+        Tests that every candidate cipher is measured over loopback and
+        that the fastest is suggested first
+        """
+        results = bench.bench_ciphers(self.cert, self.key, 1024 * 1024)
+        self.assertEqual([r["aead"] for r in results], [aead for aead, _, _ in bench.CANDIDATES])
+        for result in results:
+            self.assertIsNone(result["error"])
+            self.assertGreater(result["rate"], 0)
+        fastest = max(results, key=lambda r: r["rate"])
+        self.assertIn(fastest["aead"].split("-")[0], bench.suggestion(results)[0].replace("_", "-"))
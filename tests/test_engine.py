@@ -0,0 +1,124 @@
+import os
+import socket
+import sys
+import tempfile
+import time
+import unittest
+
+from threading import Thread
+
+lobbit_app = os.path.join(os.path.abspath(os.path.dirname(__file__)), "../")
+sys.path.append(lobbit_app)
+
+if lobbit_app in sys.path:
+    from app.lobbit_client.client import LobbitClient
+    from app.lobbit_client.engine import UploadEngine, format_bytes, format_eta
+    from app.lobbit_client.upload_queue import UploadQueue
+    from app.lobbit_util import protocol
+    from app.lobbit_util.buffer import Buffer
+
+
+class TestUploadEngine(unittest.TestCase):
+    """
+    Test class for the background UploadEngine
+    """
+
+    def setUp(self) -> None:
+        """
+        Initialises test case variables
+        """
+        self.tmp = tempfile.TemporaryDirectory()
+        self.files = []
+        for name, size in (("a", 3000), ("b", 10)):
+            path = os.path.join(self.tmp.name, name)
+            with open(path, "wb") as f:
+                f.write(b"x" * size)
+            self.files.append(path)
+        self.client_sock, self.server_sock = socket.socketpair()
+        self.received = []
+        self.server = Thread(target=self.serve, daemon=True)
+        self.server.start()
+        self.client = LobbitClient("localhost", 0, [])
+        self.client.socks = [self.client_sock]
+        self.client.sock = self.client_sock
+        self.queue = UploadQueue(":memory:")
+
+    def tearDown(self) -> None:
+        """
+        Cleans up after testing
+        """
+        self.client_sock.close()
+        self.server_sock.close()
+        self.server.join(timeout=5)
+        self.queue.close()
+        self.tmp.cleanup()
+
+    def serve(self) -> None:
+        """
+        Minimal server that confirms every file it is sent
+        """
+        buffer = Buffer(self.server_sock)
+        try:
+            while name := buffer.get_utf8():
+                size = int(buffer.get_utf8())
+                offset = buffer.get_utf8()
+                if offset == protocol.MTIME:
+                    buffer.get_utf8()
+                    offset = buffer.get_utf8()
+                buffer.discard(size - int(offset))
+                self.received.append(name)
+                protocol.send_status(buffer, protocol.OK, size)
+        except OSError:
+            return
+        self.server_sock.close()
+
+    def wait(self, engine: UploadEngine) -> None:
+        """
+        Waits for the engine to finish sending
+        """
+        deadline = time.time() + 5
+        while engine.busy and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_submit_uploads_in_background_and_reports_status(self) -> None:
+        """
+        Tests that submitted files are sent on a background thread and
+        that the status report covers each file and the overall upload
+        """
+        engine = UploadEngine(self.client, self.queue)
+        self.assertTrue(engine.submit([self.files[0]]))
+        self.wait(engine)
+        self.assertEqual(self.received, ["a"])
+        self.assertEqual([r["status"] for r in engine.results], ["confirmed"])
+        lines = engine.status()
+        self.assertIn("confirmed", lines[0])
+        self.assertIn("100.0%", lines[0])
+        self.assertTrue(lines[-1].startswith("Overall: 1 file(s)"))
+        self.assertIn("[+] Upload finished: 1 confirmed, 0 not confirmed", engine.messages)
+        self.assertEqual([row["state"] for row in self.queue.entries([UploadQueue.DONE])], ["done"])
+        # the connections are closed once the engine runs out of files
+        self.assertFalse(engine.submit([self.files[1]]))
+
+    def test_cancel_marks_only_unfinished_files(self) -> None:
+        """
+        Tests that cancelling flags a file that has not been sent and
+        leaves a file that has already been confirmed alone
+        """
+        engine = UploadEngine(self.client, self.queue)
+        job = self.client.new_job({"jobs": {}, "order": [], "results": [], "lock": engine._lock},
+                                  self.files[1], "b", 10)
+        self.client.cancel(job)
+        self.assertTrue(job["cancelled"])
+        job["status"] = "confirmed"
+        job["cancelled"] = False
+        self.client.cancel(job)
+        self.assertFalse(job["cancelled"])
+
+    def test_format_helpers(self) -> None:
+        """
+        Tests the byte and ETA formatting used by the status report
+        """
+        self.assertEqual(format_bytes(10), "10 B")
+        self.assertEqual(format_bytes(1536), "1.5 KB")
+        self.assertEqual(format_eta(3725), "1:02:05")
+        self.assertEqual(format_eta(None), "--:--")
@@ -0,0 +1,96 @@
+import hashlib
+import os
+import sys
+import tempfile
+import unittest
+
+from unittest import mock
+
+lobbit_app = os.path.join(os.path.abspath(os.path.dirname(__file__)), "../")
+sys.path.append(lobbit_app)
+
+if lobbit_app in sys.path:
+    from app.lobbit_client.client import glob_escape
+    from app.lobbit_client.hash_cache import HashCache
+
+
+class TestHashCache(unittest.TestCase):
+    """
+    Test class for the client's persistent hash cache
+    """
+
+    def setUp(self) -> None:
+        """
+        Initialises test case variables
+        """
+        self.dir = tempfile.TemporaryDirectory()
+        self.db = os.path.join(self.dir.name, ".lobbit", "hashes.db")
+        self.cache = HashCache(self.db)
+
+    def tearDown(self) -> None:
+        """
+        Cleans up after testing
+        """
+        self.cache.close()
+        self.dir.cleanup()
+
+    def write(self, name: str, data: bytes) -> str:
+        """
+        Writes a file to hash
+
+        Args:
+            name (str)   : name of the file
+            data (bytes) : its contents
+        Returns:
+            str : path of the file
+        """
+        path = os.path.join(self.dir.name, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_unchanged_files_are_not_read_again(self) -> None:
+        """
+        Tests that a second hash of an unchanged file comes from the cache,
+        even after reopening it, and that a changed file is hashed again
+        """
+        path = self.write("a.bin", b"hello")
+        self.assertEqual(self.cache.digest(path), hashlib.sha256(b"hello").hexdigest())
+        self.cache.close()
+        self.cache = HashCache(self.db)
+        with mock.patch("builtins.open", side_effect=AssertionError("file was read")):
+            self.assertEqual(self.cache.digest(path), hashlib.sha256(b"hello").hexdigest())
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 0))
+        stat = os.stat(path)
+        self.write("a.bin", b"world")
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        self.assertEqual(self.cache.digest(path), hashlib.sha256(b"world").hexdigest())
+
+    def test_digest_many_keeps_order_and_evicts_least_recently_used(self) -> None:
+        """
+        Tests that files hashed in the pool are returned in order with
+        errors for unreadable files, and that the entry used longest ago
+        is evicted over the limit
+        """
+        self.cache.max_entries = 2
+        paths = [self.write(f"{i}.bin", bytes([i]) * 100) for i in range(3)]
+        self.cache.digest_many(paths[:2])
+        self.cache.digest_many(paths[:1])
+        results = self.cache.digest_many(paths[2:] + [os.path.join(self.dir.name, "missing")])
+        self.assertEqual(results[0], (paths[2], hashlib.sha256(bytes([2]) * 100).hexdigest(), None))
+        self.assertIsNone(results[1][1])
+        self.assertTrue(results[1][2])
+        self.cache.misses = 0
+        self.cache.digest_many(paths)
+        # 1.bin was used longest ago so only it was evicted
+        self.assertEqual(self.cache.misses, 1)
+
+    def test_glob_escape_matches_only_the_name(self) -> None:
+        """
+        Tests that wildcards in upload names are escaped
+        """
+        self.assertEqual(glob_escape("a*b?[c].log"), "a[*]b[?][[]c].log")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from threading import Thread
+from unittest import mock
+
+lobbit_app = os.path.join(os.path.abspath(os.path.dirname(__file__)), "../")
+sys.path.append(lobbit_app)
+
+if lobbit_app in sys.path:
+    from app.lobbit_server.hooks import HookRunner
+
+
+class HeldPool:
+    """
+    Stands in for the process pool, holding every run until released
+    """
+
+    def __init__(self) -> None:
+        self.futures = []
+
+    def submit(self, *args) -> Future:
+        future = Future()
+        self.futures.append(future)
+        return future
+
+
+class TestHooks(unittest.TestCase):
+    """
+    Test class for the post-receive hooks
+    """
+
+    def setUp(self) -> None:
+        """
+        Initialises test case variables
+        """
+        self.dir = tempfile.TemporaryDirectory()
+        self.log_path = os.path.join(self.dir.name, ".lobbit", "hooks.log")
+        self.messages = []
+
+    def tearDown(self) -> None:
+        """
+        Cleans up after testing
+        """
+        self.dir.cleanup()
+
+    def write(self, name: str, data: bytes) -> str:
+        path = os.path.join(self.dir.name, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def results(self) -> list:
+        with open(self.log_path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_hooks_run_in_worker_processes_and_are_logged(self) -> None:
+        runner = HookRunner([{"hook": "sha256"}, {"hook": "gzip", "match": "*.gz"}], self.log_path,
+                            workers=1, echo=self.messages.append)
+        plain = self.write("plain.txt", b"lobbit")
+        fake = self.write("fake.gz", b"not gzip")
+        self.assertEqual(runner.submit("plain.txt", plain, 6), 1)
+        self.assertEqual(runner.submit("fake.gz", fake, 8), 2)
+        runner.close()
+        results = {(r["hook"], r["name"]): r for r in self.results()}
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[("sha256", "plain.txt")]["result"]["sha256"],
+                         hashlib.sha256(b"lobbit").hexdigest())
+        self.assertEqual(results[("gzip", "fake.gz")]["status"], "failed")
+        self.assertIn("BadGzipFile", results[("gzip", "fake.gz")]["error"])
+        summary = runner.summary()
+        self.assertEqual((summary["sha256"]["runs"], summary["sha256"]["failures"]), (2, 0))
+        self.assertEqual((summary["gzip"]["runs"], summary["gzip"]["failures"]), (1, 1))
+
+    def test_submit_waits_while_the_backlog_is_full(self) -> None:
+        runner = HookRunner(["sha256"], self.log_path, backlog=1, echo=self.messages.append)
+        pool = runner._pool = HeldPool()
+        runner.submit("a", "a", 1)
+        waiting = Thread(target=runner.submit, args=("b", "b", 1))
+        waiting.start()
+        waiting.join(0.2)
+        self.assertTrue(waiting.is_alive())
+        self.assertEqual(len(pool.futures), 1)
+        pool.futures[0].set_result((0.0, 0.5, {}, None))
+        waiting.join(5)
+        self.assertFalse(waiting.is_alive())
+        self.assertEqual(len(pool.futures), 2)
+        self.assertTrue(any("backlog full" in message for message in self.messages))
+        self.assertEqual(runner.summary()["sha256"]["max_seconds"], 0.5)
+
+    def test_slot_is_freed_when_a_run_cannot_be_queued(self) -> None:
+        runner = HookRunner(["sha256"], self.log_path, backlog=1, echo=self.messages.append)
+        broken = mock.Mock()
+        broken.submit.side_effect = BrokenProcessPool("worker died")
+        with mock.patch.object(runner, "pool", return_value=broken):
+            submitting = Thread(target=lambda: [runner.submit(name, name, 1) for name in ("a", "b")])
+            submitting.start()
+            submitting.join(5)
+        self.assertFalse(submitting.is_alive())
+        self.assertEqual(broken.submit.call_count, 4)
+        self.assertTrue(any("Could not queue" in message for message in self.messages))
+
+    def test_unknown_hooks_are_rejected(self) -> None:
+        with self.assertRaises(ValueError):
+            HookRunner([{"hook": "json:nothing_here"}], self.log_path)
+        with self.assertRaises(ImportError):
+            HookRunner([{"hook": "no_such_module:hook"}], self.log_path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,32 @@
+import os
+import sys
+import unittest
+import zlib
+
+lobbit_app = os.path.join(os.path.abspath(os.path.dirname(__file__)), "../")
+sys.path.append(lobbit_app)
+
+if lobbit_app in sys.path:
+    from app.lobbit_util import manifest
+
+
+class TestManifest(unittest.TestCase):
+    """
+    Test class for the compressed frames of a sync manifest
+    """
+
+    def test_frames_round_trip_and_reject_damage(self) -> None:
+        entries = [(f"photos/2024/{i:05d}.jpg", i * 1000, 1700000000123456789 + i) for i in range(manifest.BATCH_SIZE)]
+        entries.append(("données/naïve.txt", 0, -1))
+        frame = manifest.encode_frame(entries)
+        self.assertEqual(manifest.decode_frame(frame), entries)
+        # the repeated directories compress away
+        self.assertLess(len(frame), len(entries) * manifest.ENTRY.size)
+        self.assertEqual(manifest.decode_frame(manifest.encode_frame([])), [])
+        for damaged in (frame[:-8], b"not a frame", zlib.compress(manifest.ENTRY.pack(1, 1, 10) + b"short")):
+            with self.assertRaises(ValueError):
+                manifest.decode_frame(damaged)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import os
+import socket
+import sys
+import tempfile
+import unittest
+
+from threading import Thread
+from unittest import mock
+
+lobbit_app = os.path.join(os.path.abspath(os.path.dirname(__file__)), "../")
+sys.path.append(lobbit_app)
+
+if lobbit_app in sys.path:
+    from app.lobbit_client.client import LobbitClient
+    from app.lobbit_client.mirror import parse_address
+    from app.lobbit_client.sender import FileSender
+    from app.lobbit_server.server import LobbitServer
+
+
+class TestMirror(unittest.TestCase):
+    """
+    Test class for uploads mirrored to several servers
+    """
+
+    def setUp(self) -> None:
+        """
+        Initialises test case variables
+        """
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp.name, "src")
+        os.makedirs(self.source)
+        self.data = {}
+        for name, size in (("a.bin", 3 * 1024 * 1024 + 7), ("b.bin", 70000), ("c.bin", 0)):
+            self.data[name] = os.urandom(size)
+            with open(os.path.join(self.source, name), "wb") as f:
+                f.write(self.data[name])
+        self.threads = []
+
+    def tearDown(self) -> None:
+        """
+        Cleans up after testing
+        """
+        for thread in self.threads:
+            thread.join(5)
+        self.tmp.cleanup()
+
+    def serve(self, name: str) -> socket.socket:
+        """
+        Starts a server receiving into <name> on one end of a socket pair
+
+        Args:
+            name (str) : upload directory under the temporary directory
+        Returns:
+            socket.socket : the client's end
+        """
+        server = LobbitServer("127.0.0.1", 1234, os.path.join(self.tmp.name, name))
+        server.sock.close()
+        left, right = socket.socketpair()
+        thread = Thread(target=server.lobbit_receive, args=(right, ("local", 0)), daemon=True)
+        thread.start()
+        self.threads.append(thread)
+        return left
+
+    def broken(self) -> socket.socket:
+        """
+        Starts a peer that fails after reading the start of the first file
+
+        Returns:
+            socket.socket : the client's end
+        """
+        left, right = socket.socketpair()
+
+        def fail() -> None:
+            right.recv(4096)
+            right.close()
+
+        thread = Thread(target=fail, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+        return left
+
+    def client(self, host: str, sock: socket.socket) -> LobbitClient:
+        client = LobbitClient(host, 8443, [self.source])
+        client.log = lambda *args: None
+        client.socks, client.sock = [sock], sock
+        return client
+
+    def test_each_file_is_read_once_and_sent_to_every_server(self) -> None:
+        client = self.client("primary", self.serve("primary"))
+        client.replicas = [self.client("mirror", self.serve("mirror")), self.client("broken", self.broken())]
+        with mock.patch.object(FileSender, "open", side_effect=FileSender.open) as opened:
+            results = client.lobbit_send()
+        client.lobbit_close()
+        self.assertEqual(opened.call_count, len(self.data))
+        self.assertEqual(len(results), len(self.data))
+        for result in results:
+            copies = result["destinations"]
+            self.assertEqual(copies["primary:8443"]["status"], "confirmed")
+            self.assertEqual(copies["mirror:8443"]["status"], "confirmed")
+            self.assertEqual(copies["broken:8443"]["status"], "failed")
+            self.assertEqual(result["status"], "failed")
+            self.assertIn("broken:8443", result["error"])
+        for server in ("primary", "mirror"):
+            for name, data in self.data.items():
+                with open(os.path.join(self.tmp.name, server, "src", name), "rb") as f:
+                    self.assertEqual(f.read(), data)
+
+    def test_parse_address(self) -> None:
+        self.assertEqual(parse_address("ingest2:8443"), ("ingest2", 8443))
+        self.assertEqual(parse_address("[::1]:8443"), ("::1", 8443))
+        for address in ("ingest2", ":8443", "ingest2:http", "ingest2:70000"):
+            with self.assertRaises(ValueError):
+                parse_address(address)
+
+
+if __name__ == "__main__":
+    unittest.main()
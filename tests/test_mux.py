@@ -0,0 +1,139 @@
+import os
+import socket
+import sys
+import time
+import unittest
+
+from threading import Event, Thread
+
+lobbit_app = os.path.join(os.path.abspath(os.path.dirname(__file__)), "../")
+sys.path.append(lobbit_app)
+
+if lobbit_app in sys.path:
+    from app.lobbit_util.buffer import Buffer
+    from app.lobbit_util.mux import CLOSE, DATA, FRAME, MAX_FRAME, STREAM_WINDOW, MuxSession, PriorityGate
+
+
+class TestMux(unittest.TestCase):
+    """
+    Test class for streams multiplexed over one connection
+    """
+
+    def setUp(self) -> None:
+        """
+        Initialises test case variables
+        """
+        self.client_sock, self.server_sock = socket.socketpair()
+        self.received = {}
+        self.server = MuxSession(Buffer(self.server_sock), on_stream=self.echo)
+        self.server.start()
+
+    def tearDown(self) -> None:
+        """
+        Cleans up after testing
+        """
+        self.server.close(1)
+        self.client_sock.close()
+        self.server_sock.close()
+
+    def echo(self, stream) -> None:
+        """
+        Reads a length prefixed payload from a stream and sends back how
+        many bytes it held
+
+        Args:
+            stream (Stream) : stream opened by the client
+        """
+        data = bytearray()
+        while len(data) < 8 or len(data) < 8 + int.from_bytes(data[:8], "big"):
+            chunk = stream.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+        data = data[8:]
+        self.received[stream.id] = bytes(data)
+        stream.sendall(str(len(data)).encode())
+        stream.close()
+
+    def test_streams_are_demultiplexed(self) -> None:
+        """
+        Tests that interleaved streams each arrive whole and in order and
+        that replies reach the stream they belong to
+        """
+        client = MuxSession(Buffer(self.client_sock))
+        client.start()
+        streams = [client.open_stream() for _ in range(3)]
+        payloads = [os.urandom(MAX_FRAME * 2 + 5), b"small", b""]
+        # the newest stream is heard from first
+        for stream, payload in reversed(list(zip(streams, payloads))):
+            stream.sendall(len(payload).to_bytes(8, "big") + payload)
+        replies = [stream.recv(64) for stream in streams]
+        self.assertEqual(replies, [str(len(p)).encode() for p in payloads])
+        self.assertEqual([self.received[s.id] for s in streams], payloads)
+        client.close(1)
+
+    def test_unread_stream_does_not_stall_the_others(self) -> None:
+        """
+        Tests that a sender waits for credit once a stream that is not
+        being read has a full window, while other streams keep flowing
+        """
+        reading = Event()
+
+        def stall_first(stream) -> None:
+            """
+            Echoes streams, the first once the test lets it be read
+            """
+            if stream.id == 1:
+                reading.wait(10)
+            self.echo(stream)
+
+        self.server.on_stream = stall_first
+        client = MuxSession(Buffer(self.client_sock))
+        client.start()
+        stalled, other = client.open_stream(), client.open_stream()
+        payload = os.urandom(STREAM_WINDOW * 2)
+        sender = Thread(target=stalled.sendall, args=(len(payload).to_bytes(8, "big") + payload,))
+        sender.start()
+        sender.join(0.5)
+        self.assertTrue(sender.is_alive())
+        other.sendall((5).to_bytes(8, "big") + b"small")
+        self.assertEqual(other.recv(64), b"5")
+        reading.set()
+        sender.join(10)
+        self.assertEqual(stalled.recv(64), str(len(payload)).encode())
+        self.assertEqual(self.received[stalled.id], payload)
+        client.close(1)
+
+    def test_closed_streams_are_not_reopened(self) -> None:
+        """
+        Tests that a late frame for a stream that has ended is dropped
+        instead of starting it again
+        """
+        self.client_sock.sendall(FRAME.pack(1, DATA, 10) + (2).to_bytes(8, "big") + b"hi" + FRAME.pack(1, CLOSE, 0))
+        self.client_sock.settimeout(5)
+        reply = self.client_sock.recv(FRAME.size + 1, socket.MSG_WAITALL)
+        self.assertEqual(reply, FRAME.pack(1, DATA, 1) + b"2")
+        self.client_sock.sendall(FRAME.pack(1, DATA, 3) + b"bye" + FRAME.pack(0, CLOSE, 0))
+        self.server.close(5)
+        self.assertEqual(self.received, {1: b"hi"})
+
+    def test_gate_prefers_higher_priority(self) -> None:
+        """
+        Tests that the gate is granted to the highest priority waiter
+        """
+        gate = PriorityGate()
+        gate.acquire(0)
+        order = []
+        threads = [Thread(target=lambda p=p: (gate.acquire(p), order.append(p), gate.release())) for p in (1, 5, 3)]
+        for thread in threads:
+            thread.start()
+        while len(gate._waiters) < 3:
+            time.sleep(0.01)
+        gate.release()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, [5, 3, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
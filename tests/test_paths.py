@@ -0,0 +1,45 @@
+import os
+import sys
+import tempfile
+import unittest
+
+from unittest import mock
+
+lobbit_app = os.path.join(os.path.abspath(os.path.dirname(__file__)), "../")
+sys.path.append(lobbit_app)
+
+if lobbit_app in sys.path:
+    from app.lobbit_util.paths import make_dirs, safe_join
+
+
+class TestPaths(unittest.TestCase):
+    """
+    Test class for the path helper functions
+    """
+
+    def test_safe_join_keeps_relative_paths(self) -> None:
+        """
+        Tests that relative names are recreated under the root
+        """
+        self.assertEqual(safe_join("/uploads", "dir/sub/file.txt"), "/uploads/dir/sub/file.txt")
+
+    def test_safe_join_rejects_unsafe_names(self) -> None:
+        """
+        Tests that names escaping the root are rejected
+        """
+        for name in ("", "/etc/passwd", "../secret", "dir/../../x", "dir//x", "./x", "a\\b"):
+            self.assertIsNone(safe_join("/uploads", name))
+
+    def test_make_dirs_flushes_each_new_directory(self) -> None:
+        """
+        Tests that every directory created is flushed to its parent and
+        that nothing is flushed when the directory already exists
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            with mock.patch("app.lobbit_util.paths.sync_dir") as sync_dir:
+                make_dirs(os.path.join(tmp, "a", "b"))
+                self.assertTrue(os.path.isdir(os.path.join(tmp, "a", "b")))
+                self.assertEqual([c.args[0] for c in sync_dir.call_args_list], [tmp, os.path.join(tmp, "a")])
+                sync_dir.reset_mock()
+                make_dirs(os.path.join(tmp, "a"))
+                sync_dir.assert_not_called()
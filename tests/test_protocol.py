@@ -0,0 +1,83 @@
+import os
+import socket
+import sys
+import unittest
+
+lobbit_app = os.path.join(os.path.abspath(os.path.dirname(__file__)), "../")
+sys.path.append(lobbit_app)
+
+if lobbit_app in sys.path:
+    from app.lobbit_client.sender import FileSender, TransferCancelled
+    from app.lobbit_util import protocol
+    from app.lobbit_util.buffer import Buffer
+
+
+class TestProtocol(unittest.TestCase):
+    """
+    Test class for the status replies and the windowed FileSender
+    """
+
+    def setUp(self) -> None:
+        """
+        Initialises test case variables
+        """
+        self.client, self.server = socket.socketpair()
+        self.server_buffer = Buffer(self.server)
+        self.finished = []
+
+    def tearDown(self) -> None:
+        """
+        Cleans up after testing
+        """
+        self.client.close()
+        self.server.close()
+
+    def test_status_round_trip(self) -> None:
+        """
+        Tests that a status sent by the server is read by the client
+        """
+        protocol.send_status(self.server_buffer, protocol.ACK, 1234)
+        self.assertEqual(protocol.recv_status(Buffer(self.client)), (protocol.ACK, 1234))
+
+    def test_recv_status_raises_when_connection_closes(self) -> None:
+        """
+        Tests that a closed connection raises ConnectionError
+        """
+        self.server.close()
+        self.assertRaises(ConnectionError, protocol.recv_status, Buffer(self.client))
+
+    def test_sender_applies_acks_to_oldest_file(self) -> None:
+        """
+        Tests that ACKs move the committed offset of the oldest file
+        in flight and final statuses complete it in order
+        """
+        sender = FileSender(self.client, lambda job, status, offset: self.finished.append((job["name"], status)))
+        first = {"name": "a", "size": 10, "committed": 0}
+        second = {"name": "b", "size": 5, "committed": 0}
+        sender.in_flight.extend([first, second])
+        sender.sent = 15
+        protocol.send_status(self.server_buffer, protocol.ACK, 6)
+        protocol.send_status(self.server_buffer, protocol.OK, 10)
+        protocol.send_status(self.server_buffer, protocol.ERR_IO, 2)
+        sender.read_status()
+        self.assertEqual((first["committed"], sender.acked), (6, 6))
+        sender.drain()
+        self.assertEqual(self.finished, [("a", protocol.OK), ("b", protocol.ERR_IO)])
+        self.assertEqual((second["committed"], sender.acked), (2, 15))
+
+    def test_sender_stops_cancelled_file(self) -> None:
+        """
+        Tests that a cancelled file raises TransferCancelled before its
+        data is sent and that earlier files are still confirmed
+        """
+        sender = FileSender(self.client, lambda job, status, offset: self.finished.append((job["name"], status)))
+        first = {"name": "a", "size": 10, "committed": 10}
+        job = {"name": "b", "size": 5, "committed": 0, "sent": 0, "transferred": 0, "cancelled": True}
+        sender.in_flight.append(first)
+        with open(__file__, "rb") as f:
+            self.assertRaises(TransferCancelled, sender.send, job, f)
+        self.assertEqual(job["sent"], 0)
+        protocol.send_status(self.server_buffer, protocol.OK, 10)
+        sender.drain_before(job)
+        self.assertEqual(self.finished, [("a", protocol.OK)])
+        self.assertEqual(len(sender.in_flight), 0)
@@ -0,0 +1,67 @@
+import os
+import socket
+import sys
+import unittest
+
+lobbit_app = os.path.join(os.path.abspath(os.path.dirname(__file__)), "../")
+sys.path.append(lobbit_app)
+
+if lobbit_app in sys.path:
+    from app.lobbit_server.reaper import ConnectionReaper
+    from app.lobbit_util.buffer import Buffer
+
+
+class TestConnectionReaper(unittest.TestCase):
+    """
+    Test class for the ConnectionReaper class
+    """
+
+    def setUp(self) -> None:
+        """
+        Initialises test case variables
+        """
+        self.server, self.client = socket.socketpair()
+        self.buffer = Buffer(self.server)
+        self.reaper = ConnectionReaper(idle_timeout=10, min_rate=100, window=5)
+        self.conn = self.reaper.watch(self.server, self.buffer, ("127.0.0.1", 1))
+        self.start = self.conn.last_active
+
+    def tearDown(self) -> None:
+        """
+        Cleans up after testing
+        """
+        self.server.close()
+        self.client.close()
+
+    def test_idle_connection_is_reaped(self) -> None:
+        """
+        Tests that a connection waiting between files is reaped after
+        the idle timeout and that the blocked read returns
+        """
+        self.assertIsNone(self.reaper.check(self.conn, self.start + 9))
+        reason = self.reaper.check(self.conn, self.start + 11)
+        self.assertIn("idle", reason)
+        self.reaper.reap(self.conn, reason)
+        self.assertEqual(self.buffer.get_utf8(), "")
+        self.assertNotIn(self.conn, self.reaper.connections)
+
+    def test_slow_transfer_is_reaped(self) -> None:
+        """
+        Tests that a file received below the throughput floor is reaped
+        while a fast one is not
+        """
+        self.conn.set_receiving(True)
+        start = self.conn.window_start
+        self.buffer.received += 1000
+        self.assertIsNone(self.reaper.check(self.conn, start + 5))
+        self.buffer.received += 10
+        self.assertIn("below", self.reaper.check(self.conn, start + 10))
+
+    def test_buffer_counts_received_bytes(self) -> None:
+        """
+        Tests that the buffer counts every byte read from the socket
+        """
+        self.client.sendall(b"name\x00" + b"x" * 10)
+        self.buffer.get_utf8()
+        self.buffer.get_bytes(10)
+        self.assertEqual(self.buffer.received, 15)
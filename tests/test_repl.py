@@ -10,6 +10,7 @@ sys.path.append(lobbit_app)
 
 if lobbit_app in sys.path:
     from app.lobbit_client.repl import LobbitREPL
+    from app.lobbit_client.upload_queue import UploadQueue
 
 
 class TestLobbitREPL(unittest.TestCase):
@@ -123,6 +124,18 @@ class TestLobbitREPL(unittest.TestCase):
             self.repl.do_set("ip")
             self.assertIn("missing required argument", stdout.getvalue())
 
+    def test_set_connections_updates_connections(self) -> None:
+        """
+        Tests that 'set connections' stores a valid number of connections
+        and rejects an invalid one
+        """
+        self.repl.do_set("connections 4")
+        self.assertEqual(self.repl.connections, 4)
+        with patch("sys.stdout", new=StringIO()) as stdout:
+            self.repl.do_set("connections 0")
+            self.assertIn("Invalid number of connections", stdout.getvalue())
+        self.assertEqual(self.repl.connections, 4)
+
     def test_do_file_method_returns_when_no_args(self) -> None:
         """
         Tests that the do_file method returns when no arguments
@@ -230,6 +243,15 @@ class TestLobbitREPL(unittest.TestCase):
         self.assertIn(self.good_path, self.repl.files)
         self.assertIn(self.good_path_2, self.repl.files)
 
+    def test_handle_add_appends_directories_and_globs_to_list(self) -> None:
+        """
+        Tests that the <self.files> attribute List is updated when a
+        directory or a matching glob pattern is passed as an argument
+        """
+        directory = os.path.dirname(self.good_path)
+        self.repl.handle_add([directory, f"{directory}/*.txt"])
+        self.assertEqual(self.repl.files, [directory, f"{directory}/*.txt"])
+
     def test_handle_add_does_not_append_to_list_with_bad_path(self) -> None:
         """
         Tests that the <self.files> attribute List is not updated if a bad
@@ -307,6 +329,54 @@ class TestLobbitREPL(unittest.TestCase):
         """
         self.assertEqual(None, self.repl.handle_upload())
 
+    def test_handle_upload_queues_files_when_server_is_unreachable(self) -> None:
+        """
+        Tests that files are queued before connecting, so they are kept
+        while the server can't be reached
+        """
+        self.repl.files = [self.good_path]
+        self.repl.host, self.repl.port = "127.0.0.1", 1
+        self.repl.queue = UploadQueue(":memory:")
+        with patch("sys.stdout", new=StringIO()), \
+                patch("app.lobbit_client.engine.UploadEngine.start"):
+            self.repl.handle_upload()
+        self.assertEqual([row["source"] for row in self.repl.queue.entries()], [self.good_path])
+        self.assertEqual(self.repl.files, [])
+        self.repl.queue.close()
+
+    def test_handle_verify_closes_the_hash_cache_when_it_fails(self) -> None:
+        """
+        Tests that the hash cache is closed when the server can't be asked
+        for its checksums
+        """
+        self.repl.files = [self.good_path]
+        self.repl.host, self.repl.port = "127.0.0.1", 1
+        with patch("sys.stdout", new=StringIO()) as output, \
+                patch("app.lobbit_client.client.HashCache") as cache, \
+                patch("app.lobbit_client.client.LobbitClient.lobbit_connect", return_value=True), \
+                patch("app.lobbit_client.client.LobbitClient.lobbit_close"), \
+                patch("app.lobbit_client.client.LobbitClient.remote_lookup", side_effect=OSError("reset")):
+            cache.return_value.digest_many.return_value = [(self.good_path, "00", None)]
+            self.repl.handle_verify()
+        self.assertIn("Could not verify the files: reset", output.getvalue())
+        cache.return_value.close.assert_called_once()
+
+    def test_handle_status_prints_error_if_nothing_uploaded(self) -> None:
+        """
+        Tests that 'file status' reports an error before any upload
+        """
+        with patch("sys.stdout", new=StringIO()) as stdout:
+            self.repl.handle_status()
+            self.assertIn("No files have been uploaded", stdout.getvalue())
+
+    def test_handle_cancel_prints_error_if_no_upload_is_running(self) -> None:
+        """
+        Tests that 'file cancel' reports an error when no upload is running
+        """
+        with patch("sys.stdout", new=StringIO()) as stdout:
+            self.repl.do_file("cancel 0")
+            self.assertIn("No upload is running", stdout.getvalue())
+
     def test_handle_upload_returns_if_no_network_settings_are_present(self) -> None:
         """
         Tests that handle_upload returns when user tries to upload without
@@ -0,0 +1,108 @@
+import os
+import sys
+import tempfile
+import unittest
+
+from threading import Event, Thread
+
+lobbit_app = os.path.join(os.path.abspath(os.path.dirname(__file__)), "../")
+sys.path.append(lobbit_app)
+
+if lobbit_app in sys.path:
+    from app.lobbit_client.scheduler import FileScheduler
+
+
+class TestFileScheduler(unittest.TestCase):
+    """
+    Test class for the FileScheduler class
+    """
+
+    def setUp(self) -> None:
+        """
+        Initialises test case variables
+        """
+        self.tmp = tempfile.TemporaryDirectory()
+        self.files = []
+        for name, size in (("small", 1), ("large", 300), ("medium", 20)):
+            path = os.path.join(self.tmp.name, name)
+            with open(path, "wb") as f:
+                f.write(b"x" * size)
+            self.files.append((path, name))
+
+    def tearDown(self) -> None:
+        """
+        Cleans up after testing
+        """
+        self.tmp.cleanup()
+
+    def drain(self, scheduler: FileScheduler) -> list:
+        """
+        Returns the names of every job in the order they are handed out
+        """
+        names = []
+        while job := scheduler.next_job():
+            names.append(job[1])
+        return names
+
+    def test_largest_first_order(self) -> None:
+        """
+        Tests that the largest files are handed out first
+        """
+        self.assertEqual(self.drain(FileScheduler(self.files)), ["large", "medium", "small"])
+
+    def test_smallest_first_order(self) -> None:
+        """
+        Tests that the smallest files are handed out first
+        """
+        scheduler = FileScheduler(self.files, order="smallest")
+        self.assertEqual(self.drain(scheduler), ["small", "medium", "large"])
+
+    def test_fifo_order(self) -> None:
+        """
+        Tests that files are handed out in discovery order
+        """
+        scheduler = FileScheduler(self.files, order="fifo")
+        self.assertEqual(self.drain(scheduler), ["small", "large", "medium"])
+
+    def test_missing_files_are_recorded_as_errors(self) -> None:
+        """
+        Tests that files that cannot be stat'd are skipped and recorded
+        """
+        scheduler = FileScheduler(self.files + [("/no/such/file", "file")])
+        self.assertEqual(len(self.drain(scheduler)), 3)
+        self.assertEqual(scheduler.errors[0][0], "/no/such/file")
+
+    def test_queued_files_are_handed_out_while_the_source_is_slow(self) -> None:
+        """
+        Tests that a worker takes a queued file while another worker is
+        waiting on the source
+        """
+        released = Event()
+
+        def slow_source():
+            """
+            Yields the first two files, then waits before the last
+            """
+            yield from self.files[:2]
+            released.wait(5)
+            yield self.files[2]
+
+        scheduler = FileScheduler(slow_source(), lookahead=2)
+        self.assertEqual(scheduler.next_job()[1], "large")
+        waiting = []
+        worker = Thread(target=lambda: waiting.append(scheduler.next_job()[1]))
+        worker.start()
+        while not scheduler._source.locked():
+            worker.join(0.01)
+        self.assertEqual(scheduler.next_job()[1], "small")
+        self.assertTrue(worker.is_alive())
+        released.set()
+        worker.join(5)
+        self.assertEqual(waiting, ["medium"])
+        self.assertIsNone(scheduler.next_job())
+
+    def test_invalid_order_raises_ValueError(self) -> None:
+        """
+        Tests that an unknown order is rejected
+        """
+        self.assertRaises(ValueError, FileScheduler, self.files, "random")
@@ -1,14 +1,30 @@
+import hashlib
+import io
+import json
 import os
+import random
 import socket
+import sqlite3
 import sys
+import tempfile
 import threading
+import time
 import unittest
 
+from types import SimpleNamespace
+from unittest import mock
+
 lobbit_app = os.path.join(os.path.abspath(os.path.dirname(__file__)), "../")
 sys.path.append(lobbit_app)
 
 if lobbit_app in sys.path:
+    from app.lobbit_client.client import LobbitClient
+    from app.lobbit_client.sender import FileSender, SourceChanged
+    from app.lobbit_server.chunks import ChunkStore
     from app.lobbit_server.server import LobbitServer
+    from app.lobbit_util import protocol
+    from app.lobbit_util.buffer import Buffer
+    from app.lobbit_util.config import LobbitConfig
 
 
 class TestServer(unittest.TestCase):
@@ -41,3 +57,428 @@ class TestServer(unittest.TestCase):
         self.assertEqual(self.ls.upload_path, "/test/path")
         self.assertEqual(type(self.ls.sock), type(self.sock))
         self.assertEqual(type(self.ls.thread_lock), type(threading.Lock()))
+
+    @unittest.skipIf(os.getenv("GITHUB_ACTIONS") == "true", "Skipping due to missing SSL cert on runner")
+    def test_receive_mmap_writes_file_through_mapping(self) -> None:
+        """
+        Tests that receive_mmap receives data into a mapping of the
+        destination file and truncates it if the sender stops early
+        """
+        left, right = socket.socketpair()
+        right.sendall(b"0123456789")
+        right.close()
+        with tempfile.TemporaryFile() as f:
+            received = LobbitServer.receive_mmap(Buffer(left), f, 16)
+            f.seek(0)
+            self.assertEqual(received, 10)
+            self.assertEqual(f.read(), b"0123456789")
+        left.close()
+
+    @unittest.skipIf(os.getenv("GITHUB_ACTIONS") == "true", "Skipping due to missing SSL cert on runner")
+    def test_receive_file_resumes_at_committed_offset(self) -> None:
+        """
+        Tests that a file is resumed at the offset sent by the client
+        when the server already holds that many bytes
+        """
+        left, right = socket.socketpair()
+        with tempfile.TemporaryDirectory() as upload_path:
+            self.ls.upload_path = upload_path
+            with open(os.path.join(upload_path, "part"), "wb") as f:
+                f.write(b"0123xxxx")
+            right.sendall(b"456789")
+            status = self.ls.receive_file(Buffer(left), "part", 10, 4)
+            self.assertEqual(status, (protocol.OK, 10))
+            with open(os.path.join(upload_path, "part"), "rb") as f:
+                self.assertEqual(f.read(), b"0123456789")
+        left.close()
+        right.close()
+
+    @unittest.skipIf(os.getenv("GITHUB_ACTIONS") == "true", "Skipping due to missing SSL cert on runner")
+    def test_receive_file_rejects_offset_beyond_held_bytes(self) -> None:
+        """
+        Tests that resuming past the bytes the server holds is refused
+        with the committed offset and the data is discarded
+        """
+        left, right = socket.socketpair()
+        buffer = Buffer(left)
+        with tempfile.TemporaryDirectory() as upload_path:
+            self.ls.upload_path = upload_path
+            right.sendall(b"456789next")
+            self.assertEqual(self.ls.receive_file(buffer, "missing", 10, 4), (protocol.ERR_OFFSET, 0))
+            self.assertEqual(buffer.get_bytes(4), b"next")
+        left.close()
+        right.close()
+
+    @unittest.skipIf(os.getenv("GITHUB_ACTIONS") == "true", "Skipping due to missing SSL cert on runner")
+    def test_incomplete_file_is_kept_for_resume_or_deleted(self) -> None:
+        """
+        Tests that a file cut short by the client is truncated to the bytes
+        received and kept, or deleted when PARTIAL_FILES is 'delete'
+        """
+        with tempfile.TemporaryDirectory() as upload_path:
+            self.ls.upload_path = upload_path
+            for policy, expected in (("keep", True), ("delete", False)):
+                self.ls.apply_limits({"PARTIAL_FILES": policy})
+                left, right = socket.socketpair()
+                right.sendall(b"01234")
+                right.close()
+                self.assertRaises(ConnectionError, self.ls.receive_file, Buffer(left), policy, 10, 0)
+                left.close()
+                path = os.path.join(upload_path, policy)
+                self.assertEqual(os.path.exists(path), expected)
+                if expected:
+                    self.assertEqual(os.path.getsize(path), 5)
+
+    @unittest.skipIf(os.getenv("GITHUB_ACTIONS") == "true", "Skipping due to missing SSL cert on runner")
+    def test_file_that_shrinks_while_sending_is_not_confirmed(self) -> None:
+        """
+        Tests that a file ending short of its size is abandoned by the
+        client instead of padded, so the server never confirms it
+        """
+        with tempfile.TemporaryDirectory() as upload_path:
+            self.ls.upload_path = upload_path
+            source = os.path.join(upload_path, "source")
+            with open(source, "wb") as f:
+                f.write(b"x" * 50)
+            left, right = socket.socketpair()
+            job = {"name": "shrunk", "size": 100, "committed": 0, "sent": 0, "transferred": 0,
+                   "cancelled": False, "error": None}
+            with open(source, "rb") as f:
+                self.assertRaises(SourceChanged, FileSender(right, lambda *args: None).send, job, f)
+            self.assertEqual(job["error"], "File changed size while sending")
+            right.close()
+            buffer = Buffer(left)
+            name, size, offset = buffer.get_utf8(), int(buffer.get_utf8()), int(buffer.get_utf8())
+            self.assertRaises(ConnectionError, self.ls.receive_file, buffer, name, size, offset)
+            left.close()
+            self.assertEqual(os.path.getsize(os.path.join(upload_path, "shrunk")), 50)
+
+    @unittest.skipIf(os.getenv("GITHUB_ACTIONS") == "true", "Skipping due to missing SSL cert on runner")
+    def test_dedup_sends_only_chunks_the_server_lacks(self) -> None:
+        """
+        Tests that a file sent as chunks is rebuilt on the server and that
+        sending a copy with a small change only sends the changed chunks
+        """
+        data = random.Random(2).randbytes(768 * 1024)
+        with tempfile.TemporaryDirectory() as upload_path:
+            self.ls.upload_path = upload_path
+            for name, content in (("first", data), ("second", data[:5000] + b"changed" + data[5000:])):
+                left, right = socket.socketpair()
+                buffer = Buffer(left)
+                watched = self.ls.reaper.watch(left, buffer, ("local", 0))
+                replies = []
+
+                def receive() -> None:
+                    file_name, file_size, offset = buffer.get_utf8(), int(buffer.get_utf8()), buffer.get_utf8()
+                    self.assertEqual(offset, protocol.DEDUP)
+                    replies.append(self.ls.receive_dedup(buffer, file_name, file_size, watched))
+
+                server = threading.Thread(target=receive)
+                server.start()
+                job = {"name": name, "size": len(content), "cancelled": False, "transferred": 0}
+                finished = []
+                sender = FileSender(right, lambda *args: finished.append(args))
+                sender.send_dedup(job, io.BytesIO(content))
+                server.join()
+                protocol.send_status(buffer, *replies[0])
+                sender.drain()
+                self.assertEqual(finished, [(job, protocol.OK, len(content))])
+                with open(os.path.join(upload_path, name), "rb") as f:
+                    self.assertEqual(f.read(), content)
+                left.close()
+                right.close()
+            self.assertGreater(job["dedup"]["chunks"], job["dedup"]["chunks_sent"])
+            self.assertLess(job["dedup"]["bytes_sent"], len(content) // 2)
+
+    @unittest.skipIf(os.getenv("GITHUB_ACTIONS") == "true", "Skipping due to missing SSL cert on runner")
+    def test_chunks_are_flushed_before_they_are_used(self) -> None:
+        """
+        Tests that a stored chunk and the directory naming it are flushed
+        to disk before put returns
+        """
+        data = b"chunk"
+        with tempfile.TemporaryDirectory() as root:
+            store = ChunkStore(root)
+            digest = hashlib.sha256(data).digest()
+            os.makedirs(os.path.dirname(store.path(digest)))
+            with mock.patch("app.lobbit_server.chunks.os.fsync") as fsync, \
+                    mock.patch("app.lobbit_server.chunks.sync_dir") as sync_dir:
+                store.put(digest, data)
+            fsync.assert_called_once()
+            sync_dir.assert_called_once_with(os.path.dirname(store.path(digest)))
+            self.assertTrue(store.has(digest))
+
+    @unittest.skipIf(os.getenv("GITHUB_ACTIONS") == "true", "Skipping due to missing SSL cert on runner")
+    def test_sparse_file_is_received_with_holes(self) -> None:
+        """
+        Tests that only the data extents of a sparse file are sent and the
+        server recreates the holes between and after them
+        """
+        size = 32 * 1024 * 1024
+        extents = [(4096, 4096), (16 * 1024 * 1024, 8192)]
+        with tempfile.TemporaryDirectory() as upload_path, tempfile.TemporaryFile() as source:
+            self.ls.upload_path = upload_path
+            source.truncate(size)
+            for start, length in extents:
+                source.seek(start)
+                source.write(os.urandom(length))
+            left, right = socket.socketpair()
+            buffer = Buffer(left)
+            replies = []
+
+            def receive() -> None:
+                file_name, file_size = buffer.get_utf8(), int(buffer.get_utf8())
+                self.assertEqual(buffer.get_utf8(), protocol.SPARSE)
+                offset = int(buffer.get_utf8())
+                received = self.ls.receive_extent_map(buffer, file_size, offset)
+                replies.append(self.ls.receive_file(buffer, file_name, file_size, offset, received))
+
+            server = threading.Thread(target=receive)
+            server.start()
+            job = {"name": "image", "size": size, "committed": 0, "cancelled": False, "transferred": 0}
+            FileSender(right, lambda *args: None).send(job, source, extents)
+            server.join()
+            left.close()
+            right.close()
+            self.assertEqual(replies, [(protocol.OK, size)])
+            self.assertEqual(job["transferred"], 4096 + 8192)
+            path = os.path.join(upload_path, "image")
+            source.seek(0)
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), source.read())
+            self.assertLess(os.stat(path).st_blocks * 512, 1024 * 1024)
+
+    @unittest.skipIf(os.getenv("GITHUB_ACTIONS") == "true", "Skipping due to missing SSL cert on runner")
+    def test_changing_upload_path_closes_the_old_catalog(self) -> None:
+        """
+        Tests that the catalog and storage of the old destination are
+        closed and new ones built for the new destination
+        """
+        with tempfile.TemporaryDirectory() as old, tempfile.TemporaryDirectory() as new:
+            self.ls.upload_path = old
+            catalog, storage = self.ls.catalog, self.ls.storage
+            with mock.patch.object(storage, "close") as close_storage:
+                self.ls.upload_path = new
+            close_storage.assert_called_once()
+            self.assertRaises(sqlite3.ProgrammingError, catalog.count)
+            self.assertIsNot(self.ls.catalog, catalog)
+            self.assertEqual(self.ls.catalog.count(), 0)
+            self.ls.catalog.close()
+
+    @unittest.skipIf(os.getenv("GITHUB_ACTIONS") == "true", "Skipping due to missing SSL cert on runner")
+    def test_list_request_pages_the_catalog(self) -> None:
+        """
+        Tests that a list request is answered with a page of the catalog,
+        which the server fills with the files already stored
+        """
+        with tempfile.TemporaryDirectory() as upload_path:
+            for name in ("a.txt", "b.txt", "c.bin"):
+                with open(os.path.join(upload_path, name), "wb") as f:
+                    f.write(name.encode())
+            self.ls.upload_path = upload_path
+            catalog = self.ls.catalog
+            deadline = time.monotonic() + 5
+            while catalog.count() < 3 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            left, right = socket.socketpair()
+            client = Buffer(right)
+            for field in ("*.txt", "", "1"):
+                client.put_utf8(field)
+            self.ls.handle_request(Buffer(left), protocol.LIST, ("local", 0))
+            page = json.loads(client.get_utf8())
+            self.assertEqual([entry["name"] for entry in page["files"]], ["a.txt"])
+            self.assertEqual(page["next"], "a.txt")
+            catalog.join()
+            catalog.close()
+            left.close()
+            right.close()
+
+    @unittest.skipIf(os.getenv("GITHUB_ACTIONS") == "true", "Skipping due to missing SSL cert on runner")
+    @unittest.skipUnless(hasattr(socket, "AF_UNIX"), "Unix domain sockets are not supported")
+    def test_local_client_uploads_over_unix_socket(self) -> None:
+        """
+        Tests that a client on the same host connects through the server's
+        Unix socket without TLS and that its files are received
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            self.ls.upload_path = os.path.join(tmp, "up")
+            self.ls.unix_path = os.path.join(tmp, "lobbit.sock")
+            self.ls.listen_unix()
+            source = os.path.join(tmp, "data.bin")
+            data = os.urandom(3 * 1024 * 1024 + 7)
+            with open(source, "wb") as f:
+                f.write(data)
+            with open(os.path.join(tmp, "config.json"), "w") as f:
+                json.dump({"UNIX_SOCKET": self.ls.unix_path}, f)
+            client = LobbitClient("localhost", 1234, [source])
+            client.config = LobbitConfig(os.path.join(tmp, "config.json"))
+            client.log = lambda *args: None
+            try:
+                self.assertTrue(client.lobbit_connect())
+                self.assertEqual(client.transport, "unix")
+                results = client.lobbit_send()
+            finally:
+                client.lobbit_close()
+                self.ls.close_unix()
+            self.assertEqual([r["status"] for r in results], ["confirmed"])
+            with open(os.path.join(tmp, "up", "data.bin"), "rb") as f:
+                self.assertEqual(f.read(), data)
+            self.assertFalse(os.path.exists(os.path.join(tmp, "lobbit.sock")))
+            self.ls.catalog.join()
+            self.ls.catalog.close()
+
+    def test_streams_of_unknown_length_are_received(self) -> None:
+        """
+        Tests that data from a generator and a file-like object is stored
+        whole without its size being sent first, and that a stream whose
+        source fails is dropped while the connection stays usable
+        """
+        def failing():
+            yield b"partial data"
+            raise OSError("producer died")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            self.ls.upload_path = os.path.join(tmp, "up")
+            self.ls.unix_path = os.path.join(tmp, "lobbit.sock")
+            self.ls.listen_unix()
+            with open(os.path.join(tmp, "config.json"), "w") as f:
+                json.dump({"UNIX_SOCKET": self.ls.unix_path}, f)
+            parts = [os.urandom(n) for n in (1, 70000, 3 * 1024 * 1024, 5)]
+            client = LobbitClient("localhost", 1234, [])
+            client.config = LobbitConfig(os.path.join(tmp, "config.json"))
+            client.log = lambda *args: None
+            try:
+                self.assertTrue(client.lobbit_connect())
+                generated = client.send_stream("dump/gen.bin", iter(parts))
+                failed = client.send_stream("dump/failed.bin", failing())
+                piped = client.send_stream("dump/pipe.bin", io.BytesIO(b"".join(parts)))
+            finally:
+                client.lobbit_close()
+                self.ls.close_unix()
+            self.assertEqual((generated["status"], generated["size"]), ("confirmed", sum(map(len, parts))))
+            self.assertEqual(failed["status"], "failed")
+            self.assertIn("producer died", failed["error"])
+            self.assertEqual(piped["status"], "confirmed")
+            for name in ("gen.bin", "pipe.bin"):
+                with open(os.path.join(tmp, "up", "dump", name), "rb") as f:
+                    self.assertEqual(f.read(), b"".join(parts))
+            self.assertFalse(os.path.exists(os.path.join(tmp, "up", "dump", "failed.bin")))
+            self.ls.catalog.join()
+            self.ls.catalog.close()
+
+    def test_post_receive_hooks_run_on_confirmed_files(self) -> None:
+        """
+        Tests that the hooks matching a confirmed file run after it is
+        received and their results are logged beside the catalog
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            self.ls.upload_path = os.path.join(tmp, "up")
+            self.ls.unix_path = os.path.join(tmp, "lobbit.sock")
+            self.ls.apply_hooks({"POST_RECEIVE_HOOKS": [{"hook": "json", "match": "*.json"}], "HOOK_WORKERS": 1})
+            self.ls.listen_unix()
+            with open(os.path.join(tmp, "config.json"), "w") as f:
+                json.dump({"UNIX_SOCKET": self.ls.unix_path}, f)
+            client = LobbitClient("localhost", 1234, [])
+            client.config = LobbitConfig(os.path.join(tmp, "config.json"))
+            client.log = lambda *args: None
+            try:
+                self.assertTrue(client.lobbit_connect())
+                client.send_stream("data.json", iter([b'{"a": 1}']))
+                client.send_stream("data.bin", iter([b"not json"]))
+            finally:
+                client.lobbit_close()
+                self.ls.close_unix()
+            self.ls.close_hooks()
+            with open(os.path.join(tmp, "up", ".lobbit", "hooks.log")) as f:
+                results = [json.loads(line) for line in f]
+            self.assertEqual([(r["name"], r["status"], r["result"]) for r in results],
+                             [("data.json", "ok", {"type": "dict"})])
+            self.ls.catalog.join()
+            self.ls.catalog.close()
+
+    def test_uploads_that_do_not_fit_are_refused(self) -> None:
+        """
+        Tests that files larger than the free space are refused with
+        ERR_SPACE, large ones before their data is sent, that a stream is
+        dropped once it outgrows the space and that the connection stays
+        usable for the files that fit
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            up = os.path.join(tmp, "up")
+            src = os.path.join(tmp, "src")
+            os.makedirs(src)
+            for name, size in (("big.bin", 2000000), ("mid.bin", 1600000), ("small.bin", 100000)):
+                with open(os.path.join(src, name), "wb") as f:
+                    f.write(os.urandom(size))
+
+            def statvfs(path: str) -> SimpleNamespace:
+                # 1.5 MB free before anything is uploaded
+                used = sum(os.path.getsize(os.path.join(root, name))
+                           for root, _, names in os.walk(up) for name in names if ".lobbit" not in root)
+                return SimpleNamespace(f_bavail=1500000 - used, f_frsize=1)
+
+            self.ls.upload_path = up
+            self.ls.unix_path = os.path.join(tmp, "lobbit.sock")
+            self.ls.listen_unix()
+            with open(os.path.join(tmp, "config.json"), "w") as f:
+                json.dump({"UNIX_SOCKET": self.ls.unix_path}, f)
+            client = LobbitClient("localhost", 1234, [src])
+            client.config = LobbitConfig(os.path.join(tmp, "config.json"))
+            client.log = lambda *args: None
+            with mock.patch("app.lobbit_server.space.os.statvfs", side_effect=statvfs), \
+                    mock.patch.object(FileSender, "EXPECT_SIZE", 1800000):
+                try:
+                    self.assertTrue(client.lobbit_connect())
+                    results = {os.path.basename(r["file"]): r for r in client.lobbit_send()}
+                    stream = client.send_stream("stream.bin", iter([os.urandom(1024 * 1024)] * 3))
+                    after = client.send_stream("after.bin", iter([b"still in step"]))
+                finally:
+                    client.lobbit_close()
+                    self.ls.close_unix()
+            self.assertEqual(results["small.bin"]["status"], "confirmed")
+            for name in ("big.bin", "mid.bin"):
+                self.assertEqual(results[name]["status"], "failed")
+                self.assertIn("Not enough space", results[name]["error"])
+            jobs = {job["name"]: job for job in client.state["order"]}
+            self.assertEqual(jobs["src/big.bin"]["transferred"], 0)
+            self.assertEqual(stream["status"], "failed")
+            self.assertIn("Not enough space", stream["error"])
+            self.assertEqual(after["status"], "confirmed")
+            self.assertEqual(sorted(os.listdir(os.path.join(up, "src"))), ["small.bin"])
+            self.assertEqual(sorted(n for n in os.listdir(up) if n != ".lobbit"), ["after.bin", "src"])
+            self.assertEqual(self.ls.space.reservations, [])
+            self.ls.catalog.join()
+            self.ls.catalog.close()
+
+    def test_files_are_received_over_multiplexed_streams(self) -> None:
+        """
+        Tests that files sent at once as streams over one connection
+        are each received whole
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            self.ls.upload_path = os.path.join(tmp, "up")
+            self.ls.unix_path = os.path.join(tmp, "lobbit.sock")
+            self.ls.listen_unix()
+            sources = {}
+            for name, size in (("large.bin", 8 * 1024 * 1024 + 3), ("a.txt", 10), ("b.txt", 0), ("c.bin", 70000)):
+                sources[name] = os.urandom(size)
+                with open(os.path.join(tmp, name), "wb") as f:
+                    f.write(sources[name])
+            with open(os.path.join(tmp, "config.json"), "w") as f:
+                json.dump({"UNIX_SOCKET": self.ls.unix_path}, f)
+            client = LobbitClient("localhost", 1234, [os.path.join(tmp, name) for name in sources], streams=3)
+            client.config = LobbitConfig(os.path.join(tmp, "config.json"))
+            client.log = lambda *args: None
+            try:
+                self.assertTrue(client.lobbit_connect())
+                self.assertEqual((len(client.sessions), len(client.socks)), (1, 3))
+                results = client.lobbit_send()
+            finally:
+                client.lobbit_close()
+                self.ls.close_unix()
+            self.assertEqual([r["status"] for r in results], ["confirmed"] * 4)
+            for name, data in sources.items():
+                with open(os.path.join(tmp, "up", name), "rb") as f:
+                    self.assertEqual(f.read(), data)
+            self.ls.catalog.join()
+            self.ls.catalog.close()
@@ -0,0 +1,70 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from types import SimpleNamespace
+from unittest import mock
+
+lobbit_app = os.path.join(os.path.abspath(os.path.dirname(__file__)), "../")
+sys.path.append(lobbit_app)
+
+if lobbit_app in sys.path:
+    from app.lobbit_server.space import SpaceAdmission
+
+
+class TestSpace(unittest.TestCase):
+    """
+    Test class for admitting uploads by free disk space
+    """
+
+    def setUp(self) -> None:
+        """
+        Initialises test case variables, the filesystem reports 1000 free bytes
+        """
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "new", "dir", "file.bin")
+        self.free = 1000
+        statvfs = lambda path: SimpleNamespace(f_bavail=self.free, f_frsize=1)
+        self.patch = mock.patch("app.lobbit_server.space.os.statvfs", side_effect=statvfs)
+        self.patch.start()
+
+    def tearDown(self) -> None:
+        """
+        Cleans up after testing
+        """
+        self.patch.stop()
+        self.tmp.cleanup()
+
+    def test_reservations_count_against_the_free_space(self) -> None:
+        space = SpaceAdmission(min_free=100)
+        first = space.reserve(self.path, 600)
+        self.assertIsNotNone(first)
+        self.assertIsNone(space.reserve(self.path, 400))
+        # written bytes show in the free space instead of the reservation
+        first.written = 300
+        self.free -= 300
+        self.assertIsNone(space.reserve(self.path, 400))
+        second = space.reserve(self.path, 300)
+        self.assertIsNotNone(second)
+        space.release(first)
+        self.assertIsNotNone(space.reserve(self.path, 300))
+        self.assertFalse(space.extend(second, 1))
+        self.assertEqual(space.describe(self.path), "0 bytes free for uploads")
+
+    def test_upload_waits_for_space_to_be_released(self) -> None:
+        space = SpaceAdmission(wait=5.0)
+        held = space.reserve(self.path, 900)
+        threading.Timer(0.2, space.release, (held,)).start()
+        started = time.monotonic()
+        self.assertIsNotNone(space.reserve(self.path, 500))
+        self.assertLess(time.monotonic() - started, 2.0)
+        started = time.monotonic()
+        self.assertIsNone(space.reserve(self.path, 800, wait=0.1))
+        self.assertLess(time.monotonic() - started, 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
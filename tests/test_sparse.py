@@ -0,0 +1,49 @@
+import os
+import sys
+import tempfile
+import unittest
+
+lobbit_app = os.path.join(os.path.abspath(os.path.dirname(__file__)), "../")
+sys.path.append(lobbit_app)
+
+if lobbit_app in sys.path:
+    from app.lobbit_util import sparse
+
+
+class TestSparse(unittest.TestCase):
+    """
+    Test class for finding and checking the data extents of sparse files
+    """
+
+    @unittest.skipUnless(hasattr(os, "SEEK_DATA"), "SEEK_DATA is not supported")
+    def test_data_extents_skip_holes(self) -> None:
+        """
+        Tests that the extents of a file with holes cover its data and
+        leave out the holes
+        """
+        with tempfile.TemporaryFile() as f:
+            f.truncate(64 * 1024 * 1024)
+            f.seek(8 * 1024 * 1024)
+            f.write(b"x" * 4096)
+            f.flush()
+            extents = sparse.data_extents(f.fileno(), 0, 64 * 1024 * 1024)
+            if extents == [(0, 64 * 1024 * 1024)]:
+                self.skipTest("filesystem does not report holes")
+            self.assertEqual(len(extents), 1)
+            start, length = extents[0]
+            self.assertLessEqual(start, 8 * 1024 * 1024)
+            self.assertGreaterEqual(start + length, 8 * 1024 * 1024 + 4096)
+            self.assertLess(length, 1024 * 1024)
+
+    def test_decode_extents_rejects_overlaps_and_overruns(self) -> None:
+        """
+        Tests that extent maps must be in order and inside the file
+        """
+        valid = [(0, 10), (20, 5)]
+        self.assertEqual(sparse.decode_extents(sparse.encode_extents(valid), 0, 25), valid)
+        for extents, start in (([(0, 10), (5, 5)], 0), ([(20, 10)], 0), ([(5, 0)], 0), ([(0, 10)], 2)):
+            self.assertRaises(ValueError, sparse.decode_extents, sparse.encode_extents(extents), start, 25)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import sys
+import tempfile
+import unittest
+
+from unittest.mock import patch
+
+lobbit_app = os.path.join(os.path.abspath(os.path.dirname(__file__)), "../")
+sys.path.append(lobbit_app)
+
+if lobbit_app in sys.path:
+    from app.lobbit_server.storage import Storage
+
+
+class TestStorage(unittest.TestCase):
+    """
+    Test class for the sharded Storage layout
+    """
+
+    def setUp(self) -> None:
+        """
+        Initialises test case variables
+        """
+        self.tmp = tempfile.TemporaryDirectory()
+        self.roots = [os.path.join(self.tmp.name, "disk1"), os.path.join(self.tmp.name, "disk2")]
+
+    def tearDown(self) -> None:
+        """
+        Cleans up after testing
+        """
+        self.tmp.cleanup()
+
+    def test_single_root_is_flat_without_index(self) -> None:
+        """
+        Tests that a single upload root keeps the original flat layout
+        """
+        storage = Storage(self.roots[0])
+        self.assertIsNone(storage.index)
+        self.assertEqual(storage.place("a/b.txt"), os.path.join(self.roots[0], "a", "b.txt"))
+        self.assertIsNone(storage.place("../escape"))
+
+    def test_hash_placement_is_stable_and_uses_every_root(self) -> None:
+        """
+        Tests that names are spread over every root, under two levels
+        of fan-out directories, and always map to the same place
+        """
+        storage = Storage(self.roots)
+        paths = [storage.place(f"file{i}") for i in range(200)]
+        self.assertEqual(paths, [storage.place(f"file{i}") for i in range(200)])
+        for root in self.roots:
+            self.assertTrue(any(path.startswith(root + os.sep) for path in paths))
+        relative = os.path.relpath(paths[0], os.path.commonpath(self.roots))
+        self.assertEqual(len(relative.split(os.sep)), 4)
+        storage.close()
+
+    def test_index_records_and_locates_files(self) -> None:
+        """
+        Tests that recorded files are found through the index and keep
+        their location when placed again
+        """
+        storage = Storage(self.roots, placement="space")
+        path = storage.place("data/report.csv", 10)
+        storage.record("data/report.csv", path, 10)
+        self.assertEqual(storage.locate("data/report.csv"), path)
+        self.assertEqual(storage.place("data/report.csv", 10), path)
+        self.assertIsNone(storage.locate("missing"))
+        storage.close()
+
+    def test_space_placement_skips_full_roots(self) -> None:
+        """
+        Tests that a root without room for the file is never chosen
+        """
+        class Stat:
+            f_frsize = 1
+
+            def __init__(self, path: str) -> None:
+                self.f_bavail = 5 if path.endswith("disk1") else 1000
+
+        storage = Storage(self.roots, placement="space")
+        with patch("os.statvfs", new=Stat):
+            roots = {storage.choose_root(f"f{i}", 100) for i in range(50)}
+        self.assertEqual(roots, {self.roots[1]})
+        storage.close()
+
+    def test_index_cannot_be_overwritten(self) -> None:
+        """
+        Tests that an upload name resolving to the index is rejected
+        """
+        storage = Storage(self.roots[0], fanout=0, index_path=os.path.join(self.roots[0], ".lobbit", "index.db"))
+        self.assertIsNone(storage.place(".lobbit/index.db"))
+        self.assertIsNone(storage.place(".lobbit"))
+        storage.close()
@@ -0,0 +1,107 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+lobbit_app = os.path.join(os.path.abspath(os.path.dirname(__file__)), "../")
+sys.path.append(lobbit_app)
+
+if lobbit_app in sys.path:
+    from app.lobbit_client.client import LobbitClient
+    from app.lobbit_server.server import LobbitServer
+    from app.lobbit_util import manifest
+    from app.lobbit_util.config import LobbitConfig
+
+
+class TestSync(unittest.TestCase):
+    """
+    Test class for uploads that only send new or changed files
+    """
+
+    def setUp(self) -> None:
+        """
+        Initialises test case variables, a server on a Unix socket and a
+        tree of files to sync
+        """
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp.name, "tree")
+        for i in range(3):
+            self.write(f"dir{i}/file{i}.txt", f"contents {i}".encode())
+        self.server = LobbitServer("127.0.0.1", 1234, os.path.join(self.tmp.name, "up"),
+                                   unix_path=os.path.join(self.tmp.name, "lobbit.sock"))
+        self.server.listen_unix()
+        self.config = os.path.join(self.tmp.name, "config.json")
+        with open(self.config, "w") as f:
+            json.dump({"UNIX_SOCKET": self.server.unix_path}, f)
+
+    def tearDown(self) -> None:
+        """
+        Cleans up after testing
+        """
+        self.server.close_unix()
+        self.server.sock.close()
+        self.server.catalog.join()
+        self.server.catalog.close()
+        self.tmp.cleanup()
+
+    def write(self, name: str, data: bytes) -> None:
+        """
+        Writes a file into the tree to sync
+
+        Args:
+            name (str)   : path of the file relative to the tree
+            data (bytes) : contents of the file
+        """
+        path = os.path.join(self.source, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def sync(self) -> LobbitClient:
+        """
+        Syncs the tree with the server
+
+        Returns:
+            LobbitClient : the client, holding the results in <last>
+        """
+        client = LobbitClient("localhost", 1234, [self.source], sync=True)
+        client.config = LobbitConfig(self.config)
+        client.log = lambda *args: None
+        self.assertTrue(client.lobbit_connect())
+        try:
+            client.last = client.lobbit_send()
+        finally:
+            client.lobbit_close()
+        return client
+
+    def test_only_new_and_changed_files_are_sent(self) -> None:
+        first = self.sync()
+        self.assertEqual(len(first.last), 3)
+        self.assertEqual((first.manifest.compared, first.manifest.unchanged), (3, 0))
+        self.assertEqual(self.sync().last, [])
+        # same size, new modified time
+        path = os.path.join(self.source, "dir1", "file1.txt")
+        self.write("dir1/file1.txt", b"CONTENTS 1")
+        os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 1))
+        self.write("dir3/new.txt", b"new")
+        client = self.sync()
+        self.assertEqual(sorted(r["name"] for r in client.last), ["tree/dir1/file1.txt", "tree/dir3/new.txt"])
+        self.assertTrue(all(r["status"] == "confirmed" for r in client.last))
+        self.assertEqual((client.manifest.compared, client.manifest.unchanged), (4, 2))
+        with open(os.path.join(self.tmp.name, "up", "tree", "dir1", "file1.txt"), "rb") as f:
+            self.assertEqual(f.read(), b"CONTENTS 1")
+
+    def test_manifests_span_several_frames(self) -> None:
+        for i in range(3, manifest.BATCH_SIZE + 10):
+            self.write(f"many/{i}", b"")
+        client = self.sync()
+        self.assertEqual(len(client.last), manifest.BATCH_SIZE + 10)
+        self.write("many/3", b"changed")
+        client = self.sync()
+        self.assertEqual([r["name"] for r in client.last], ["tree/many/3"])
+        self.assertEqual(client.manifest.unchanged, manifest.BATCH_SIZE + 9)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import os
+import socket
+import sys
+import unittest
+
+from unittest import mock
+
+lobbit_app = os.path.join(os.path.abspath(os.path.dirname(__file__)), "../")
+sys.path.append(lobbit_app)
+
+if lobbit_app in sys.path:
+    from app.lobbit_util import tuning
+    from app.lobbit_util.tuning import DEFAULT_LIMITS, Tuner, read_limits
+
+
+class TestTuning(unittest.TestCase):
+    """
+    Test class for the chunk size and socket buffer tuning
+    """
+
+    def setUp(self) -> None:
+        """
+        Initialises test case variables
+        """
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.transferred = 0
+        self.messages = []
+        self.tuner = Tuner(self.sock, socket.SO_SNDBUF, lambda: self.transferred, name="test",
+                           log=self.messages.append)
+
+    def tearDown(self) -> None:
+        """
+        Cleans up after testing
+        """
+        self.sock.close()
+
+    def sample(self, rate: float, rtt: float, gap: float = 1.0) -> bool:
+        """
+        Feeds the tuner one measurement taken <gap> seconds after the last
+
+        Args:
+            rate (float) : bytes per second moved since the last measurement
+            rtt (float)  : round trip time reported by the kernel
+            gap (float)  : seconds since the last measurement
+        Returns:
+            bool : True if the tuner changed the connection
+        """
+        now = self.tuner._last[0] + gap if self.tuner._last else 0.0
+        self.transferred += int(rate * gap)
+        with mock.patch.object(tuning, "tcp_rtt", return_value=rtt):
+            return self.tuner.measure(now)
+
+    def test_invalid_limits_fall_back_to_defaults(self) -> None:
+        """
+        Tests that invalid limits are replaced and that the chunk range is kept in order
+        """
+        limits = read_limits({"SOCKET_BUFFER_MAX": -1, "CHUNK_SIZE_MIN": 1024 * 1024,
+                              "CHUNK_SIZE_MAX": 65536}, log=lambda msg: None)
+        self.assertEqual(limits["SOCKET_BUFFER_MAX"], DEFAULT_LIMITS["SOCKET_BUFFER_MAX"])
+        self.assertEqual((limits["CHUNK_SIZE_MIN"], limits["CHUNK_SIZE_MAX"]), (65536, 65536))
+
+    def test_long_link_raises_buffer_and_chunks(self) -> None:
+        """
+        Tests that a link with a large bandwidth-delay product gets a larger
+        send buffer, within SOCKET_BUFFER_MAX, and larger chunks, and that
+        the values chosen are logged
+        """
+        start = self.tuner.buffer_size
+        self.sample(0, 0.05)
+        with mock.patch.object(tuning, "kernel_buffer_limits", return_value=(4194304, 64 * 1024 * 1024)):
+            self.assertTrue(self.sample(100 * 1024 * 1024, 0.05))
+        self.assertGreater(self.tuner.buffer_size, start)
+        self.assertLessEqual(self.tuner.buffer_size, 2 * DEFAULT_LIMITS["SOCKET_BUFFER_MAX"])
+        self.assertEqual(self.tuner.chunk_size, 1024 * 1024)
+        self.assertIn("RTT 50.00 ms", self.messages[-1])
+
+    def test_buffer_is_left_to_autotuning_when_it_reaches_further(self) -> None:
+        """
+        Tests that the buffer is not set when the kernel caps the size that
+        can be set below its autotuning maximum, as it does by default
+        """
+        start = self.tuner.buffer_size
+        self.sample(0, 0.05)
+        with mock.patch.object(tuning, "kernel_buffer_limits", return_value=(6291456, 212992)):
+            self.sample(100 * 1024 * 1024, 0.05)
+        self.assertEqual(self.tuner.buffer_size, start)
+        self.assertEqual(self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF), start)
+
+    def test_chunks_shrink_only_when_rate_falls_well_below(self) -> None:
+        """
+        Tests that a small drop in rate keeps the chunk size and that a
+        large one shrinks it, and that an idle gap is not measured
+        """
+        self.sample(0, None)
+        self.sample(100 * 1024 * 1024, None)
+        self.assertEqual(self.tuner.chunk_size, 1024 * 1024)
+        self.sample(90 * 1024 * 1024, None)
+        self.assertEqual(self.tuner.chunk_size, 1024 * 1024)
+        self.assertFalse(self.sample(1, None, gap=60))
+        for _ in range(4):
+            self.sample(1024 * 1024, None)
+        self.assertEqual(self.tuner.chunk_size, DEFAULT_LIMITS["CHUNK_SIZE_MIN"])
+
+
+if __name__ == '__main__':
+    unittest.main()
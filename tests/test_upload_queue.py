@@ -0,0 +1,146 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+from threading import Lock
+from unittest import mock
+
+lobbit_app = os.path.join(os.path.abspath(os.path.dirname(__file__)), "../")
+sys.path.append(lobbit_app)
+
+if lobbit_app in sys.path:
+    from app.lobbit_client.client import LobbitClient
+    from app.lobbit_client.upload_queue import UploadQueue, source_exists, source_of
+
+
+class TestUploadQueue(unittest.TestCase):
+    """
+    Test class for the durable UploadQueue
+    """
+
+    def setUp(self) -> None:
+        """
+        Initialises test case variables
+        """
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "queue.db")
+        self.queue = UploadQueue(self.path, max_attempts=2)
+
+    def tearDown(self) -> None:
+        """
+        Cleans up after testing
+        """
+        self.queue.close()
+        self.tmp.cleanup()
+
+    def test_claim_returns_highest_priority_due_entries(self) -> None:
+        """
+        Tests that only the due entries sharing the highest priority
+        for the server are claimed and marked running
+        """
+        self.queue.add(["/low"], "host", 1)
+        self.queue.add(["/high1", "/high2"], "host", 1, priority=5)
+        self.queue.add(["/other"], "other", 1, priority=9)
+        claimed = self.queue.claim("host", 1)
+        self.assertEqual([row["source"] for row in claimed], ["/high1", "/high2"])
+        self.assertEqual([row["source"] for row in self.queue.claim("host", 1)], ["/low"])
+        self.assertEqual(self.queue.claim("host", 1), [])
+        self.assertEqual(len(self.queue.entries([UploadQueue.RUNNING])), 3)
+
+    def test_fail_backs_off_then_gives_up(self) -> None:
+        """
+        Tests that a failed entry is retried after a backoff and marked
+        failed once it has used every attempt
+        """
+        entry_id = self.queue.add(["/file"], "host", 1)[0]
+        self.queue.claim("host", 1)
+        self.assertTrue(self.queue.fail(entry_id, "boom"))
+        self.assertEqual(self.queue.claim("host", 1), [])
+        self.assertGreater(self.queue.next_due("host", 1), time.time())
+        self.queue.execute("UPDATE uploads SET next_attempt = 0")
+        self.queue.claim("host", 1)
+        self.assertFalse(self.queue.fail(entry_id, "boom"))
+        row = self.queue.entries([UploadQueue.FAILED])[0]
+        self.assertEqual((row["attempts"], row["last_error"]), (2, "boom"))
+
+    def test_running_entries_and_progress_survive_a_restart(self) -> None:
+        """
+        Tests that entries left running are pending again and saved file
+        progress is available when the queue is reopened
+        """
+        data = os.path.join(self.tmp.name, "data")
+        with open(data, "wb") as f:
+            f.write(b"x" * 100)
+        self.queue.add([data], "host", 1)
+        self.queue.claim("host", 1)
+        self.queue.save_progress("host", 1, [{"file": data, "size": 100, "mtime": 1, "committed": 10}])
+        self.queue.close()
+        with mock.patch("app.lobbit_client.upload_queue.pid_alive", return_value=False):
+            self.queue = UploadQueue(self.path)
+        self.assertEqual(self.queue.recovered, 1)
+        self.assertEqual(self.queue.pending("host", 1), 1)
+        size, _, committed = self.queue.load_progress("host", 1)[data]
+        self.assertEqual((size, committed), (100, 10))
+        self.queue.clear_progress("host", 1, [data])
+        self.assertEqual(self.queue.load_progress("host", 1), {})
+
+    def test_file_changed_while_sending_is_not_resumed(self) -> None:
+        """
+        Tests that progress is saved with the file as it was when sent,
+        so a file edited before the checkpoint is sent again from the start
+        """
+        data = os.path.join(self.tmp.name, "data")
+        with open(data, "wb") as f:
+            f.write(b"x" * 100)
+        os.utime(data, ns=(1, 1))
+
+        def send_and_edit(job, f, extents) -> None:
+            """
+            Commits part of the file, then rewrites it in place
+            """
+            job["committed"] = 10
+            with open(data, "r+b") as edited:
+                edited.write(b"y" * 100)
+
+        runs = []
+        for _ in range(2):
+            client = LobbitClient("host", 1, [])
+            client.resume = self.queue.load_progress("host", 1)
+            state = {"jobs": {}, "order": [], "results": [], "lock": Lock()}
+            job = client.new_job(state, data, "data", 100)
+            client.send_file(mock.MagicMock(**{"send.side_effect": send_and_edit}), job, state)
+            runs.append(job["attempt_offset"])
+            self.queue.save_progress("host", 1, [client.result(job, "failed", "stopped")])
+        self.assertEqual(runs, [0, 0])
+        self.assertNotEqual(self.queue.load_progress("host", 1)[data][1], os.stat(data).st_mtime_ns)
+
+    def test_entries_of_a_running_process_are_not_recovered(self) -> None:
+        """
+        Tests that entries claimed by a live process stay running when the
+        queue is opened elsewhere, and are recovered once the lease expires
+        """
+        self.queue.add(["/data"], "host", 1)
+        self.queue.claim("host", 1)
+        other = UploadQueue(self.path)
+        self.assertEqual(other.recovered, 0)
+        self.assertEqual(other.claim("host", 1), [])
+        self.queue.execute("UPDATE uploads SET lease = ?", (time.time() - 1,))
+        self.queue.renew([row["id"] for row in self.queue.entries()])
+        self.assertEqual(other.recover(), 0)
+        self.queue.execute("UPDATE uploads SET lease = ?", (time.time() - 1,))
+        self.assertEqual([row["source"] for row in other.claim("host", 1)], ["/data"])
+        other.close()
+
+    def test_source_of_matches_files_directories_and_globs(self) -> None:
+        """
+        Tests that files are matched back to the source they were found under
+        """
+        sources = ["/data/a.txt", "/data/dir", "/logs/*/app.log"]
+        self.assertEqual(source_of(sources, "/data/a.txt"), "/data/a.txt")
+        self.assertEqual(source_of(sources, "/data/dir/sub/b"), "/data/dir")
+        self.assertEqual(source_of(sources, "/logs/x/app.log"), "/logs/*/app.log")
+        self.assertIsNone(source_of(sources, "/data/directory/b"))
+        self.assertTrue(source_exists(self.tmp.name))
+        self.assertFalse(source_exists(os.path.join(self.tmp.name, "missing*")))
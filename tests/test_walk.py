@@ -0,0 +1,69 @@
+import os
+import sys
+import tempfile
+import unittest
+
+lobbit_app = os.path.join(os.path.abspath(os.path.dirname(__file__)), "../")
+sys.path.append(lobbit_app)
+
+if lobbit_app in sys.path:
+    from app.lobbit_util.walk import TreeWalker
+
+
+class TestTreeWalker(unittest.TestCase):
+    """
+    Test class for the TreeWalker class
+    """
+
+    def setUp(self) -> None:
+        """
+        Initialises test case variables
+        """
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp.name, "root")
+        for rel in ("a.txt", "sub/b.txt", "sub/deep/c.log", "other/d.log"):
+            path = os.path.join(self.root, *rel.split("/"))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(rel)
+
+    def tearDown(self) -> None:
+        """
+        Cleans up after testing
+        """
+        self.tmp.cleanup()
+
+    def test_walk_directory_yields_relative_names(self) -> None:
+        """
+        Tests that every file under a directory is found and named
+        relative to the parent of the directory
+        """
+        names = sorted(name for _, name in TreeWalker([self.root], workers=3))
+        self.assertEqual(names, ["root/a.txt", "root/other/d.log", "root/sub/b.txt", "root/sub/deep/c.log"])
+
+    def test_walk_file_yields_base_name(self) -> None:
+        """
+        Tests that a single file is yielded under its base name
+        """
+        path = os.path.join(self.root, "sub", "b.txt")
+        self.assertEqual(list(TreeWalker([path])), [(path, "b.txt")])
+
+    def test_walk_expands_glob_patterns(self) -> None:
+        """
+        Tests that glob patterns are expanded recursively and that matches
+        are named by their path below the pattern's fixed directory
+        """
+        names = sorted(name for _, name in TreeWalker([f"{self.root}/**/*.log"]))
+        self.assertEqual(names, ["other/d.log", "sub/deep/c.log"])
+        names = sorted(name for _, name in TreeWalker([f"{self.root}/s*"]))
+        self.assertEqual(names, ["sub/b.txt", "sub/deep/c.log"])
+
+    def test_walk_stops_cleanly_when_consumer_stops(self) -> None:
+        """
+        Tests that the walk can be abandoned part way through
+        """
+        walker = TreeWalker([self.root], workers=2)
+        files = iter(walker)
+        next(files)
+        files.close()
+        self.assertTrue(walker._stop.is_set())